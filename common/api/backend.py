@@ -37,11 +37,14 @@
 """
 
 import socket
+import time
 import traceback
 import xmlrpclib
 
 from seattlegeni.common.exceptions import *
 
+from seattlegeni.common.util import profiling
+
 from seattlegeni.common.util.decorators import log_function_call
 
 
@@ -67,17 +70,21 @@ def _get_backend_proxy():
 
 
 def _do_backend_request(func, *args):
+  starttime = time.time()
   try:
-    return func(*args)
-  except xmlrpclib.Fault, fault:
-    if fault.faultCode == 100:
-      raise NodemanagerCommunicationError(fault.faultString)
-    else:
-      raise ProgrammerError("The backend rejected the request: " + traceback.format_exc())
-  except xmlrpclib.ProtocolError:
-    raise InternalError("Unable to communicate with the backend: " + traceback.format_exc())
-  except socket.error:
-    raise InternalError("Unable to communicate with the backend: " + traceback.format_exc())
+    try:
+      return func(*args)
+    except xmlrpclib.Fault, fault:
+      if fault.faultCode == 100:
+        raise NodemanagerCommunicationError(fault.faultString)
+      else:
+        raise ProgrammerError("The backend rejected the request: " + traceback.format_exc())
+    except xmlrpclib.ProtocolError:
+      raise InternalError("Unable to communicate with the backend: " + traceback.format_exc())
+    except socket.error:
+      raise InternalError("Unable to communicate with the backend: " + traceback.format_exc())
+  finally:
+    profiling.add_time("backend", time.time() - starttime)
 
 
 
@@ -61,11 +61,14 @@
 
 import datetime
 import socket
+import time
 import traceback
 import xmlrpclib
 
 from seattlegeni.common.exceptions import *
 
+from seattlegeni.common.util import profiling
+
 from seattlegeni.common.util.decorators import log_function_call
 
 
@@ -111,14 +114,18 @@ def create_lockserver_handle(lockserver_url=LOCKSERVER_URL):
   lockserver_handle = {}
   lockserver_handle["proxy"] = xmlrpclib.ServerProxy(lockserver_url)
   
+  starttime = time.time()
   try:
-    lockserver_handle["session_id"] = lockserver_handle["proxy"].StartSession()
-  except xmlrpclib.Fault:
-    raise ProgrammerError("The lockserver rejected the request: " + traceback.format_exc())
-  except xmlrpclib.ProtocolError:
-    raise InternalError("Unable to communicate with the lockserver: " + traceback.format_exc())
-  except socket.error:
-    raise InternalError("Unable to communicate with the lockserver: " + traceback.format_exc())
+    try:
+      lockserver_handle["session_id"] = lockserver_handle["proxy"].StartSession()
+    except xmlrpclib.Fault:
+      raise ProgrammerError("The lockserver rejected the request: " + traceback.format_exc())
+    except xmlrpclib.ProtocolError:
+      raise InternalError("Unable to communicate with the lockserver: " + traceback.format_exc())
+    except socket.error:
+      raise InternalError("Unable to communicate with the lockserver: " + traceback.format_exc())
+  finally:
+    profiling.add_time("lockserver", time.time() - starttime)
   
   return lockserver_handle
 
@@ -144,14 +151,18 @@ def destroy_lockserver_handle(lockserver_handle):
     None.
   """
   
+  starttime = time.time()
   try:
-    lockserver_handle["proxy"].EndSession(lockserver_handle["session_id"])
-  except xmlrpclib.Fault:
-    raise ProgrammerError("The lockserver rejected the request: " + traceback.format_exc())
-  except xmlrpclib.ProtocolError:
-    raise InternalError("Unable to communicate with the lockserver: " + traceback.format_exc())
-  except socket.error:
-    raise InternalError("Unable to communicate with the lockserver: " + traceback.format_exc())
+    try:
+      lockserver_handle["proxy"].EndSession(lockserver_handle["session_id"])
+    except xmlrpclib.Fault:
+      raise ProgrammerError("The lockserver rejected the request: " + traceback.format_exc())
+    except xmlrpclib.ProtocolError:
+      raise InternalError("Unable to communicate with the lockserver: " + traceback.format_exc())
+    except socket.error:
+      raise InternalError("Unable to communicate with the lockserver: " + traceback.format_exc())
+  finally:
+    profiling.add_time("lockserver", time.time() - starttime)
 
 
 
@@ -317,14 +328,19 @@ def _perform_lock_request(request_type, lockserver_handle, user_list=None, node_
   else:
     raise ProgrammerError("Invalid lock request type specified: " + str(request_type))
     
+  # This includes the time spent waiting for the locks to be available.
+  starttime = time.time()
   try:
-    request_func(session_id, lockdict)
-  except xmlrpclib.Fault:
-    raise ProgrammerError("The lockserver rejected the request: " + traceback.format_exc())
-  except xmlrpclib.ProtocolError:
-    raise InternalError("Unable to communicate with the lockserver: " + traceback.format_exc())
-  except socket.error:
-    raise InternalError("Unable to communicate with the lockserver: " + traceback.format_exc())
+    try:
+      request_func(session_id, lockdict)
+    except xmlrpclib.Fault:
+      raise ProgrammerError("The lockserver rejected the request: " + traceback.format_exc())
+    except xmlrpclib.ProtocolError:
+      raise InternalError("Unable to communicate with the lockserver: " + traceback.format_exc())
+    except socket.error:
+      raise InternalError("Unable to communicate with the lockserver: " + traceback.format_exc())
+  finally:
+    profiling.add_time("lockserver", time.time() - starttime)
 
 
 
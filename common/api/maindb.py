@@ -34,12 +34,23 @@ from datetime import datetime
 from datetime import timedelta
 
 import django.contrib.auth.models
+import django.core.cache
 import django.core.exceptions
 import django.db
 
 from django.db import transaction
 
+from django.db.models import Count
+from django.db.models import F
+from django.db.models import Max
+from django.db.models import Min
+from django.db.models import Q
+
+import hashlib
+import hmac
 import random
+import threading
+import time
 
 from seattlegeni.common.exceptions import *
 
@@ -52,6 +63,8 @@ from seattlegeni.common.util.assertions import *
 
 from seattlegeni.website import settings
 
+from seattlegeni.website.control.models import AcquisitionJob
+from seattlegeni.website.control.models import AvailableVesselCount
 from seattlegeni.website.control.models import Donation
 from seattlegeni.website.control.models import GeniUser
 from seattlegeni.website.control.models import Node
@@ -80,6 +93,36 @@ ALLOWED_USER_PORTS = range(63100, 63180)
 # Number of ascii characters in generated API keys.
 API_KEY_LENGTH = 32
 
+# The number of seconds for which a successful authentication with a username
+# and api key is remembered by get_user_with_api_key(). Only the user's id and
+# a hash of the api key keyed with settings.SECRET_KEY are cached, never the
+# user record (which holds the api key, password hash and private key), so the
+# user is still loaded by id. Any change to a user's record (including a new
+# api key or deactivation) forgets the user's cached authentication. Other
+# processes only see that because they share the django cache, so
+# authentications are never cached unless settings.CACHE_IS_SHARED is True.
+# Set to 0 to not cache authentications.
+API_KEY_AUTH_CACHE_SECONDS = 60
+
+# The same as API_KEY_AUTH_CACHE_SECONDS but for authentications with a
+# username and password done by get_user_with_password(). Checking a password
+# means hashing it, which is where most of the time of a password-authenticated
+# XML-RPC call goes. The password itself is never cached, only the user's id
+# and a hash of the password keyed with settings.SECRET_KEY, so nothing is
+# cached if that isn't set.
+PASSWORD_AUTH_CACHE_SECONDS = 60
+
+# The number of seconds for which a user's summary (the data shown on the My
+# Vessels page, see cache_user_summary()) is kept in the django cache. This
+# module forgets a user's summary whenever it records a change that affects
+# it: vessels acquired, released, renewed, or expired, a donation made, a
+# donating node going up or down, or the user record being saved. This only
+# bounds how long other changes (e.g. a new address of a node the user has
+# vessels on) take to show. Set to 0 to not cache summaries. Summaries are
+# never cached unless settings.CACHE_IS_SHARED, as a process can't make the
+# other processes forget their copies of a summary.
+USER_SUMMARY_CACHE_SECONDS = 300
+
 # When initially acquired, this is the amount of time from now until a vessel
 # will expire.
 # This must be a datetime.timedelta object.
@@ -106,9 +149,89 @@ GET_AVAILABLE_VESSELS_ADDER = 10
 # nodes on thousands of subnets.
 GET_AVAILABLE_LAN_VESSELS_MAX_SUBNETS = 10
 
+# The maximum number of vessels looked up with a single query by get_vessels().
+# Each vessel adds two parameters to the query and sqlite doesn't allow more
+# than 999 parameters in a query.
+GET_VESSELS_MAX_VESSELS_PER_QUERY = 400
+
+# The maximum number of vessel ids used in a single query when changing many
+# vessels at once (e.g. in mark_expired_vessels_as_dirty()). sqlite doesn't
+# allow more than 999 parameters in a query.
+MAX_VESSEL_IDS_PER_QUERY = 500
+
+# The number of seconds after which an acquisition job that hasn't finished is
+# considered stuck and is marked as failed by get_acquisition_job().
+ACQUISITION_JOB_TIMEOUT_SECONDS = 900
+
+# The number of seconds without a heartbeat (see
+# record_acquisition_job_heartbeats()) after which an unfinished acquisition
+# job is considered lost, e.g. because the website process that was to run it
+# was restarted, and is marked as failed by get_acquisition_job(). This must
+# be several times acquisitionjobs.HEARTBEAT_INTERVAL_SECONDS.
+ACQUISITION_JOB_HEARTBEAT_TIMEOUT_SECONDS = 120
+
+# Finished acquisition jobs older than this are deleted when the same user
+# creates a new job.
+ACQUISITION_JOB_RETENTION_TIMEDELTA = timedelta(days=1)
+
+# When vessels are sampled at random from the database (see
+# _get_random_vessel_sample()), ids are read from this many randomly placed
+# ranges of the vessel id space at a time. More ranges spread the sample over
+# more nodes (vessels on the same node have consecutive ids) at the cost of a
+# longer query.
+RANDOM_VESSEL_SAMPLE_RANGE_COUNT = 20
+
 # The string that is the prefix to all NAT strings in node last_known_ip fields.
 NAT_STRING_PREFIX = "NAT$"
 
+# Whether calls to get_available_*_vessels() choose candidate vessels using the
+# in-process available vessel index rather than by querying for all available
+# vessels on the user's port each time. See _get_available_vessel_index().
+USE_AVAILABLE_VESSEL_INDEX = True
+
+# The number of seconds after which the available vessel index for a port is
+# rebuilt from the database. The index is updated by the changes this process
+# makes through this module, but changes made by other processes (other
+# website processes, the backend, the transition scripts) are only seen once
+# the index is rebuilt. Candidates from the index are always checked against
+# the database before being returned, so a stale index can only cause fewer
+# or worse candidates, never vessels that aren't actually available.
+AVAILABLE_VESSEL_INDEX_MAX_AGE_SECONDS = 60
+
+# The available vessel index. The keys are ports and the values are tuples of
+# (time_built, portindex) where portindex is an _AvailableVesselPortIndex of
+# the ids of the vessels that are available on that port, the node each is on,
+# the subnet of that node (as stored in the node's subnet field, so "" for nat
+# nodes and nodes with invalid ips) and whether it is a nat node. Access must
+# be done while holding available_vessel_index_lock.
+available_vessel_index = {}
+available_vessel_index_lock = threading.Lock()
+
+# The django database alias of the read replica, if settings.MAINDB_READ_REPLICA
+# is set. Only functions that are explicitly asked to allow stale data (e.g.
+# with allow_stale=True) read from it. See get_queryset_for_reading().
+READ_REPLICA_DATABASE_ALIAS = 'replica'
+
+# The number of seconds for which a check of how far the read replica is
+# behind the primary database is reused before checking again. Data read from
+# the replica can therefore be up to this many seconds older than
+# settings.MAINDB_READ_REPLICA_MAX_LAG_SECONDS allows.
+READ_REPLICA_LAG_CHECK_INTERVAL_SECONDS = 10
+
+# A tuple of (time_checked, is_usable) from the last check of the read replica,
+# or None if it hasn't been checked. Access must be done while holding
+# read_replica_status_lock. The lock is reentrant because checking the replica
+# can open a connection to it, which calls init_read_replica_connection().
+read_replica_status = None
+read_replica_status_lock = threading.RLock()
+
+# Counts of how often passwords were checked by hashing them and how long that
+# took, as well as how often a cached password authentication was used
+# instead. See get_password_check_stats(). Access must be done while holding
+# password_check_stats_lock.
+password_check_stats = {"hashed_count" : 0, "hashed_seconds" : 0.0, "cached_count" : 0}
+password_check_stats_lock = threading.Lock()
+
 
 
 
@@ -119,7 +242,8 @@ def init_maindb():
   <Purpose>
     Initializes the database in a way that makes database transaction commits
     from other sources immediately visible. Must be called after creating
-    any database connection.
+    any database connection other than one to the read replica (see
+    init_read_replica_connection()).
     
     If you're using the maindb in long-running non-website code, you should
     either call this function on a regular basis (even if new database
@@ -159,6 +283,197 @@ def init_maindb():
 
 
 
+def init_read_replica_connection(connection):
+  """
+  <Purpose>
+    Initializes a new connection to the read replica the same way
+    init_maindb() does for the primary database, so that long-running code
+    reading from the replica sees new data, too. This is called when the
+    connection is first opened, which is only when the replica is used.
+  <Arguments>
+    connection
+      The django database connection to the read replica.
+  <Exceptions>
+    Whatever exception setting up the connection raised.
+  <Side Effects>
+    The transaction isolation level of the connection has been set. If that
+    failed, the replica won't be used for the next
+    READ_REPLICA_LAG_CHECK_INTERVAL_SECONDS.
+  <Returns>
+    None.
+  """
+  if not _is_read_replica_mysql():
+    return
+  
+  try:
+    connection.cursor().execute('set transaction isolation level read committed')
+  except:
+    log.error("Unable to initialize a connection to the read replica.")
+    _mark_read_replica_unusable()
+    # Don't leave a connection around that isn't set up. The next use of the
+    # replica opens a new one.
+    try:
+      connection.close()
+    except:
+      pass
+    raise
+
+
+
+
+
+def _mark_read_replica_unusable():
+  """Makes reads go to the primary database until the replica is rechecked."""
+  global read_replica_status
+  
+  read_replica_status_lock.acquire()
+  try:
+    read_replica_status = (time.time(), False)
+  finally:
+    read_replica_status_lock.release()
+
+
+
+
+
+def _is_read_replica_configured():
+  """Returns True if settings.MAINDB_READ_REPLICA is set."""
+  return getattr(settings, "MAINDB_READ_REPLICA", None) is not None
+
+
+
+
+
+def _is_read_replica_mysql():
+  """Returns True if the configured read replica is a mysql database."""
+  return settings.MAINDB_READ_REPLICA.get('ENGINE', '').endswith('mysql')
+
+
+
+
+
+def _get_read_replica_lag_seconds():
+  """
+  Returns the number of seconds the read replica is behind the primary
+  database, or None if replication isn't running. The database user for the
+  replica needs the REPLICATION CLIENT privilege for this.
+  """
+  cursor = django.db.connections[READ_REPLICA_DATABASE_ALIAS].cursor()
+  cursor.execute("SHOW SLAVE STATUS")
+  row = cursor.fetchone()
+  if row is None:
+    return None
+  
+  columnnamelist = [description[0] for description in cursor.description]
+  return row[columnnamelist.index("Seconds_Behind_Master")]
+
+
+
+
+
+def _is_read_replica_usable():
+  """
+  Returns True if reads that allow stale data may currently go to the read
+  replica. The result of checking the replica's lag is reused for
+  READ_REPLICA_LAG_CHECK_INTERVAL_SECONDS.
+  """
+  global read_replica_status
+  
+  if not _is_read_replica_configured():
+    return False
+  
+  read_replica_status_lock.acquire()
+  try:
+    if read_replica_status is not None:
+      (time_checked, is_usable) = read_replica_status
+      if time.time() - time_checked < READ_REPLICA_LAG_CHECK_INTERVAL_SECONDS:
+        return is_usable
+    
+    is_usable = _check_read_replica()
+    read_replica_status = (time.time(), is_usable)
+    return is_usable
+  
+  finally:
+    read_replica_status_lock.release()
+
+
+
+
+
+def _check_read_replica():
+  """
+  Returns True if the read replica can be connected to and, unless
+  settings.MAINDB_READ_REPLICA_MAX_LAG_SECONDS is None, isn't too far behind
+  the primary database. Any error using the replica is logged, not raised.
+  """
+  maxlag = settings.MAINDB_READ_REPLICA_MAX_LAG_SECONDS
+  
+  if maxlag is not None and not _is_read_replica_mysql():
+    # We only know how to determine the lag of a mysql replica.
+    log.error("Not using the read replica because its lag can't be determined " +
+              "and MAINDB_READ_REPLICA_MAX_LAG_SECONDS is not None.")
+    return False
+  
+  # Connecting to the replica can fail in many ways (including errors of the
+  # database driver that django doesn't wrap), none of which should affect
+  # reads from the primary database.
+  try:
+    if maxlag is None:
+      _connect_to_read_replica()
+      return True
+    lag = _get_read_replica_lag_seconds()
+  except Exception, e:
+    log.error("Unable to use the read replica: " + str(e))
+    return False
+  
+  is_usable = lag is not None and lag <= maxlag
+  if not is_usable:
+    log.info("Not using the read replica because its lag is " + str(lag) + " seconds.")
+  return is_usable
+
+
+
+
+
+def _connect_to_read_replica():
+  """
+  Opens this thread's connection to the read replica if it isn't open yet,
+  which calls init_read_replica_connection() for a new connection.
+  """
+  django.db.connections[READ_REPLICA_DATABASE_ALIAS].cursor()
+
+
+
+
+
+def get_queryset_for_reading(queryset):
+  """
+  <Purpose>
+    Have a queryset read from the read replica if one is configured and it is
+    not too far behind the primary database. This is only for code that
+    doesn't need to see the very latest data, such as reports and statistics.
+  <Arguments>
+    queryset
+      A django QuerySet.
+  <Exceptions>
+    None
+  <Side Effects>
+    None
+  <Returns>
+    A QuerySet that reads from the replica, or the original queryset if the
+    primary database should be used. Objects retrieved from the replica are
+    always saved to the primary database, but they may be out of date, so
+    they should not be used as the basis for changes.
+  """
+  if not _is_read_replica_usable():
+    return queryset
+  
+  return queryset.using(READ_REPLICA_DATABASE_ALIAS)
+
+
+
+
+
 @transaction.commit_manually
 @log_function_call_and_only_first_argument
 def create_user(username, password, email, affiliation, user_pubkey, user_privkey, donor_pubkey):
@@ -277,7 +592,10 @@ def regenerate_api_key(geniuser):
   api_key = ""
   for character in random.sample(population, API_KEY_LENGTH):
     api_key += chr(character)
-    
+  
+  # Saving the user only forgets the cached authentication with the new key.
+  forget_cached_auth(geniuser)
+  
   geniuser.api_key = api_key
   geniuser.save()
 
@@ -475,7 +793,9 @@ def create_node(node_identifier, last_known_ip, last_known_port, last_known_vers
     pass
   
   # Create the Node.
-  node = Node(node_identifier=node_identifier, last_known_ip=last_known_ip,
+  node = Node(node_identifier=node_identifier,
+              node_identifier_hash=_get_node_identifier_hash(node_identifier),
+              last_known_ip=last_known_ip, subnet=_get_subnet_of_ip(last_known_ip),
               last_known_port=last_known_port, last_known_version=last_known_version,
               is_active=is_active, owner_pubkey=owner_pubkey,
               extra_vessel_name=extra_vessel_name, is_broken=False)
@@ -487,6 +807,205 @@ def create_node(node_identifier, last_known_ip, last_known_port, last_known_vers
 
 
 
+def _get_node_identifier_hash(node_identifier):
+  """
+  Returns the value stored in the node_identifier_hash field of a node with
+  the given node_identifier. All lookups of nodes by identifier should filter
+  on this indexed field rather than only on the unindexable node_identifier.
+  """
+  return hashlib.sha1(node_identifier.encode("utf-8")).hexdigest()
+
+
+
+
+
+def _get_subnet_of_ip(last_known_ip):
+  """
+  Returns the value stored in the subnet field of a node with the given
+  last_known_ip: the first three octets of the ip, or an empty string for nat
+  nodes and invalid ips.
+  """
+  if last_known_ip.startswith(NAT_STRING_PREFIX):
+    return ""
+  return last_known_ip.rpartition('.')[0]
+
+
+
+
+
+def _is_vessel_counted_as_available(vessel):
+  """
+  Returns True if the vessel is included in the AvailableVesselCount records
+  based on the values of the vessel object and its node object.
+  """
+  node = vessel.node
+  return (vessel.acquired_by_user_id is None and not vessel.is_dirty and
+          node.is_active and not node.is_broken and node.subnet != "")
+
+
+
+
+
+def _get_counted_subnet_of_node(node):
+  """
+  Returns the subnet the available vessels of the node are counted under in
+  the AvailableVesselCount records based on the values of the node object, or
+  an empty string if they aren't counted at all.
+  """
+  if node.is_active and not node.is_broken:
+    return node.subnet
+  return ""
+
+
+
+
+
+def _change_available_vessel_counts(subnet, port_list, delta):
+  """
+  Adds delta to the AvailableVesselCount of the subnet for each port in
+  port_list. A port that appears in port_list multiple times has delta added
+  that many times. Nothing is done if subnet is an empty string.
+  """
+  if not subnet:
+    return
+  
+  portcounts = {}
+  for port in port_list:
+    portcounts[port] = portcounts.get(port, 0) + delta
+  
+  for (port, portdelta) in portcounts.iteritems():
+    # Doing the addition in the database means concurrent changes by other
+    # processes to the same record aren't lost.
+    queryset = AvailableVesselCount.objects.filter(subnet=subnet, port=port)
+    if queryset.update(count=F('count') + portdelta) > 0 or portdelta < 0:
+      continue
+    
+    try:
+      AvailableVesselCount(subnet=subnet, port=port, count=portdelta).save()
+    except django.db.IntegrityError:
+      # Another process created the record after our update found nothing.
+      queryset.update(count=F('count') + portdelta)
+
+
+
+
+
+def _get_ports_of_available_vessels_on_node(node):
+  """
+  Returns a list of the ports of all vessels on the node that are neither
+  acquired nor dirty, regardless of the state of the node. A port appears in
+  the list once for each such vessel that has it.
+  """
+  queryset = VesselPort.objects.filter(vessel__node=node)
+  queryset = queryset.filter(vessel__acquired_by_user=None, vessel__is_dirty=False)
+  return list(queryset.values_list('port', flat=True))
+
+
+
+
+
+def _update_available_vessel_counts_for_vessel(vessel, was_counted):
+  """
+  Updates the AvailableVesselCount records after a change to the vessel
+  given whether the vessel was counted as available before the change.
+  """
+  is_counted = _is_vessel_counted_as_available(vessel)
+  if is_counted == was_counted:
+    return
+  
+  port_list = list(VesselPort.objects.filter(vessel=vessel).values_list('port', flat=True))
+  
+  if is_counted:
+    _change_available_vessel_counts(vessel.node.subnet, port_list, 1)
+  else:
+    _change_available_vessel_counts(vessel.node.subnet, port_list, -1)
+
+
+
+
+
+def _update_available_vessel_counts_for_node(node, old_counted_subnet):
+  """
+  Updates the AvailableVesselCount records after a change to the node given
+  the subnet its vessels were counted under before the change (see
+  _get_counted_subnet_of_node()).
+  """
+  new_counted_subnet = _get_counted_subnet_of_node(node)
+  if new_counted_subnet == old_counted_subnet:
+    return
+  
+  port_list = _get_ports_of_available_vessels_on_node(node)
+  
+  _change_available_vessel_counts(old_counted_subnet, port_list, -1)
+  _change_available_vessel_counts(new_counted_subnet, port_list, 1)
+
+
+
+
+
+@transaction.commit_manually
+def reconcile_available_vessel_counts():
+  """
+  <Purpose>
+    Correct the AvailableVesselCount records to match the current vessels,
+    vessel ports, and nodes. The records are kept up to date by the functions
+    in this module, so this is only needed if they have drifted (e.g. because
+    a process died partway through a change or the database was modified by
+    hand).
+  <Arguments>
+    None
+  <Exceptions>
+    None
+  <Side Effects>
+    AvailableVesselCount records are created, updated, and deleted as
+    necessary.
+  <Returns>
+    The number of AvailableVesselCount records that were wrong.
+  """
+  try:
+    queryset = VesselPort.objects.filter(vessel__acquired_by_user=None, vessel__is_dirty=False)
+    queryset = queryset.filter(vessel__node__is_active=True, vessel__node__is_broken=False)
+    queryset = queryset.exclude(vessel__node__subnet="")
+    queryset = queryset.values('vessel__node__subnet', 'port').annotate(vesselcount=Count('id'))
+    
+    expected = {}
+    for row in queryset:
+      expected[(row['vessel__node__subnet'], row['port'])] = row['vesselcount']
+    
+    wrongcount = 0
+    
+    for availablevesselcount in AvailableVesselCount.objects.all():
+      key = (availablevesselcount.subnet, availablevesselcount.port)
+      count = expected.pop(key, 0)
+      if availablevesselcount.count != count:
+        wrongcount += 1
+        if count == 0:
+          availablevesselcount.delete()
+        else:
+          availablevesselcount.count = count
+          availablevesselcount.save()
+    
+    # Anything left didn't have a record at all.
+    for ((subnet, port), count) in expected.iteritems():
+      wrongcount += 1
+      AvailableVesselCount(subnet=subnet, port=port, count=count).save()
+  
+  except:
+    transaction.rollback()
+    raise
+  
+  else:
+    transaction.commit()
+  
+  if wrongcount > 0:
+    log.error("Corrected " + str(wrongcount) + " AvailableVesselCount records")
+  
+  return wrongcount
+
+
+
+
+
 def get_allowed_user_ports():
   """
   <Purpose>
@@ -535,6 +1054,8 @@ def create_donation(node, donor, resource_description_text):
   donation = Donation(node=node, donor=donor,
                       resource_description_text=resource_description_text)
   donation.save()
+  
+  forget_cached_user_summary(donor)
 
   return donation
 
@@ -575,6 +1096,26 @@ def create_vessel(node, vesselname):
 
 
 
+def _update_vessel(vessel, **fieldvalues):
+  """
+  Changes only the given fields of the vessel's record in the database,
+  incrementing its version, and makes the vessel object reflect the changes.
+  Unlike vessel.save(), this doesn't overwrite fields that were changed by
+  someone else since the vessel object was retrieved, which matters because
+  vessels can be renewed without holding a node lock.
+  """
+  now = datetime.now()
+  Vessel.objects.filter(id=vessel.id).update(version=F('version') + 1, date_modified=now, **fieldvalues)
+  
+  for (fieldname, value) in fieldvalues.iteritems():
+    setattr(vessel, fieldname, value)
+  vessel.version += 1
+  vessel.date_modified = now
+
+
+
+
+
 @transaction.commit_manually
 @log_function_call
 def set_vessel_ports(vessel, port_list):
@@ -604,6 +1145,11 @@ def set_vessel_ports(vessel, port_list):
   # We're committing manually to make sure the multiple database writes are
   # atomic.
   try:
+    if _is_vessel_counted_as_available(vessel):
+      old_port_list = list(VesselPort.objects.filter(vessel=vessel).values_list('port', flat=True))
+      _change_available_vessel_counts(vessel.node.subnet, old_port_list, -1)
+      _change_available_vessel_counts(vessel.node.subnet, port_list, 1)
+    
     # Delete all existing VesselPort records for this vessel.
     VesselPort.objects.filter(vessel=vessel).delete()
     
@@ -618,46 +1164,174 @@ def set_vessel_ports(vessel, port_list):
   
   else:
     transaction.commit()
+    
+  _remove_vessels_from_available_vessel_index([vessel.id])
+  _add_vessel_to_available_vessel_index(vessel, port_list)
 
 
 
 
 
+@transaction.commit_manually
 @log_function_call
-def get_users_with_access_to_vessel(vessel):
+def create_vessels_with_ports(node, vesselname_and_port_list_list):
   """
   <Purpose>
-    Determine which users have access to a vessel according to the database.
+    Create new vessel records in the database along with their ports. This is
+    the same as calling create_vessel() and then set_vessel_ports() for each
+    vessel but is done with a few queries in a single transaction regardless
+    of the number of vessels. A node lock should be held before calling this
+    function.
   <Arguments>
-    vessel
-      The Vessel object whose user access is info is wanted.
+    node
+      The Node object of the node that the vessels exist on.
+    vesselname_and_port_list_list
+      A list of tuples of (vesselname, port_list) where port_list is the
+      complete list of port numbers (int's or long's) of the vessel.
   <Exceptions>
     None
   <Side Effects>
-    None
+    Vessel records and VesselPort records are created in the database.
   <Returns>
-    A list of GeniUser objects of the users who have access to the vessel.
+    A list of the Vessel objects of the created vessels in the same order as
+    vesselname_and_port_list_list.
   """
-  assert_vessel(vessel)
+  assert_node(node)
+  assert_list(vesselname_and_port_list_list)
+  for (vesselname, port_list) in vesselname_and_port_list_list:
+    assert_str(vesselname)
+    assert_list(port_list)
+    for port in port_list:
+      assert_int(port)
+  
+  if not vesselname_and_port_list_list:
+    # Ending a manually committed transaction that hasn't done anything.
+    transaction.commit()
+    return []
+  
+  vesselnamelist = [vesselname for (vesselname, port_list) in vesselname_and_port_list_list]
+  
+  # We're committing manually to make sure the multiple database writes are
+  # atomic.
+  try:
+    now = datetime.now()
+    vesselrowlist = []
+    for vesselname in vesselnamelist:
+      vesselrowlist.append((node.id, vesselname, None, None, None, False, True, 0, now, now))
+    
+    _bulk_insert(Vessel, ["node", "name", "acquired_by_user", "date_acquired",
+                          "date_expires", "is_dirty", "user_keys_in_sync", "version",
+                          "date_created", "date_modified"], vesselrowlist)
+    
+    # We need the ids of the vessels we just created to create their ports.
+    vesseldict = {}
+    for vessel in Vessel.objects.filter(node=node, name__in=vesselnamelist):
+      # Avoid a query for the node of each vessel.
+      vessel.node = node
+      vesseldict[vessel.name] = vessel
+    
+    portrowlist = []
+    allportlist = []
+    for (vesselname, port_list) in vesselname_and_port_list_list:
+      for port in port_list:
+        portrowlist.append((vesseldict[vesselname].id, port))
+        allportlist.append(port)
+    
+    _bulk_insert(VesselPort, ["vessel", "port"], portrowlist)
+    
+    # The new vessels are neither acquired nor dirty.
+    _change_available_vessel_counts(_get_counted_subnet_of_node(node), allportlist, 1)
 
-  user_list = []
+  except:
+    transaction.rollback()
+    raise
+  
+  else:
+    transaction.commit()
+  
+  vessel_list = []
+  for (vesselname, port_list) in vesselname_and_port_list_list:
+    vessel = vesseldict[vesselname]
+    _add_vessel_to_available_vessel_index(vessel, port_list)
+    vessel_list.append(vessel)
+  
+  return vessel_list
 
-  for vmap in VesselUserAccessMap.objects.filter(vessel=vessel):
-    user_list.append(vmap.user)
 
-  return user_list
+
+
+
+def _bulk_insert(model, fieldnamelist, rowlist):
+  """
+  Inserts a record of the model for each tuple in rowlist with a single
+  executemany(), which is much faster than saving an object for each record.
+  The values in each tuple are for the fields named in fieldnamelist, in the
+  same order, with ForeignKey values being ids. Nothing is committed and no
+  model signals are sent.
+  """
+  opts = model._meta
+  qn = django.db.connection.ops.quote_name
+  
+  columnlist = []
+  for fieldname in fieldnamelist:
+    columnlist.append(qn(opts.get_field(fieldname).column))
+  
+  sql = "INSERT INTO %s (%s) VALUES (%s)" % (qn(opts.db_table), ", ".join(columnlist),
+                                             ", ".join(["%s"] * len(columnlist)))
+  
+  # Datetimes need to be in the format the database backend expects, which
+  # django would normally take care of.
+  preparedrowlist = []
+  for row in rowlist:
+    preparedrow = []
+    for value in row:
+      if isinstance(value, datetime):
+        value = django.db.connection.ops.value_to_db_datetime(value)
+      preparedrow.append(value)
+    preparedrowlist.append(preparedrow)
+  
+  cursor = django.db.connection.cursor()
+  cursor.executemany(sql, preparedrowlist)
 
 
 
 
 
 @log_function_call
-def get_vessels_accessible_by_user(geniuser):
+def get_users_with_access_to_vessel(vessel):
   """
   <Purpose>
-    Determine which vessels the database indicates the user has access to.
+    Determine which users have access to a vessel according to the database.
   <Arguments>
-    geniuser
+    vessel
+      The Vessel object whose user access is info is wanted.
+  <Exceptions>
+    None
+  <Side Effects>
+    None
+  <Returns>
+    A list of GeniUser objects of the users who have access to the vessel.
+  """
+  assert_vessel(vessel)
+
+  user_list = []
+
+  for vmap in VesselUserAccessMap.objects.filter(vessel=vessel):
+    user_list.append(vmap.user)
+
+  return user_list
+
+
+
+
+
+@log_function_call
+def get_vessels_accessible_by_user(geniuser):
+  """
+  <Purpose>
+    Determine which vessels the database indicates the user has access to.
+  <Arguments>
+    geniuser
       The GeniUser object of the user whose vessel access info is wanted.
   <Exceptions>
     None
@@ -832,20 +1506,160 @@ def get_user_with_password(username, password):
   assert_str(username)
   assert_str(password)
   
+  cachekey = _get_password_auth_cache_key(username)
+  # Without a secret key, the hash in the cache could be used to guess the
+  # password, so nothing is cached.
+  use_cache = (PASSWORD_AUTH_CACHE_SECONDS > 0 and settings.CACHE_IS_SHARED and
+               bool(settings.SECRET_KEY))
+  
+  if use_cache:
+    passwordhash = _get_keyed_auth_hash(username, password)
+    geniuser = _get_user_of_cached_auth(cachekey, username, passwordhash)
+    if geniuser is not None:
+      _record_password_check(cached=True)
+      return geniuser
+  
   # Throws a DoesNotExistError if there is no such user.
   geniuser = get_user(username)
 
-  if not django.contrib.auth.models.check_password(password, geniuser.password):
+  starttime = time.time()
+  passwordmatches = django.contrib.auth.models.check_password(password, geniuser.password)
+  _record_password_check(cached=False, seconds=time.time() - starttime)
+  
+  if not passwordmatches:
     # Intentionally vague message to prevent a security problem if this ever
     # gets displayed on the frontend.
     raise DoesNotExistError("No such user.")
   
+  # Only the most recent password the user authenticated with is remembered.
+  if use_cache:
+    django.core.cache.cache.set(cachekey, (passwordhash, geniuser.id), PASSWORD_AUTH_CACHE_SECONDS)
+  
+  return geniuser
+
+
+
+
+
+def _get_password_auth_cache_key(username):
+  """Returns the cache key for password authentications of a user."""
+  return "maindb_password_auth_" + _hash_for_cache_key(username)
+
+
+
+
+
+def _get_keyed_auth_hash(username, secret):
+  """
+  Returns a hash of a user's password or api key keyed with
+  settings.SECRET_KEY, so that the value stored in the cache can't be used to
+  guess the password or api key.
+  """
+  if isinstance(username, unicode):
+    username = username.encode("utf-8")
+  if isinstance(secret, unicode):
+    secret = secret.encode("utf-8")
+  
+  return hmac.new(settings.SECRET_KEY, username + "\0" + secret, hashlib.sha256).hexdigest()
+
+
+
+
+
+def _get_user_of_cached_auth(cachekey, username, authhash):
+  """
+  Returns the GeniUser of a cached authentication, or None if there is no
+  cached authentication with the given hash or the user can't be used.
+  The cache only stores the (authhash, user id) of an authentication, never
+  the user record itself, as that contains the user's password hash, api key
+  and private key. The user is loaded from the database by id instead.
+  """
+  cachedvalue = django.core.cache.cache.get(cachekey)
+  if cachedvalue is None or cachedvalue[0] != authhash:
+    return None
+  
+  try:
+    geniuser = GeniUser.objects.get(id=cachedvalue[1])
+  except django.core.exceptions.ObjectDoesNotExist:
+    return None
+  
+  if geniuser.username != username or not geniuser.is_active:
+    return None
+  
   return geniuser
 
 
 
 
 
+def _record_password_check(cached, seconds=0.0):
+  """Updates the password_check_stats after a password has been checked."""
+  password_check_stats_lock.acquire()
+  try:
+    if cached:
+      password_check_stats["cached_count"] += 1
+    else:
+      password_check_stats["hashed_count"] += 1
+      password_check_stats["hashed_seconds"] += seconds
+  finally:
+    password_check_stats_lock.release()
+
+
+
+
+
+def get_password_check_stats():
+  """
+  <Purpose>
+    Get the counts of password checks done by get_user_with_password() in
+    this process.
+  <Arguments>
+    None
+  <Exceptions>
+    None
+  <Side Effects>
+    None
+  <Returns>
+    A dictionary with the keys 'hashed_count' and 'hashed_seconds' (the
+    number of passwords checked by hashing them and the total time that took)
+    and 'cached_count' (the number of checks done using a cached
+    authentication instead).
+  """
+  password_check_stats_lock.acquire()
+  try:
+    return password_check_stats.copy()
+  finally:
+    password_check_stats_lock.release()
+
+
+
+
+
+def reset_password_check_stats():
+  """
+  <Purpose>
+    Reset the counts returned by get_password_check_stats() to zero.
+  <Arguments>
+    None
+  <Exceptions>
+    None
+  <Side Effects>
+    The counts have been reset.
+  <Returns>
+    None
+  """
+  password_check_stats_lock.acquire()
+  try:
+    password_check_stats["hashed_count"] = 0
+    password_check_stats["hashed_seconds"] = 0.0
+    password_check_stats["cached_count"] = 0
+  finally:
+    password_check_stats_lock.release()
+
+
+
+
+
 @log_function_call_and_only_first_argument
 def get_user_with_api_key(username, api_key):
   """
@@ -867,6 +1681,15 @@ def get_user_with_api_key(username, api_key):
   assert_str(username)
   assert_str(api_key)
   
+  cachekey = _get_api_key_auth_cache_key(username, api_key)
+  use_cache = API_KEY_AUTH_CACHE_SECONDS > 0 and settings.CACHE_IS_SHARED
+  
+  if use_cache:
+    apikeyhash = _get_keyed_auth_hash(username, api_key)
+    geniuser = _get_user_of_cached_auth(cachekey, username, apikeyhash)
+    if geniuser is not None:
+      return geniuser
+  
   # Throws a DoesNotExistError if there is no such user.
   geniuser = get_user(username)
 
@@ -875,11 +1698,228 @@ def get_user_with_api_key(username, api_key):
     # gets displayed on the frontend.
     raise DoesNotExistError("No such user.")
   
+  if use_cache:
+    django.core.cache.cache.set(cachekey, (apikeyhash, geniuser.id), API_KEY_AUTH_CACHE_SECONDS)
+  
   return geniuser
 
 
 
 
+
+def forget_cached_auth(geniuser):
+  """
+  <Purpose>
+    Make get_user_with_password() and get_user_with_api_key() stop using
+    cached authentications of a user (with any password or the user's current
+    api key). This is done automatically whenever a GeniUser record is saved.
+  <Arguments>
+    geniuser
+      The GeniUser object of the user.
+  <Exceptions>
+    None
+  <Side Effects>
+    The cached authentications, if any, have been removed.
+  <Returns>
+    None
+  """
+  assert_geniuser(geniuser)
+  
+  django.core.cache.cache.delete(_get_password_auth_cache_key(geniuser.username))
+  
+  if geniuser.api_key:
+    django.core.cache.cache.delete(_get_api_key_auth_cache_key(geniuser.username, geniuser.api_key))
+
+
+
+
+
+def _get_api_key_auth_cache_key(username, api_key):
+  """
+  Returns the cache key for an authentication with a username and api key.
+  The api key is hashed so that it isn't stored in the cache key.
+  """
+  return "maindb_api_key_auth_" + _hash_for_cache_key(username) + "_" + _hash_for_cache_key(api_key)
+
+
+
+
+
+def _hash_for_cache_key(value):
+  """
+  Returns a hash of a string that is safe to use as part of a cache key
+  regardless of the characters in the string.
+  """
+  if isinstance(value, unicode):
+    value = value.encode("utf-8")
+  return hashlib.sha1(value).hexdigest()
+
+
+
+
+
+def get_cached_user_summary(geniuser):
+  """
+  <Purpose>
+    Retrieve a user's summary stored with cache_user_summary(), if it hasn't
+    been forgotten since.
+  <Arguments>
+    geniuser
+      The GeniUser object of the user.
+  <Exceptions>
+    None
+  <Side Effects>
+    None
+  <Returns>
+    A tuple (summary, generation). The summary is None if there is no usable
+    cached summary. In that case, the caller can compute the summary and
+    pass it to cache_user_summary() along with the generation.
+  """
+  assert_geniuser(geniuser)
+  
+  if not _user_summary_cache_is_used():
+    return (None, None)
+  
+  cache = django.core.cache.cache
+  summarykey = _get_user_summary_cache_key(geniuser.id)
+  generationkey = _get_user_summary_generation_cache_key(geniuser.id)
+  
+  # Get both with one request to the cache.
+  valuedict = cache.get_many([summarykey, generationkey])
+  generation = valuedict.get(generationkey)
+  cachedvalue = valuedict.get(summarykey)
+  
+  if generation is None:
+    # The user has no generation yet or it was evicted. A summary stored
+    # before then could be out of date, so a new generation is created. If
+    # another process created one first, that one is used.
+    cache.add(generationkey, random.getrandbits(63), USER_SUMMARY_CACHE_SECONDS * 2)
+    return (None, cache.get(generationkey))
+  
+  if cachedvalue is not None and cachedvalue[0] == generation:
+    return (cachedvalue[1], generation)
+  
+  return (None, generation)
+
+
+
+
+
+def cache_user_summary(geniuser, summary, generation):
+  """
+  <Purpose>
+    Store a user's summary for get_cached_user_summary() to return until it
+    is forgotten or USER_SUMMARY_CACHE_SECONDS have passed.
+  <Arguments>
+    geniuser
+      The GeniUser object of the user.
+    summary
+      The summary, which can be any picklable object.
+    generation
+      The generation returned by get_cached_user_summary() before the summary
+      was computed. If the user's summary was forgotten since then, the
+      summary may be out of date and won't be used.
+  <Exceptions>
+    None
+  <Side Effects>
+    The summary is in the django cache, unless there was no generation.
+  <Returns>
+    None
+  """
+  assert_geniuser(geniuser)
+  
+  # Without a generation, there is no way to tell whether the summary was
+  # forgotten while it was being computed.
+  if not _user_summary_cache_is_used() or generation is None:
+    return
+  
+  django.core.cache.cache.set(_get_user_summary_cache_key(geniuser.id),
+                              (generation, summary), USER_SUMMARY_CACHE_SECONDS)
+
+
+
+
+
+def forget_cached_user_summary(geniuser):
+  """
+  <Purpose>
+    Make get_cached_user_summary() stop returning the user's cached summary.
+    This is done automatically by the functions of this module that change
+    what is in the summary, and whenever a GeniUser record is saved.
+  <Arguments>
+    geniuser
+      The GeniUser object of the user.
+  <Exceptions>
+    None
+  <Side Effects>
+    The user's cached summary, if any, won't be used.
+  <Returns>
+    None
+  """
+  assert_geniuser(geniuser)
+  
+  _forget_cached_user_summaries_by_id([geniuser.id])
+
+
+
+
+
+def _forget_cached_user_summaries_by_id(useridlist):
+  """
+  Forget the cached summaries of the users with the given ids by giving them
+  a new generation. A summary that is being computed while this happens is
+  stored with the old generation, so it is never used.
+  """
+  if not _user_summary_cache_is_used():
+    return
+  
+  # The generations are kept for longer than the summaries so that a summary
+  # that was stored before the generation changed can't outlive it.
+  for userid in set(useridlist):
+    django.core.cache.cache.set(_get_user_summary_generation_cache_key(userid),
+                                random.getrandbits(63), USER_SUMMARY_CACHE_SECONDS * 2)
+
+
+
+
+
+def _forget_cached_user_summaries_of_donors(node):
+  """
+  Forget the cached summaries of the users who have donations on a node, as
+  their vessel credits depend on whether the node is active.
+  """
+  if not _user_summary_cache_is_used():
+    return
+  
+  _forget_cached_user_summaries_by_id(list(Donation.objects.filter(node=node).values_list('donor_id', flat=True)))
+
+
+
+
+
+def _user_summary_cache_is_used():
+  """Returns whether user summaries are cached."""
+  return USER_SUMMARY_CACHE_SECONDS > 0 and settings.CACHE_IS_SHARED
+
+
+
+
+
+def _get_user_summary_cache_key(userid):
+  """Returns the cache key of a user's summary."""
+  return "maindb_user_summary_" + str(userid)
+
+
+
+
+
+def _get_user_summary_generation_cache_key(userid):
+  """Returns the cache key of the generation of a user's summary."""
+  return "maindb_user_summary_generation_" + str(userid)
+
+
+
+
 @log_function_call
 def get_donor(donor_pubkey):
   """
@@ -1005,10 +2045,7 @@ def get_donations_by_user(geniuser, include_inactive_and_broken=False):
   """
   assert_geniuser(geniuser)
   
-  queryset = Donation.objects.filter(donor=geniuser)
-  if not include_inactive_and_broken:
-    queryset = queryset.filter(node__is_active=True)
-    queryset = queryset.filter(node__is_broken=False)
+  queryset = _get_queryset_of_donations_by_user(geniuser, include_inactive_and_broken)
   
   # Let's return it as a list() rather than a django QuerySet.
   # Using list() causes the QuerySet to be converted to a list, which also
@@ -1020,45 +2057,127 @@ def get_donations_by_user(geniuser, include_inactive_and_broken=False):
 
 
 @log_function_call
-def get_node(node_identifier):
+def get_donation_count_by_user(geniuser, include_inactive_and_broken=False, allow_stale=False):
   """
   <Purpose>
-    Retrieve a Node object that represents a specific node.
+    Determine the number of donations made by a user without retrieving them.
+    By default, only counts donations from nodes that are active and not
+    broken.
   <Arguments>
-    node_identifier
-      The identifier of the node to be retrieved.
+    geniuser
+      The user whose donations are to be counted.
+    include_inactive_and_broken
+      Whether to count donations by the user that are from nodes which are
+      inactive and/or broken. Default is False.
+    allow_stale
+      Whether the data may be read from the read replica and so be slightly
+      out of date. Default is False.
   <Exceptions>
-    DoesNotExistError
-      If there is no node in the database with the provided identifier.
+    None
   <Side Effects>
     None
   <Returns>
-    A Node object.
+    The number of donations, the same as the length of the list that
+    get_donations_by_user() would return.
   """
-  assert_str(node_identifier)
-
-  try:
-    node = Node.objects.get(node_identifier=node_identifier)
-    
-  except django.core.exceptions.ObjectDoesNotExist:
-    raise DoesNotExistError("There is no node with the node identifier: " + str(node_identifier))
-    
-  except django.core.exceptions.MultipleObjectsReturned:
-    raise InternalError("Multiple records returned when looking up a node by node identifier.")
+  assert_geniuser(geniuser)
   
-  return node
+  queryset = _get_queryset_of_donations_by_user(geniuser, include_inactive_and_broken)
+  if allow_stale:
+    queryset = get_queryset_for_reading(queryset)
+  
+  return queryset.count()
 
 
 
 
 
-@log_function_call
-def set_node_owner_pubkey(node, ownerkeystring):
+def _get_queryset_of_donations_by_user(geniuser, include_inactive_and_broken):
   """
-  <Purpose>
-    Change a node's owner key. A node lock should be held before calling this
-    function.
-  <Arguments>
+  Get a queryset of the donations made by a user. See get_donations_by_user().
+  """
+  queryset = Donation.objects.filter(donor=geniuser)
+  if not include_inactive_and_broken:
+    queryset = queryset.filter(node__is_active=True)
+    queryset = queryset.filter(node__is_broken=False)
+  return queryset
+
+
+
+
+
+@log_function_call
+def get_node(node_identifier):
+  """
+  <Purpose>
+    Retrieve a Node object that represents a specific node.
+  <Arguments>
+    node_identifier
+      The identifier of the node to be retrieved.
+  <Exceptions>
+    DoesNotExistError
+      If there is no node in the database with the provided identifier.
+  <Side Effects>
+    None
+  <Returns>
+    A Node object.
+  """
+  assert_str(node_identifier)
+
+  try:
+    # We also compare the full identifier so that a hash collision can never
+    # give us the wrong node. The database only uses the hash's index.
+    node = Node.objects.get(node_identifier_hash=_get_node_identifier_hash(node_identifier),
+                            node_identifier=node_identifier)
+    
+  except django.core.exceptions.ObjectDoesNotExist:
+    raise DoesNotExistError("There is no node with the node identifier: " + str(node_identifier))
+    
+  except django.core.exceptions.MultipleObjectsReturned:
+    raise InternalError("Multiple records returned when looking up a node by node identifier.")
+  
+  return node
+
+
+
+
+
+@log_function_call
+def get_nodes_with_last_known_address(last_known_ip, last_known_port):
+  """
+  <Purpose>
+    Retrieve the nodes that were last known to be at a given address. There
+    will usually be zero or one, but nothing prevents a node that is no longer
+    at an address from still being recorded there.
+  <Arguments>
+    last_known_ip
+      The last known ip address or NAT string of the node.
+    last_known_port
+      The last known port of the node.
+  <Exceptions>
+    None
+  <Side Effects>
+    None
+  <Returns>
+    A list of Node objects.
+  """
+  assert_str(last_known_ip)
+  assert_int(last_known_port)
+
+  return list(Node.objects.filter(last_known_ip=last_known_ip,
+                                  last_known_port=last_known_port))
+
+
+
+
+
+@log_function_call
+def set_node_owner_pubkey(node, ownerkeystring):
+  """
+  <Purpose>
+    Change a node's owner key. A node lock should be held before calling this
+    function.
+  <Arguments>
     node
       The node object of the node whose owner key is to be modified.
     ownerkeystring
@@ -1099,8 +2218,18 @@ def record_node_communication_failure(node):
   """
   assert_node(node)
   
+  old_counted_subnet = _get_counted_subnet_of_node(node)
+  was_active = node.is_active
+  
   node.is_active = False
   node.save()
+  
+  _update_available_vessel_counts_for_node(node, old_counted_subnet)
+  
+  # This is called for every failed contact with a node, so only look up the
+  # donors when the node actually went down.
+  if was_active:
+    _forget_cached_user_summaries_of_donors(node)
 
 
 
@@ -1137,12 +2266,26 @@ def record_node_communication_success(node, version, ip, port):
   assert_str(ip)
   assert_positive_int(port)
   
+  # The subnet of the node's vessels in the available vessel index may no
+  # longer be right. They'll be added back when the index is rebuilt.
+  if node.last_known_ip != ip:
+    _remove_node_from_available_vessel_index(node)
+  
+  old_counted_subnet = _get_counted_subnet_of_node(node)
+  was_active = node.is_active
+  
   node.last_known_version = version
   node.last_known_ip = ip
+  node.subnet = _get_subnet_of_ip(ip)
   node.last_known_port = port
   node.is_active = True
   node.date_last_contacted = datetime.now()
   node.save()
+  
+  _update_available_vessel_counts_for_node(node, old_counted_subnet)
+  
+  if not was_active:
+    _forget_cached_user_summaries_of_donors(node)
 
 
 
@@ -1199,8 +2342,19 @@ def mark_node_as_active(node):
   """
   assert_node(node)
   
+  old_counted_subnet = _get_counted_subnet_of_node(node)
+  
   node.is_active = True
   node.save()
+  
+  _update_available_vessel_counts_for_node(node, old_counted_subnet)
+  
+  _forget_cached_user_summaries_of_donors(node)
+  
+  for vessel in node.vessel_set.all():
+    # Avoid a query for the node of each vessel.
+    vessel.node = node
+    _add_vessel_to_available_vessel_index(vessel)
 
 
 
@@ -1228,8 +2382,16 @@ def mark_node_as_inactive(node):
   """
   assert_node(node)
   
+  old_counted_subnet = _get_counted_subnet_of_node(node)
+  
   node.is_active = False
   node.save()
+  
+  _update_available_vessel_counts_for_node(node, old_counted_subnet)
+  
+  _forget_cached_user_summaries_of_donors(node)
+  
+  _remove_node_from_available_vessel_index(node)
 
 
 
@@ -1257,8 +2419,16 @@ def mark_node_as_broken(node):
   """
   assert_node(node)
   
+  old_counted_subnet = _get_counted_subnet_of_node(node)
+  
   node.is_broken = True
   node.save()
+  
+  _update_available_vessel_counts_for_node(node, old_counted_subnet)
+  
+  _forget_cached_user_summaries_of_donors(node)
+  
+  _remove_node_from_available_vessel_index(node)
 
 
 
@@ -1287,7 +2457,8 @@ def get_vessel(node_identifier, vesselname):
   assert_str(vesselname)
 
   try:
-    vessel = Vessel.objects.get(node__node_identifier=node_identifier, name=vesselname)
+    vessel = Vessel.objects.get(node__node_identifier_hash=_get_node_identifier_hash(node_identifier),
+                                node__node_identifier=node_identifier, name=vesselname)
     
   except django.core.exceptions.ObjectDoesNotExist:
     raise DoesNotExistError("There is no vessel with the node identifier: " + 
@@ -1303,7 +2474,103 @@ def get_vessel(node_identifier, vesselname):
 
 
 @log_function_call
-def get_acquired_vessels(geniuser):
+def get_vessels(node_identifier_and_vesselname_list):
+  """
+  <Purpose>
+    Retrieve Vessel objects that represent many specific vessels. This is the
+    same as calling get_vessel() for each vessel but requires only one query
+    (for up to GET_VESSELS_MAX_VESSELS_PER_QUERY vessels). The node of each
+    vessel is retrieved in the same query.
+  <Arguments>
+    node_identifier_and_vesselname_list
+      A list of tuples of (node_identifier, vesselname).
+  <Exceptions>
+    DoesNotExistError
+      If any of the vessels are not in the database (including if there is no
+      node with the given identifier).
+  <Side Effects>
+    None
+  <Returns>
+    A list of Vessel objects in the same order as the tuples in
+    node_identifier_and_vesselname_list.
+  """
+  assert_list(node_identifier_and_vesselname_list)
+  for (node_identifier, vesselname) in node_identifier_and_vesselname_list:
+    assert_str(node_identifier)
+    assert_str(vesselname)
+  
+  # The keys are tuples of (node_identifier_hash, vesselname).
+  vesseldict = {}
+  
+  for start in range(0, len(node_identifier_and_vesselname_list), GET_VESSELS_MAX_VESSELS_PER_QUERY):
+    chunk = node_identifier_and_vesselname_list[start:start + GET_VESSELS_MAX_VESSELS_PER_QUERY]
+    
+    # This can also match vessels with the name of one of the requested
+    # vessels that are on the node of another, but those are just ignored.
+    hashlist = [_get_node_identifier_hash(node_identifier) for (node_identifier, vesselname) in chunk]
+    namelist = [vesselname for (node_identifier, vesselname) in chunk]
+    
+    queryset = Vessel.objects.filter(node__node_identifier_hash__in=hashlist, name__in=namelist)
+    for vessel in queryset.select_related('node'):
+      vesseldict[(vessel.node.node_identifier_hash, vessel.name)] = vessel
+  
+  vessel_list = []
+  
+  for (node_identifier, vesselname) in node_identifier_and_vesselname_list:
+    vessel = vesseldict.get((_get_node_identifier_hash(node_identifier), vesselname))
+    if vessel is None or vessel.node.node_identifier != node_identifier:
+      raise DoesNotExistError("There is no vessel with the node identifier: " + 
+                              str(node_identifier) + " and vessel name: " + vesselname)
+    vessel_list.append(vessel)
+  
+  return vessel_list
+
+
+
+
+
+@log_function_call
+def get_nodes_of_vessels(vessel_list):
+  """
+  <Purpose>
+    Retrieve the Node objects of the nodes that many vessels are on using at
+    most a single query. The nodes of vessels that were retrieved along with
+    their node (e.g. through select_related()) aren't retrieved again.
+  <Arguments>
+    vessel_list
+      A list of Vessel objects.
+  <Exceptions>
+    None
+  <Side Effects>
+    None
+  <Returns>
+    A dictionary whose keys are node ids (the node_id of each vessel) and whose
+    values are Node objects.
+  """
+  assert_list(vessel_list)
+  for vessel in vessel_list:
+    assert_vessel(vessel)
+  
+  # The attribute django keeps a vessel's node in once it has been retrieved.
+  nodecachename = Vessel._meta.get_field('node').get_cache_name()
+  
+  nodedict = {}
+  for vessel in vessel_list:
+    if hasattr(vessel, nodecachename):
+      nodedict[vessel.node_id] = getattr(vessel, nodecachename)
+  
+  nodeidlist = list(set([vessel.node_id for vessel in vessel_list]) - set(nodedict.keys()))
+  if nodeidlist:
+    nodedict.update(Node.objects.in_bulk(nodeidlist))
+  
+  return nodedict
+
+
+
+
+
+@log_function_call
+def get_acquired_vessels(geniuser, allow_stale=False):
   """
   <Purpose>
     Retrieve a list of vessels that are acquired by a user.
@@ -1311,6 +2578,9 @@ def get_acquired_vessels(geniuser):
     geniuser
       The GeniUser object of the user whose acquired vessels are to be
       retrieved.
+    allow_stale
+      Whether the data may be read from the read replica and so be slightly
+      out of date. Default is False.
   <Exceptions>
     None
   <Side Effects>
@@ -1320,16 +2590,107 @@ def get_acquired_vessels(geniuser):
   """
   assert_geniuser(geniuser)
   
+  queryset = _get_queryset_of_acquired_vessels(geniuser)
+  if allow_stale:
+    queryset = get_queryset_for_reading(queryset)
+  
   # Let's return it as a list() rather than a django QuerySet.
   # Using list() causes the QuerySet to be converted to a list, which also
   # means the query is executed (no lazy loading).
-  queryset = Vessel.objects.filter(acquired_by_user=geniuser)
+  return list(queryset)
+
+
+
+
+
+@log_function_call
+def get_acquired_vessels_page(geniuser, after_vessel_id, page_size, allow_stale=False):
+  """
+  <Purpose>
+    Retrieve part of the list of vessels that are acquired by a user. The
+    vessels are ordered by id and the page starts after a given vessel id, so
+    the whole list can be retrieved a page at a time without the database
+    having to skip over the vessels of earlier pages.
+  <Arguments>
+    geniuser
+      The GeniUser object of the user whose acquired vessels are to be
+      retrieved.
+    after_vessel_id
+      Only vessels whose id is greater than this are retrieved. To get the
+      first page, use 0. To get the next page, use the id of the last vessel
+      of the previous page.
+    page_size
+      The largest number of vessels to retrieve.
+    allow_stale
+      Whether the data may be read from the read replica and so be slightly
+      out of date. Default is False.
+  <Exceptions>
+    None
+  <Side Effects>
+    None
+  <Returns>
+    A list of at most page_size Vessel objects.
+  """
+  assert_geniuser(geniuser)
+  assert_int(after_vessel_id)
+  assert_positive_int(page_size)
+  
+  queryset = _get_queryset_of_acquired_vessels(geniuser)
+  queryset = queryset.filter(id__gt=after_vessel_id).order_by('id')
+  if allow_stale:
+    queryset = get_queryset_for_reading(queryset)
+  
+  return list(queryset[:page_size])
+
+
+
+
+
+@log_function_call
+def get_acquired_vessel_count(geniuser, allow_stale=False):
+  """
+  <Purpose>
+    Determine the number of vessels that are acquired by a user without
+    retrieving them.
+  <Arguments>
+    geniuser
+      The GeniUser object of the user whose acquired vessels are to be
+      counted.
+    allow_stale
+      Whether the data may be read from the read replica and so be slightly
+      out of date. Default is False.
+  <Exceptions>
+    None
+  <Side Effects>
+    None
+  <Returns>
+    The number of vessels, the same as the length of the list that
+    get_acquired_vessels() would return.
+  """
+  assert_geniuser(geniuser)
+  
+  queryset = _get_queryset_of_acquired_vessels(geniuser)
+  if allow_stale:
+    queryset = get_queryset_for_reading(queryset)
+  
+  return queryset.count()
+
+
+
+
+
+def _get_queryset_of_acquired_vessels(geniuser):
+  """
+  Get a queryset of the vessels that are acquired by a user. The node of each
+  vessel is retrieved in the same query.
+  """
+  queryset = Vessel.objects.filter(acquired_by_user=geniuser).select_related('node')
   # We don't include expired vessels. That is, as far as what the user sees and
   # is considered having acquired, vessels expire immediately when their
   # expiration time arrives.
   queryset = queryset.exclude(date_expires__lte=datetime.now())
-  return list(queryset)
-  
+  return queryset
+
 
 
 
@@ -1341,18 +2702,17 @@ def _get_queryset_of_all_available_vessels_for_a_port_include_nat_nodes(port):
   vessels on nat nodes.
   """
   queryset = Vessel.objects.filter(acquired_by_user=None)
-  # No dirty vessels or inactive nodes.
-  queryset = queryset.exclude(is_dirty=True)
-  queryset = queryset.exclude(node__is_active=False)
-  queryset = queryset.exclude(node__is_broken=True)
+  # No dirty vessels or inactive nodes. We use filter() rather than exclude()
+  # so that these are simple equality conditions the database can satisfy
+  # using the composite indexes in website/control/sql.
+  queryset = queryset.filter(is_dirty=False)
+  queryset = queryset.filter(node__is_active=True, node__is_broken=False)
   # Make sure we only get vessels with the user's assigned port.
   queryset = queryset.filter(vesselport__port__exact=port)
-  # Randomize the vessels returned by the query.
-  # Using order_by('?') is the QuerySet way of saying ORDER BY RAND().
-  queryset = queryset.order_by('?')
-  
-  log.debug("There are " + str(queryset.count()) + " available NAT and non-NAT node vessels on port " + str(port))
-
+  # Note that the queryset is not randomized. Having the database do an
+  # ORDER BY RAND() means sorting every available vessel on the port each time
+  # this is used. See _get_random_vessel_sample() and the available vessel
+  # index for how vessels are chosen at random from the queryset.
   return queryset
 
 
@@ -1367,8 +2727,6 @@ def _get_queryset_of_all_available_vessels_for_a_port_exclude_nat_nodes(port):
   queryset = _get_queryset_of_all_available_vessels_for_a_port_include_nat_nodes(port)
   
   queryset = queryset.exclude(node__last_known_ip__startswith=NAT_STRING_PREFIX)
-  
-  log.debug("There are " + str(queryset.count()) + " available non-NAT node vessels on port " + str(port))
 
   return queryset
 
@@ -1384,8 +2742,6 @@ def _get_queryset_of_all_available_vessels_for_a_port_only_nat_nodes(port):
   queryset = _get_queryset_of_all_available_vessels_for_a_port_include_nat_nodes(port)
   
   queryset = queryset.filter(node__last_known_ip__startswith=NAT_STRING_PREFIX)
-  
-  log.debug("There are " + str(queryset.count()) + " available NAT node vessels on port " + str(port))
 
   return queryset
 
@@ -1393,6 +2749,469 @@ def _get_queryset_of_all_available_vessels_for_a_port_only_nat_nodes(port):
 
 
 
+def _get_vessels_by_id(vesselidlist):
+  """
+  Returns a list of Vessel objects in the same order as the ids in
+  vesselidlist. The node of each vessel is retrieved in the same query. Ids of
+  vessels that no longer exist are skipped.
+  """
+  vesseldict = Vessel.objects.select_related('node').in_bulk(vesselidlist)
+  return [vesseldict[vesselid] for vesselid in vesselidlist if vesselid in vesseldict]
+
+
+
+
+
+def _get_random_vessel_sample(queryset, samplesize):
+  """
+  Returns a list of up to samplesize Vessel objects chosen at random from the
+  queryset. Rather than reading the id of every vessel in the queryset, ids are
+  read from random ranges of the vessel id space that together start out
+  covering about four times samplesize ids. The ranges are made four times
+  larger until enough vessels are found or they cover every id, so the work
+  done depends on the sample size and on how many vessels are available rather
+  than on the number of vessels in the queryset.
+  """
+  idrange = Vessel.objects.aggregate(Min('id'), Max('id'))
+  (minid, maxid) = (idrange['id__min'], idrange['id__max'])
+  if minid is None:
+    return []
+
+  idspan = maxid - minid + 1
+  coveredids = 4 * samplesize
+
+  while True:
+    if coveredids >= idspan:
+      vesselidlist = list(queryset.values_list('id', flat=True))
+      break
+
+    rangesize = max(1, coveredids // RANDOM_VESSEL_SAMPLE_RANGE_COUNT)
+    rangefilterlist = []
+    for i in range(RANDOM_VESSEL_SAMPLE_RANGE_COUNT):
+      start = random.randint(minid, maxid)
+      rangefilterlist.append(Q(id__gte=start, id__lt=start + rangesize))
+      # Ranges that go past the largest id continue from the smallest id so
+      # that vessels with small ids aren't less likely to be chosen.
+      if start + rangesize > maxid + 1:
+        rangefilterlist.append(Q(id__lt=minid + start + rangesize - maxid - 1))
+
+    rangefilter = rangefilterlist[0]
+    for otherfilter in rangefilterlist[1:]:
+      rangefilter = rangefilter | otherfilter
+
+    vesselidlist = list(set(queryset.filter(rangefilter).values_list('id', flat=True)))
+    if len(vesselidlist) >= samplesize:
+      break
+
+    coveredids *= 4
+
+  sampledidlist = random.sample(vesselidlist, min(samplesize, len(vesselidlist)))
+
+  return _get_vessels_by_id(sampledidlist)
+
+
+
+
+
+class _RandomSampleList(object):
+  """
+  A set of items kept in a list so that items can be added, removed, and
+  sampled at random without the work depending on the number of items.
+  """
+
+  def __init__(self):
+    self.items = []
+    # The position of each item in self.items.
+    self.positions = {}
+
+
+
+  def __len__(self):
+    return len(self.items)
+
+
+
+  def add(self, item):
+    if item not in self.positions:
+      self.positions[item] = len(self.items)
+      self.items.append(item)
+
+
+
+  def remove(self, item):
+    position = self.positions.pop(item, None)
+    if position is None:
+      return
+    # Move the last item into the removed item's place.
+    lastitem = self.items.pop()
+    if position < len(self.items):
+      self.items[position] = lastitem
+      self.positions[lastitem] = position
+
+
+
+  def sample(self, count):
+    return random.sample(self.items, min(count, len(self.items)))
+
+
+
+
+
+class _AvailableVesselPortIndex(object):
+  """
+  The vessels available on one port in the available vessel index (see the
+  comments for available_vessel_index at the top of this module). Access must
+  be done while holding available_vessel_index_lock.
+  """
+
+  def __init__(self):
+    # A dict of vessel ids to tuples of (node_id, subnet, is_nat).
+    self.vesseldict = {}
+    self.vesselids = _RandomSampleList()
+    # The ids of the vessels on nat nodes. These are also on the "" subnet in
+    # subnetvesselids, along with the vessels on nodes with invalid ips.
+    self.natvesselids = _RandomSampleList()
+    # A dict of subnets to _RandomSampleLists of the ids of the vessels on them.
+    self.subnetvesselids = {}
+    # The subnets in subnetvesselids other than "" (nat nodes and nodes with
+    # invalid ips).
+    self.subnets = _RandomSampleList()
+    # A dict of node ids to sets of the ids of the vessels on them.
+    self.nodevesselids = {}
+
+
+
+  def __len__(self):
+    return len(self.vesseldict)
+
+
+
+  def get_vessel_ids(self, subnet=None):
+    """Returns the ids of all vessels, or of those on the subnet if it is given."""
+    if subnet is None:
+      return list(self.vesselids.items)
+    if subnet not in self.subnetvesselids:
+      return []
+    return list(self.subnetvesselids[subnet].items)
+
+
+
+  def get_index_values(self, vesselidlist):
+    """Returns a dict of the (node_id, subnet, is_nat) of each of the vessels ids."""
+    indexvaluedict = {}
+    for vesselid in vesselidlist:
+      if vesselid in self.vesseldict:
+        indexvaluedict[vesselid] = self.vesseldict[vesselid]
+    return indexvaluedict
+
+
+
+  def add_vessel(self, vesselid, nodeid, subnet, is_nat=False):
+    self.remove_vessel(vesselid)
+    self.vesseldict[vesselid] = (nodeid, subnet, is_nat)
+    self.vesselids.add(vesselid)
+    if is_nat:
+      self.natvesselids.add(vesselid)
+    self.subnetvesselids.setdefault(subnet, _RandomSampleList()).add(vesselid)
+    if subnet:
+      self.subnets.add(subnet)
+    self.nodevesselids.setdefault(nodeid, set()).add(vesselid)
+
+
+
+  def remove_vessel(self, vesselid):
+    indexvalue = self.vesseldict.pop(vesselid, None)
+    if indexvalue is None:
+      return
+    (nodeid, subnet, is_nat) = indexvalue
+
+    self.vesselids.remove(vesselid)
+    self.natvesselids.remove(vesselid)
+
+    subnetvesselids = self.subnetvesselids[subnet]
+    subnetvesselids.remove(vesselid)
+    if len(subnetvesselids) == 0:
+      del self.subnetvesselids[subnet]
+      self.subnets.remove(subnet)
+
+    nodevesselids = self.nodevesselids[nodeid]
+    nodevesselids.discard(vesselid)
+    if not nodevesselids:
+      del self.nodevesselids[nodeid]
+
+
+
+  def remove_node(self, nodeid):
+    for vesselid in list(self.nodevesselids.get(nodeid, [])):
+      self.remove_vessel(vesselid)
+
+
+
+  def sample_vessels(self, count, subnet=None):
+    """
+    Returns the ids of up to count vessels chosen at random, only from those
+    on the subnet if it is given.
+    """
+    if subnet is None:
+      return self.vesselids.sample(count)
+    if subnet not in self.subnetvesselids:
+      return []
+    return self.subnetvesselids[subnet].sample(count)
+
+
+
+  def sample_nat_vessels(self, count):
+    """Returns the ids of up to count vessels on nat nodes chosen at random."""
+    return self.natvesselids.sample(count)
+
+
+
+  def sample_one_vessel_per_subnet(self, count):
+    """
+    Returns the ids of up to count vessels in random order where each vessel
+    is randomly chosen from those on a different non-nat subnet.
+    """
+    vesselidlist = []
+    for subnet in self.subnets.sample(count):
+      vesselidlist.append(random.choice(self.subnetvesselids[subnet].items))
+    return vesselidlist
+
+
+
+  def get_subnets_with_vessel_count(self, vesselcount):
+    """
+    Returns the non-nat subnets with at least vesselcount vessels, in random
+    order.
+    """
+    subnetlist = self.subnets.sample(len(self.subnets))
+    return [subnet for subnet in subnetlist if len(self.subnetvesselids[subnet]) >= vesselcount]
+
+
+
+
+
+def _get_available_vessel_index(port, rebuild=False):
+  """
+  Returns the _AvailableVesselPortIndex of the available vessel index for a
+  port, which must only be used while holding available_vessel_index_lock. If
+  the index for the port doesn't exist, is older than
+  AVAILABLE_VESSEL_INDEX_MAX_AGE_SECONDS, or rebuild is True, the index for
+  the port is first rebuilt from the database with a single query.
+  """
+  available_vessel_index_lock.acquire()
+  try:
+    indexentry = available_vessel_index.get(port)
+  finally:
+    available_vessel_index_lock.release()
+  
+  if (not rebuild and indexentry is not None and
+      time.time() - indexentry[0] < AVAILABLE_VESSEL_INDEX_MAX_AGE_SECONDS):
+    return indexentry[1]
+  
+  queryset = _get_queryset_of_all_available_vessels_for_a_port_include_nat_nodes(port)
+  
+  portindex = _AvailableVesselPortIndex()
+  for (vesselid, nodeid, last_known_ip) in queryset.values_list('id', 'node', 'node__last_known_ip'):
+    portindex.add_vessel(vesselid, nodeid, _get_subnet_of_ip(last_known_ip),
+                         last_known_ip.startswith(NAT_STRING_PREFIX))
+  
+  available_vessel_index_lock.acquire()
+  try:
+    available_vessel_index[port] = (time.time(), portindex)
+  finally:
+    available_vessel_index_lock.release()
+  
+  return portindex
+
+
+
+
+
+def _remove_vessels_from_available_vessel_index(vesselidlist):
+  """
+  Removes vessels from the available vessel index for all ports.
+  """
+  available_vessel_index_lock.acquire()
+  try:
+    for (time_built, portindex) in available_vessel_index.values():
+      for vesselid in vesselidlist:
+        portindex.remove_vessel(vesselid)
+  finally:
+    available_vessel_index_lock.release()
+
+
+
+
+
+def _remove_node_from_available_vessel_index(node):
+  """
+  Removes all vessels on a node from the available vessel index.
+  """
+  available_vessel_index_lock.acquire()
+  try:
+    for (time_built, portindex) in available_vessel_index.values():
+      portindex.remove_node(node.id)
+  finally:
+    available_vessel_index_lock.release()
+
+
+
+
+
+def _add_vessel_to_available_vessel_index(vessel, port_list=None):
+  """
+  Adds a vessel to the available vessel index for each of its ports (or those
+  in port_list, if given) if the vessel is available. Nothing is done for
+  ports whose index hasn't been built, as the vessel will be included when it
+  is built.
+  """
+  if vessel.acquired_by_user_id is not None or vessel.is_dirty:
+    return
+  
+  # Processes that never choose vessels for users (e.g. the backend) never
+  # build the index, so don't waste any queries on it.
+  available_vessel_index_lock.acquire()
+  try:
+    if not available_vessel_index:
+      return
+  finally:
+    available_vessel_index_lock.release()
+  
+  node = vessel.node
+  if not node.is_active or node.is_broken:
+    return
+  
+  if port_list is None:
+    port_list = list(VesselPort.objects.filter(vessel=vessel).values_list('port', flat=True))
+  
+  subnet = _get_subnet_of_ip(node.last_known_ip)
+  is_nat = node.last_known_ip.startswith(NAT_STRING_PREFIX)
+  
+  available_vessel_index_lock.acquire()
+  try:
+    for port in port_list:
+      if port in available_vessel_index:
+        available_vessel_index[port][1].add_vessel(vessel.id, node.id, subnet, is_nat)
+  finally:
+    available_vessel_index_lock.release()
+
+
+
+
+
+def reset_available_vessel_index():
+  """
+  <Purpose>
+    Discard the available vessel index for all ports.
+  <Arguments>
+    None
+  <Exceptions>
+    None
+  <Side Effects>
+    The index for each port will be rebuilt from the database the next time
+    it is needed.
+  <Returns>
+    None
+  """
+  available_vessel_index_lock.acquire()
+  try:
+    available_vessel_index.clear()
+  finally:
+    available_vessel_index_lock.release()
+
+
+
+
+
+def _get_available_vessels_by_id(port, vesselidlist, indexvaluedict):
+  """
+  Returns a list of the Vessel objects (with their nodes) for the ids in
+  vesselidlist, in the same order, that are actually available on the port
+  according to the database and are still on the node and subnet, and on a
+  nat or non-nat node, as indexvaluedict (a dict of vessel ids to their
+  (node_id, subnet, is_nat) in the available vessel index) says they are. Ids
+  of vessels that aren't are removed from the available vessel index.
+  """
+  if not vesselidlist:
+    return []
+  
+  queryset = _get_queryset_of_all_available_vessels_for_a_port_include_nat_nodes(port)
+  vesseldict = queryset.select_related('node').in_bulk(vesselidlist)
+  
+  vessellist = []
+  unavailableidlist = []
+  
+  for vesselid in vesselidlist:
+    vessel = vesseldict.get(vesselid)
+    if vessel is None:
+      unavailableidlist.append(vesselid)
+      continue
+    
+    last_known_ip = vessel.node.last_known_ip
+    indexvalue = (vessel.node_id, _get_subnet_of_ip(last_known_ip),
+                  last_known_ip.startswith(NAT_STRING_PREFIX))
+    if indexvaluedict.get(vesselid) != indexvalue:
+      unavailableidlist.append(vesselid)
+      continue
+    
+    vessellist.append(vessel)
+  
+  if unavailableidlist:
+    _remove_vessels_from_available_vessel_index(unavailableidlist)
+  
+  return vessellist
+
+
+
+
+
+def _choose_from_available_vessel_index(port, choose_func, rebuild=False):
+  """
+  Calls choose_func, which is given the _AvailableVesselPortIndex for a port
+  and returns a list of vessel ids, while holding available_vessel_index_lock.
+  
+  Returns a tuple (vesselidlist, indexvaluedict, availablecount) where
+  vesselidlist is what choose_func returned, indexvaluedict is the
+  (node_id, subnet, is_nat) of each chosen vessel in the index, and
+  availablecount is the number of vessels in the index.
+  """
+  portindex = _get_available_vessel_index(port, rebuild)
+  
+  available_vessel_index_lock.acquire()
+  try:
+    vesselidlist = choose_func(portindex)
+    return (vesselidlist, portindex.get_index_values(vesselidlist), len(portindex))
+  finally:
+    available_vessel_index_lock.release()
+
+
+
+
+
+def _get_available_vessels_using_index(port, choose_func, requiredcount):
+  """
+  Uses choose_func, which is given the _AvailableVesselPortIndex for a port
+  (while holding available_vessel_index_lock) and returns a list of vessel ids,
+  to choose vessels that are available on the port. If fewer than
+  requiredcount of the chosen vessels turn out to be available, the index for
+  the port is rebuilt and vessels are chosen again.
+  
+  Returns a tuple (vessellist, availablecount) where availablecount is the
+  number of vessels in the index the last vessels were chosen from.
+  """
+  for rebuild in [False, True]:
+    (vesselidlist, indexvaluedict, availablecount) = _choose_from_available_vessel_index(port, choose_func,
+                                                                                          rebuild)
+    vessellist = _get_available_vessels_by_id(port, vesselidlist, indexvaluedict)
+    if len(vessellist) >= requiredcount:
+      break
+  
+  return (vessellist, availablecount)
+
+
+
+
+
 @log_function_call
 def get_available_rand_vessels(geniuser, vesselcount):
   """
@@ -1422,14 +3241,28 @@ def get_available_rand_vessels(geniuser, vesselcount):
   # attempted to be acquired by the client code.
   returnvesselcount = GET_AVAILABLE_VESSELS_MULTIPLIER * vesselcount + GET_AVAILABLE_VESSELS_ADDER
   
-  allvesselsqueryset = _get_queryset_of_all_available_vessels_for_a_port_include_nat_nodes(geniuser.usable_vessel_port)
+  if USE_AVAILABLE_VESSEL_INDEX:
+    def choose_func(portindex):
+      return portindex.sample_vessels(returnvesselcount)
+    
+    (vessellist, availablecount) = _get_available_vessels_using_index(geniuser.usable_vessel_port,
+                                                                      choose_func, vesselcount)
+  
+    log.debug("There are " + str(availablecount) + " available NAT and non-NAT node vessels on port " + str(geniuser.usable_vessel_port))
+  
+  else:
+    allvesselsqueryset = _get_queryset_of_all_available_vessels_for_a_port_include_nat_nodes(geniuser.usable_vessel_port)
+    vessellist = _get_random_vessel_sample(allvesselsqueryset, returnvesselcount)
+    # Only count the available vessels when we need to say how many there are.
+    if len(vessellist) < vesselcount:
+      availablecount = allvesselsqueryset.count()
    
-  if allvesselsqueryset.count() < vesselcount:
-    message = "Requested " + str(vesselcount) + " rand vessels, but we only have " + str(allvesselsqueryset.count())
+  if len(vessellist) < vesselcount:
+    message = "Requested " + str(vesselcount) + " rand vessels, but we only have " + str(availablecount)
     message += " vessels with port " + str(geniuser.usable_vessel_port) + " available." 
     raise UnableToAcquireResourcesError(message)
   
-  return list(allvesselsqueryset[:returnvesselcount])
+  return vessellist
 
 
 
@@ -1463,17 +3296,28 @@ def get_available_nat_vessels(geniuser, vesselcount):
   # attempted to be acquired by the client code.
   returnvesselcount = GET_AVAILABLE_VESSELS_MULTIPLIER * vesselcount + GET_AVAILABLE_VESSELS_ADDER
   
-  natvesselsqueryset = _get_queryset_of_all_available_vessels_for_a_port_only_nat_nodes(geniuser.usable_vessel_port)
+  if USE_AVAILABLE_VESSEL_INDEX:
+    def choose_func(portindex):
+      return portindex.sample_nat_vessels(returnvesselcount)
+    
+    (vessellist, availablecount) = _get_available_vessels_using_index(geniuser.usable_vessel_port,
+                                                                      choose_func, vesselcount)
+    
+  else:
+    natvesselsqueryset = _get_queryset_of_all_available_vessels_for_a_port_only_nat_nodes(geniuser.usable_vessel_port)
+    vessellist = _get_random_vessel_sample(natvesselsqueryset, returnvesselcount)
+  
+  log.debug("There are " + str(len(vessellist)) + " available NAT node vessel candidates on port " + str(geniuser.usable_vessel_port))
    
-  if natvesselsqueryset.count() < vesselcount:
+  if len(vessellist) < vesselcount:
     #COMMENT this out when NAT acquistion feature is re-enabled  /* ADDED Aug 06, 2012 by GP */
     message = 'Acquiring NAT vessels is currently disabled. '
     #UNCOMMENT this when NAT acquistion feature is re-enabled
-    #message = "Requested " + str(vesselcount) + " nat vessels, but we only have " + str(natvesselsqueryset.count())
+    #message = "Requested " + str(vesselcount) + " nat vessels, but we only have " + str(len(vessellist))
     #message += " vessels with port " + str(geniuser.usable_vessel_port) + " available." 
     raise UnableToAcquireResourcesError(message)
   
-  return list(natvesselsqueryset[:returnvesselcount])
+  return vessellist
 
 
 
@@ -1507,95 +3351,80 @@ def get_available_wan_vessels(geniuser, vesselcount):
   # attempted to be acquired by the client code.
   returnvesselcount = GET_AVAILABLE_VESSELS_MULTIPLIER * vesselcount + GET_AVAILABLE_VESSELS_ADDER
   
-  vessellist = []
-  includedsubnets = []
-  
-  nonnatvesselsqueryset = _get_queryset_of_all_available_vessels_for_a_port_exclude_nat_nodes(geniuser.usable_vessel_port)
-   
-  # Note: it would be more efficient to have the sql query return vessels
-  # in unique subnets, but we would have to be very careful that the UNIQUE
-  # wasn't being applied/interpreted "before" the RAND(). That is, we would
-  # have to be careful that we weren't always getting the same node for a given
-  # subnet. So, instead of worrying about the sql for that which wouldn't
-  # be intuitive to do with the django ORM, let's just do that part manually.
-  
-  for possiblevessel in nonnatvesselsqueryset:
+  if USE_AVAILABLE_VESSEL_INDEX:
+    def choose_func(portindex):
+      return portindex.sample_one_vessel_per_subnet(returnvesselcount)
     
-    subnet = possiblevessel.node.last_known_ip.rpartition('.')[0]
-    if not subnet:
-      log.error("The vessel " + str(possiblevessel) + " has an invalid last_known_ip")
-      continue
+    (vessellist, availablecount) = _get_available_vessels_using_index(geniuser.usable_vessel_port,
+                                                                      choose_func, vesselcount)
+    subnetcount = len(vessellist)
     
-    # For efficiency, includedsubnets should be a constant time lookup type.
-    if subnet in includedsubnets:
-      continue
-    
-    includedsubnets.append(subnet)
-    vessellist.append(possiblevessel)
-    
-    if len(vessellist) == returnvesselcount:
-      break 
+  else:
+    (vessellist, subnetcount) = _get_available_wan_vessels_from_database(geniuser.usable_vessel_port,
+                                                                         returnvesselcount)
 
   if len(vessellist) < vesselcount:
     message = "Requested " + str(vesselcount) + " wan vessels, but we only have vessels with port "
-    message += str(geniuser.usable_vessel_port) + " available on " + str(len(includedsubnets)) + " subnets." 
+    message += str(geniuser.usable_vessel_port) + " available on " + str(subnetcount) + " subnets." 
     raise UnableToAcquireResourcesError(message)
   
-  return vessellist
+  return vessellist
+
+
+
+
+
+def _get_available_wan_vessels_from_database(port, returnvesselcount):
+  """
+  Returns a tuple (vessellist, subnetcount) where vessellist is a list of up
+  to returnvesselcount randomly chosen vessels available on the port with no
+  two on the same subnet and subnetcount is the number of subnets the vessels
+  were chosen from. This is used for wan vessel selection when the available
+  vessel index isn't.
+  """
+  nonnatvesselsqueryset = _get_queryset_of_all_available_vessels_for_a_port_exclude_nat_nodes(port)
+  
+  # Nat nodes are already excluded, so vessels with an empty subnet are on
+  # nodes with an invalid last_known_ip.
+  invalidipqueryset = nonnatvesselsqueryset.filter(node__subnet="")
+  invalidipvesselidlist = list(invalidipqueryset.values_list('id', flat=True)[:returnvesselcount])
+  if invalidipvesselidlist:
+    log.error("The vessels with ids " + str(invalidipvesselidlist) + " have an invalid last_known_ip")
+  
+  # Rather than reading every available vessel, we read the distinct subnets
+  # that have any and then pick one vessel at random from each of up to
+  # returnvesselcount random subnets. Having the database pick the vessel for
+  # each subnet with GROUP BY would always pick the same vessel for a subnet.
+  subnetvesselsqueryset = nonnatvesselsqueryset.exclude(node__subnet="")
+  subnetlist = list(subnetvesselsqueryset.values_list('node__subnet', flat=True).distinct())
+  random.shuffle(subnetlist)
+  
+  log.debug("There are available non-NAT node vessels on port " + str(port) + " on " + str(len(subnetlist)) + " subnets")
+  
+  vessellist = []
+  for subnet in subnetlist[:returnvesselcount]:
+    vessellist.extend(_get_random_vessel_sample(subnetvesselsqueryset.filter(node__subnet=subnet), 1))
+  
+  return (vessellist, len(subnetlist))
 
 
 
 
 
-def _get_subnet_list():
+def _get_subnet_list(allow_stale=False):
   """
   Returns a randomly-ordered list of subnets that have at least one active
-  non-nat node on the subnet.
-  """
-  
-  # The commented out code only works on mysql but is more efficient. Leaving
-  # it out for now as it's harder to test, as our tests run on sqlite.
-  
-  # Get a list of subnets that have at least vesselcount active nodes in the subnet.
-  # This doesn't guarantee that there are available vessels for this user on
-  # those nodes, but it's a start. We'll narrow it down further after we get
-  # the list of possible subnets.
-  #
-  #  subnetsql = """SELECT COUNT(*) AS lansize,
-  #                        SUBSTRING_INDEX(last_known_ip, '.', 3) AS subnet
-  #                 FROM control_node
-  #                 WHERE is_active = TRUE AND
-  #                       is_broken = FALSE
-  #                 GROUP BY subnet
-  #                 HAVING lansize >= %s
-  #                 ORDER BY RAND()""" % (vesselcount)
-  #                 
-  #  cursor = django.db.connection.cursor()
-  #  cursor.execute(subnetsql)
-  #  return cursor.fetchall()
-  
-  # Get a queryset of all active nodes.
-  queryset = Node.objects.filter(is_active=True)
-  queryset = queryset.filter(is_broken=False)
-  queryset = queryset.exclude(last_known_ip__startswith=NAT_STRING_PREFIX)
-  queryset = queryset.order_by('last_known_ip')
-
-  previous_subnet = None
-  subnetlist = []
+  non-nat node on the subnet. If allow_stale is True, the subnets may be read
+  from the read replica.
+  """
+  # Nat nodes and nodes with an invalid last_known_ip have an empty subnet.
+  queryset = Node.objects.filter(is_active=True, is_broken=False)
+  queryset = queryset.exclude(subnet="")
+  if allow_stale:
+    queryset = get_queryset_for_reading(queryset)
+  
+  subnetlist = list(queryset.values_list('subnet', flat=True).distinct())
   
-  # Look through the queryset and build a list of unique subnets.
-  for node in queryset:
-    
-    subnet = node.last_known_ip.rpartition('.')[0]
-    
-    if not subnet:
-      log.error("The node " + str(node) + " has an invalid last_known_ip")
-      continue
-    
-    if subnet != previous_subnet:
-      subnetlist.append(subnet)
-      previous_subnet = subnet
-           
   # Randomize the order of the subnets.
   random.shuffle(subnetlist)
   
@@ -1635,30 +3464,105 @@ def get_available_lan_vessels_by_subnet(geniuser, vesselcount):
   assert_geniuser(geniuser)
   assert_positive_int(vesselcount)
   
-  subnetlist = _get_subnet_list()
+  if USE_AVAILABLE_VESSEL_INDEX:
+    subnets_vessels_list = _get_available_lan_vessels_using_index(geniuser.usable_vessel_port, vesselcount)
+  else:
+    subnets_vessels_list = _get_available_lan_vessels_from_database(geniuser.usable_vessel_port, vesselcount)
+
+  if len(subnets_vessels_list) == 0:
+    message = "No subnets exist with at least " + str(vesselcount)
+    message += " active nodes that have a vessel available on port " + str(geniuser.usable_vessel_port)
+    raise UnableToAcquireResourcesError(message)
+  
+  return subnets_vessels_list
+
+
+
+
+
+def _get_available_lan_vessels_using_index(port, vesselcount):
+  """
+  Returns a list of up to GET_AVAILABLE_LAN_VESSELS_MAX_SUBNETS randomly
+  ordered lists of vessels, each list having at least vesselcount vessels
+  available on the port and on the same subnet. The subnets and vessels are
+  chosen using the available vessel index.
+  """
+  for rebuild in [False, True]:
+    portindex = _get_available_vessel_index(port, rebuild)
+    
+    available_vessel_index_lock.acquire()
+    try:
+      subnetlist = portindex.get_subnets_with_vessel_count(vesselcount)
+    finally:
+      available_vessel_index_lock.release()
+    
+    subnets_vessels_list = []
+    
+    for subnet in subnetlist:
+      # We don't worry about too many vessels being in this list, as it will
+      # be 255 at most.
+      available_vessel_index_lock.acquire()
+      try:
+        vesselidlist = portindex.get_vessel_ids(subnet)
+        indexvaluedict = portindex.get_index_values(vesselidlist)
+      finally:
+        available_vessel_index_lock.release()
+      
+      lanvessellist = _get_available_vessels_by_id(port, vesselidlist, indexvaluedict)
+      
+      if len(lanvessellist) >= vesselcount:
+        random.shuffle(lanvessellist)
+        subnets_vessels_list.append(lanvessellist)
+  
+      if len(subnets_vessels_list) >= GET_AVAILABLE_LAN_VESSELS_MAX_SUBNETS:
+        break
+    
+    if subnets_vessels_list:
+      break
+  
+  return subnets_vessels_list
+
+
+
+
+
+def _get_available_lan_vessels_from_database(port, vesselcount):
+  """
+  The same as _get_available_lan_vessels_using_index() but queries the
+  database for the subnets and vessels rather than using the available
+  vessel index.
+  """
+  # The AvailableVesselCount records let us find the subnets that have enough
+  # vessels available on the port without looking at any nodes or vessels.
+  # The counts can be briefly out of date, so we still check the number of
+  # vessels we actually find on each subnet.
+  countqueryset = AvailableVesselCount.objects.filter(port=port, count__gte=vesselcount)
+  subnetlist = list(countqueryset.values_list('subnet', flat=True))
 
   if len(subnetlist) == 0:
-    raise UnableToAcquireResourcesError("No subnets exist with at least " + str(vesselcount) + " active nodes")
+    return []
+  
+  random.shuffle(subnetlist)
   
   subnets_vessels_list = []
   
-  nonnatvesselsqueryset = _get_queryset_of_all_available_vessels_for_a_port_exclude_nat_nodes(geniuser.usable_vessel_port)
+  nonnatvesselsqueryset = _get_queryset_of_all_available_vessels_for_a_port_exclude_nat_nodes(port)
   
   for subnet in subnetlist:
-    lanvesselsqueryset = nonnatvesselsqueryset.filter(node__last_known_ip__startswith=subnet + '.')
+    lanvesselsqueryset = nonnatvesselsqueryset.filter(node__subnet=subnet)
+    
+    # We don't worry about too many vessels being in this list, as it will be
+    # 255 at most. So, rather than first asking the database for a count, we
+    # just get them all and shuffle them ourselves.
+    lanvessellist = list(lanvesselsqueryset.select_related('node'))
     
-    if lanvesselsqueryset.count() >= vesselcount:
-      # We don't worry about too many vessels being in this list, as it will be 255 at most.
-      subnets_vessels_list.append(list(lanvesselsqueryset))
+    if len(lanvessellist) >= vesselcount:
+      random.shuffle(lanvessellist)
+      subnets_vessels_list.append(lanvessellist)
 
     if len(subnets_vessels_list) >= GET_AVAILABLE_LAN_VESSELS_MAX_SUBNETS:
       break
 
-  if len(subnets_vessels_list) == 0:
-    message = "No subnets exist with at least " + str(vesselcount)
-    message += " active nodes that have a vessel available on port " + str(geniuser.usable_vessel_port)
-    raise UnableToAcquireResourcesError(message)
-  
   return subnets_vessels_list
 
 
@@ -1709,7 +3613,7 @@ def get_user_vessel_credits_from_donations(geniuser):
   """
   assert_geniuser(geniuser)
 
-  return len(get_donations_by_user(geniuser)) * VESSEL_CREDITS_FOR_DONATIONS_MULTIPLIER
+  return get_donation_count_by_user(geniuser) * VESSEL_CREDITS_FOR_DONATIONS_MULTIPLIER
   
 
 
@@ -1768,8 +3672,7 @@ def require_user_can_acquire_resources(geniuser, requested_vessel_count):
   # information. I wanted to avoid making the assertions module dependent
   # on maindb. If it's confusing, the name of this method can be changed.
   
-  # This can be made faster. When necessary, add a get_acquired_vessels_count() function.
-  acquired_vessel_count = len(get_acquired_vessels(geniuser))
+  acquired_vessel_count = get_acquired_vessel_count(geniuser)
   
   max_allowed_vessels = get_user_total_vessel_credits(geniuser)
   
@@ -1807,13 +3710,20 @@ def record_acquired_vessel(geniuser, vessel):
   # We aren't caching any information with the user record about how many
   # resources have been acquired, so the only thing we need to do is make the
   # vessel as having been acquired by this user.
-  vessel.acquired_by_user = geniuser
-  vessel.date_acquired = datetime.now()
-  vessel.date_expires = vessel.date_acquired + DEFAULT_VESSEL_EXPIRATION_TIMEDELTA
-  vessel.save()
+  was_counted = _is_vessel_counted_as_available(vessel)
+  
+  date_acquired = datetime.now()
+  _update_vessel(vessel, acquired_by_user=geniuser, date_acquired=date_acquired,
+                 date_expires=date_acquired + DEFAULT_VESSEL_EXPIRATION_TIMEDELTA)
+  
+  _update_available_vessel_counts_for_vessel(vessel, was_counted)
+  
+  _remove_vessels_from_available_vessel_index([vessel.id])
   
   # Update the database to reflect that this user has access to this vessel.
   add_vessel_access_user(vessel, geniuser)
+  
+  forget_cached_user_summary(geniuser)
 
 
 
@@ -1847,15 +3757,16 @@ def record_released_vessel(vessel):
   # of it gets done.
   _remove_all_user_access_to_vessel(vessel)
   
+  userid = vessel.acquired_by_user_id
+  
   # We aren't caching any information with the user record about how many
   # resources have been acquired, so the only thing we need to do is make the
   # vessel as having not having been acquired by any user.
-  vessel.acquired_by_user = None
-  vessel.is_dirty = True
-  vessel.user_keys_in_sync = True
-  vessel.date_acquired = None
-  vessel.date_expires = None
-  vessel.save()
+  _update_vessel(vessel, acquired_by_user=None, is_dirty=True, user_keys_in_sync=True,
+                 date_acquired=None, date_expires=None)
+  
+  if userid is not None:
+    _forget_cached_user_summaries_by_id([userid])
 
 
 
@@ -1877,9 +3788,78 @@ def set_maximum_vessel_expiration(vessel):
   """
   assert_vessel(vessel)
   
-  vessel.date_acquired = datetime.now()
-  vessel.date_expires = vessel.date_acquired + MAXIMUM_VESSEL_EXPIRATION_TIMEDELTA
-  vessel.save()
+  date_acquired = datetime.now()
+  _update_vessel(vessel, date_acquired=date_acquired,
+                 date_expires=date_acquired + MAXIMUM_VESSEL_EXPIRATION_TIMEDELTA)
+  
+  if vessel.acquired_by_user_id is not None:
+    _forget_cached_user_summaries_by_id([vessel.acquired_by_user_id])
+
+
+
+
+
+@log_function_call
+def renew_vessels_of_user(geniuser, vessel_list):
+  """
+  <Purpose>
+    Sets the expiration dates of those vessels in vessel_list which are still
+    acquired by a user to the maximum allowed. Each vessel is only changed if
+    it is acquired by the user at the moment it is updated, so this is safe to
+    use without holding locks on the nodes of the vessels or the user.
+  <Arguments>
+    geniuser
+      The GeniUser object of the user whose vessels are to be renewed.
+    vessel_list
+      A list of Vessel objects of the vessels to be renewed.
+  <Exceptions>
+    None
+  <Side Effects>
+    The expiration dates of the vessels that are acquired by the user have
+    been extended. The vessel objects in vessel_list reflect the current
+    expiration dates and versions of their records.
+  <Returns>
+    The number of vessels that were renewed.
+  """
+  assert_geniuser(geniuser)
+  assert_list(vessel_list)
+  for vessel in vessel_list:
+    assert_vessel(vessel)
+  
+  vesselidlist = list(set([vessel.id for vessel in vessel_list]))
+  
+  date_acquired = datetime.now()
+  date_expires = date_acquired + MAXIMUM_VESSEL_EXPIRATION_TIMEDELTA
+  
+  renewedcount = 0
+  currentvalues = {}
+  
+  for start in range(0, len(vesselidlist), MAX_VESSEL_IDS_PER_QUERY):
+    chunk = vesselidlist[start:start + MAX_VESSEL_IDS_PER_QUERY]
+    
+    # The conditions are checked by the database as part of the update, so a
+    # vessel released or expired by someone else at the same time isn't
+    # renewed. mark_expired_vessels_as_dirty() likewise won't expire a vessel
+    # renewed after it found the vessel to be expired.
+    queryset = Vessel.objects.filter(id__in=chunk, acquired_by_user=geniuser, is_dirty=False)
+    renewedcount += queryset.update(date_acquired=date_acquired, date_expires=date_expires,
+                                    version=F('version') + 1, date_modified=date_acquired)
+    
+    for row in Vessel.objects.filter(id__in=chunk).values('id', 'date_acquired', 'date_expires',
+                                                          'date_modified', 'version'):
+      currentvalues[row['id']] = row
+  
+  # Make the vessel objects reflect what is now in the database, whether or
+  # not they were renewed.
+  for vessel in vessel_list:
+    if vessel.id in currentvalues:
+      for (fieldname, value) in currentvalues[vessel.id].iteritems():
+        setattr(vessel, fieldname, value)
+  
+  if renewedcount > 0:
+    forget_cached_user_summary(geniuser)
+  
+  return renewedcount
 
 
 
@@ -1887,6 +3867,7 @@ def set_maximum_vessel_expiration(vessel):
 
 # We don't log the function call here so that we don't fill up the backend
 # daemon's logs.
+@transaction.commit_manually
 def mark_expired_vessels_as_dirty():
   """
   <Purpose>
@@ -1903,18 +3884,69 @@ def mark_expired_vessels_as_dirty():
     all vessel user access map entries for each of these vessels have been
     removed.
   <Returns>
-    The list of vessels that were marked as dirty.
+    The list of vessels that were marked as dirty. Vessels that were renewed
+    while this was being done aren't included. The node of each vessel has
+    already been retrieved.
   """
   # We want to mark as dirty all vessels past their expiration date that are
   # currently acquired by users.
-  queryset = Vessel.objects.filter(date_expires__lte=datetime.now())
+  now = datetime.now()
+  queryset = Vessel.objects.filter(date_expires__lte=now)
   queryset = queryset.exclude(acquired_by_user=None)
   
-  vessel_list = list(queryset)
+  # This does the same as calling record_released_vessel() for each vessel,
+  # but with a few queries for all of the vessels rather than a few queries
+  # for each one. We're committing manually so that a vessel is never left
+  # marked as dirty while users still have access to it, or the other way
+  # around.
+  try:
+    candidate_vessel_list = list(queryset.select_related('node'))
+    vesselidlist = [vessel.id for vessel in candidate_vessel_list]
+    
+    # The (id, version) of each vessel that is now marked as dirty.
+    changedidversionset = set()
+    
+    for start in range(0, len(vesselidlist), MAX_VESSEL_IDS_PER_QUERY):
+      chunk = vesselidlist[start:start + MAX_VESSEL_IDS_PER_QUERY]
+      
+      # The date_expires condition is repeated so that a vessel renewed since
+      # we got the list isn't marked as dirty.
+      updatequeryset = Vessel.objects.filter(id__in=chunk, date_expires__lte=now)
+      updatequeryset.update(acquired_by_user=None, is_dirty=True, user_keys_in_sync=True,
+                            date_acquired=None, date_expires=None,
+                            version=F('version') + 1, date_modified=now)
+      
+      # For the same reason, only access to vessels that are no longer
+      # acquired is removed.
+      mapqueryset = VesselUserAccessMap.objects.filter(vessel__in=chunk, vessel__acquired_by_user=None)
+      mapqueryset.delete()
+      
+      # A vessel that was renewed since we got the list wasn't changed by the
+      # update, so it is still acquired and its version wasn't incremented.
+      changedqueryset = Vessel.objects.filter(id__in=chunk, acquired_by_user=None, is_dirty=True)
+      changedidversionset.update(changedqueryset.values_list('id', 'version'))
+  
+  except:
+    transaction.rollback()
+    raise
   
-  if len(vessel_list) > 0:
-    for vessel in vessel_list:
-      record_released_vessel(vessel)
+  else:
+    transaction.commit()
+  
+  vessel_list = [vessel for vessel in candidate_vessel_list
+                 if (vessel.id, vessel.version + 1) in changedidversionset]
+  
+  _forget_cached_user_summaries_by_id([vessel.acquired_by_user_id for vessel in vessel_list])
+  
+  # Make the vessel objects reflect the changes, as they would if
+  # record_released_vessel() had been used.
+  for vessel in vessel_list:
+    vessel.acquired_by_user = None
+    vessel.is_dirty = True
+    vessel.user_keys_in_sync = True
+    vessel.date_acquired = None
+    vessel.date_expires = None
+    vessel.version += 1
 
   # Return the number of vessels that just expired.
   return vessel_list
@@ -1941,9 +3973,13 @@ def mark_vessel_as_clean(vessel):
   """
   assert_vessel(vessel)
   
-  vessel.is_dirty = False
-  vessel.user_keys_in_sync = True
-  vessel.save()
+  was_counted = _is_vessel_counted_as_available(vessel)
+  
+  _update_vessel(vessel, is_dirty=False, user_keys_in_sync=True)
+  
+  _update_available_vessel_counts_for_vessel(vessel, was_counted)
+  
+  _add_vessel_to_available_vessel_index(vessel)
 
 
 
@@ -1951,12 +3987,14 @@ def mark_vessel_as_clean(vessel):
 
 # We don't log the function call here so that we don't fill up the backend
 # daemon's logs.
-def get_vessels_needing_cleanup():
+def get_vessels_needing_cleanup(allow_stale=False):
   """
   <Purpose>
     Determine which vessels need to be cleaned up by the backend.
   <Arguments>
-    None
+    allow_stale
+      Whether the data may be read from the read replica and so be slightly
+      out of date. Default is False.
   <Exceptions>
     None
   <Side Effects>
@@ -1970,6 +4008,8 @@ def get_vessels_needing_cleanup():
   # Be certain not to clean up vessels acquired by users. This is here mostly
   # in case an admin marked a vessel for cleanup that was acquired by a user.
   queryset = queryset.filter(acquired_by_user=None)
+  if allow_stale:
+    queryset = get_queryset_for_reading(queryset)
   return list(queryset)
 
 
@@ -2039,8 +4079,7 @@ def mark_vessel_as_needing_user_key_sync(vessel):
   """
   assert_vessel(vessel)
   
-  vessel.user_keys_in_sync = False
-  vessel.save()
+  _update_vessel(vessel, user_keys_in_sync=False)
 
 
 
@@ -2063,8 +4102,7 @@ def mark_vessel_as_not_needing_user_key_sync(vessel):
   """
   assert_vessel(vessel)
   
-  vessel.user_keys_in_sync = True
-  vessel.save()
+  _update_vessel(vessel, user_keys_in_sync=True)
 
 
 
@@ -2155,18 +4193,30 @@ def delete_all_vessels_of_node(node):
   """
   assert_node(node)
   
+  port_list = _get_ports_of_available_vessels_on_node(node)
+  _change_available_vessel_counts(_get_counted_subnet_of_node(node), port_list, -1)
+  
+  queryset = Vessel.objects.filter(node=node).exclude(acquired_by_user=None)
+  useridlist = list(queryset.values_list('acquired_by_user_id', flat=True))
+  
   Vessel.objects.filter(node=node).delete()
+  
+  _forget_cached_user_summaries_by_id(useridlist)
+  
+  _remove_node_from_available_vessel_index(node)
 
 
 
 
 
-def get_active_nodes():
+def get_active_nodes(allow_stale=False):
   """
   <Purpose>
     Get a list of all active nodes that are not broken.
   <Arguments>
-    None
+    allow_stale
+      Whether the data may be read from the read replica and so be slightly
+      out of date. Default is False.
   <Exceptions>
     None
   <Side Effects>
@@ -2174,18 +4224,23 @@ def get_active_nodes():
   <Returns>
     A list of Node objects of active nodes that aren't broken.
   """
-  return list(Node.objects.filter(is_active=True, is_broken=False))
+  queryset = Node.objects.filter(is_active=True, is_broken=False)
+  if allow_stale:
+    queryset = get_queryset_for_reading(queryset)
+  return list(queryset)
 
 
 
 
 
-def get_active_nodes_include_broken():
+def get_active_nodes_include_broken(allow_stale=False):
   """
   <Purpose>
     Get a list of all active nodes including those that are broken.
   <Arguments>
-    None
+    allow_stale
+      Whether the data may be read from the read replica and so be slightly
+      out of date. Default is False.
   <Exceptions>
     None
   <Side Effects>
@@ -2193,7 +4248,10 @@ def get_active_nodes_include_broken():
   <Returns>
     A list of Node objects of active nodes.
   """
-  return list(Node.objects.filter(is_active=True))
+  queryset = Node.objects.filter(is_active=True)
+  if allow_stale:
+    queryset = get_queryset_for_reading(queryset)
+  return list(queryset)
 
 
 
@@ -2238,9 +4296,259 @@ def create_action_log_event(function_name, user, second_arg, third_arg,
   
   event.save()
   
+  if not vessel_list:
+    return
+  
+  # There can be thousands of vessels (e.g. when many vessels expire at once),
+  # so rather than saving an ActionLogVesselDetails object for each vessel,
+  # the records are inserted all at once.
+  rowlist = []
   for vessel in vessel_list:
-    vesseldetails = ActionLogVesselDetails(event=event, node=vessel.node,
-                                           node_address=vessel.node.last_known_ip,
-                                           node_port=vessel.node.last_known_port,
-                                           vessel_name=vessel.name)
-    vesseldetails.save()
+    rowlist.append((event.id, vessel.node_id, vessel.node.last_known_ip,
+                    vessel.node.last_known_port, vessel.name))
+  
+  _bulk_insert(ActionLogVesselDetails, ["event", "node", "node_address", "node_port", "vessel_name"], rowlist)
+  
+  # Django only commits on its own after changes it knows about.
+  transaction.commit_unless_managed()
+
+
+
+
+
+@log_function_call
+def create_acquisition_job(geniuser, vesselcount, vesseltype):
+  """
+  <Purpose>
+    Create a record of a pending request by a user to acquire vessels in the
+    background. Also deletes the user's old finished jobs.
+  <Arguments>
+    geniuser
+      The GeniUser object of the user the vessels are to be acquired for.
+    vesselcount
+      The number of vessels to acquire.
+    vesseltype
+      The type of vessels to acquire ('wan', 'lan', 'nat', or 'rand').
+  <Exceptions>
+    None
+  <Side Effects>
+    A pending AcquisitionJob record has been created.
+  <Returns>
+    The AcquisitionJob object of the new job.
+  """
+  assert_geniuser(geniuser)
+  assert_positive_int(vesselcount)
+  assert_str(vesseltype)
+  
+  oldjobs = AcquisitionJob.objects.filter(user=geniuser, status__in=['done', 'failed'])
+  oldjobs.filter(date_created__lt=datetime.now() - ACQUISITION_JOB_RETENTION_TIMEDELTA).delete()
+  
+  job = AcquisitionJob(user=geniuser, vesselcount=vesselcount, vesseltype=vesseltype,
+                       status='pending', date_heartbeat=datetime.now())
+  job.save()
+  
+  return job
+
+
+
+
+
+@log_function_call
+def get_acquisition_job(geniuser, job_id):
+  """
+  <Purpose>
+    Retrieve one of a user's acquisition jobs. If the job hasn't finished
+    within ACQUISITION_JOB_TIMEOUT_SECONDS or there hasn't been a heartbeat for
+    it within ACQUISITION_JOB_HEARTBEAT_TIMEOUT_SECONDS, it is first marked as
+    failed.
+  <Arguments>
+    geniuser
+      The GeniUser object of the user who created the job.
+    job_id
+      The id of the job.
+  <Exceptions>
+    DoesNotExistError
+      If the user has no job with the given id.
+  <Side Effects>
+    The job may have been marked as failed.
+  <Returns>
+    The AcquisitionJob object of the job.
+  """
+  assert_geniuser(geniuser)
+  assert_int(job_id)
+  
+  try:
+    job = AcquisitionJob.objects.get(id=job_id, user=geniuser)
+  except django.core.exceptions.ObjectDoesNotExist:
+    raise DoesNotExistError("No acquisition job with id " + str(job_id) + ".")
+  
+  if job.status in ['pending', 'running']:
+    now = datetime.now()
+    oldest = now - timedelta(seconds=ACQUISITION_JOB_TIMEOUT_SECONDS)
+    oldestheartbeat = now - timedelta(seconds=ACQUISITION_JOB_HEARTBEAT_TIMEOUT_SECONDS)
+    
+    message = None
+    if (job.date_heartbeat or job.date_created) < oldestheartbeat:
+      message = "The job was lost because the server running it was restarted."
+    elif (job.date_started or job.date_created) < oldest:
+      message = "The job did not finish in time and was abandoned."
+    
+    if message is not None:
+      # The job may have acquired some of the vessels before it was lost.
+      if job.status == 'running':
+        message += " Any vessels acquired by the job remain acquired by you."
+      # Only change the job if it hasn't finished in the meantime.
+      queryset = AcquisitionJob.objects.filter(id=job.id, status=job.status)
+      if queryset.update(status='failed', error_type='InternalError', error_message=message,
+                         date_finished=now) == 1:
+        log.error("Marked " + str(job) + " as failed: " + message)
+      job = AcquisitionJob.objects.get(id=job.id)
+  
+  return job
+
+
+
+
+
+def get_unfinished_acquisition_job_count(geniuser, max_job_id=None):
+  """
+  <Purpose>
+    Determine the number of a user's acquisition jobs that are pending or
+    running.
+  <Arguments>
+    geniuser
+      The GeniUser object of the user.
+    max_job_id
+      (optional) If given, only jobs with an id no larger than this (that is,
+      created no later than that job) are counted.
+  <Exceptions>
+    None
+  <Side Effects>
+    None
+  <Returns>
+    The number of unfinished jobs.
+  """
+  assert_geniuser(geniuser)
+  
+  queryset = AcquisitionJob.objects.filter(user=geniuser, status__in=['pending', 'running'])
+  if max_job_id is not None:
+    queryset = queryset.filter(id__lte=max_job_id)
+  return queryset.count()
+
+
+
+
+
+@log_function_call
+def delete_acquisition_job(job):
+  """
+  <Purpose>
+    Delete an acquisition job that was created but will not be run.
+  <Arguments>
+    job
+      The AcquisitionJob object of the job.
+  <Exceptions>
+    None
+  <Side Effects>
+    The job no longer exists.
+  <Returns>
+    None
+  """
+  AcquisitionJob.objects.filter(id=job.id).delete()
+
+
+
+
+
+def record_acquisition_job_heartbeats(job_id_list):
+  """
+  <Purpose>
+    Record that the unfinished acquisition jobs with the given ids are still
+    going to be or being run, so get_acquisition_job() doesn't consider them
+    lost.
+  <Arguments>
+    job_id_list
+      A list of the ids of the jobs.
+  <Exceptions>
+    None
+  <Side Effects>
+    The heartbeat date of each of the jobs that is unfinished is now.
+  <Returns>
+    None
+  """
+  assert_list(job_id_list)
+  
+  if not job_id_list:
+    return
+  
+  queryset = AcquisitionJob.objects.filter(id__in=job_id_list, status__in=['pending', 'running'])
+  queryset.update(date_heartbeat=datetime.now())
+
+
+
+
+
+@log_function_call
+def start_acquisition_job(job):
+  """
+  <Purpose>
+    Mark a pending acquisition job as running.
+  <Arguments>
+    job
+      The AcquisitionJob object of the job.
+  <Exceptions>
+    None
+  <Side Effects>
+    If the job was pending, it is now running.
+  <Returns>
+    True if the job was pending and so should be run, False otherwise.
+  """
+  now = datetime.now()
+  queryset = AcquisitionJob.objects.filter(id=job.id, status='pending')
+  if queryset.update(status='running', date_started=now) == 0:
+    return False
+  
+  job.status = 'running'
+  job.date_started = now
+  return True
+
+
+
+
+
+@log_function_call
+def finish_acquisition_job(job, vessel_list=None, error=None):
+  """
+  <Purpose>
+    Record the result of an acquisition job.
+  <Arguments>
+    job
+      The AcquisitionJob object of the job.
+    vessel_list
+      The list of Vessel objects that were acquired, if the job succeeded.
+    error
+      The exception that describes why the job failed, if it did.
+  <Exceptions>
+    None
+  <Side Effects>
+    The job is done or failed. This is recorded even if the job had been
+    marked as failed because it took too long, as the outcome is what matters
+    to the user.
+  <Returns>
+    None
+  """
+  job.date_finished = datetime.now()
+  
+  if error is None:
+    assert_list(vessel_list)
+    job.status = 'done'
+    handlelist = []
+    for vessel in vessel_list:
+      handlelist.append(vessel.node.node_identifier + ":" + vessel.name)
+    job.vessel_handles = "\n".join(handlelist)
+  else:
+    job.status = 'failed'
+    job.error_type = error.__class__.__name__
+    job.error_message = str(error)[:1024]
+  
+  job.save()
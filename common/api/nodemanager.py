@@ -19,6 +19,13 @@
     * get_node_info()
     * get_vessel_resources()
   
+  get_node_info() can optionally be told to return a recently cached result
+  rather than contacting the node (see NODE_INFO_CACHE_SECONDS). The cache is
+  local to the process and the entry for a node is discarded whenever a signed
+  (state-changing) call is made to that node through this module. Use
+  invalidate_node_info_cache() if the node is known to have been changed some
+  other way.
+  
   You will not be able to use any of the other functions in this module from
   most code because you will not have access to the private owner keys for the
   node. Only the backend should be accessing the private owner keys. That is,
@@ -37,13 +44,18 @@
        as the first argument.
 """
 
+import copy
 import random
+import threading
+import time
 import traceback
 
 from seattlegeni.common.util.assertions import *
 
 from seattlegeni.common.exceptions import *
 
+from seattlegeni.common.util import profiling
+
 from seattlegeni.common.util.decorators import log_function_call_without_first_argument
 
 # Let's keep a copy of the built-ins, as repyportability destroys them
@@ -77,7 +89,6 @@ sys.modules['dylink_repy'].openconnection = openconnection
 ####### end code to enable affixes ######
 
 dy_import_module_symbols('nmclient.r2py')
-dy_import_module_symbols("listops.r2py")
 dy_import_module_symbols("time.r2py")
 
 # Restore built-ins so that django and other libraries don't complain
@@ -93,6 +104,18 @@ MAX_TIME_UPDATE_ATTEMPTS = 5
 # Ports to use for UDP listening when doing a time update.
 TIME_UPDATE_POSSIBLE_PORTS = range(10000, 60001)
 
+# The number of seconds a result of get_node_info() may be reused by callers
+# that pass allow_cached=True. This is intentionally short: the cache is only
+# meant to avoid asking the same node for its vessel dict several times within
+# a few seconds (e.g. once before and once after obtaining a node lock).
+NODE_INFO_CACHE_SECONDS = 10
+
+# A dict whose keys are "ip:port" strings and whose values are tuples of
+# (time_stored, nodeinfo). Access is protected by node_info_cache_lock because
+# the backend and the polling daemons call into this module from many threads.
+node_info_cache = {}
+node_info_cache_lock = threading.Lock()
+
 
 
 
@@ -130,7 +153,63 @@ def init_nodemanager():
 
 
 
-def get_node_info(ip, port):
+def _get_node_info_cache_key(ip, port):
+  return str(ip) + ":" + str(port)
+
+
+
+
+
+def invalidate_node_info_cache(ip, port):
+  """
+  <Purpose>
+    Discard any cached get_node_info() result for a node.
+  <Arguments>
+    ip
+      The ip address of of the nodemanager.
+    port
+      The port the nodemanager is listening on.
+  <Exceptions>
+    None
+  <Side Effects>
+    The next call to get_node_info() for this node will contact the node.
+  <Returns>
+    None
+  """
+  node_info_cache_lock.acquire()
+  try:
+    node_info_cache.pop(_get_node_info_cache_key(ip, port), None)
+  finally:
+    node_info_cache_lock.release()
+
+
+
+
+
+def reset_node_info_cache():
+  """
+  <Purpose>
+    Discard all cached get_node_info() results.
+  <Arguments>
+    None
+  <Exceptions>
+    None
+  <Side Effects>
+    The node info cache is empty.
+  <Returns>
+    None
+  """
+  node_info_cache_lock.acquire()
+  try:
+    node_info_cache.clear()
+  finally:
+    node_info_cache_lock.release()
+
+
+
+
+
+def get_node_info(ip, port, allow_cached=False):
   """
   <Purpose>
     Query a nodemanager for information about it.
@@ -139,11 +218,16 @@ def get_node_info(ip, port):
       The ip address of of the nodemanager.
     port
       The port the nodemanager is listening on.
+    allow_cached
+      (optional, default False) If True, a result obtained from this node less
+      than NODE_INFO_CACHE_SECONDS ago will be returned without contacting the
+      node. Regardless of this value, a successful query of the node is stored
+      in the cache.
   <Exceptions>
     NodemanagerCommunicationError
       If we cannot communicate with a nodemanager at the specified ip and port.
   <Side Effects>
-    None
+    The result is stored in the node info cache.
   <Returns>
     A dictionary as returned by nmclient_getvesseldict(). This is a dictionary
     that will have at least the following keys (slight difference from the the
@@ -166,6 +250,23 @@ def get_node_info(ip, port):
   assert_str(ip)
   assert_int(port)
   
+  cachekey = _get_node_info_cache_key(ip, port)
+  
+  if allow_cached:
+    node_info_cache_lock.acquire()
+    try:
+      cacheentry = node_info_cache.get(cachekey)
+    finally:
+      node_info_cache_lock.release()
+    
+    if cacheentry is not None:
+      (time_stored, cachednodeinfo) = cacheentry
+      if time.time() - time_stored < NODE_INFO_CACHE_SECONDS:
+        # Callers are free to modify what we return, so never hand out the
+        # cached dict itself.
+        return copy.deepcopy(cachednodeinfo)
+  
+  starttime = time.time()
   try:
     # This can raise an NMClientException, but the handle won't be stored in
     # the nmclient module if it does so we don't have to clean it up.
@@ -176,6 +277,7 @@ def get_node_info(ip, port):
       nodeinfo = nmclient_getvesseldict(nmhandle)
     finally:
       nmclient_destroyhandle(nmhandle)
+      profiling.add_time("nodemanager", time.time() - starttime)
     
   except NMClientException:
     nodestr = str((ip, port))
@@ -194,34 +296,72 @@ def get_node_info(ip, port):
     fullvesselinfo.update(fullnodeinfo["vessels"][vesselname])
     fullnodeinfo["vessels"][vesselname] = fullvesselinfo
   
+  node_info_cache_lock.acquire()
+  try:
+    node_info_cache[cachekey] = (time.time(), copy.deepcopy(fullnodeinfo))
+  finally:
+    node_info_cache_lock.release()
+  
   return fullnodeinfo
 
 
 
 
 
-def _get_vessel_usableports(resourcedata):
+def parse_vessel_resources(resourcedata):
   """
-  A helper function for get_vessel_resources().
-  Finds the list of ports where the resource contains both connport and messport.
+  <Purpose>
+    Parse the contents of a resources file (as returned by a nodemanager's
+    GetVesselResources call) in a single pass.
+  <Arguments>
+    resourcedata
+      The resources file contents as a string.
+  <Exceptions>
+    ValueError
+      If a resource line doesn't have a value or a port isn't a number.
+  <Side Effects>
+    None
+  <Returns>
+    A dictionary that has the following keys:
+      resources -- a dict whose keys are the names of the quantity resources
+                   (cpu, memory, events, etc.) and whose values are floats.
+                   Resources whose values aren't numbers are left out.
+      connports -- a list of the vessel's connports, in the order they are
+                   in the file.
+      messports -- a list of the vessel's messports, in the order they are
+                   in the file.
+      usableports -- a list of the connports that are also messports, in the
+                     same order as connports.
+    Lines which aren't resource lines (e.g. call restrictions) are ignored.
   """
-  # I think this code could stand to be in nmclient.r2py.
-
-  connports = []
-  messports = []
+  quantities = {}
+  ports = {"connport":[], "messport":[]}
 
   for line in resourcedata.split('\n'):
 
-    if line.startswith('resource'):
-      # Ignore the word "resource" and any comments at the end.
-      (resourcetype, value) = line.split()[1:3]
-      if resourcetype == 'connport':
-        # We do int(float(x)) because value might be a string '13253.0'
-        connports.append(int(float(value)))
-      if resourcetype == 'messport':
-        messports.append(int(float(value)))
+    if not line.startswith('resource'):
+      continue
+
+    # Ignore the word "resource" and any comments at the end. This raises a
+    # ValueError if the line is too short.
+    (resourcetype, value) = line.split()[1:3]
+
+    if resourcetype in ports:
+      # We do int(float(x)) because value might be a string '13253.0'
+      ports[resourcetype].append(int(float(value)))
+    else:
+      try:
+        quantities[resourcetype] = float(value)
+      except ValueError:
+        pass
+
+  messportset = set(ports["messport"])
+  usableports = [port for port in ports["connport"] if port in messportset]
 
-  return listops_intersect(connports, messports)
+  return {"resources":quantities,
+          "connports":ports["connport"],
+          "messports":ports["messport"],
+          "usableports":usableports}
 
 
 
@@ -230,9 +370,7 @@ def _get_vessel_usableports(resourcedata):
 def get_vessel_resources(ip, port, vesselname):
   """
   <Purpose>
-    Query a nodemanager for information about a vessel's resources. Currently
-    only obtains information about usableports, but can be expanded to include
-    more information as needed.
+    Query a nodemanager for information about a vessel's resources.
   <Arguments>
     ip
       The ip address of of the nodemanager.
@@ -243,19 +381,23 @@ def get_vessel_resources(ip, port, vesselname):
   <Exceptions>
     NodemanagerCommunicationError
       If we cannot communicate with a nodemanager at the specified ip and port.
+    ValueError
+      If the vessel's resource file is malformed.
   <Side Effects>
     None
   <Returns>
-    A dictionary that has the following keys:
+    A dictionary as returned by parse_vessel_resources(). Notably, it has the
+    following keys:
       usableports -- the value of this key is a list of ports that the vessel
                      has available as both a connport and a messport.
+      resources -- a dict of the vessel's quantity resources (e.g. cpu) to
+                   floats.
   """
   assert_str(ip)
   assert_int(port)
   assert_str(vesselname)
   
-  resourcesdict = {}
-  
+  starttime = time.time()
   try:
     # This can raise an NMClientException, but the handle won't be stored in
     # the nmclient module if it does so we don't have to clean it up.
@@ -266,16 +408,14 @@ def get_vessel_resources(ip, port, vesselname):
       resourcedata = nmclient_rawsay(nmhandle, "GetVesselResources", vesselname)  
     finally:
       nmclient_destroyhandle(nmhandle)
-    
-    resourcesdict["usableports"] = _get_vessel_usableports(resourcedata)
-    
+      profiling.add_time("nodemanager", time.time() - starttime)
     
   except NMClientException:
     nodestr = str((ip, port))
     message = "Failed to communicate with node " + nodestr + ": "
     raise NodemanagerCommunicationError(message + traceback.format_exc())
   
-  return resourcesdict
+  return parse_vessel_resources(resourcedata)
 
 
 
@@ -513,6 +653,7 @@ def _do_signed_call(privkeystring, nodeid_ip_port_pubkey_tuple, *callargs):
   """
   (nodeid, ip, port, pubkeystring) = nodeid_ip_port_pubkey_tuple
   
+  starttime = time.time()
   try:
     # This can raise an NMClientException, but the handle won't be stored in
     # the nmclient module if it does so we don't have to clean it up.
@@ -529,6 +670,11 @@ def _do_signed_call(privkeystring, nodeid_ip_port_pubkey_tuple, *callargs):
       
     finally:
       nmclient_destroyhandle(nmhandle)
+      profiling.add_time("nodemanager", time.time() - starttime)
+      # Whether or not the call succeeded, the node may have changed. We don't
+      # want anyone in this process to be given vessel information from before
+      # the call.
+      invalidate_node_info_cache(ip, port)
     
   except NMClientException:
     nodestr = str((nodeid, ip, port))
@@ -131,6 +131,15 @@ class InsufficientUserResourcesError(SeattleGeniError):
 
 
 
+class TooManyRequestsError(SeattleGeniError):
+  """
+  Indicates that a request was refused, either because the user has made too
+  many similar requests recently or because seattlegeni is too busy. The
+  request can be made again later.
+  """
+
+
+
 class TimeUpdateError(SeattleGeniError):
   """
   Indicates that a call to the time_updatetime() repy function failed. This is
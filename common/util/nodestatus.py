@@ -303,7 +303,11 @@ def check_node(node, readonly=True, lockserver_handle=None):
                            "Not marking node broken, though.")
     
     try:
-      nodeinfo = nodemanager.get_node_info(node.last_known_ip, node.last_known_port)
+      # In readonly mode nothing is changed based on what the node reports, so
+      # there's no harm in using a result fetched moments ago by someone else
+      # in this process.
+      nodeinfo = nodemanager.get_node_info(node.last_known_ip, node.last_known_port,
+                                           allow_cached=readonly)
     except NodemanagerCommunicationError:
       _record_node_communication_failure(readonly, node)
       _report_node_problem(node, "Can't communicate with node.")
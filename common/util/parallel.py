@@ -18,6 +18,8 @@
 import time
 import traceback
 
+from seattlegeni.common.util import profiling
+
 from seattle.repyportability import *
 add_dy_support(locals())
 
@@ -61,6 +63,13 @@ def run_parallelized(first_arg_list, func, *additional_args):
          return value)}
   """
   
+  # The calls are made by other threads. If the current thread is profiling a
+  # request, have the time they spend talking to other services count towards
+  # that request.
+  profile = profiling.get_current_profile()
+  if profile is not None:
+    func = _get_func_run_with_profile(func, profile)
+  
   try:
     phandle = parallelize_initfunction(first_arg_list, func, CONCURRENT_THREADS_PER_CALL, *additional_args)
   
@@ -76,3 +85,21 @@ def run_parallelized(first_arg_list, func, *additional_args):
       
   except ParallelizeError, e:
     raise InternalError("Failed to run parallelized function: " + traceback.format_exc())
+
+
+
+
+
+def _get_func_run_with_profile(func, profile):
+  """
+  Returns a function that calls func with the current thread adding its times
+  to the given profiling.py profile.
+  """
+  def run_with_profile(*args):
+    profiling.set_current_profile(profile)
+    try:
+      return func(*args)
+    finally:
+      profiling.set_current_profile(None)
+  
+  return run_with_profile
@@ -0,0 +1,409 @@
+"""
+<Program>
+  profiling.py
+
+<Purpose>
+  Keeps track of where the time of each website request goes (database
+  queries, lockserver requests, backend requests, and nodemanager
+  communication) and aggregates this in-process per request name (the view or
+  xmlrpc method) so that it's possible to tell which requests are slow and
+  why.
+
+  The website's profiling middleware (website/middleware/profilerequest.py)
+  calls start_request() and finish_request(). While a request is being
+  profiled, the modules that talk to other services call add_time(). If no
+  request is being profiled by the current thread, add_time() does nothing,
+  so it's fine to call from code that isn't run by the website.
+
+  Everything is kept per-process. With multiple website processes, each has
+  its own statistics.
+"""
+
+import re
+import threading
+import time
+
+
+
+
+
+# The kinds of time (other than database queries) that are tracked.
+TIME_CATEGORIES = ["lockserver", "backend", "nodemanager"]
+
+# The upper bounds of the buckets of the wall time histograms, in milliseconds.
+# There is one more bucket for anything slower.
+WALL_TIME_HISTOGRAM_BOUNDS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# The upper bounds of the buckets of the query count histograms. There is one
+# more bucket for anything more.
+QUERY_COUNT_HISTOGRAM_BOUNDS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500]
+
+# The number of slowest requests to keep details of.
+SLOW_REQUEST_SAMPLE_SIZE = 20
+
+# The most queries to keep the sql of for each request in the slow request
+# sample.
+SLOW_REQUEST_MAX_QUERIES = 200
+
+# The name that requests are aggregated under when they are for something that
+# doesn't exist (unknown paths and xmlrpc methods), so that the number of names
+# doesn't depend on what clients ask for.
+UNKNOWN_REQUEST_NAME = "(not found)"
+
+# The literals in the sql of the queries kept in the slow request sample are
+# replaced with '?', as django gives the sql with the query's parameters (which
+# can include passwords and api keys) filled in.
+SQL_STRING_LITERAL_REGEX = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+SQL_NUMBER_LITERAL_REGEX = re.compile(r"\b\d+(?:\.\d+)?\b")
+
+# The attribute 'profile' of this is the dict of the request being profiled by
+# the current thread, or None.
+profile_context = threading.local()
+
+# A dict of request names to dicts of their aggregated statistics.
+aggregate_stats = {}
+
+# A list of the dicts of the slowest requests, slowest first.
+slow_request_sample = []
+
+# Held when changing a request's profile (which can be added to by multiple
+# threads) or the aggregated statistics.
+profiling_lock = threading.Lock()
+
+
+
+
+
+def start_request(name):
+  """
+  <Purpose>
+    Start profiling a request handled by the current thread.
+  <Arguments>
+    name
+      The name to aggregate the request's statistics under. It can be
+      changed with set_request_name().
+  <Exceptions>
+    None
+  <Side Effects>
+    The thread is profiling the request.
+  <Returns>
+    None
+  """
+  profile = {"name":name, "starttime":time.time()}
+  for category in TIME_CATEGORIES:
+    profile[category + "_seconds"] = 0.0
+  profile_context.profile = profile
+
+
+
+
+
+def set_request_name(name):
+  """
+  Change the name of the request being profiled by the current thread, if
+  there is one.
+  """
+  profile = get_current_profile()
+  if profile is not None:
+    profile["name"] = name
+
+
+
+
+
+def get_current_profile():
+  """
+  Returns the profile of the request being profiled by the current thread, or
+  None. Code that has other threads do work for the request can pass this to
+  set_current_profile() in those threads.
+  """
+  return getattr(profile_context, "profile", None)
+
+
+
+
+
+def set_current_profile(profile):
+  """Make the current thread add its times to the given profile (or none)."""
+  profile_context.profile = profile
+
+
+
+
+
+def add_time(category, seconds):
+  """
+  <Purpose>
+    Add to the time spent on one of TIME_CATEGORIES by the request being
+    profiled by the current thread.
+  <Arguments>
+    category
+      One of TIME_CATEGORIES.
+    seconds
+      The time spent.
+  <Exceptions>
+    None
+  <Side Effects>
+    If a request is being profiled, its time is increased.
+  <Returns>
+    None
+  """
+  profile = get_current_profile()
+  if profile is None:
+    return
+
+  profiling_lock.acquire()
+  try:
+    profile[category + "_seconds"] += seconds
+  finally:
+    profiling_lock.release()
+
+
+
+
+
+def finish_request(querylist):
+  """
+  <Purpose>
+    Finish profiling the request handled by the current thread and add its
+    statistics to the aggregated statistics.
+  <Arguments>
+    querylist
+      A list of the request's database queries as dicts with the keys 'sql'
+      and 'time' (the seconds, possibly as a string), as django's
+      connection.queries has.
+  <Exceptions>
+    None
+  <Side Effects>
+    The thread is no longer profiling a request. The aggregated statistics
+    and possibly the slow request sample have been updated.
+  <Returns>
+    The profile of the request, or None if no request was being profiled.
+  """
+  profile = get_current_profile()
+  if profile is None:
+    return None
+  profile_context.profile = None
+
+  profile["wall_seconds"] = time.time() - profile["starttime"]
+  profile["db_query_count"] = len(querylist)
+  profile["db_seconds"] = 0.0
+  for query in querylist:
+    profile["db_seconds"] += float(query["time"])
+
+  profiling_lock.acquire()
+  try:
+    _aggregate(profile)
+    _update_slow_request_sample(profile, querylist)
+  finally:
+    profiling_lock.release()
+
+  return profile
+
+
+
+
+
+def _get_histogram_index(bounds, value):
+  """Returns the index of the histogram bucket that the value belongs in."""
+  for index in range(len(bounds)):
+    if value <= bounds[index]:
+      return index
+  return len(bounds)
+
+
+
+
+
+def _aggregate(profile):
+  """Adds a finished profile to aggregate_stats. Requires profiling_lock."""
+  stats = aggregate_stats.get(profile["name"])
+  if stats is None:
+    stats = {"count":0, "wall_seconds":0.0, "max_wall_seconds":0.0,
+             "db_query_count":0, "db_seconds":0.0,
+             "wall_time_histogram":[0] * (len(WALL_TIME_HISTOGRAM_BOUNDS_MS) + 1),
+             "query_count_histogram":[0] * (len(QUERY_COUNT_HISTOGRAM_BOUNDS) + 1)}
+    for category in TIME_CATEGORIES:
+      stats[category + "_seconds"] = 0.0
+    aggregate_stats[profile["name"]] = stats
+
+  stats["count"] += 1
+  stats["max_wall_seconds"] = max(stats["max_wall_seconds"], profile["wall_seconds"])
+  for key in ["wall_seconds", "db_query_count", "db_seconds"]:
+    stats[key] += profile[key]
+  for category in TIME_CATEGORIES:
+    stats[category + "_seconds"] += profile[category + "_seconds"]
+
+  index = _get_histogram_index(WALL_TIME_HISTOGRAM_BOUNDS_MS, profile["wall_seconds"] * 1000)
+  stats["wall_time_histogram"][index] += 1
+  index = _get_histogram_index(QUERY_COUNT_HISTOGRAM_BOUNDS, profile["db_query_count"])
+  stats["query_count_histogram"][index] += 1
+
+
+
+
+
+def _update_slow_request_sample(profile, querylist):
+  """
+  Keeps the profile (with its queries) in slow_request_sample if it is one of
+  the SLOW_REQUEST_SAMPLE_SIZE slowest. Requires profiling_lock.
+  """
+  if len(slow_request_sample) >= SLOW_REQUEST_SAMPLE_SIZE:
+    if profile["wall_seconds"] <= slow_request_sample[-1]["wall_seconds"]:
+      return
+
+  sample = profile.copy()
+  sample["queries"] = []
+  for query in querylist[:SLOW_REQUEST_MAX_QUERIES]:
+    sample["queries"].append((float(query["time"]), _redact_sql(query["sql"])))
+
+  slow_request_sample.append(sample)
+  slow_request_sample.sort(key=lambda sample: sample["wall_seconds"], reverse=True)
+  del slow_request_sample[SLOW_REQUEST_SAMPLE_SIZE:]
+
+
+
+
+
+def _redact_sql(sql):
+  """Returns the sql with its string and number literals replaced with '?'."""
+  sql = SQL_STRING_LITERAL_REGEX.sub("?", sql)
+  return SQL_NUMBER_LITERAL_REGEX.sub("?", sql)
+
+
+
+
+
+def get_aggregate_stats():
+  """
+  Returns a copy of the aggregated statistics: a dict of request names to
+  dicts of statistics (see _aggregate() for the keys).
+  """
+  profiling_lock.acquire()
+  try:
+    statscopy = {}
+    for name in aggregate_stats:
+      stats = aggregate_stats[name].copy()
+      stats["wall_time_histogram"] = list(stats["wall_time_histogram"])
+      stats["query_count_histogram"] = list(stats["query_count_histogram"])
+      statscopy[name] = stats
+    return statscopy
+  finally:
+    profiling_lock.release()
+
+
+
+
+
+def get_slow_request_sample():
+  """
+  Returns a copy of the list of the slowest requests, slowest first. Each is a
+  profile dict whose key 'queries' is a list of (seconds, sql) tuples.
+  """
+  profiling_lock.acquire()
+  try:
+    return [sample.copy() for sample in slow_request_sample]
+  finally:
+    profiling_lock.release()
+
+
+
+
+
+def reset():
+  """Forget all aggregated statistics and the slow request sample."""
+  profiling_lock.acquire()
+  try:
+    aggregate_stats.clear()
+    del slow_request_sample[:]
+  finally:
+    profiling_lock.release()
+
+
+
+
+
+def get_report():
+  """
+  <Purpose>
+    Describe the aggregated statistics and the slow request sample.
+  <Arguments>
+    None
+  <Exceptions>
+    None
+  <Side Effects>
+    None
+  <Returns>
+    A list of lines of text.
+  """
+  lines = []
+
+  statsdict = get_aggregate_stats()
+  namelist = statsdict.keys()
+  # Show the requests that took the most time in total first.
+  namelist.sort(key=lambda name: statsdict[name]["wall_seconds"], reverse=True)
+
+  lines.append("Requests by total wall time (times are averages in ms)")
+  lines.append("")
+  header = "%-50s %7s %9s %9s %7s %9s" % ("request", "count", "wall", "max wall", "queries", "db")
+  for category in TIME_CATEGORIES:
+    header += " %11s" % category
+  lines.append(header)
+
+  for name in namelist:
+    stats = statsdict[name]
+    count = float(stats["count"])
+    line = "%-50s %7d %9.1f %9.1f %7.1f %9.1f" % (name[:50], stats["count"],
+        stats["wall_seconds"] / count * 1000, stats["max_wall_seconds"] * 1000,
+        stats["db_query_count"] / count, stats["db_seconds"] / count * 1000)
+    for category in TIME_CATEGORIES:
+      line += " %11.1f" % (stats[category + "_seconds"] / count * 1000)
+    lines.append(line)
+
+  lines.append("")
+  lines.append("Wall time histograms (upper bounds in ms)")
+  lines.append("")
+  lines += _get_histogram_lines(statsdict, namelist, "wall_time_histogram",
+                                WALL_TIME_HISTOGRAM_BOUNDS_MS)
+
+  lines.append("")
+  lines.append("Query count histograms (upper bounds)")
+  lines.append("")
+  lines += _get_histogram_lines(statsdict, namelist, "query_count_histogram",
+                                QUERY_COUNT_HISTOGRAM_BOUNDS)
+
+  lines.append("")
+  lines.append("Slowest requests")
+  for sample in get_slow_request_sample():
+    lines.append("")
+    line = "%s: %.1f ms wall, %d queries in %.1f ms" % (sample["name"],
+        sample["wall_seconds"] * 1000, sample["db_query_count"], sample["db_seconds"] * 1000)
+    for category in TIME_CATEGORIES:
+      line += ", %s %.1f ms" % (category, sample[category + "_seconds"] * 1000)
+    lines.append(line)
+    for (seconds, sql) in sample["queries"]:
+      lines.append("  %8.1f ms  %s" % (seconds * 1000, sql))
+    if sample["db_query_count"] > len(sample["queries"]):
+      lines.append("  (%d more queries)" % (sample["db_query_count"] - len(sample["queries"])))
+
+  return lines
+
+
+
+
+
+def _get_histogram_lines(statsdict, namelist, key, bounds):
+  """Returns lines of a table of one of the histograms of each request name."""
+  header = "%-50s" % "request"
+  for bound in bounds:
+    header += " %6s" % bound
+  header += " %6s" % "more"
+  lines = [header]
+
+  for name in namelist:
+    line = "%-50s" % name[:50]
+    for bucketcount in statsdict[name][key]:
+      line += " %6d" % bucketcount
+    lines.append(line)
+
+  return lines
@@ -6,6 +6,10 @@ Some of the functions in the module are very database intensive. They could
 be done more efficiently, but where possible this module tries to use the
 maindb api so that summarized information matches how seattlegeni actually
 sees things.
+
+The queries allow stale data so that they go to the read replica, if one is
+configured, rather than competing with vessel acquisition on the primary
+database.
 """
 
 from seattlegeni.common.api import maindb
@@ -28,10 +32,10 @@ def get_vessel_acquisition_counts_by_user():
   
   vessel_acquisition_dict = {}
   
-  for user in GeniUser.objects.all():
-    acquired_vessels = maindb.get_acquired_vessels(user)
-    if len(acquired_vessels) > 0:
-      vessel_acquisition_dict[user.username] = len(acquired_vessels)
+  for user in maindb.get_queryset_for_reading(GeniUser.objects.all()):
+    acquired_vessel_count = maindb.get_acquired_vessel_count(user, allow_stale=True)
+    if acquired_vessel_count > 0:
+      vessel_acquisition_dict[user.username] = acquired_vessel_count
       
   # Restore the original log level.
   log.set_log_level(initial_log_level)
@@ -51,9 +55,10 @@ def get_donation_counts_by_user():
   
   donation_dict = {}
   
-  for user in GeniUser.objects.all():
-    active_donation_count = len(maindb.get_donations_by_user(user))
-    inactive_donation_count = len(maindb.get_donations_by_user(user, include_inactive_and_broken=True)) - active_donation_count
+  for user in maindb.get_queryset_for_reading(GeniUser.objects.all()):
+    active_donation_count = maindb.get_donation_count_by_user(user, allow_stale=True)
+    inactive_donation_count = maindb.get_donation_count_by_user(user, include_inactive_and_broken=True,
+                                                                allow_stale=True) - active_donation_count
     if active_donation_count > 0 or inactive_donation_count > 0:
       donation_dict[user.username] = (active_donation_count, inactive_donation_count)
       
@@ -77,9 +82,12 @@ def get_available_vessel_counts_by_port():
   
   for port in maindb.ALLOWED_USER_PORTS:
     available_vessels_dict[port] = {}
-    available_vessels_dict[port]["all"] = maindb._get_queryset_of_all_available_vessels_for_a_port_include_nat_nodes(port).count()
-    available_vessels_dict[port]["no_nat"] = maindb._get_queryset_of_all_available_vessels_for_a_port_exclude_nat_nodes(port).count()
-    available_vessels_dict[port]["only_nat"] = maindb._get_queryset_of_all_available_vessels_for_a_port_only_nat_nodes(port).count()
+    allqueryset = maindb._get_queryset_of_all_available_vessels_for_a_port_include_nat_nodes(port)
+    nonatqueryset = maindb._get_queryset_of_all_available_vessels_for_a_port_exclude_nat_nodes(port)
+    onlynatqueryset = maindb._get_queryset_of_all_available_vessels_for_a_port_only_nat_nodes(port)
+    available_vessels_dict[port]["all"] = maindb.get_queryset_for_reading(allqueryset).count()
+    available_vessels_dict[port]["no_nat"] = maindb.get_queryset_for_reading(nonatqueryset).count()
+    available_vessels_dict[port]["only_nat"] = maindb.get_queryset_for_reading(onlynatqueryset).count()
   
   # Restore the original log level.
   log.set_log_level(initial_log_level)
@@ -100,14 +108,15 @@ def get_available_lan_vessel_counts():
   
   lan_sizes_by_port = {}
 
-  subnetlist = maindb._get_subnet_list()
+  subnetlist = maindb._get_subnet_list(allow_stale=True)
 
   for port in maindb.ALLOWED_USER_PORTS:
     subnet_vessel_list_sizes = []
     nonnatvesselsqueryset = maindb._get_queryset_of_all_available_vessels_for_a_port_exclude_nat_nodes(port)
+    nonnatvesselsqueryset = maindb.get_queryset_for_reading(nonnatvesselsqueryset)
   
     for subnet in subnetlist:
-      lanvesselsqueryset = nonnatvesselsqueryset.filter(node__last_known_ip__startswith=subnet + '.')
+      lanvesselsqueryset = nonnatvesselsqueryset.filter(node__subnet=subnet)
       subnet_vessel_list_sizes.append(lanvesselsqueryset.count())
   
     subnet_vessel_list_sizes.sort(reverse=True)
@@ -0,0 +1,27 @@
+/*
+ * <Purpose>
+ *   Creates the control_acquisitionjob table in an existing seattlegeni
+ *   database. New databases created with syncdb already have this table.
+ *
+ *   The table starts out empty, so this can be run at any time before the
+ *   website code that uses it is deployed.
+ */
+
+CREATE TABLE seattlegeni.control_acquisitionjob (
+  `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+  `user_id` integer NOT NULL,
+  `vesselcount` integer NOT NULL,
+  `vesseltype` varchar(10) NOT NULL,
+  `status` varchar(10) NOT NULL,
+  `vessel_handles` longtext NOT NULL,
+  `error_type` varchar(50) NOT NULL,
+  `error_message` varchar(1024) NOT NULL,
+  `date_created` datetime NOT NULL,
+  `date_started` datetime NULL,
+  `date_finished` datetime NULL,
+  `date_heartbeat` datetime NULL,
+  INDEX `control_acquisitionjob_user_id` (`user_id`),
+  INDEX `control_acquisitionjob_status` (`status`),
+  INDEX `control_acquisitionjob_date_created` (`date_created`),
+  FOREIGN KEY (`user_id`) REFERENCES seattlegeni.control_geniuser (`user_ptr_id`)
+) ENGINE=InnoDB;
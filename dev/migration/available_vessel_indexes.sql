@@ -0,0 +1,33 @@
+/*
+ * <Purpose>
+ *   Adds the composite indexes used when looking up available vessels to an
+ *   existing seattlegeni database. New databases created with syncdb get
+ *   these from the custom sql in website/control/sql.
+ *
+ *   These can take a while on large tables. InnoDB will block writes to each
+ *   table while its index is built, so run this when acquisitions and the
+ *   transition scripts can be paused.
+ */
+
+ALTER TABLE seattlegeni.control_node
+  ADD INDEX `control_node_active_broken` (`is_active`, `is_broken`);
+
+ALTER TABLE seattlegeni.control_vessel
+  ADD INDEX `control_vessel_availability` (`acquired_by_user_id`, `is_dirty`, `node_id`);
+
+ALTER TABLE seattlegeni.control_vesselport
+  ADD INDEX `control_vesselport_port_vessel` (`port`, `vessel_id`);
+
+/* To confirm the indexes are used, run EXPLAIN on the query django generates
+ * for an available vessel lookup, for example:
+ *
+ *   EXPLAIN SELECT control_vessel.id FROM control_vessel
+ *     INNER JOIN control_vesselport ON (control_vessel.id = control_vesselport.vessel_id)
+ *     INNER JOIN control_node ON (control_vessel.node_id = control_node.id)
+ *     WHERE control_vessel.acquired_by_user_id IS NULL
+ *       AND control_vessel.is_dirty = 0 AND control_node.is_active = 1
+ *       AND control_node.is_broken = 0 AND control_vesselport.port = 63100;
+ *
+ * The `key` column should list control_vesselport_port_vessel (or
+ * control_vessel_availability if few vessels are available).
+ */
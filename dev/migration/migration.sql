@@ -50,6 +50,7 @@ TRUNCATE seattlegeni.control_geniuser ;
 TRUNCATE seattlegeni.control_node ;
 TRUNCATE seattlegeni.control_vessel ;
 TRUNCATE seattlegeni.control_vesselport ;
+TRUNCATE seattlegeni.control_availablevesselcount ;
 TRUNCATE seattlegeni.control_vesseluseraccessmap ;
 TRUNCATE keydb.keys ;
 
@@ -62,7 +63,9 @@ Order of fields in the new control_node table:
 
 id
 node_identifier
+node_identifier_hash
 last_known_ip
+subnet
 last_known_port
 last_known_version
 date_last_contacted
@@ -117,7 +120,12 @@ INSERT INTO seattlegeni.control_node
   SELECT 
     old_donation.id,
     old_donation.pubkey,
+    SHA1(old_donation.pubkey),
     old_donation.ip,
+    /* The subnet is empty for nat nodes and ips without a dot, the same as
+     * maindb._get_subnet_of_ip() would give. */
+    IF(old_donation.ip LIKE 'NAT$%' OR LOCATE('.', old_donation.ip) = 0, '',
+       SUBSTRING_INDEX(old_donation.ip, '.', 3)),
     old_donation.port,
     old_donation.version,
     /* The old seattlegeni didn't keep a meaningful last_heard value, but we don't want
@@ -233,6 +241,32 @@ INSERT INTO seattlegeni.control_vesselport
 
 
 
+
+/*
+Order of fields in the new control_availablevesselcount table:
+
+id
+subnet
+port
+count
+
+These are the same counts maindb.reconcile_available_vessel_counts() computes.
+*/
+INSERT INTO seattlegeni.control_availablevesselcount
+  SELECT NULL, /* Tell mysql to autoincrement the id field */
+         node.subnet,
+         vport.port,
+         COUNT(*)
+  FROM seattlegeni.control_vesselport vport
+    INNER JOIN seattlegeni.control_vessel vessel ON (vessel.id = vport.vessel_id)
+    INNER JOIN seattlegeni.control_node node ON (node.id = vessel.node_id)
+  WHERE vessel.acquired_by_user_id IS NULL AND vessel.is_dirty = FALSE AND
+        node.is_active = TRUE AND node.is_broken = FALSE AND node.subnet <> ''
+  GROUP BY node.subnet, vport.port;
+
+
+
+
 /*
 Order of fields in the new control_vesseluseraccessmap table:
 
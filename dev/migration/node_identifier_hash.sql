@@ -0,0 +1,27 @@
+/*
+ * <Purpose>
+ *   Adds the node_identifier_hash column to the control_node table of an
+ *   existing seattlegeni database and populates it. New databases created
+ *   with syncdb already have this column.
+ *
+ *   The value must be the lowercase hex SHA-1 of node_identifier, which is
+ *   what both MySQL's SHA1() and maindb._get_node_identifier_hash() produce.
+ *
+ *   Stop the website, backend, and polling daemons before running this, as
+ *   nodes created while the column is being populated would get an empty
+ *   hash and then violate the unique index.
+ */
+
+ALTER TABLE seattlegeni.control_node
+  ADD COLUMN node_identifier_hash varchar(40) NULL AFTER node_identifier;
+
+UPDATE seattlegeni.control_node SET node_identifier_hash = SHA1(node_identifier);
+
+/* If this fails, there are duplicate node_identifiers in the database which
+   need to be cleaned up by hand. To find them:
+     SELECT node_identifier_hash, COUNT(*) FROM seattlegeni.control_node
+       GROUP BY node_identifier_hash HAVING COUNT(*) > 1
+ */
+ALTER TABLE seattlegeni.control_node
+  MODIFY node_identifier_hash varchar(40) NOT NULL,
+  ADD UNIQUE INDEX (node_identifier_hash);
@@ -0,0 +1,47 @@
+/*
+ * <Purpose>
+ *   Adds the subnet column to the control_node table of an existing
+ *   seattlegeni database, populates it, and creates and populates the
+ *   control_availablevesselcount table. New databases created with syncdb
+ *   already have these.
+ *
+ *   The subnet must be an empty string for nat nodes and ips without a dot,
+ *   which is what maindb._get_subnet_of_ip() produces.
+ *
+ *   Stop the website, backend, and polling daemons before running this, as
+ *   changes made while it runs would not be reflected in the counts. If the
+ *   counts are ever suspected to be wrong, they can be corrected while
+ *   everything is running with maindb.reconcile_available_vessel_counts(),
+ *   which the check_active_db_nodes polling daemon also does periodically.
+ */
+
+ALTER TABLE seattlegeni.control_node
+  ADD COLUMN subnet varchar(100) NOT NULL DEFAULT '' AFTER last_known_ip,
+  ADD INDEX `control_node_subnet` (subnet);
+
+UPDATE seattlegeni.control_node
+  SET subnet = SUBSTRING_INDEX(last_known_ip, '.', 3)
+  WHERE last_known_ip NOT LIKE 'NAT$%' AND LOCATE('.', last_known_ip) > 0;
+
+CREATE TABLE seattlegeni.control_availablevesselcount (
+  `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+  `subnet` varchar(100) NOT NULL,
+  `port` integer NOT NULL,
+  `count` integer NOT NULL,
+  UNIQUE (`subnet`, `port`),
+  INDEX `control_availablevesselcount_subnet` (`subnet`),
+  INDEX `control_availablevesselcount_port` (`port`),
+  INDEX `control_availablevesselcount_port_count` (`port`, `count`)
+) ENGINE=InnoDB;
+
+INSERT INTO seattlegeni.control_availablevesselcount
+  SELECT NULL, /* Tell mysql to autoincrement the id field */
+         node.subnet,
+         vport.port,
+         COUNT(*)
+  FROM seattlegeni.control_vesselport vport
+    INNER JOIN seattlegeni.control_vessel vessel ON (vessel.id = vport.vessel_id)
+    INNER JOIN seattlegeni.control_node node ON (node.id = vessel.node_id)
+  WHERE vessel.acquired_by_user_id IS NULL AND vessel.is_dirty = FALSE AND
+        node.is_active = TRUE AND node.is_broken = FALSE AND node.subnet <> ''
+  GROUP BY node.subnet, vport.port;
@@ -0,0 +1,14 @@
+/*
+ * <Purpose>
+ *   Adds the version column to the control_vessel table of an existing
+ *   seattlegeni database. New databases created with syncdb already have
+ *   this column.
+ *
+ *   All existing vessels start at version 0. This can be run while the
+ *   website, backend, and polling daemons are stopped or running with code
+ *   that doesn't yet know about the column (they never set it, so the
+ *   default is used).
+ */
+
+ALTER TABLE seattlegeni.control_vessel
+  ADD COLUMN version integer NOT NULL DEFAULT 0 AFTER user_keys_in_sync;
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Compare how long it takes to marshal the xmlrpc response of get_resource_info
+for a user with many vessels using xmlrpclib and using the website's
+marshalling module, in both the full and the compact vessel info formats.
+
+Usage:
+  python scripts/benchmark_xmlrpc_marshalling.py [vesselcount] [repetitions]
+
+The default is 1000 vessels and 20 repetitions. The database isn't used.
+"""
+
+import random
+import sys
+import time
+import xmlrpclib
+
+from seattlegeni.website.xmlrpc import marshalling
+
+# The keys of the vessel infodicts. This is the same as
+# interface.VESSEL_INFODICT_FIELDS, which isn't imported so that django doesn't
+# need to be configured.
+VESSEL_INFODICT_FIELDS = ["node_id", "node_ip", "node_port", "vessel_id", "handle",
+                          "is_active", "expires_in_seconds"]
+
+
+
+
+
+def make_infodict_list(vesselcount):
+  """
+  Make a list of vessel infodicts like the website would return. Node ids are
+  public key strings, which are what makes the responses large.
+  """
+  infodict_list = []
+  for i in range(vesselcount):
+    node_id = str(random.getrandbits(1024)) + " " + str(random.getrandbits(16))
+    infodict_list.append({"node_id":node_id,
+                          "node_ip":"10.%d.%d.%d" % (i / 65536, (i / 256) % 256, i % 256),
+                          "node_port":1224,
+                          "vessel_id":"v" + str(random.randint(1, 10)),
+                          "handle":node_id + ":v" + str(i % 10),
+                          "is_active":True,
+                          "expires_in_seconds":random.randint(0, 7 * 24 * 3600)})
+  return infodict_list
+
+
+
+
+
+def time_marshalling(dumpsfunc, value, repetitions):
+  """Returns the (best seconds, response length) of marshaling the value."""
+  besttime = None
+  for i in range(repetitions):
+    start = time.time()
+    response = dumpsfunc(value)
+    elapsed = time.time() - start
+    if besttime is None or elapsed < besttime:
+      besttime = elapsed
+  return (besttime, len(response))
+
+
+
+
+
+def xmlrpclib_dumps(value):
+  return xmlrpclib.dumps((value,), methodresponse=True)
+
+
+
+
+
+def marshalling_dumps_uncached(value):
+  marshalling.string_fragment_cache.clear()
+  marshalling.member_fragment_cache.clear()
+  return marshalling.dumps_response(value)
+
+
+
+
+
+if __name__ == "__main__":
+
+  vesselcount = 1000
+  repetitions = 20
+  if len(sys.argv) > 1:
+    vesselcount = int(sys.argv[1])
+  if len(sys.argv) > 2:
+    repetitions = int(sys.argv[2])
+
+  infodict_list = make_infodict_list(vesselcount)
+  compact = marshalling.get_compact_dict_list(infodict_list, VESSEL_INFODICT_FIELDS)
+
+  assert xmlrpclib_dumps(infodict_list) == marshalling.dumps_response(infodict_list)
+
+  print "Marshaling get_resource_info responses for %d vessels (best of %d)" % (vesselcount, repetitions)
+  print
+  print "%-10s%-22s%12s%12s" % ("Format", "Marshaller", "ms", "bytes")
+  print "%-10s%-22s%12s%12s" % ("------", "----------", "--", "-----")
+
+  for (formatname, value) in [("full", infodict_list), ("compact", compact)]:
+    for (marshallername, dumpsfunc) in [("xmlrpclib", xmlrpclib_dumps),
+                                        ("marshalling (cold)", marshalling_dumps_uncached),
+                                        ("marshalling (warm)", marshalling.dumps_response)]:
+      (seconds, length) = time_marshalling(dumpsfunc, value, repetitions)
+      print "%-10s%-22s%12.2f%12d" % (formatname, marshallername, seconds * 1000, length)
@@ -42,6 +42,7 @@ import os
 import sys
 import time
 import random
+import threading
 import traceback
 
 import django.db
@@ -80,6 +81,26 @@ dy_import_module_symbols('random.r2py')
 # Whether _init_node_transition_lib() has been called yet.
 is_initialized = False
 
+# If True, processnode() looks up the node identifier of a node in the
+# database by the node's address, locks that node, and then queries the node
+# only once. The node query is only repeated if the node turns out to have a
+# different identifier than the database said (e.g. a new or reinstalled
+# node). If False, the node is always queried before and after locking it.
+OPTIMISTIC_NODE_LOCKING = True
+
+# The number of vessels created by split_vessels() that are recorded in the
+# database together. Vessels are recorded as splitting goes on rather than all
+# at the end so that a long split that fails late doesn't lose every record.
+VESSEL_RECORD_BATCH_SIZE = 10
+
+# Counts of how often processnode() had to query a node again after locking
+# it ('refetch_performed') and how often that was avoided ('refetch_avoided').
+# Use get_node_info_fetch_counts() and reset_node_info_fetch_counts(), as
+# processnode() runs in parallel threads and the counts are only changed while
+# holding node_info_fetch_counts_lock.
+node_info_fetch_counts = {"refetch_avoided" : 0, "refetch_performed" : 0}
+node_info_fetch_counts_lock = threading.Lock()
+
 
 
 
@@ -224,6 +245,7 @@ def do_one_processnode_run(change_nodestate_function_tuplelist, transition_scrip
    
     # Return the number of failures and successes.
     log("Succeeded on "+str(success_processrun_count)+" nodes, Failed on "+str(fail_processrun_count)+" nodes")
+    log("Node info fetch counts so far: " + str(get_node_info_fetch_counts()))
     result_list.append( (success_processrun_count, fail_processrun_count) )
 
     
@@ -388,23 +410,36 @@ def processnode(node_string, startstate_name, endstate_name, nodeprocess_func, n
 
   log("Starting to process node: "+node_string)
 
-  # Try to retrieve the vessel dictionary for a node, 
-  # on error raise a NodeError exception.
-  try:
-    node_info = nodemanager.get_node_info(ip_or_nat_string, port_num)
-  except NodemanagerCommunicationError:
-    raise
-    
+  nodeID = None
+  node_info = None
+
+  if OPTIMISTIC_NODE_LOCKING:
+    (nodeID, lockserver_handle, node_info) = _optimistically_lock_node(ip_or_nat_string, port_num)
 
-  # Extract the nodeID in order to acquire a lock
-  nodeID =  _do_rsa_publickey_to_string(node_info['nodekey'])
+  if nodeID is None:
+    # Try to retrieve the vessel dictionary for a node, 
+    # on error raise a NodeError exception. We only need the nodekey from this
+    # to know what to lock, so a recently cached result is good enough.
+    try:
+      pre_lock_node_info = nodemanager.get_node_info(ip_or_nat_string, port_num,
+                                                     allow_cached=True)
+    except NodemanagerCommunicationError:
+      raise
+      
   
-  # Acquire a node lock
-  lockserver_handle = acquire_node_lock(nodeID)
+    # Extract the nodeID in order to acquire a lock
+    nodeID =  _do_rsa_publickey_to_string(pre_lock_node_info['nodekey'])
+    
+    # Acquire a node lock
+    lockserver_handle = acquire_node_lock(nodeID)
 
   try:
-    log("Retrieving node vesseldict for node: "+node_string)   
-    node_info = nodemanager.get_node_info(ip_or_nat_string, port_num)
+    # The node info we have (if any) was obtained while holding the lock, so
+    # there's no need to ask the node again.
+    if node_info is None:
+      log("Retrieving node vesseldict for node: "+node_string)   
+      node_info = nodemanager.get_node_info(ip_or_nat_string, port_num)
+      _count_node_info_fetch("refetch_performed")
    
     log("Successfully retrieved node_info for node: " + node_string)
 
@@ -467,6 +502,9 @@ def processnode(node_string, startstate_name, endstate_name, nodeprocess_func, n
     log("Ran into some unexpected error while processing node: " + node_string)
     return False
   finally:
+    # The node was likely changed through the backend, which can't invalidate
+    # the node info cache of this process for us.
+    nodemanager.invalidate_node_info_cache(ip_or_nat_string, port_num)
     release_node_lock(lockserver_handle, nodeID)
 
   #everything worked out fine
@@ -476,6 +514,96 @@ def processnode(node_string, startstate_name, endstate_name, nodeprocess_func, n
 
 
 
+def _optimistically_lock_node(ip_or_nat_string, port_num):
+  """
+  <Purpose>
+    Lock the node the database believes is at an address and then query the
+    node, making sure that it is the node we locked.
+
+  <Arguments>
+    ip_or_nat_string - the ip or NAT string of the node.
+
+    port_num - the port of the node.
+
+  <Exceptions>
+    NodemanagerCommunicationError - raised if problem communicating the node
+
+  <Side Effects>
+    If the returned nodeID is not None, the node is locked.
+
+  <Return>
+    A tuple (nodeID, lockserver_handle, node_info). If the database doesn't
+    know exactly one node at the address or the node reported a different
+    nodeID, no lock is held and all three values are None.
+  """
+
+  database_nodelist = maindb.get_nodes_with_last_known_address(ip_or_nat_string, port_num)
+  if len(database_nodelist) != 1:
+    return (None, None, None)
+
+  guessed_nodeID = database_nodelist[0].node_identifier
+  lockserver_handle = acquire_node_lock(guessed_nodeID)
+
+  try:
+    node_info = nodemanager.get_node_info(ip_or_nat_string, port_num)
+    nodeID = _do_rsa_publickey_to_string(node_info['nodekey'])
+  except:
+    release_node_lock(lockserver_handle, guessed_nodeID)
+    raise
+
+  if nodeID != guessed_nodeID:
+    log("Node at " + ip_or_nat_string + ":" + str(port_num) + " is not the " +
+        "node the database expected. Locking the reported node instead.")
+    release_node_lock(lockserver_handle, guessed_nodeID)
+    return (None, None, None)
+
+  _count_node_info_fetch("refetch_avoided")
+  return (nodeID, lockserver_handle, node_info)
+
+
+
+
+
+def _count_node_info_fetch(key):
+  """Adds one to the count of node_info_fetch_counts[key]."""
+  node_info_fetch_counts_lock.acquire()
+  try:
+    node_info_fetch_counts[key] += 1
+  finally:
+    node_info_fetch_counts_lock.release()
+
+
+
+
+
+def get_node_info_fetch_counts():
+  """
+  Returns a copy of the dict counting how often processnode() did and didn't
+  need to query a node a second time after locking it.
+  """
+  node_info_fetch_counts_lock.acquire()
+  try:
+    return node_info_fetch_counts.copy()
+  finally:
+    node_info_fetch_counts_lock.release()
+
+
+
+
+
+def reset_node_info_fetch_counts():
+  """Resets the counts returned by get_node_info_fetch_counts() to zero."""
+  node_info_fetch_counts_lock.acquire()
+  try:
+    for key in node_info_fetch_counts:
+      node_info_fetch_counts[key] = 0
+  finally:
+    node_info_fetch_counts_lock.release()
+
+
+
+
+
 @log_function_call
 def get_node_state(node_info, database_nodeobject):
   """
@@ -930,9 +1058,12 @@ def split_vessels (node_string, node_info, database_nodeobject, resourcetemplate
 
   donated_vesselname = database_nodeobject.extra_vessel_name
 
-  # Retrieve the usable ports list for the node and then shuffle
-  # the ports so each vessel gets a random subset of the ports
-  usable_ports_list = nodemanager.get_vessel_resources(ip_or_nat_string, port_num, donated_vesselname)['usableports']
+  # Retrieve the resources of the donated vessel. We only need the usable
+  # ports list for the node, which we shuffle so each vessel gets a random
+  # subset of the ports, but the rest is logged to help diagnose failed splits.
+  vessel_resources = nodemanager.get_vessel_resources(ip_or_nat_string, port_num, donated_vesselname)
+  log("Resources of vessel " + donated_vesselname + " on node: " + node_string + ". " + str(vessel_resources['resources']))
+  usable_ports_list = vessel_resources['usableports']
   log("List of usable ports in node: "+node_string+". "+str(usable_ports_list))
   random.shuffle(usable_ports_list)
 
@@ -940,61 +1071,75 @@ def split_vessels (node_string, node_info, database_nodeobject, resourcetemplate
   current_vessel = donated_vesselname
   log("Name of starting vessel: "+current_vessel)
 
-  # Keep splittiing the vessel until we run out of resources.
-  # Note that when split_vessel is called the left vessel
-  # has the leftover (extra vessel)and the right vessel has
-  # the vessel with the exact resources.
-  while len(usable_ports_list) >= 10:
-    desired_resourcedata = get_resource_data(resourcetemplate, usable_ports_list)
-
-    #use the first 10 ports so remove them from the list of usable_ports_list
-    used_ports_list = usable_ports_list[:10]
-    usable_ports_list = usable_ports_list[10:]
-
-    log("Ports we are going to use for the new vessel: "+str(used_ports_list))
-    log("Starting to split vessel: "+current_vessel)
+  # The names and port lists of the vessels created by splitting that haven't
+  # been recorded in the database yet.
+  new_vessel_list = []
 
-    # Split the current vessel. The exact vessel is the right vessel
-    # and the extra vessel is the left vessel.
-    try:
-      leftover_vessel, new_vessel = backend.split_vessel(database_nodeobject, current_vessel, desired_resourcedata)
-    except NodemanagerCommunicationError, e:
-      # The object 'e' will already include traceback info that has the actual node error.
-      # If the failure is due to inability to split further, that's ok.
-      if 'Insufficient quantity:' in str(e):
-        log("Could not split " + current_vessel + " any further due to insufficient resource/quantity. " + str(e))
-        # We must break out of the while loop here. If we let the exception get,
-        # raised, it will look like the transition failed.
-        break
-      raise
+  try:
+    # Keep splittiing the vessel until we run out of resources.
+    # Note that when split_vessel is called the left vessel
+    # has the leftover (extra vessel)and the right vessel has
+    # the vessel with the exact resources.
+    while len(usable_ports_list) >= 10:
+      desired_resourcedata = get_resource_data(resourcetemplate, usable_ports_list)
+
+      #use the first 10 ports so remove them from the list of usable_ports_list
+      used_ports_list = usable_ports_list[:10]
+      usable_ports_list = usable_ports_list[10:]
+
+      log("Ports we are going to use for the new vessel: "+str(used_ports_list))
+      log("Starting to split vessel: "+current_vessel)
+
+      # Split the current vessel. The exact vessel is the right vessel
+      # and the extra vessel is the left vessel.
+      try:
+        leftover_vessel, new_vessel = backend.split_vessel(database_nodeobject, current_vessel, desired_resourcedata)
+      except NodemanagerCommunicationError, e:
+        # The object 'e' will already include traceback info that has the actual node error.
+        # If the failure is due to inability to split further, that's ok.
+        if 'Insufficient quantity:' in str(e):
+          log("Could not split " + current_vessel + " any further due to insufficient resource/quantity. " + str(e))
+          # We must break out of the while loop here. If we let the exception get,
+          # raised, it will look like the transition failed.
+          break
+        raise
+
+      log("Successfully split vessel: "+current_vessel+" into vessels: "+leftover_vessel+" and "+new_vessel)
+      current_vessel = leftover_vessel
+
+      # Make sure to update the database and record the new
+      # name of the extra vessel as when backend.split_vessels()
+      # is called, the old vessel does not exist anymore.
+      # Instead two new vessels are created, where the first
+      # vessel is the extra vessel with leftover resources
+      # and the second vessel has the actual amount of resources
+      maindb.set_node_extra_vessel_name(database_nodeobject, current_vessel)
+
+      # Set the user_list for the new vesel to be empty. Remember that user_list is what determines
+      # the transition state, and only the extra vessel should have this set.
+      backend.set_vessel_user_keylist(database_nodeobject, new_vessel, [])
+      log("Changed the userkeys for the vessel "+new_vessel+" to []")
+
+      # The newly created vessel and its ports are added to the database along
+      # with a batch of others.
+      new_vessel_list.append((new_vessel, used_ports_list))
+      if len(new_vessel_list) >= VESSEL_RECORD_BATCH_SIZE:
+        create_vessel_records(node_string, database_nodeobject, new_vessel_list)
+        new_vessel_list = []
 
-    log("Successfully split vessel: "+current_vessel+" into vessels: "+leftover_vessel+" and "+new_vessel)
-    current_vessel = leftover_vessel
-
-    # Make sure to update the database and record the new
-    # name of the extra vessel as when backend.split_vessels()
-    # is called, the old vessel does not exist anymore.
-    # Instead two new vessels are created, where the first
-    # vessel is the extra vessel with leftover resources
-    # and the second vessel has the actual amount of resources
-    maindb.set_node_extra_vessel_name(database_nodeobject, current_vessel)
-
-    # Set the user_list for the new vesel to be empty. Remember that user_list is what determines
-    # the transition state, and only the extra vessel should have this set.
-    backend.set_vessel_user_keylist(database_nodeobject, new_vessel, [])
-    log("Changed the userkeys for the vessel "+new_vessel+" to []")
-
-    # Add the newly created vessel to the database and then add the ports associated with
-    # the vessel to the database also.
-    log("Creating a vessel record in the database for vessel "+new_vessel+" for node "+node_string)
+  except:
+    # The vessels that were created before the error still have to be recorded
+    # in the database, but a failure to do that mustn't hide the original
+    # error.
+    exc_info = sys.exc_info()
     try:
-      vessel_object = maindb.create_vessel(database_nodeobject, new_vessel)
-      log("Setting the vessel ports in the database for vessel "+new_vessel+" with port list: "+str(used_ports_list))
-      maindb.set_vessel_ports(vessel_object, used_ports_list)
+      create_vessel_records(node_string, database_nodeobject, new_vessel_list)
     except:
-      raise DatabaseError("Failed to create vessel entry or change vessel entry for vessel: " +
-                          new_vessel + ". " + traceback.format_exc())
+      log("Failed to record the vessels created on node " + node_string +
+          " before splitting failed: " + traceback.format_exc())
+    raise exc_info[0], exc_info[1], exc_info[2]
 
+  create_vessel_records(node_string, database_nodeobject, new_vessel_list)
 
   log("Finished splitting vessels up for the node: "+node_string)
 
@@ -1002,6 +1147,47 @@ def split_vessels (node_string, node_info, database_nodeobject, resourcetemplate
 
 
 
+@log_function_call
+def create_vessel_records(node_string, database_nodeobject, new_vessel_list):
+  """
+  <Purpose>
+    Add records for vessels created by splitting the extra vessel of a node to
+    the database, along with the ports associated with each vessel. All of the
+    vessels are added in a single transaction.
+
+  <Arguments>
+    node_string - the name of the node. ip:port or NAT:port
+
+    database_nodeobject - a database object for the node
+
+    new_vessel_list - a list of tuples of (vesselname, port_list)
+
+  <Exceptions>
+    DatabaseError - raised if unable to modify the database
+
+  <Side Effects>
+    Database gets modified.
+
+  <Return>
+    None
+  """
+
+  if not new_vessel_list:
+    return
+
+  log("Creating vessel records in the database for node "+node_string+" with vessels and port lists: "+
+      str(new_vessel_list))
+  try:
+    maindb.create_vessels_with_ports(database_nodeobject, new_vessel_list)
+  except:
+    raise DatabaseError("Failed to create vessel entries for vessels: " +
+                        str([vesselname for (vesselname, port_list) in new_vessel_list]) +
+                        ". " + traceback.format_exc())
+
+
+
+
+
 @log_function_call
 def get_resource_data(resourcetemplate, usable_ports_list):
   """
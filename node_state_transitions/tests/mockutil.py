@@ -82,7 +82,7 @@ def mock_transitionlib_do_advertise_lookup(nodeaddress_list_to_return):
 
 def mock_nodemanager_get_node_info(nodeid_key, version, vessels_dict):
   
-  def _mock_get_node_info(ip, port):
+  def _mock_get_node_info(ip, port, allow_cached=False):
     nodeinfo = {"version" : version,
                 "nodename" : "",
                 "nodekey" : nodeid_key,
@@ -131,6 +131,7 @@ def mock_nodemanager_get_vesselresources():
     for i in range(90):
       resourcelist.append(i)
     resource_dict['usableports'] = resourcelist
+    resource_dict['resources'] = {}
     
     return resource_dict
 
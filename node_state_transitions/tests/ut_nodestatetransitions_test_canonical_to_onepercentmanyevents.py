@@ -24,8 +24,11 @@ from seattlegeni.tests import testlib
 from seattlegeni.node_state_transitions import node_transition_lib
 from seattlegeni.node_state_transitions import transition_canonical_to_onepercentmanyevents
 
+from seattlegeni.common.api import backend
 from seattlegeni.common.api import maindb
 
+from seattlegeni.common.exceptions import *
+
 from seattlegeni.node_state_transitions.tests import mockutil
 
 from seattle.repyportability import *
@@ -282,6 +285,52 @@ def run_moving2onepercent_to_canonical_test():
 
 
 
+def run_split_and_record_failure_test():
+
+  # Splitting fails part of the way through and then recording the vessels
+  # that were created before that fails, too. The error from splitting is the
+  # one that must be seen.
+  def mock_split_vessel_fails_third_time(node, vesselname, resource_data):
+    if mockutil.split_vessel_call_count == 2:
+      raise NodemanagerCommunicationError("connection lost")
+    return original_mock_split_vessel(node, vesselname, resource_data)
+
+  def mock_create_vessels_with_ports(node, vessel_list):
+    raise Exception("database is down")
+
+  mockutil.mock_backend_split_vessel()
+  original_mock_split_vessel = backend.split_vessel
+  backend.split_vessel = mock_split_vessel_fails_third_time
+
+  original_create_vessels_with_ports = maindb.create_vessels_with_ports
+  maindb.create_vessels_with_ports = mock_create_vessels_with_ports
+
+  onepercentmanyevents_resource_fd = file(transition_canonical_to_onepercentmanyevents.RESOURCES_TEMPLATE_FILE_PATH)
+  onepercentmanyevents_resourcetemplate = onepercentmanyevents_resource_fd.read()
+  onepercentmanyevents_resource_fd.close()
+
+  node = maindb.get_node(mockutil.nodeid_key_str)
+
+  print "Starting split and record failure test....."
+
+  try:
+    try:
+      transition_canonical_to_onepercentmanyevents.onepercentmanyevents_divide(
+          mockutil.node_address, None, node, onepercentmanyevents_resourcetemplate)
+    except NodemanagerCommunicationError, e:
+      assert("connection lost" in str(e))
+    else:
+      assert(False)
+  finally:
+    maindb.create_vessels_with_ports = original_create_vessels_with_ports
+
+  assert(mockutil.split_vessel_call_count == 2)
+  assert(len(maindb.get_vessels_on_node(node)) == 0)
+
+
+
+
+
 def assert_database_info_before_completed():
 
   active_nodes_list = maindb.get_active_nodes()
@@ -354,3 +403,9 @@ if __name__ == "__main__":
     run_moving2onepercent_to_canonical_test()
   finally:
     teardown_test()
+
+  setup_test()
+  try:
+    run_split_and_record_failure_test()
+  finally:
+    teardown_test()
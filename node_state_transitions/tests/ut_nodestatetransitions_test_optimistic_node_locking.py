@@ -0,0 +1,136 @@
+"""
+<Program>
+  ut_nodestatetransitions_test_optimistic_node_locking.py
+
+<Purpose>
+  Test out _optimistically_lock_node() in node_transition_lib: the node the
+  database has at an address is locked and kept locked only if the node
+  turns out to be that node.
+"""
+
+#pragma out
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.node_state_transitions import node_transition_lib
+
+from seattlegeni.common.api import lockserver
+from seattlegeni.common.api import maindb
+
+from seattlegeni.node_state_transitions.tests import mockutil
+
+
+
+
+
+
+# The (request_type, node_list) of each lock request made.
+lock_requests = []
+
+other_nodeid_key_str = "7 8"
+
+
+
+
+def _mock_perform_lock_request(request_type, lockserver_handle, user_list=None, node_list=None):
+  lock_requests.append((request_type, node_list))
+
+
+
+
+def setup_test():
+  testlib.setup_test_db()
+
+  # Make sure all the variables are its default values
+  mockutil.mockutil_cleanup_variables()
+
+  mockutil.mock_nodemanager_get_node_info(mockutil.nodeid_key, "10.0test", {})
+  mockutil.mock_lockserver_calls()
+  lockserver._perform_lock_request = _mock_perform_lock_request
+  del lock_requests[:]
+
+  node_transition_lib.reset_node_info_fetch_counts()
+
+
+
+
+def _create_node(node_identifier):
+  maindb.create_node(node_identifier, mockutil.node_ip, mockutil.node_port, "10.0test",
+                     False, mockutil.per_node_key_str, mockutil.extra_vessel_name)
+
+
+
+
+def run_guessed_node_matches_test():
+  _create_node(mockutil.nodeid_key_str)
+
+  (nodeID, lockserver_handle, node_info) = node_transition_lib._optimistically_lock_node(
+      mockutil.node_ip, mockutil.node_port)
+
+  assert(nodeID == mockutil.nodeid_key_str)
+  assert(node_info["nodekey"] == mockutil.nodeid_key)
+
+  # The node is still locked.
+  assert(lock_requests == [(lockserver.REQUEST_TYPE_LOCK, [mockutil.nodeid_key_str])])
+  assert(node_transition_lib.get_node_info_fetch_counts()["refetch_avoided"] == 1)
+
+
+
+
+def run_guessed_node_mismatch_test():
+  # The database thinks a different node is at the address.
+  _create_node(other_nodeid_key_str)
+
+  result = node_transition_lib._optimistically_lock_node(mockutil.node_ip, mockutil.node_port)
+
+  assert(result == (None, None, None))
+
+  # The guessed node was locked and then released.
+  assert(lock_requests == [(lockserver.REQUEST_TYPE_LOCK, [other_nodeid_key_str]),
+                           (lockserver.REQUEST_TYPE_UNLOCK, [other_nodeid_key_str])])
+  assert(node_transition_lib.get_node_info_fetch_counts()["refetch_avoided"] == 0)
+
+
+
+
+def run_no_node_at_address_test():
+  result = node_transition_lib._optimistically_lock_node(mockutil.node_ip, mockutil.node_port)
+
+  assert(result == (None, None, None))
+  assert(lock_requests == [])
+
+
+
+
+def run_multiple_nodes_at_address_test():
+  _create_node(mockutil.nodeid_key_str)
+  _create_node(other_nodeid_key_str)
+
+  result = node_transition_lib._optimistically_lock_node(mockutil.node_ip, mockutil.node_port)
+
+  # Nothing is locked as we can't tell which node to guess.
+  assert(result == (None, None, None))
+  assert(lock_requests == [])
+
+
+
+
+def teardown_test():
+
+  # Cleanup the test database.
+  testlib.teardown_test_db()
+
+
+
+
+if __name__ == "__main__":
+  for testfunc in [run_guessed_node_matches_test, run_guessed_node_mismatch_test,
+                   run_no_node_at_address_test, run_multiple_nodes_at_address_test]:
+    setup_test()
+    try:
+      testfunc()
+    finally:
+      teardown_test()
+
+  print "All Tests Passed!"
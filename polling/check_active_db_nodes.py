@@ -88,7 +88,9 @@ def main():
         # quickly offline (e.g. broken nodes in development), but having one be
         # online for an extended period of time is a stronger signal of
         # potentially unknown bugs in the seattlegeni or seattle code.
-        active_nodes = maindb.get_active_nodes_include_broken()
+        # In readonly mode nothing is changed based on the nodes, so they can
+        # come from the read replica.
+        active_nodes = maindb.get_active_nodes_include_broken(allow_stale=READONLY)
         log.info("Starting check of " + str(len(active_nodes)) + " active nodes.")
       
         checked_node_count = 0
@@ -113,9 +115,15 @@ def main():
         for actionname in actionstaken:
           log.info("\t" + actionname + ": " + str(len(actionstaken[actionname])) + 
                    " " + str(actionstaken[actionname]))
-    
+
         nodestatus.reset_collected_data()
-        
+
+        # The counts of available vessels per subnet and port are maintained
+        # as vessels and nodes change, but this corrects any drift.
+        if not READONLY:
+          wrongcount = maindb.reconcile_available_vessel_counts()
+          log.info("Available vessel count records corrected: " + str(wrongcount))
+
         log.info("Sleeping for " + str(SLEEP_SECONDS_BETWEEN_RUNS) + " seconds.")
         time.sleep(SLEEP_SECONDS_BETWEEN_RUNS)
   
@@ -21,6 +21,8 @@ All of the usages print out something like this, just one single line:
 2009-10-29 14:30,472,3
 
 The above is a date (2009-10-29 14:30), followed by two numbers (472 and 3).
+
+The data is read from the read replica of the database if one is configured.
 """
 
 from seattlegeni.website.control.models import Node
@@ -80,18 +82,18 @@ def get_node_overview_line():
 
 
 def _active_node_count():
-  return len(maindb.get_active_nodes())
+  return len(maindb.get_active_nodes(allow_stale=True))
 
 
 def _active_broken_node_count():
-  return len(maindb.get_active_nodes_include_broken()) - len(maindb.get_active_nodes())
+  return len(maindb.get_active_nodes_include_broken(allow_stale=True)) - len(maindb.get_active_nodes(allow_stale=True))
 
 
 def _active_old_version_node_count():
   currentversion = sys.argv[2]
   queryset = Node.objects.filter(is_active=True, is_broken=False)
   queryset = queryset.exclude(last_known_version=currentversion)
-  return queryset.count()
+  return maindb.get_queryset_for_reading(queryset).count()
 
 
 
@@ -108,13 +110,13 @@ def get_node_type_line():
 def _active_non_nat_node_count():
   queryset = Node.objects.filter(is_active=True, is_broken=False)
   queryset = queryset.exclude(last_known_ip__startswith=maindb.NAT_STRING_PREFIX)
-  return queryset.count()
+  return maindb.get_queryset_for_reading(queryset).count()
 
 
 def _active_nat_node_count():
   queryset = Node.objects.filter(is_active=True, is_broken=False)
   queryset = queryset.filter(last_known_ip__startswith=maindb.NAT_STRING_PREFIX)
-  return queryset.count()
+  return maindb.get_queryset_for_reading(queryset).count()
 
 
 
@@ -132,17 +134,17 @@ def get_vessels_line():
 def _free_vessels():
   queryset = Vessel.objects.filter(acquired_by_user=None)
   queryset = queryset.filter(node__is_active=True, node__is_broken=False)
-  return queryset.count()
+  return maindb.get_queryset_for_reading(queryset).count()
 
 
 def _acquired_vessels():
   queryset = Vessel.objects.exclude(acquired_by_user=None)
   queryset = queryset.exclude(date_expires__lte=datetime.datetime.now())
-  return queryset.count()
+  return maindb.get_queryset_for_reading(queryset).count()
 
 
 def _dirty_vessels():
-  return len(maindb.get_vessels_needing_cleanup())
+  return len(maindb.get_vessels_needing_cleanup(allow_stale=True))
 
 
 
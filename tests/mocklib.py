@@ -36,7 +36,7 @@ from seattlegeni.common.exceptions import *
 
 _mock_nodemanager_get_node_info_args = None
 
-def _mock_get_node_info(ip, port):
+def _mock_get_node_info(ip, port, allow_cached=False):
   
   (nodeid_key, version, vessels_dict) = _mock_nodemanager_get_node_info_args
   nodeinfo = {"version" : version,
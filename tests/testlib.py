@@ -45,6 +45,29 @@ settings.TEST_DATABASE_NAME = test_db_filename
 #      be an issue with python 2.5's sqlite.
 settings.DATABASE_OPTIONS = {'timeout':30}
 
+# Tests always use only the single test database, even if a read replica is
+# configured in settings.py.
+settings.MAINDB_READ_REPLICA = None
+if getattr(settings, 'DATABASES', None):
+  settings.DATABASES = {}
+  settings.DATABASE_ROUTERS = []
+
+# Tests make many requests in quick succession. The tests of rate limiting
+# turn it back on.
+settings.RATE_LIMIT_VESSEL_OPERATIONS = False
+
+# Don't contact the installer builder when test users are registered.
+settings.PREBUILD_INSTALLERS = False
+
+# The tests run in a single process, so the local memory cache is shared by
+# everything that uses it.
+settings.CACHE_IS_SHARED = True
+
+# Things that are only done with a secret key (such as caching password
+# authentications) are tested even if settings.py doesn't have one.
+if not settings.SECRET_KEY:
+  settings.SECRET_KEY = 'seattlegeni test secret key'
+
 # Remove the CSRF middleware as our tests don't try to send csrf tokens. We're
 # not the only ones who ignore this for testing:
 # http://code.djangoproject.com/ticket/11692
@@ -53,6 +76,7 @@ new_middleware_classes.remove('django.contrib.csrf.middleware.CsrfViewMiddleware
 new_middleware_classes.remove('django.contrib.csrf.middleware.CsrfResponseMiddleware')
 settings.MIDDLEWARE_CLASSES = tuple(new_middleware_classes)
 
+import django.core.cache
 import django.db
 
 import django.test.utils
@@ -95,6 +119,16 @@ def setup_test_db():
   
   # Creates a new test database and runs syncdb against it.
   django.db.connection.creation.create_test_db()
+  
+  # Don't let data cached from a previous test database be used. This is
+  # imported here because the settings need to be changed before maindb is
+  # imported.
+  from seattlegeni.common.api import maindb
+  maindb.reset_available_vessel_index()
+  
+  # The same goes for the django cache, as the ids of users and other records
+  # start over with each test database.
+  django.core.cache.cache.clear()
 
 
 
@@ -0,0 +1,221 @@
+"""
+<Program Name>
+  acquisitionjobs.py
+
+<Purpose>
+  Runs acquisition jobs (see interface.submit_acquire_vessels_job()) in a pool
+  of background threads of the website process the job was submitted to, so
+  that large vessel acquisitions don't keep the submitting request waiting.
+
+  The state and result of each job is kept in the database by maindb so that
+  any website process can report on it. A heartbeat thread regularly records
+  that the jobs of this process are still alive. If the process goes away,
+  the heartbeats stop and maindb.get_acquisition_job() marks its unfinished
+  jobs as failed.
+"""
+
+import Queue
+import random
+import threading
+import time
+import traceback
+
+import django.db
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.common.api import maindb
+
+from seattlegeni.common.util import log
+
+
+
+
+
+# The number of threads in each website process that run acquisition jobs.
+# Jobs submitted while all of them are busy wait in the queue.
+WORKER_THREAD_COUNT = 4
+
+# The exceptions that an acquisition can fail with that are the user's concern
+# rather than a problem with seattlegeni.
+EXPECTED_ERRORS = (UnableToAcquireResourcesError, InsufficientUserResourcesError,
+                   TooManyRequestsError)
+
+# The acquisition of a job is refused (with a TooManyRequestsError) if too many
+# backend operations are in progress. It is then tried again after waiting
+# this many seconds, doubled after each refusal up to the maximum, with some
+# randomness so that refused jobs don't all try again at once. The job fails
+# once it has waited for ADMISSION_RETRY_MAX_TOTAL_SECONDS.
+ADMISSION_RETRY_INITIAL_SECONDS = 1.0
+ADMISSION_RETRY_MAX_SECONDS = 16.0
+ADMISSION_RETRY_MAX_TOTAL_SECONDS = 300.0
+
+# How often the heartbeat thread records that the jobs of this process are
+# alive. This must be well below maindb.ACQUISITION_JOB_HEARTBEAT_TIMEOUT_SECONDS.
+HEARTBEAT_INTERVAL_SECONDS = 30
+
+# Tuples of (job, acquirefunc) waiting to be run.
+job_queue = Queue.Queue()
+
+# The ids of the jobs that are queued or running in this process. Access must
+# be done while holding active_job_id_set_lock.
+active_job_id_set = set()
+active_job_id_set_lock = threading.Lock()
+
+# The worker threads and the heartbeat thread that have been started. Access
+# must be done while holding worker_thread_list_lock.
+worker_thread_list = []
+heartbeat_thread_list = []
+worker_thread_list_lock = threading.Lock()
+
+
+
+
+
+def run_job_in_background(job, acquirefunc):
+  """
+  <Purpose>
+    Have a pending acquisition job run by one of the worker threads.
+  <Arguments>
+    job
+      The AcquisitionJob object of the job.
+    acquirefunc
+      The function that does the acquisition. It is called with the user, the
+      vessel count, and the vessel type of the job and returns the list of
+      acquired vessels. It must not apply the user's rate limit, as a
+      TooManyRequestsError is taken to mean that the backend is busy and the
+      acquisition is tried again later.
+  <Exceptions>
+    None
+  <Side Effects>
+    The worker threads have been started if they weren't already.
+  <Returns>
+    None
+  """
+  active_job_id_set_lock.acquire()
+  try:
+    active_job_id_set.add(job.id)
+  finally:
+    active_job_id_set_lock.release()
+  
+  _start_worker_threads()
+  job_queue.put((job, acquirefunc))
+
+
+
+
+
+def _start_worker_threads():
+  """Starts the worker threads if they haven't been started yet."""
+  worker_thread_list_lock.acquire()
+  try:
+    while len(worker_thread_list) < WORKER_THREAD_COUNT:
+      workerthread = threading.Thread(target=_worker)
+      # Don't keep the process from exiting. Jobs that were queued or running
+      # will be marked as failed once their heartbeats stop.
+      workerthread.setDaemon(True)
+      workerthread.start()
+      worker_thread_list.append(workerthread)
+    
+    if not heartbeat_thread_list:
+      heartbeatthread = threading.Thread(target=_heartbeat)
+      heartbeatthread.setDaemon(True)
+      heartbeatthread.start()
+      heartbeat_thread_list.append(heartbeatthread)
+  finally:
+    worker_thread_list_lock.release()
+
+
+
+
+
+def _worker():
+  """The function run by each worker thread."""
+  while True:
+    (job, acquirefunc) = job_queue.get()
+    try:
+      _run_job(job, acquirefunc)
+    except:
+      log.critical("Unexpected error running " + str(job) + ": " + traceback.format_exc())
+
+    active_job_id_set_lock.acquire()
+    try:
+      active_job_id_set.discard(job.id)
+    finally:
+      active_job_id_set_lock.release()
+
+    # Each thread has its own database connection. Don't keep it open while
+    # waiting for the next job.
+    django.db.connection.close()
+
+
+
+
+
+def _heartbeat():
+  """The function run by the heartbeat thread."""
+  while True:
+    time.sleep(HEARTBEAT_INTERVAL_SECONDS)
+
+    active_job_id_set_lock.acquire()
+    try:
+      job_id_list = list(active_job_id_set)
+    finally:
+      active_job_id_set_lock.release()
+
+    try:
+      maindb.record_acquisition_job_heartbeats(job_id_list)
+    except:
+      log.critical("Unable to record acquisition job heartbeats: " + traceback.format_exc())
+
+    django.db.connection.close()
+
+
+
+
+
+def _run_job(job, acquirefunc):
+  """Runs a single job, recording its result in the database."""
+  if not maindb.start_acquisition_job(job):
+    log.info("Not running " + str(job) + " because it is no longer pending.")
+    return
+
+  try:
+    geniuser = maindb.get_user(job.user.username)
+    vessel_list = _acquire_when_admitted(job, geniuser, acquirefunc)
+
+  except EXPECTED_ERRORS, e:
+    maindb.finish_acquisition_job(job, error=e)
+
+  except Exception, e:
+    log.critical("Acquisition failed for " + str(job) + ": " + traceback.format_exc())
+    maindb.finish_acquisition_job(job, error=InternalError("Internal error while acquiring vessels."))
+
+  else:
+    maindb.finish_acquisition_job(job, vessel_list=vessel_list)
+
+
+
+
+
+def _acquire_when_admitted(job, geniuser, acquirefunc):
+  """
+  Calls acquirefunc for the job, trying again with backoff for as long as the
+  acquisition is refused because the backend is busy.
+  """
+  delay = ADMISSION_RETRY_INITIAL_SECONDS
+  waited = 0.0
+
+  while True:
+    try:
+      return acquirefunc(geniuser, job.vesselcount, job.vesseltype)
+    except TooManyRequestsError:
+      if waited >= ADMISSION_RETRY_MAX_TOTAL_SECONDS:
+        raise
+      sleepseconds = delay * random.uniform(0.5, 1.0)
+      log.info("Acquisition for " + str(job) + " refused as the backend is busy. " +
+               "Trying again in %.1f seconds." % sleepseconds)
+
+    time.sleep(sleepseconds)
+    waited += sleepseconds
+    delay = min(delay * 2, ADMISSION_RETRY_MAX_SECONDS)
@@ -0,0 +1,42 @@
+"""
+<Program Name>
+  dbrouters.py
+
+<Purpose>
+  Provides the django database router used when a read replica of the
+  database is configured (see MAINDB_READ_REPLICA in settings.py).
+
+  Reads only go to the replica when maindb is explicitly asked to use it for
+  a query. Objects retrieved that way remember which database they came from,
+  and by default django would also save them to that database. This router
+  makes sure all writes go to the primary database regardless.
+
+  This module must not import maindb or the models, as django loads it while
+  setting up its database connections.
+"""
+
+
+
+
+
+class PrimaryWriteRouter(object):
+
+  def db_for_read(self, model, **hints):
+    # No preference: use the database the query or related object asked for.
+    return None
+
+
+
+  def db_for_write(self, model, **hints):
+    return 'default'
+
+
+
+  def allow_relation(self, obj1, obj2, **hints):
+    # The replica has the same data as the primary.
+    return True
+
+
+
+  def allow_syncdb(self, db, model):
+    return db == 'default'
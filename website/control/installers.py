@@ -0,0 +1,363 @@
+"""
+<Program Name>
+  installers.py
+
+<Purpose>
+  Gets the URLs of the installers that donate resources to a user from the
+  Custom Installer Builder (see settings.SEATTLECLEARINGHOUSE_INSTALLER_BUILDER_XMLRPC)
+  and remembers them, so that the builder is asked at most once per user
+  rather than on every download.
+
+  A build depends only on the user's donor key, the key of the state that new
+  donations are put in, and the builder (its url and
+  settings.SEATTLECLEARINGHOUSE_INSTALLER_BUILDER_VERSION, which should be
+  changed whenever the builder or its base installers are updated). The URLs
+  are kept in the django cache under a key made of these, so all website
+  processes that share the cache share the builds.
+
+  Installers can be built in a background thread of the website process
+  (e.g. when a user registers) so that they are usually ready before the
+  user asks for them.
+"""
+
+import Queue
+import hashlib
+import os
+import threading
+import traceback
+import xmlrpclib
+
+import django.core.cache
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.common.util import log
+
+from seattlegeni.website import settings
+
+from seattle.repyportability import *
+add_dy_support(locals())
+
+dy_import_module_symbols("rsa.r2py")
+
+
+
+
+
+# The platforms the builder makes installers for.
+PLATFORMS = ["android", "windows", "linux", "mac"]
+
+# How long the URLs of a build are kept in the cache. The builder keeps the
+# files for longer than this.
+INSTALLER_URLS_CACHE_SECONDS = 7 * 24 * 3600
+
+# The longest to wait for the builder to accept a connection or to send any
+# part of its response.
+INSTALLER_BUILDER_TIMEOUT_SECONDS = 60
+
+# The longest a request for installers waits for a build of the same
+# installers by another thread of the same process to finish. If it doesn't
+# finish in time (or fails), the request fails rather than asking the builder
+# again.
+MAX_WAIT_FOR_BUILD_IN_PROGRESS_SECONDS = 60
+
+# The most users whose installers can be waiting to be built in the
+# background. Users beyond that have theirs built when they ask for them.
+MAX_PREBUILD_QUEUE_SIZE = 1000
+
+# The vessels of the installers: the user (the owner of the installer's
+# vessel, as the donor) gets 80% of the node's resources and the state key
+# (the vessel's user) lets the clearinghouse find the new donation.
+INSTALLER_VESSEL_LIST = [{'percentage': 80, 'owner': 'owner', 'users': ['user']}]
+
+# The key used as the state key for new donations. See
+# _get_acceptdonations_state_pubkey().
+acceptdonations_state_pubkey = None
+
+# A dict of the cache keys of builds being done by threads of this process to
+# threading.Event objects that are set when the build is finished. Access
+# must be done while holding builds_in_progress_lock.
+builds_in_progress = {}
+builds_in_progress_lock = threading.Lock()
+
+# Tuples of (donor key, cache key) of the installers to be built in the
+# background.
+prebuild_queue = Queue.Queue(MAX_PREBUILD_QUEUE_SIZE)
+
+# The cache keys of the installers in prebuild_queue, so that each is only
+# queued once. Access must be done while holding prebuild_thread_lock.
+prebuild_queued_cache_keys = set()
+
+# The background thread that builds installers, once started. Access must be
+# done while holding prebuild_thread_lock.
+prebuild_thread = None
+prebuild_thread_lock = threading.Lock()
+
+
+
+
+
+def _get_acceptdonations_state_pubkey():
+  """
+  Returns the key used as the state key for new donations as a string. The
+  key file is only read the first time.
+  """
+  global acceptdonations_state_pubkey
+  if acceptdonations_state_pubkey is None:
+    fullpath = os.path.join(settings.SEATTLECLEARINGHOUSE_STATE_KEYS_DIR, "acceptdonation.publickey")
+    acceptdonations_state_pubkey = rsa_publickey_to_string(rsa_file_to_publickey(fullpath))
+  return acceptdonations_state_pubkey
+
+
+
+
+
+def _get_installer_urls_cache_key(donor_pubkey):
+  """Returns the cache key of the installer URLs of a donor key."""
+  buildinputs = "\n".join([donor_pubkey, _get_acceptdonations_state_pubkey(),
+                           settings.SEATTLECLEARINGHOUSE_INSTALLER_BUILDER_XMLRPC,
+                           settings.SEATTLECLEARINGHOUSE_INSTALLER_BUILDER_VERSION])
+  if isinstance(buildinputs, unicode):
+    buildinputs = buildinputs.encode("utf-8")
+  return "installer_urls_" + hashlib.sha1(buildinputs).hexdigest()
+
+
+
+
+
+def get_cached_installer_urls(donor_pubkey):
+  """
+  <Purpose>
+    Get the URLs of the installers for a donor key if they have been built
+    already.
+  <Arguments>
+    donor_pubkey
+      The donor key of the user the installers donate resources to.
+  <Exceptions>
+    None
+  <Side Effects>
+    None
+  <Returns>
+    A dict of platforms to installer URLs, or None if the installers haven't
+    been built (or were built too long ago).
+  """
+  return django.core.cache.cache.get(_get_installer_urls_cache_key(donor_pubkey))
+
+
+
+
+
+def get_installer_urls(donor_pubkey):
+  """
+  <Purpose>
+    Get the URLs of the installers for a donor key, having them built if
+    they haven't been already.
+  <Arguments>
+    donor_pubkey
+      The donor key of the user the installers donate resources to.
+  <Exceptions>
+    InternalError
+      If the installers had to be built and the builder failed.
+  <Side Effects>
+    The installers may have been built and their URLs cached.
+  <Returns>
+    A dict of platforms to installer URLs.
+  """
+  cachekey = _get_installer_urls_cache_key(donor_pubkey)
+
+  urldict = django.core.cache.cache.get(cachekey)
+  if urldict is not None:
+    return urldict
+
+  # If another thread is already building these installers (e.g. the
+  # background thread right after registration, or a request for another
+  # platform), wait for it rather than asking the builder again.
+  builds_in_progress_lock.acquire()
+  try:
+    finishedevent = builds_in_progress.get(cachekey)
+    is_building = finishedevent is None
+    if is_building:
+      finishedevent = threading.Event()
+      builds_in_progress[cachekey] = finishedevent
+  finally:
+    builds_in_progress_lock.release()
+
+  if not is_building:
+    finishedevent.wait(MAX_WAIT_FOR_BUILD_IN_PROGRESS_SECONDS)
+    urldict = django.core.cache.cache.get(cachekey)
+    if urldict is None:
+      # Asking the builder again right after it failed (or while it is still
+      # building) would only add to its load.
+      raise InternalError("Failed to build installers: the build in progress " +
+                          "failed or didn't finish in time.")
+    return urldict
+
+  try:
+    return _build_installers(donor_pubkey, cachekey)
+  finally:
+    builds_in_progress_lock.acquire()
+    try:
+      del builds_in_progress[cachekey]
+    finally:
+      builds_in_progress_lock.release()
+    finishedevent.set()
+
+
+
+
+
+def _build_installers(donor_pubkey, cachekey):
+  """
+  Has the builder build the installers for a donor key, caches their URLs
+  under cachekey, and returns them. Raises an InternalError if the builder
+  fails.
+  """
+  user_data = {
+    'owner': {'public_key': donor_pubkey},
+    'user': {'public_key': _get_acceptdonations_state_pubkey()},
+  }
+
+  try:
+    xmlrpc_proxy = _get_installer_builder_proxy()
+    build_results = xmlrpc_proxy.build_installers(INSTALLER_VESSEL_LIST, user_data)
+    urldict = dict(build_results['installers'])
+  except Exception:
+    raise InternalError("Failed to build installers: " + traceback.format_exc())
+
+  django.core.cache.cache.set(cachekey, urldict, INSTALLER_URLS_CACHE_SECONDS)
+
+  return urldict
+
+
+
+
+
+def _get_installer_builder_proxy():
+  """
+  Returns an xmlrpclib proxy of the builder whose requests time out after
+  INSTALLER_BUILDER_TIMEOUT_SECONDS.
+  """
+  url = settings.SEATTLECLEARINGHOUSE_INSTALLER_BUILDER_XMLRPC
+  if url.startswith("https:"):
+    transport = _TimeoutSafeTransport()
+  else:
+    transport = _TimeoutTransport()
+  return xmlrpclib.ServerProxy(url, transport=transport)
+
+
+
+
+
+def _set_connection_timeout(connection):
+  """Sets the timeout of a connection made by an xmlrpclib transport."""
+  # Before python 2.7, xmlrpclib's transports return the old httplib.HTTP
+  # and HTTPS classes, which wrap the connection.
+  connection = getattr(connection, "_conn", connection)
+  connection.timeout = INSTALLER_BUILDER_TIMEOUT_SECONDS
+
+
+
+
+
+class _TimeoutTransport(xmlrpclib.Transport):
+  """An xmlrpclib transport for http whose connections time out."""
+
+  def make_connection(self, host):
+    connection = xmlrpclib.Transport.make_connection(self, host)
+    _set_connection_timeout(connection)
+    return connection
+
+
+
+
+
+class _TimeoutSafeTransport(xmlrpclib.SafeTransport):
+  """An xmlrpclib transport for https whose connections time out."""
+
+  def make_connection(self, host):
+    connection = xmlrpclib.SafeTransport.make_connection(self, host)
+    _set_connection_timeout(connection)
+    return connection
+
+
+
+
+
+def prebuild_installers_in_background(donor_pubkey):
+  """
+  <Purpose>
+    Have the installers for a donor key built by a background thread, unless
+    they have been built already, so that they are ready when the user asks
+    for them.
+  <Arguments>
+    donor_pubkey
+      The donor key of the user the installers donate resources to.
+  <Exceptions>
+    None
+  <Side Effects>
+    The background thread has been started if it wasn't already.
+  <Returns>
+    None
+  """
+  if not settings.PREBUILD_INSTALLERS:
+    return
+
+  cachekey = _get_installer_urls_cache_key(donor_pubkey)
+  if django.core.cache.cache.get(cachekey) is not None:
+    return
+
+  _start_prebuild_thread()
+
+  prebuild_thread_lock.acquire()
+  try:
+    if cachekey in prebuild_queued_cache_keys:
+      return
+    try:
+      prebuild_queue.put_nowait((donor_pubkey, cachekey))
+    except Queue.Full:
+      log.error("Not prebuilding installers as too many are waiting to be built.")
+      return
+    prebuild_queued_cache_keys.add(cachekey)
+  finally:
+    prebuild_thread_lock.release()
+
+
+
+
+
+def _start_prebuild_thread():
+  """Starts the background thread if it hasn't been started yet."""
+  global prebuild_thread
+  prebuild_thread_lock.acquire()
+  try:
+    if prebuild_thread is None:
+      prebuild_thread = threading.Thread(target=_prebuild_worker)
+      # Don't keep the process from exiting. Anything not built yet is built
+      # when the user asks for it.
+      prebuild_thread.setDaemon(True)
+      prebuild_thread.start()
+  finally:
+    prebuild_thread_lock.release()
+
+
+
+
+
+def _prebuild_worker():
+  """The function run by the background thread."""
+  while True:
+    (donor_pubkey, cachekey) = prebuild_queue.get()
+
+    prebuild_thread_lock.acquire()
+    try:
+      prebuild_queued_cache_keys.discard(cachekey)
+    finally:
+      prebuild_thread_lock.release()
+
+    try:
+      get_installer_urls(donor_pubkey)
+    except InternalError:
+      # The installers will be built when the user asks for them instead.
+      log.error("Failed to prebuild installers: " + traceback.format_exc())
+    except:
+      log.critical("Unexpected error prebuilding installers: " + traceback.format_exc())
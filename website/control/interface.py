@@ -40,6 +40,7 @@
 
 import traceback
 import datetime
+import time
 
 import django.contrib.auth
 
@@ -61,12 +62,43 @@ from seattlegeni.common.util.decorators import log_function_call_and_only_first_
 from seattlegeni.common.util.decorators import log_function_call_without_arguments
 from seattlegeni.common.util.decorators import log_function_call_without_return
 
+from seattlegeni.website.control import acquisitionjobs
+from seattlegeni.website.control import installers
+from seattlegeni.website.control import ratelimit
 from seattlegeni.website.control import vessels
 
 
 
 
 
+# The most acquisition jobs (see submit_acquire_vessels_job()) a user can have
+# pending or running at once.
+MAX_UNFINISHED_ACQUISITION_JOBS_PER_USER = 2
+
+# The longest get_acquire_vessels_job_result() will wait for a job to finish.
+MAX_ACQUISITION_JOB_WAIT_SECONDS = 30
+
+# How often get_acquire_vessels_job_result() checks whether the job it is
+# waiting for has finished. The job may be run by a different process, so
+# this is done by checking the database.
+ACQUISITION_JOB_POLL_INTERVAL_SECONDS = 0.5
+
+# The exceptions a failed acquisition job can be reported with. Any other
+# failure is reported as an InternalError.
+ACQUISITION_JOB_ERRORS = {
+  "UnableToAcquireResourcesError" : UnableToAcquireResourcesError,
+  "InsufficientUserResourcesError" : InsufficientUserResourcesError,
+  "TooManyRequestsError" : TooManyRequestsError,
+}
+
+# The keys of the dictionaries returned by get_vessel_infodict_list().
+VESSEL_INFODICT_FIELDS = ["node_id", "node_ip", "node_port", "vessel_id", "handle",
+                          "is_active", "expires_in_seconds"]
+
+
+
+
+
 @log_function_call_and_only_first_argument
 def register_user(username, password, email, affiliation, pubkey=None):
   """
@@ -90,6 +122,7 @@ def register_user(username, password, email, affiliation, pubkey=None):
     The user record in the django db is created as well as a user record in the
     corresponding user profile table that stores our custom information. A port
     will be assigned to the user and the user's donation keys will be set.
+    The user's installers may be being built in the background.
   <Returns>
     GeniUser instance (our GeniUser model, not the django User) corresponding to the
     newly registered user.
@@ -140,6 +173,9 @@ def register_user(username, password, email, affiliation, pubkey=None):
     # Unlock the user.
     lockserver.unlock_user(lockserver_handle, username)
     lockserver.destroy_lockserver_handle(lockserver_handle)
+  
+  # Have the user's installers ready by the time they want to download one.
+  installers.prebuild_installers_in_background(geniuser.donor_pubkey)
     
   return geniuser
   
@@ -195,6 +231,39 @@ def get_user_for_installers(username):
 
 
 
+def get_installer_url(geniuser, platform):
+  """
+  <Purpose>
+    Gets the URL of an installer that donates resources to a user. The
+    installers are only built the first time they are asked for (or in the
+    background after the user registers).
+  <Arguments>
+    geniuser
+      The GeniUser the installer donates resources to.
+    platform
+      The platform of the installer, one of installers.PLATFORMS.
+  <Exceptions>
+    InternalError
+      If the installers had to be built and the installer builder failed.
+  <Side Effects>
+    The user's installers may have been built.
+  <Returns>
+    The URL the installer can be downloaded from.
+  """
+  assert_geniuser(geniuser)
+  assert(platform in installers.PLATFORMS)
+  
+  urldict = installers.get_installer_urls(geniuser.donor_pubkey)
+  
+  if platform not in urldict:
+    raise InternalError("The installer builder didn't build a " + platform + " installer.")
+  
+  return urldict[platform]
+
+
+
+
+
 @log_function_call
 def get_user_without_password(username):
   """
@@ -777,6 +846,30 @@ def get_donations(geniuser):
 
 
 
+@log_function_call
+def get_donation_count(geniuser):
+  """
+  <Purpose>
+    Gets the number of donations made by a specific user.
+  <Arguments>
+    geniuser
+      The GeniUser object who is the donor of the donations.
+  <Exceptions>
+    None
+  <Side Effects>
+    None
+  <Returns>
+    The number of donations made by geniuser.
+  """
+  assert_geniuser(geniuser)
+  
+  # This is read-only, so not locking the user.
+  return maindb.get_donation_count_by_user(geniuser)
+
+
+
+
+
 @log_function_call
 def get_acquired_vessels(geniuser):
   """
@@ -802,12 +895,66 @@ def get_acquired_vessels(geniuser):
 
 
 
+@log_function_call
+def get_acquired_vessels_page(geniuser, after_vessel_id, page_size):
+  """
+  <Purpose>
+    Gets part of the list of vessels that have been acquired by the user,
+    ordered by vessel id.
+  <Arguments>
+    geniuser
+      A GeniUser object of the user who is assigned to the vessels.
+    after_vessel_id
+      Only vessels with a greater id are included. Use 0 for the first page
+      and the id of the last vessel of a page for the page after it.
+    page_size
+      The most vessels to include.
+  <Exceptions>
+    None
+  <Side Effects>
+    None
+  <Returns>
+    A list of at most page_size Vessel objects.
+  """
+  assert_geniuser(geniuser)
+  
+  # This is read-only, so not locking the user.
+  return maindb.get_acquired_vessels_page(geniuser, after_vessel_id, page_size)
+
+
+
+
+
+@log_function_call
+def get_acquired_vessel_count(geniuser):
+  """
+  <Purpose>
+    Gets the number of vessels that have been acquired by the user.
+  <Arguments>
+    user
+      A GeniUser object of the user who is assigned to the vessels.
+  <Exceptions>
+    None
+  <Side Effects>
+    None
+  <Returns>
+    The number of vessels that have been acquired by the user.
+  """
+  assert_geniuser(geniuser)
+  
+  # This is read-only, so not locking the user.
+  return maindb.get_acquired_vessel_count(geniuser)
+
+
+
+
+
 # @log_action is a decorator that records details of vessel-affecting
 # operations in the database. This decorator should be kept in mind whenever
 # the arguments or return value to this function are changed.
 @log_action
 @log_function_call
-def acquire_vessels(geniuser, vesselcount, vesseltype):
+def acquire_vessels(geniuser, vesselcount, vesseltype, check_rate_limit=True):
   """
   <Purpose>
     Acquire unused vessels of a given type for a user. For information on how
@@ -821,6 +968,10 @@ def acquire_vessels(geniuser, vesselcount, vesseltype):
       The number of vessels to acquire (a positive integer).
     vesseltype
       The type of vessels to acquire. One of either 'lan', 'wan', 'nat', or 'rand'.
+    check_rate_limit
+      (optional) Whether to take a token from the user's rate limit for
+      acquiring vessels. This is False when the token was already taken, e.g.
+      by submit_acquire_vessels_job(). Default is True.
   <Exceptions>
     UnableToAcquireResourcesError
       If not able to acquire the requested vessels (in this case, no vessels
@@ -828,6 +979,9 @@ def acquire_vessels(geniuser, vesselcount, vesseltype):
     InsufficientUserResourcesError
       The user does not have enough vessel credits to acquire the number of
       vessels requested.
+    TooManyRequestsError
+      If the user has acquired vessels too many times recently or too many
+      requests that use the backend are being processed.
   <Side Effects>
     A total of 'vesselcount' previously-unassigned vessels of the specified
     vesseltype have been acquired by the user.
@@ -838,40 +992,191 @@ def acquire_vessels(geniuser, vesselcount, vesseltype):
   assert_positive_int(vesselcount)
   assert_str(vesseltype)
 
-  # Lock the user.
-  lockserver_handle = lockserver.create_lockserver_handle()
-  lockserver.lock_user(lockserver_handle, geniuser.username)
-  
+  if check_rate_limit:
+    ratelimit.require_user_within_rate_limit(geniuser, "acquire")
+
+  # Refuse the request before waiting for any locks if too many requests that
+  # use the backend are already being processed.
+  ratelimit.start_backend_operation()
   try:
-    # Make sure the user still exists now that we hold the lock. Also makes
-    # sure that we see any changes made to the user before we obtained the lock.
-    try:
-      geniuser = maindb.get_user(geniuser.username)
-    except DoesNotExistError:
-      raise InternalError(traceback.format_exc())
-    
-    # Ensure the user is allowed to acquire these resources. This call will
-    # raise an InsufficientUserResourcesError if the additional vessels would
-    # cause the user to be over their limit.
-    maindb.require_user_can_acquire_resources(geniuser, vesselcount)
-    
-    if vesseltype == 'wan':
-      acquired_list = vessels.acquire_wan_vessels(lockserver_handle, geniuser, vesselcount)
-    elif vesseltype == 'lan':
-      acquired_list = vessels.acquire_lan_vessels(lockserver_handle, geniuser, vesselcount)
-    elif vesseltype == 'nat':
-      acquired_list = vessels.acquire_nat_vessels(lockserver_handle, geniuser, vesselcount)
-    elif vesseltype == 'rand':
-      acquired_list = vessels.acquire_rand_vessels(lockserver_handle, geniuser, vesselcount)
-    else:
-      raise ProgrammerError("Vessel type '%s' is not a valid type" % vesseltype)
-    
-    return acquired_list
+    # Lock the user.
+    lockserver_handle = lockserver.create_lockserver_handle()
+    lockserver.lock_user(lockserver_handle, geniuser.username)
     
+    try:
+      # Make sure the user still exists now that we hold the lock. Also makes
+      # sure that we see any changes made to the user before we obtained the lock.
+      try:
+        geniuser = maindb.get_user(geniuser.username)
+      except DoesNotExistError:
+        raise InternalError(traceback.format_exc())
+      
+      # Ensure the user is allowed to acquire these resources. This call will
+      # raise an InsufficientUserResourcesError if the additional vessels would
+      # cause the user to be over their limit.
+      maindb.require_user_can_acquire_resources(geniuser, vesselcount)
+      
+      if vesseltype == 'wan':
+        acquired_list = vessels.acquire_wan_vessels(lockserver_handle, geniuser, vesselcount)
+      elif vesseltype == 'lan':
+        acquired_list = vessels.acquire_lan_vessels(lockserver_handle, geniuser, vesselcount)
+      elif vesseltype == 'nat':
+        acquired_list = vessels.acquire_nat_vessels(lockserver_handle, geniuser, vesselcount)
+      elif vesseltype == 'rand':
+        acquired_list = vessels.acquire_rand_vessels(lockserver_handle, geniuser, vesselcount)
+      else:
+        raise ProgrammerError("Vessel type '%s' is not a valid type" % vesseltype)
+      
+      return acquired_list
+      
+    finally:
+      # Unlock the user.
+      lockserver.unlock_user(lockserver_handle, geniuser.username)
+      lockserver.destroy_lockserver_handle(lockserver_handle)
+
   finally:
-    # Unlock the user.
-    lockserver.unlock_user(lockserver_handle, geniuser.username)
-    lockserver.destroy_lockserver_handle(lockserver_handle)
+    ratelimit.finish_backend_operation()
+
+
+
+
+
+@log_function_call
+def submit_acquire_vessels_job(geniuser, vesselcount, vesseltype):
+  """
+  <Purpose>
+    Start acquiring vessels for a user in the background. This is the same
+    as acquire_vessels() except that it returns right away. The result is
+    retrieved with get_acquire_vessels_job_result().
+  <Arguments>
+    geniuser
+      The GeniUser which will be assigned the vessels.
+    vesselcount
+      The number of vessels to acquire (a positive integer).
+    vesseltype
+      The type of vessels to acquire. One of either 'lan', 'wan', 'nat', or 'rand'.
+  <Exceptions>
+    InsufficientUserResourcesError
+      The user does not currently have enough vessel credits to acquire the
+      number of vessels requested.
+    InvalidRequestError
+      If the user already has the maximum number of unfinished jobs.
+    TooManyRequestsError
+      If the user has acquired vessels too many times recently.
+  <Side Effects>
+    A job has been created that will acquire the vessels in the background.
+    The job has taken a token from the user's rate limit for acquiring vessels.
+  <Returns>
+    The id of the job.
+  """
+  assert_geniuser(geniuser)
+  assert_positive_int(vesselcount)
+  assert_str(vesseltype)
+  
+  if vesseltype not in ['wan', 'lan', 'nat', 'rand']:
+    raise ProgrammerError("Vessel type '%s' is not a valid type" % vesseltype)
+  
+  # The rate limit applies when the job is submitted rather than when it is
+  # run, so that it is the submitting request that's refused.
+  ratelimit.require_user_within_rate_limit(geniuser, "acquire")
+  
+  # Fail early if the acquisition can't succeed. This is checked again (while
+  # holding the user lock) when the job is run.
+  maindb.require_user_can_acquire_resources(geniuser, vesselcount)
+  
+  # The job is created before the user's unfinished jobs are counted so that
+  # concurrent submissions can't all get in under the limit. Only the jobs
+  # created no later than this one are counted, so the earliest of them are
+  # the ones that are kept.
+  job = maindb.create_acquisition_job(geniuser, vesselcount, vesseltype)
+  
+  unfinishedcount = maindb.get_unfinished_acquisition_job_count(geniuser, max_job_id=job.id)
+  if unfinishedcount > MAX_UNFINISHED_ACQUISITION_JOBS_PER_USER:
+    maindb.delete_acquisition_job(job)
+    raise InvalidRequestError("You already have " + str(MAX_UNFINISHED_ACQUISITION_JOBS_PER_USER) +
+                              " acquisition requests in progress.")
+  
+  acquisitionjobs.run_job_in_background(job, _acquire_vessels_for_job)
+  
+  return job.id
+
+
+
+
+
+def _acquire_vessels_for_job(geniuser, vesselcount, vesseltype):
+  """
+  Acquires the vessels of a job submitted by submit_acquire_vessels_job(),
+  which already took the rate limit token.
+  """
+  return acquire_vessels(geniuser, vesselcount, vesseltype, check_rate_limit=False)
+
+
+
+
+
+@log_function_call
+def get_acquire_vessels_job_result(geniuser, job_id, max_wait_seconds=0):
+  """
+  <Purpose>
+    Get the result of a job started with submit_acquire_vessels_job(),
+    optionally waiting for the job to finish.
+  <Arguments>
+    geniuser
+      The GeniUser who submitted the job.
+    job_id
+      The id of the job.
+    max_wait_seconds
+      The longest to wait for the job to finish if it hasn't yet. This is
+      limited to MAX_ACQUISITION_JOB_WAIT_SECONDS. Default is 0.
+  <Exceptions>
+    DoesNotExistError
+      If the user has no job with the given id.
+    UnableToAcquireResourcesError
+      If the job failed because the vessels couldn't be acquired.
+    InsufficientUserResourcesError
+      If the job failed because the user didn't have enough vessel credits.
+    TooManyRequestsError
+      If the job failed because of rate limiting or admission control.
+    InternalError
+      If the job failed for any other reason.
+  <Side Effects>
+    None
+  <Returns>
+    None if the job hasn't finished. Otherwise, a list of the vessels that were
+    acquired and are still acquired by the user.
+  """
+  assert_geniuser(geniuser)
+  assert_int(job_id)
+  
+  max_wait_seconds = min(max(max_wait_seconds, 0), MAX_ACQUISITION_JOB_WAIT_SECONDS)
+  waituntil = time.time() + max_wait_seconds
+  
+  while True:
+    job = maindb.get_acquisition_job(geniuser, job_id)
+    if job.status in ['done', 'failed']:
+      break
+    if time.time() >= waituntil:
+      return None
+    time.sleep(ACQUISITION_JOB_POLL_INTERVAL_SECONDS)
+  
+  if job.status == 'failed':
+    errorclass = ACQUISITION_JOB_ERRORS.get(job.error_type, InternalError)
+    raise errorclass(job.error_message)
+  
+  if not job.vessel_handles:
+    return []
+  
+  # Vessels can be released (or even deleted along with their node) after the
+  # job finished, so only the ones still acquired by the user are returned.
+  job_vesselhandle_set = set(job.vessel_handles.split("\n"))
+  
+  vessel_list = []
+  for vessel in maindb.get_acquired_vessels(geniuser):
+    if vessel.node.node_identifier + ":" + vessel.name in job_vesselhandle_set:
+      vessel_list.append(vessel)
+  
+  return vessel_list
 
 
 
@@ -897,6 +1202,9 @@ def acquire_specific_vessels(geniuser, vessel_list):
       vessels requested.
     InvalidRequestError
       If the list of vessels is empty.
+    TooManyRequestsError
+      If the user has acquired vessels too many times recently or too many
+      requests that use the backend are being processed.
   <Side Effects>
     Zero or more of the vessels in vessel_list have been acquired by the user.
   <Returns>
@@ -912,29 +1220,38 @@ def acquire_specific_vessels(geniuser, vessel_list):
   if not vessel_list:
     raise InvalidRequestError("The list of vessels cannot be empty.")
 
-  # Lock the user.
-  lockserver_handle = lockserver.create_lockserver_handle()
-  lockserver.lock_user(lockserver_handle, geniuser.username)
-  
+  ratelimit.require_user_within_rate_limit(geniuser, "acquire")
+
+  # Refuse the request before waiting for any locks if too many requests that
+  # use the backend are already being processed.
+  ratelimit.start_backend_operation()
   try:
-    # Make sure the user still exists now that we hold the lock. Also makes
-    # sure that we see any changes made to the user before we obtained the lock.
-    try:
-      geniuser = maindb.get_user(geniuser.username)
-    except DoesNotExistError:
-      raise InternalError(traceback.format_exc())
-    
-    # Ensure the user is allowed to acquire these resources. This call will
-    # raise an InsufficientUserResourcesError if the additional vessels would
-    # cause the user to be over their limit.
-    maindb.require_user_can_acquire_resources(geniuser, len(vessel_list))
-    
-    return vessels.acquire_specific_vessels_best_effort(lockserver_handle, geniuser, vessel_list)
+    # Lock the user.
+    lockserver_handle = lockserver.create_lockserver_handle()
+    lockserver.lock_user(lockserver_handle, geniuser.username)
     
+    try:
+      # Make sure the user still exists now that we hold the lock. Also makes
+      # sure that we see any changes made to the user before we obtained the lock.
+      try:
+        geniuser = maindb.get_user(geniuser.username)
+      except DoesNotExistError:
+        raise InternalError(traceback.format_exc())
+      
+      # Ensure the user is allowed to acquire these resources. This call will
+      # raise an InsufficientUserResourcesError if the additional vessels would
+      # cause the user to be over their limit.
+      maindb.require_user_can_acquire_resources(geniuser, len(vessel_list))
+      
+      return vessels.acquire_specific_vessels_best_effort(lockserver_handle, geniuser, vessel_list)
+      
+    finally:
+      # Unlock the user.
+      lockserver.unlock_user(lockserver_handle, geniuser.username)
+      lockserver.destroy_lockserver_handle(lockserver_handle)
+
   finally:
-    # Unlock the user.
-    lockserver.unlock_user(lockserver_handle, geniuser.username)
-    lockserver.destroy_lockserver_handle(lockserver_handle)
+    ratelimit.finish_backend_operation()
 
 
 
@@ -958,6 +1275,9 @@ def release_vessels(geniuser, vessel_list):
     InvalidRequestError
       If any of the vessels in the vessel_list are not currently acquired by
       geniuser or if the list of vessels is empty.
+    TooManyRequestsError
+      If the user has released vessels too many times recently or too many
+      requests that use the backend are being processed.
   <Side Effects>
     The vessel is no longer assigned to the user. If this was the last user
     assigned to the vessel, the vessel is freed.
@@ -972,24 +1292,33 @@ def release_vessels(geniuser, vessel_list):
   if not vessel_list:
     raise InvalidRequestError("The list of vessels cannot be empty.")
 
-  # Lock the user.
-  lockserver_handle = lockserver.create_lockserver_handle()
-  lockserver.lock_user(lockserver_handle, geniuser.username)
-  
+  ratelimit.require_user_within_rate_limit(geniuser, "release")
+
+  # Refuse the request before waiting for any locks if too many requests that
+  # use the backend are already being processed.
+  ratelimit.start_backend_operation()
   try:
-    # Make sure the user still exists now that we hold the lock. Also makes
-    # sure that we see any changes made to the user before we obtained the lock.
-    try:
-      geniuser = maindb.get_user(geniuser.username)
-    except DoesNotExistError:
-      raise InternalError(traceback.format_exc())
+    # Lock the user.
+    lockserver_handle = lockserver.create_lockserver_handle()
+    lockserver.lock_user(lockserver_handle, geniuser.username)
     
-    vessels.release_vessels(lockserver_handle, geniuser, vessel_list)
+    try:
+      # Make sure the user still exists now that we hold the lock. Also makes
+      # sure that we see any changes made to the user before we obtained the lock.
+      try:
+        geniuser = maindb.get_user(geniuser.username)
+      except DoesNotExistError:
+        raise InternalError(traceback.format_exc())
+      
+      vessels.release_vessels(lockserver_handle, geniuser, vessel_list)
+
+    finally:
+      # Unlock the user.
+      lockserver.unlock_user(lockserver_handle, geniuser.username)
+      lockserver.destroy_lockserver_handle(lockserver_handle)
 
   finally:
-    # Unlock the user.
-    lockserver.unlock_user(lockserver_handle, geniuser.username)
-    lockserver.destroy_lockserver_handle(lockserver_handle)
+    ratelimit.finish_backend_operation()
 
 
 
@@ -1050,6 +1379,8 @@ def renew_vessels(geniuser, vessel_list):
       geniuser or if the list of vessels is empty.
     InsufficientUserResourcesError
       If the user is currently over their limit of acquired resources.
+    TooManyRequestsError
+      If the user has renewed vessels too many times recently.
   <Side Effects>
     The vessels are renewed to the maximum time vessels can be acquired for,
     regardless of their previous individual expiration times.
@@ -1064,34 +1395,30 @@ def renew_vessels(geniuser, vessel_list):
   if not vessel_list:
     raise InvalidRequestError("The list of vessels cannot be empty.")
 
-  # Lock the user.
-  lockserver_handle = lockserver.create_lockserver_handle()
-  lockserver.lock_user(lockserver_handle, geniuser.username)
+  ratelimit.require_user_within_rate_limit(geniuser, "renew")
+
+  # Renewing vessels only changes the database, and maindb only renews the
+  # vessels that are still acquired by the user at the time of the change. So,
+  # unlike acquiring and releasing, neither the user nor the vessels' nodes
+  # need to be locked.
   
+  # Make sure the user still exists. Also makes sure that we see any changes
+  # made to the user since the geniuser object was retrieved.
   try:
-    # Make sure the user still exists now that we hold the lock. Also makes
-    # sure that we see any changes made to the user before we obtained the lock.
-    try:
-      geniuser = maindb.get_user(geniuser.username)
-    except DoesNotExistError:
-      raise InternalError(traceback.format_exc())
-    
-    # Ensure the user is not over their limit of acquired vessels due to
-    # donations of theirs having gone offline. This call will raise an
-    # InsufficientUserResourcesError if the user is currently over their
-    # limit.
-    vesselcount = 0
-    maindb.require_user_can_acquire_resources(geniuser, vesselcount)
-    
-    # The vessels.renew_vessels function is responsible for ensuring that the
-    # vessels belong to this user. We let the other function do the check
-    # because we want to hold locks on the vessels' nodes before checking.
-    vessels.renew_vessels(lockserver_handle, geniuser, vessel_list)
-
-  finally:
-    # Unlock the user.
-    lockserver.unlock_user(lockserver_handle, geniuser.username)
-    lockserver.destroy_lockserver_handle(lockserver_handle)
+    geniuser = maindb.get_user(geniuser.username)
+  except DoesNotExistError:
+    raise InternalError(traceback.format_exc())
+  
+  # Ensure the user is not over their limit of acquired vessels due to
+  # donations of theirs having gone offline. This call will raise an
+  # InsufficientUserResourcesError if the user is currently over their
+  # limit.
+  vesselcount = 0
+  maindb.require_user_can_acquire_resources(geniuser, vesselcount)
+  
+  # The vessels.renew_vessels function is responsible for ensuring that the
+  # vessels belong to this user.
+  vessels.renew_vessels(geniuser, vessel_list)
 
 
 
@@ -1156,25 +1483,25 @@ def get_vessel_list(vesselhandle_list):
   """
   assert_list_of_str(vesselhandle_list)
   
-  vessel_list = []
+  node_identifier_and_vesselname_list = []
   
   for vesselhandle in vesselhandle_list:
     if len((vesselhandle.split(":"))) != 2:
       raise InvalidRequestError("Invalid vesselhandle: " + vesselhandle)
     
     (nodeid, vesselname) = vesselhandle.split(":")
-    # Raises DoesNotExistError if there is no such node/vessel.
-    vessel = maindb.get_vessel(nodeid, vesselname)
-    vessel_list.append(vessel)
-    
-  return vessel_list
+    node_identifier_and_vesselname_list.append((nodeid, vesselname))
+  
+  # Raises DoesNotExistError if there is no such node/vessel. All of the
+  # vessels are looked up together rather than with a query for each.
+  return maindb.get_vessels(node_identifier_and_vesselname_list)
 
 
   
 
 
 # Not logging the function call for now.
-def get_vessel_infodict_list(vessel_list):
+def get_vessel_infodict_list(vessel_list, fields=None):
   """
   <Purpose>
     Convert a list of Vessel objects into a list of vessel infodicts.
@@ -1188,6 +1515,9 @@ def get_vessel_infodict_list(vessel_list):
   <Arguments>
     vessel_list
       A list of Vessel objects.
+    fields
+      (optional) A list of the infodict keys to include, each of which must be
+      in VESSEL_INFODICT_FIELDS. By default, all of them are included.
   <Exceptions>
     None
   <Side Effects>
@@ -1195,13 +1525,27 @@ def get_vessel_infodict_list(vessel_list):
   <Returns>
     A list of vessel infodicts.
   """
+  if fields is None:
+    fields = VESSEL_INFODICT_FIELDS
+  
+  for field in fields:
+    assert(field in VESSEL_INFODICT_FIELDS)
+  
   infodict_list = []
   
+  # Get the node records of all of the vessels at once rather than making a
+  # query for each vessel. Nodes retrieved along with their vessels are used
+  # as they are.
+  nodedict = maindb.get_nodes_of_vessels(vessel_list)
+  
+  now = datetime.datetime.now()
+  
   for vessel in vessel_list:
     vessel_info = {}
     
-    vessel_info["node_id"] = maindb.get_node_identifier_from_vessel(vessel)
-    node = maindb.get_node(vessel_info["node_id"])
+    node = nodedict[vessel.node_id]
+    
+    vessel_info["node_id"] = node.node_identifier
     
     vessel_info["node_ip"] = node.last_known_ip
     vessel_info["node_port"] = node.last_known_port
@@ -1211,9 +1555,14 @@ def get_vessel_infodict_list(vessel_list):
     
     vessel_info["is_active"] = node.is_active
     
-    expires_in_timedelta = vessel.date_expires - datetime.datetime.now()
+    expires_in_timedelta = vessel.date_expires - now
     # The timedelta object stores information in two parts: days and seconds.
     vessel_info["expires_in_seconds"] = (expires_in_timedelta.days * 3600 * 24) + expires_in_timedelta.seconds
+    
+    if len(fields) < len(VESSEL_INFODICT_FIELDS):
+      for key in vessel_info.keys():
+        if key not in fields:
+          del vessel_info[key]
       
     infodict_list.append(vessel_info)
     
@@ -1283,9 +1632,78 @@ def get_available_vessel_credits(geniuser):
   assert_geniuser(geniuser)
   
   max_allowed_vessels = maindb.get_user_total_vessel_credits(geniuser)
-  acquired_vessel_count = len(maindb.get_acquired_vessels(geniuser))
+  acquired_vessel_count = maindb.get_acquired_vessel_count(geniuser)
   
   if acquired_vessel_count >= max_allowed_vessels:
     return 0
   else:
     return max_allowed_vessels - acquired_vessel_count
+
+
+
+
+
+def get_user_summary(geniuser):
+  """
+  <Purpose>
+    Gets what the My Vessels page shows about a user: their vessel credits,
+    number of donations, and acquired vessels. The summary is cached (see
+    maindb.USER_SUMMARY_CACHE_SECONDS) and forgotten by maindb whenever it
+    changes, so usually no queries are needed.
+  <Arguments>
+    geniuser
+      The GeniUser whose summary is wanted.
+  <Exceptions>
+    None
+  <Side Effects>
+    The user's summary may have been added to the cache.
+  <Returns>
+    A dictionary with the keys:
+      'vessels': a list of vessel infodicts of the user's acquired vessels,
+          as get_vessel_infodict_list() returns.
+      'donation_count': the number of donations made by the user.
+      'free_vessel_credits': as get_free_vessel_credits_amount() returns.
+      'total_vessel_credits': as get_total_vessel_credits() returns.
+      'available_vessel_credits': as get_available_vessel_credits() returns.
+  """
+  assert_geniuser(geniuser)
+  
+  (snapshot, generation) = maindb.get_cached_user_summary(geniuser)
+  
+  if snapshot is None:
+    # This is read-only, so not locking the user.
+    vessel_list = maindb.get_acquired_vessels(geniuser)
+    donation_count = maindb.get_donation_count_by_user(geniuser)
+    free_vessel_credits = maindb.get_user_free_vessel_credits(geniuser)
+    
+    # The same as maindb.get_user_total_vessel_credits() but without counting
+    # the donations again.
+    total_vessel_credits = free_vessel_credits + donation_count * maindb.VESSEL_CREDITS_FOR_DONATIONS_MULTIPLIER
+    
+    snapshot = {"time_created" : time.time(),
+                "vessels" : get_vessel_infodict_list(vessel_list),
+                "donation_count" : donation_count,
+                "free_vessel_credits" : free_vessel_credits,
+                "total_vessel_credits" : total_vessel_credits}
+    
+    maindb.cache_user_summary(geniuser, snapshot, generation)
+  
+  # The expiration times in the snapshot were as of when it was created.
+  # Vessels that have expired since then are no longer considered acquired,
+  # the same as maindb.get_acquired_vessels() would do.
+  elapsed_seconds = int(time.time() - snapshot["time_created"])
+  
+  vessel_infodict_list = []
+  for infodict in snapshot["vessels"]:
+    infodict = infodict.copy()
+    infodict["expires_in_seconds"] -= elapsed_seconds
+    if infodict["expires_in_seconds"] > 0:
+      vessel_infodict_list.append(infodict)
+  
+  available_vessel_credits = max(0, snapshot["total_vessel_credits"] - len(vessel_infodict_list))
+  
+  return {"vessels" : vessel_infodict_list,
+          "donation_count" : snapshot["donation_count"],
+          "free_vessel_credits" : snapshot["free_vessel_credits"],
+          "total_vessel_credits" : snapshot["total_vessel_credits"],
+          "available_vessel_credits" : available_vessel_credits}
@@ -22,6 +22,7 @@
 """
 
 import django
+import django.db.models.signals
 
 from django.db import models
 from django.contrib.auth.models import User as DjangoUser
@@ -38,7 +39,13 @@ from seattlegeni.common.util import log
 # Called when new database connections are created (see below).
 def _prepare_newly_created_db_connection(sender, **kwargs):
   from seattlegeni.common.api import maindb
-  maindb.init_maindb()
+  # With django >= 1.2, the connection may be one to the read replica, which
+  # is only opened when the replica is actually used.
+  connection = kwargs.get('connection')
+  if getattr(connection, 'alias', None) == maindb.READ_REPLICA_DATABASE_ALIAS:
+    maindb.init_read_replica_connection(connection)
+  else:
+    maindb.init_maindb()
 
 # If this is a modern-enough version of django to support specifying a function
 # to be called on database connection creation, then have it call init_maindb()
@@ -144,9 +151,24 @@ class Node(models.Model):
   # We index this field with custom sql. See the file sql/node.sql.
   node_identifier = models.CharField("Node identifier", max_length=2048)
 
+  # The hex SHA-1 of the node_identifier. Unlike the node_identifier, this can
+  # be fully indexed and made unique at the database-level, so lookups of
+  # nodes by identifier filter on this field. It is set by maindb.create_node().
+  # Existing databases can add this field with the file
+  # dev/migration/node_identifier_hash.sql.
+  node_identifier_hash = models.CharField("SHA-1 of node identifier", max_length=40, unique=True)
+
   # The IP address the nodemanager was last known to be accessible through.
   last_known_ip = models.CharField("Last known nodemanager IP address or NAT string", max_length=100, db_index=True)
 
+  # The subnet (the first three octets of last_known_ip) the nodemanager was
+  # last known to be on. This is an empty string for nat nodes and nodes with
+  # an invalid last_known_ip. It is set by maindb whenever last_known_ip is so
+  # that subnets don't have to be computed from every node's ip when looking
+  # for lan vessels. Existing databases can add this field with the file
+  # dev/migration/node_subnet.sql.
+  subnet = models.CharField("Subnet", max_length=100, blank=True, db_index=True)
+
   # The port the nodemanager was last known to be accessible through. 
   last_known_port = models.IntegerField("Last known nodemanager port", db_index=True)
 
@@ -200,6 +222,22 @@ class Node(models.Model):
 
 
 
+# Called when a GeniUser record is saved (see below).
+def _forget_cached_auth_of_saved_user(sender, instance, **kwargs):
+  from seattlegeni.common.api import maindb
+  maindb.forget_cached_auth(instance)
+  maindb.forget_cached_user_summary(instance)
+
+# Make sure a cached password or api key authentication is never used after
+# the user has been changed (e.g. deactivated, given new keys, or given a new
+# password), no matter where the change was made from. The same goes for the
+# user's cached summary (e.g. after a change of free vessel credits).
+django.db.models.signals.post_save.connect(_forget_cached_auth_of_saved_user, sender=GeniUser)
+
+
+
+
+
 class Donation(models.Model):
   """
   Defines the Donation model. A Donation record represents the resources a user
@@ -283,6 +321,12 @@ class Vessel(models.Model):
   # False here indicates that the user keys have changed since they were last
   # set on the vessel.
   user_keys_in_sync = models.BooleanField(db_index=True)
+  
+  # Incremented by maindb every time the vessel record is changed, which lets
+  # maindb tell whether a record was changed by someone else since it was
+  # retrieved. Existing databases can add this field with the file
+  # dev/migration/vessel_version.sql.
+  version = models.IntegerField("Version", default=0)
     
   # Have the database keep track of when each record was created and modified.
   date_created = models.DateTimeField("Date added to DB", auto_now_add=True, db_index=True)
@@ -328,6 +372,44 @@ class VesselPort(models.Model):
 
 
 
+class AvailableVesselCount(models.Model):
+  """
+  Defines the AvailableVesselCount model. An AvailableVesselCount record is
+  the number of vessels on a single subnet that are available to be acquired
+  by users who have been assigned a single port. These records are maintained
+  by maindb as vessels and nodes change so that subnets with enough available
+  vessels for a lan request can be found without looking at every node. They
+  are never the authority on whether a vessel is available and can be rebuilt
+  from the other tables with maindb.reconcile_available_vessel_counts().
+  """
+
+  class Meta:
+    # Only one record can have a given subnet and port combination.
+    unique_together = ("subnet", "port")
+
+
+  # The subnet (the first three octets of an ip address) being counted.
+  subnet = models.CharField("Subnet", max_length=100, db_index=True)
+  
+  # The port being counted.
+  port = models.IntegerField("Port", db_index=True)
+  
+  # The number of available vessels on the subnet that have the port. Lookups
+  # by port and count use an index created with custom sql. See the file
+  # sql/availablevesselcount.sql.
+  count = models.IntegerField("Available vessel count")
+
+
+  def __unicode__(self):
+    """
+    Produces a string representation of the AvailableVesselCount instance.
+    """
+    return "AvailableVesselCount:%s:%s:%d" % (self.subnet, self.port, self.count)
+
+
+
+
+
 class VesselUserAccessMap(models.Model):
   """
   Defines the VesselUserAccessMap model. A VesselUserAccessMap record
@@ -360,6 +442,48 @@ class VesselUserAccessMap(models.Model):
 
 
 
+class AcquisitionJob(models.Model):
+  """
+  Defines the AcquisitionJob model. An AcquisitionJob record represents a
+  user's request to acquire vessels that is carried out in the background
+  rather than while the request that submitted it waits.
+  """
+  # The user who the vessels are being acquired for.
+  user = models.ForeignKey(GeniUser, db_index=True)
+  
+  # The number and type ('wan', 'lan', 'nat', or 'rand') of vessels requested.
+  vesselcount = models.IntegerField("Vessel count")
+  vesseltype = models.CharField("Vessel type", max_length=10)
+  
+  # One of 'pending', 'running', 'done', or 'failed'.
+  status = models.CharField("Status", max_length=10, db_index=True)
+  
+  # For done jobs, the handles of the acquired vessels, one per line.
+  vessel_handles = models.TextField("Vessel handles", blank=True)
+  
+  # For failed jobs, the name of the exception class that describes why and
+  # its message.
+  error_type = models.CharField("Error type", max_length=50, blank=True)
+  error_message = models.CharField("Error message", max_length=1024, blank=True)
+  
+  date_created = models.DateTimeField("Date added to DB", auto_now_add=True, db_index=True)
+  date_started = models.DateTimeField("Date started", null=True)
+  date_finished = models.DateTimeField("Date finished", null=True)
+  
+  # Updated regularly by the website process that will run or is running the
+  # job, so that jobs lost along with their process can be recognized.
+  date_heartbeat = models.DateTimeField("Date of last heartbeat", null=True)
+  
+  def __unicode__(self):
+    """
+    Produces a string representation of the AcquisitionJob instance.
+    """
+    return "AcquisitionJob:[%s]:[%s]" % (self.id, self.status)
+
+
+
+
+
 class ActionLogEvent(models.Model):
   """
   Defines the ActionLogEvent model. An ActionLogEvent record represents an
@@ -0,0 +1,216 @@
+"""
+<Program Name>
+  ratelimit.py
+
+<Purpose>
+  Limits how often each user can acquire, release, and renew vessels, and
+  refuses requests that would need the backend when too many backend
+  operations are already in progress (admission control).
+
+  Each user has a token bucket for each kind of operation: a request takes a
+  token and tokens are added back at a fixed rate up to the size of the
+  bucket. This allows short bursts while limiting the sustained rate.
+
+  The buckets and the count of backend operations in progress are kept in the
+  django cache. With a cache shared by all website processes (e.g. memcached),
+  the limits apply across processes. Updates from different processes can
+  race, so the limits are approximate. With the default local memory cache
+  (see settings.CACHE_IS_SHARED), each process enforces the limits separately,
+  so the overall limits are that many times higher.
+
+  Both kinds of refusal raise a TooManyRequestsError, which tells the client
+  to back off and try again later.
+"""
+
+import django.core.cache
+
+import hashlib
+import math
+import threading
+import time
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.common.util import log
+
+from seattlegeni.website import settings
+
+
+
+
+
+# A dict of operations to (bucketsize, seconds per token) tuples. For example,
+# a user can acquire vessels 10 times in a row, and after that once every six
+# seconds.
+RATE_LIMITS = {
+  "acquire" : (10, 6.0),
+  "release" : (20, 3.0),
+  "renew" : (20, 3.0),
+}
+
+# The most backend operations (acquiring or releasing vessels) that can be in
+# progress at once across all website processes that share the cache.
+MAX_CONCURRENT_BACKEND_OPERATIONS = 20
+
+# How long the count of backend operations in progress is kept in the cache.
+# If a website process dies in the middle of an operation, it is never
+# subtracted from the count. Letting the count expire keeps that from
+# permanently reducing how many operations are admitted.
+BACKEND_OPERATION_COUNT_CACHE_SECONDS = 600
+
+BACKEND_OPERATION_COUNT_CACHE_KEY = "ratelimit_backend_operations"
+
+# Serializes the updates of token buckets made by the threads of this process.
+bucket_lock = threading.Lock()
+
+# Serializes the updates of the count of backend operations made by the
+# threads of this process. The local memory cache's incr() and decr() aren't
+# atomic, unlike memcached's.
+backend_operation_count_lock = threading.Lock()
+
+
+
+
+
+def _get_bucket_cache_key(username, operation):
+  """Returns the cache key of a user's token bucket for an operation."""
+  if isinstance(username, unicode):
+    username = username.encode("utf-8")
+  return "ratelimit_" + operation + "_" + hashlib.sha1(username).hexdigest()
+
+
+
+
+
+def require_user_within_rate_limit(geniuser, operation):
+  """
+  <Purpose>
+    Take a token from a user's token bucket for an operation, or refuse the
+    request if there is none.
+  <Arguments>
+    geniuser
+      The GeniUser making the request.
+    operation
+      One of the keys of RATE_LIMITS.
+  <Exceptions>
+    TooManyRequestsError
+      If the user has made too many requests for the operation recently. The
+      message says how long to wait.
+  <Side Effects>
+    If the request is allowed, the user has one less token for the operation.
+  <Returns>
+    None
+  """
+  if not settings.RATE_LIMIT_VESSEL_OPERATIONS:
+    return
+
+  (bucketsize, seconds_per_token) = RATE_LIMITS[operation]
+  cachekey = _get_bucket_cache_key(geniuser.username, operation)
+
+  # After this long without requests, the bucket would be full again, which is
+  # the same as there being no bucket in the cache.
+  cacheseconds = int(math.ceil(bucketsize * seconds_per_token))
+
+  bucket_lock.acquire()
+  try:
+    now = time.time()
+    bucket = django.core.cache.cache.get(cachekey)
+    if bucket is None:
+      tokens = float(bucketsize)
+    else:
+      (tokens, lastupdate) = bucket
+      tokens = min(float(bucketsize), tokens + (now - lastupdate) / seconds_per_token)
+
+    if tokens < 1:
+      django.core.cache.cache.set(cachekey, (tokens, now), cacheseconds)
+      waitseconds = int(math.ceil((1 - tokens) * seconds_per_token))
+      log.info("Refused " + operation + " request of user " + geniuser.username +
+               " because of the rate limit.")
+      raise TooManyRequestsError("You have made too many " + operation +
+                                 " requests recently. Please try again in " +
+                                 str(waitseconds) + " seconds.")
+
+    django.core.cache.cache.set(cachekey, (tokens - 1, now), cacheseconds)
+
+  finally:
+    bucket_lock.release()
+
+
+
+
+
+def start_backend_operation():
+  """
+  <Purpose>
+    Admit an operation that uses the backend, unless too many are in progress
+    already. Every call that doesn't raise an exception must be followed by a
+    call to finish_backend_operation(), e.g. in a finally block.
+  <Arguments>
+    None
+  <Exceptions>
+    TooManyRequestsError
+      If MAX_CONCURRENT_BACKEND_OPERATIONS are already in progress.
+  <Side Effects>
+    The operation is counted as in progress.
+  <Returns>
+    None
+  """
+  if not settings.RATE_LIMIT_VESSEL_OPERATIONS:
+    return
+
+  cache = django.core.cache.cache
+  backend_operation_count_lock.acquire()
+  try:
+    cache.add(BACKEND_OPERATION_COUNT_CACHE_KEY, 0, BACKEND_OPERATION_COUNT_CACHE_SECONDS)
+    try:
+      count = cache.incr(BACKEND_OPERATION_COUNT_CACHE_KEY)
+    except ValueError:
+      # The count expired after the add() above.
+      cache.add(BACKEND_OPERATION_COUNT_CACHE_KEY, 1, BACKEND_OPERATION_COUNT_CACHE_SECONDS)
+      count = 1
+  finally:
+    backend_operation_count_lock.release()
+
+  if count > MAX_CONCURRENT_BACKEND_OPERATIONS:
+    finish_backend_operation()
+    log.error("Refused a request because " + str(count - 1) +
+              " backend operations are already in progress.")
+    raise TooManyRequestsError("SeattleGeni is too busy to process this request. " +
+                               "Please try again in a few seconds.")
+
+
+
+
+
+def finish_backend_operation():
+  """
+  <Purpose>
+    Stop counting an operation admitted by start_backend_operation() as in
+    progress.
+  <Arguments>
+    None
+  <Exceptions>
+    None
+  <Side Effects>
+    The count of operations in progress has been decreased.
+  <Returns>
+    None
+  """
+  if not settings.RATE_LIMIT_VESSEL_OPERATIONS:
+    return
+
+  backend_operation_count_lock.acquire()
+  try:
+    try:
+      count = django.core.cache.cache.decr(BACKEND_OPERATION_COUNT_CACHE_KEY)
+    except ValueError:
+      # The count expired while the operation was in progress.
+      return
+
+    if count < 0:
+      # The count expired and was started again while the operation was in
+      # progress, so it wasn't included.
+      django.core.cache.cache.set(BACKEND_OPERATION_COUNT_CACHE_KEY, 0,
+                                  BACKEND_OPERATION_COUNT_CACHE_SECONDS)
+  finally:
+    backend_operation_count_lock.release()
@@ -0,0 +1,5 @@
+/* Looking for subnets with enough available vessels for a lan request filters
+ * on the port and then on a minimum count. This index lets the database find
+ * just the qualifying subnets rather than every subnet with the port.
+ */
+ALTER TABLE `control_availablevesselcount` ADD INDEX `control_availablevesselcount_port_count` (`port`, `count`);
@@ -0,0 +1,2 @@
+/* The sqlite3 counterpart of the composite index in availablevesselcount.mysql.sql. */
+CREATE INDEX `control_availablevesselcount_port_count` ON `control_availablevesselcount` (`port`, `count`);
@@ -13,3 +13,7 @@
  * http://docs.djangoproject.com/en/dev/howto/initial-data/#providing-initial-sql-data
  */
 ALTER TABLE `control_node` ADD INDEX (`node_identifier` (767));
+
+/* Used when looking up available vessels, which are only on nodes that are
+ * active and not broken. See also vessel.mysql.sql. */
+ALTER TABLE `control_node` ADD INDEX `control_node_active_broken` (`is_active`, `is_broken`);
@@ -0,0 +1,5 @@
+/* The sqlite3 counterpart of the composite index in node.mysql.sql. This is
+ * mostly so that the test databases (which use sqlite3) have the same
+ * indexes as production.
+ */
+CREATE INDEX `control_node_active_broken` ON `control_node` (`is_active`, `is_broken`);
@@ -0,0 +1,9 @@
+/* Composite index for looking up available vessels (see the functions named
+ * _get_queryset_of_all_available_vessels_for_a_port_* in maindb). An available
+ * vessel has no acquired_by_user and is not dirty. Including node_id lets the
+ * join to control_node be done from the index alone.
+ *
+ * Existing databases can add the indexes in this directory with the file
+ * dev/migration/available_vessel_indexes.sql.
+ */
+ALTER TABLE `control_vessel` ADD INDEX `control_vessel_availability` (`acquired_by_user_id`, `is_dirty`, `node_id`);
@@ -0,0 +1,2 @@
+/* The sqlite3 counterpart of the composite index in vessel.mysql.sql. */
+CREATE INDEX `control_vessel_availability` ON `control_vessel` (`acquired_by_user_id`, `is_dirty`, `node_id`);
@@ -0,0 +1,7 @@
+/* The unique (vessel_id, port) index django creates for unique_together can't
+ * be used to find the vessels that have a given port, which is the first thing
+ * done when looking up available vessels for a user. This index starts with
+ * the port and includes the vessel_id so that the join to control_vessel can
+ * be done from the index alone.
+ */
+ALTER TABLE `control_vesselport` ADD INDEX `control_vesselport_port_vessel` (`port`, `vessel_id`);
@@ -0,0 +1,2 @@
+/* The sqlite3 counterpart of the composite index in vesselport.mysql.sql. */
+CREATE INDEX `control_vesselport_port_vessel` ON `control_vesselport` (`port`, `vessel_id`);
@@ -51,11 +51,13 @@ def _parallel_process_vessels_from_list(vessel_list, process_func, lockserver_ha
   # Lock the nodes that these vessels are on.
   lockserver.lock_multiple_nodes(lockserver_handle, node_id_list)
   try:
-    # Get new vessel objects from the db now that we have node locks.
-    new_vessel_list = []
+    # Get new vessel objects from the db now that we have node locks. They are
+    # all retrieved with one query to keep the time the locks are held short.
+    node_id_and_vesselname_list = []
     for vessel in vessel_list:
       node_id = maindb.get_node_identifier_from_vessel(vessel)
-      new_vessel_list.append(maindb.get_vessel(node_id, vessel.name))
+      node_id_and_vesselname_list.append((node_id, vessel.name))
+    new_vessel_list = maindb.get_vessels(node_id_and_vesselname_list)
     # Have the list object the caller may still be using contain the actual
     # vessel objects we have processed. That is, we've just replaced the
     # caller's list's contents with new vessel objects for the same vessels.
@@ -519,50 +521,32 @@ def _do_release_vessel(vessel, geniuser):
 
 
 @log_function_call
-def renew_vessels(lockserver_handle, geniuser, vessel_list):
+def renew_vessels(geniuser, vessel_list):
   """
   <Purpose>
-    Renew vessels.
+    Renew vessels. Unlike acquiring and releasing vessels, this doesn't
+    require any node locks because renewal only changes the database and
+    maindb only renews vessels that are still acquired by the user at the
+    time of the update.
   <Arguments>
-    lockserver_handle
-      The lockserver handle to use for acquiring node locks.
     geniuser
       The user who has acquired the vessels.
     vessel_list
       A list of vessels to be renewed.
   <Exceptions>
-    InvalidRequestError
-      If any vessels in vessel_list are not already acquired by geniuser.
+    None.
   <Side Effects>
-    The vessels in the vessel_list have expirations dates which are the maximum
-    length of time from now that we allow renewal for.
+    The vessels in the vessel_list that are acquired by geniuser have
+    expirations dates which are the maximum length of time from now that we
+    allow renewal for.
   <Returns>
     None.
   """
   
-  # This is going to be a potentially large list of vessels to obtain node
-  # locks on simultaneously. This is something to revisit if lock contention
-  # starts to become an issue.
-  parallel_results = _parallel_process_vessels_from_list(vessel_list, _do_renew_vessel,
-                                                         lockserver_handle, geniuser)
-  
-  for (vessel, exception_message) in parallel_results["exception"]:
-      raise InternalError("Unexpected exception occurred during parallelized " + 
-                          "renewal of vessels: " + exception_message)
+  renewedcount = maindb.renew_vessels_of_user(geniuser, vessel_list)
   
-
-
-
-
-@log_function_call
-def _do_renew_vessel(vessel, geniuser):
-  
-  if vessel.acquired_by_user != geniuser:
-    # The vessel was either already released, someone is trying to do things
-    # they shouldn't, or we have a bug.
-    log.info("Not renewing vessel " + str(vessel) + 
-             " because it is not acquired by user " + str(geniuser))
-    return
-    
-  maindb.set_maximum_vessel_expiration(vessel)
-
+  if renewedcount < len(vessel_list):
+    # Some vessels were either already released, someone is trying to do
+    # things they shouldn't, or we have a bug.
+    log.info("Not renewing " + str(len(vessel_list) - renewedcount) + " of the vessels " +
+             str(vessel_list) + " because they are not acquired by user " + str(geniuser))
@@ -194,7 +194,7 @@ class AutoRegisterForm(forms.ModelForm):
 
 
 
-def gen_get_form(geni_user, req_post=None):
+def gen_get_form(geni_user, req_post=None, avail_vessel_credits=None):
   """
   <Purpose>
       Dynamically generates a GetVesselsForm that has the right
@@ -209,6 +209,9 @@ def gen_get_form(geni_user, req_post=None):
           An HTTP POST request (django) object from which a
           GetVesselsForm may be instantiated. If this argument is
           not supplied, a blank form will be created
+      avail_vessel_credits:
+          The number of vessels the user can acquire, if the caller
+          already knows it. Otherwise it is looked up.
 
   <Exceptions>
       None.
@@ -222,7 +225,8 @@ def gen_get_form(geni_user, req_post=None):
   """
       
   # the total number of vessels a user may acquire
-  avail_vessel_credits = interface.get_available_vessel_credits(geni_user)
+  if avail_vessel_credits is None:
+    avail_vessel_credits = interface.get_available_vessel_credits(geni_user)
   
   # Dynamic generation of the options for numbers the user can request based
   # on their number of available vessel credits.
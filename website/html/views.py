@@ -21,6 +21,7 @@ import os
 import sys
 import shutil
 import subprocess
+import traceback
 import xmlrpclib
 
 # Needed to escape characters for the Android referrer...
@@ -91,25 +92,6 @@ class LoggedInButFailedGetGeniUserError(Exception):
 
 
 
-def _state_key_file_to_publickey_string(key_file_name):
-  """
-  Read a public key file from the the state keys directory and return it in
-  a key string format.
-  """
-  fullpath = os.path.join(settings.SEATTLECLEARINGHOUSE_STATE_KEYS_DIR, key_file_name)
-  return rsa_publickey_to_string(rsa_file_to_publickey(fullpath))
-
-
-
-
-
-# The key used as the state key for new donations.
-ACCEPTDONATIONS_STATE_PUBKEY = _state_key_file_to_publickey_string("acceptdonation.publickey")
-
-
-
-
-
 def error(request):
   """
   <Purpose>
@@ -467,7 +449,7 @@ def mygeni(request):
     return _show_failed_get_geniuser_page(request)
   
   total_vessel_credits = interface.get_total_vessel_credits(user)
-  num_acquired_vessels = len(interface.get_acquired_vessels(user))
+  num_acquired_vessels = interface.get_acquired_vessel_count(user)
   avail_vessel_credits = interface.get_available_vessel_credits(user)
   
   if num_acquired_vessels > total_vessel_credits:
@@ -497,24 +479,29 @@ def myvessels(request, get_form=False, action_summary="", action_detail="", remo
   except LoggedInButFailedGetGeniUserError:
     return _show_failed_get_geniuser_page(request)
   
+  # Everything shown about the user's vessels and credits. This is usually
+  # cached, so it doesn't take any queries.
+  summary = interface.get_user_summary(user)
+  
+  # this user's number of vessels they can still acquire
+  my_max_vessels = summary['available_vessel_credits']
+  
   # get_form of None means don't show the form to acquire vessels.
-  if interface.get_available_vessel_credits(user) == 0:
+  if my_max_vessels == 0:
     get_form = None
   elif get_form is False:
-    get_form = forms.gen_get_form(user)
+    get_form = forms.gen_get_form(user, avail_vessel_credits=my_max_vessels)
 
   # shared vessels that are used by others but which belong to this user (TODO)
   shvessels = []
 
   # this user's used vessels
-  my_vessels_raw = interface.get_acquired_vessels(user)
-  my_vessels = interface.get_vessel_infodict_list(my_vessels_raw)
+  my_vessels = summary['vessels']
   
-  # this user's number of donations, max vessels, total vessels and free credits
-  my_donations = interface.get_donations(user)
-  my_max_vessels = interface.get_available_vessel_credits(user)	
-  my_free_vessel_credits = interface.get_free_vessel_credits_amount(user)
-  my_total_vessel_credits = interface.get_total_vessel_credits(user)
+  # this user's number of donations, total vessels and free credits
+  my_donations = summary['donation_count']
+  my_free_vessel_credits = summary['free_vessel_credits']
+  my_total_vessel_credits = summary['total_vessel_credits']
 
   for vessel in my_vessels:
     if vessel["expires_in_seconds"] <= 0:
@@ -535,7 +522,7 @@ def myvessels(request, get_form=False, action_summary="", action_detail="", remo
                              'get_form' : get_form,
                              'action_summary' : action_summary,
                              'action_detail' : action_detail,
-                             'my_donations' : len(my_donations),
+                             'my_donations' : my_donations,
                              'my_max_vessels' : my_max_vessels, 
                              'free_vessel_credits' : my_free_vessel_credits,
                              'total_vessel_credits' : my_total_vessel_credits,
@@ -597,6 +584,10 @@ def get_resources(request):
     except InsufficientUserResourcesError:
       action_summary = "Unable to acquire vessels: you do not have enough vessel credits to fulfill this request."
       keep_get_form = True
+    except TooManyRequestsError, err:
+      action_summary = "Unable to acquire vessels at this time."
+      action_detail += str(err)
+      keep_get_form = True
   else:
     keep_get_form = True
   
@@ -644,6 +635,8 @@ def del_resource(request):
     except InvalidRequestError, err:
       remove_summary = "Unable to remove vessel. The vessel does not belong"
       remove_summary += " to you any more (maybe it expired?). " + str(err)
+    except TooManyRequestsError, err:
+      remove_summary = "Unable to remove vessel. " + str(err)
   
   return myvessels(request, remove_summary=remove_summary)
 
@@ -669,6 +662,8 @@ def del_all_resources(request):
     interface.release_all_vessels(user)
   except InvalidRequestError, err:
     remove_summary = "Unable to release all vessels: " + str(err)
+  except TooManyRequestsError, err:
+    remove_summary = "Unable to release all vessels: " + str(err)
   
   return myvessels(request, remove_summary=remove_summary)
 
@@ -714,6 +709,8 @@ def renew_resource(request):
       action_summary = "Unable to renew vessel: you are currently over your"
       action_summary += " vessel credit limit."
       action_detail += str(err)
+    except TooManyRequestsError, err:
+      action_summary = "Unable to renew vessel: " + str(err)
   
   return myvessels(request, False, action_summary=action_summary, action_detail=action_detail)
 
@@ -743,6 +740,8 @@ def renew_all_resources(request):
     action_summary = "Unable to renew vessels: you are currently over your"
     action_summary += " vessel credit limit."
     action_detail += str(err)
+  except TooManyRequestsError, err:
+    action_summary = "Unable to renew vessels: " + str(err)
   
   return myvessels(request, False, action_summary=action_summary, action_detail=action_detail)
 
@@ -1106,21 +1105,14 @@ def _build_installer(username, platform):
     return False, error_response
 
   try:
-    xmlrpc_proxy = xmlrpclib.ServerProxy(settings.SEATTLECLEARINGHOUSE_INSTALLER_BUILDER_XMLRPC)
-    
-    vessel_list = [{'percentage': 80, 'owner': 'owner', 'users': ['user']}]
-    
-    user_data = {
-      'owner': {'public_key': user.donor_pubkey},
-      'user': {'public_key': ACCEPTDONATIONS_STATE_PUBKEY},
-    }
-    
-    build_results = xmlrpc_proxy.build_installers(vessel_list, user_data)
-  except:
+    # The installers are only built the first time they are asked for (or
+    # in the background after registration). After that, the URL is cached.
+    installer_url = interface.get_installer_url(user, platform)
+  except InternalError:
+    log.error("Failed to build installer for " + username + ": " + traceback.format_exc())
     error_response = HttpResponse("Failed to build installer.")
     return False, error_response
 
-  installer_url = build_results['installers'][platform]
   return True, installer_url
 
 
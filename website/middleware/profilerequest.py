@@ -0,0 +1,82 @@
+"""
+<Program>
+  profilerequest.py
+
+<Purpose>
+  We register "middleware" with django to profile requests using the
+  common/util/profiling.py module: the wall time of each request, its database
+  queries, and the time spent talking to the lockserver, backend, and
+  nodemanagers. The results can be seen at /reports/profiling.
+
+  This is only used if settings.PROFILE_REQUESTS is True, as recording every
+  query has some overhead. It needs django 1.2 or later (for
+  django.db.connections) and isn't used with older versions.
+
+  Documenation on django middleware: http://www.djangobook.com/en/1.0/chapter15/
+"""
+
+import django.db
+
+from django.core.exceptions import MiddlewareNotUsed
+
+from seattlegeni.common.util import profiling
+
+from seattlegeni.website import settings
+
+class ProfileRequestMiddleware(object):
+
+  def __init__(self):
+    # Django doesn't use middleware whose constructor raises this.
+    if not settings.PROFILE_REQUESTS:
+      raise MiddlewareNotUsed
+
+    # Before django 1.2 there is only django.db.connection, and queries are
+    # only recorded with DEBUG on.
+    if not hasattr(django.db, "connections"):
+      raise MiddlewareNotUsed
+
+
+
+  def process_request(self, request):
+    # Have django record the queries of this thread's connections even though
+    # DEBUG is False. The lists of queries are emptied by django at the start
+    # of each request, but note where they are at just in case.
+    request.profiling_query_start = {}
+    for connection in django.db.connections.all():
+      connection.use_debug_cursor = True
+      request.profiling_query_start[connection.alias] = len(connection.queries)
+
+    # Requests for paths that don't have a view keep this name (rather than
+    # their path) so that they are all aggregated together.
+    profiling.start_request(profiling.UNKNOWN_REQUEST_NAME)
+
+    # Returning None indicates that the request should continue to be processed.
+    return None
+
+
+
+  def process_view(self, request, view_func, view_args, view_kwargs):
+    # Aggregate by view rather than by path. The xmlrpc dispatcher further
+    # changes this to the name of the method being called.
+    profiling.set_request_name(view_func.__module__ + "." + view_func.__name__)
+    return None
+
+
+
+  def process_response(self, request, response):
+    # Views of paths that exist can still respond that the requested thing
+    # doesn't.
+    if response.status_code == 404:
+      profiling.set_request_name(profiling.UNKNOWN_REQUEST_NAME)
+
+    querylist = []
+    # This is also called for requests that process_request() wasn't called
+    # for if an earlier middleware returned a response.
+    query_start = getattr(request, "profiling_query_start", None)
+    if query_start is not None:
+      for connection in django.db.connections.all():
+        querylist += connection.queries[query_start.get(connection.alias, 0):]
+
+    profiling.finish_request(querylist)
+
+    return response
@@ -8,4 +8,5 @@ urlpatterns = patterns('seattlegeni.website.reports.views',
                        (r'^acquired_vessels$', 'acquired_vessels', {}, 'acquired_vessels'),
                        (r'^vessels_by_port$', 'vessels_by_port', {}, 'vessels_by_port'),
                        (r'^lan_sizes_by_port$', 'lan_sizes_by_port', {}, 'lan_sizes_by_port'),
+                       (r'^profiling$', 'profiling_report', {}, 'profiling_report'),
                       )
@@ -12,11 +12,18 @@
   Views for reports about seattlegeni.
 """
 
+import os
+
 import django.contrib.auth.decorators
 from django.http import HttpResponse
 
+from seattlegeni.common.api import maindb
+
+from seattlegeni.common.util import profiling
 from seattlegeni.common.util import statistics
 
+from seattlegeni.website import settings
+
 
 
 
@@ -41,6 +48,7 @@ def index(request):
   html += '<li><a href="%s">%s</a></li>' % ("acquired_vessels", "Acquired vessels")
   html += '<li><a href="%s">%s</a></li>' % ("vessels_by_port", "Available vessels by port")
   html += '<li><a href="%s">%s</a></li>' % ("lan_sizes_by_port", "Available LAN sizes by port")
+  html += '<li><a href="%s">%s</a></li>' % ("profiling", "Request profiling (this website process only)")
   html += '</ul>'
   html += '</body></html>'
   return HttpResponse(html)
@@ -101,6 +109,31 @@ def lan_sizes_by_port(request):
 
 
 
+@django.contrib.auth.decorators.user_passes_test(user_is_staff_member)
+def profiling_report(request):
+  lines = []
+  lines.append("Request profiling of website process " + str(os.getpid()))
+  lines.append("-------------------------------------" + "-" * len(str(os.getpid())))
+  lines.append("")
+  
+  if not settings.PROFILE_REQUESTS:
+    lines.append("Requests are not being profiled. Set PROFILE_REQUESTS to True in settings.py.")
+    lines.append("")
+  
+  stats = maindb.get_password_check_stats()
+  lines.append("Password checks: %d hashed in %.3f seconds, %d cached" %
+               (stats["hashed_count"], stats["hashed_seconds"], stats["cached_count"]))
+  lines.append("")
+  
+  lines += profiling.get_report()
+  
+  output = "\n".join(lines)
+  return HttpResponse(output, content_type='text/plain')
+
+
+
+
+
 def _get_text_number_of_vessels_acquired_per_user():
   
   lines = []
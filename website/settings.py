@@ -41,6 +41,16 @@ SEATTLECLEARINGHOUSE_STATE_KEYS_DIR = os.path.join(SEATTLECLEARINGHOUSE_WEBSITE_
 # The XML-RPC interface to the Custom Installer Builder.
 SEATTLECLEARINGHOUSE_INSTALLER_BUILDER_XMLRPC = "https://custombuilder.poly.edu/custom_install/xmlrpc/"
 
+# The URLs of the installers built for each user are cached (see
+# website/control/installers.py). Change this whenever the installer builder
+# or its base installers are updated so that new installers are built.
+SEATTLECLEARINGHOUSE_INSTALLER_BUILDER_VERSION = "1"
+
+# Whether to have a user's installers built in the background when they
+# register, so that they don't have to wait for the installer builder when
+# they download one.
+PREBUILD_INSTALLERS = True
+
 # Not currently used. This is left in for legacy installs
 # The directory where the base installers named seattle_linux.tgz, seattle_mac.tgz,
 # and seattle_win.zip are located.
@@ -104,6 +114,58 @@ DATABASE_PORT = ''             # Set to empty string for default. Not used with
 if DATABASE_ENGINE == 'mysql':
   DATABASE_OPTIONS = {'init_command': 'SET storage_engine=INNODB'}
 
+# An optional read replica of the database. If set, reports, statistics, and
+# other code that explicitly allows slightly stale data will read from the
+# replica rather than the primary database. This requires django 1.2+.
+# Example:
+#MAINDB_READ_REPLICA = {
+#  'ENGINE': 'django.db.backends.mysql',
+#  'NAME': 'FILL_THIS_IN',
+#  'USER': 'FILL_THIS_IN',
+#  'PASSWORD': 'FILL_THIS_IN',
+#  'HOST': 'FILL_THIS_IN',
+#  'PORT': '',
+#}
+MAINDB_READ_REPLICA = None
+
+# If the read replica is more than this many seconds behind the primary
+# database (or replication isn't running), reads go to the primary instead.
+# Set to None to never check how far behind the replica is.
+MAINDB_READ_REPLICA_MAX_LAG_SECONDS = 30
+
+if MAINDB_READ_REPLICA is not None:
+  DATABASES = {
+    'default': {
+      'ENGINE': 'django.db.backends.' + DATABASE_ENGINE,
+      'NAME': DATABASE_NAME,
+      'USER': DATABASE_USER,
+      'PASSWORD': DATABASE_PASSWORD,
+      'HOST': DATABASE_HOST,
+      'PORT': DATABASE_PORT,
+    },
+    'replica': MAINDB_READ_REPLICA,
+  }
+  if DATABASE_ENGINE == 'mysql':
+    DATABASES['default']['OPTIONS'] = DATABASE_OPTIONS
+  # Never write to the replica, even when saving objects that were read
+  # from it.
+  DATABASE_ROUTERS = ['seattlegeni.website.control.dbrouters.PrimaryWriteRouter']
+
+# The django cache is used by maindb to remember recent api key
+# authentications and the summaries shown on users' My Vessels pages. When the
+# website runs in multiple processes, use a shared cache such as memcached
+# (e.g. 'memcached://127.0.0.1:11211/') so that a changed api key, a
+# deactivated account, or changes made by the backend and transition scripts
+# are noticed by all of them at once. With a cache that isn't shared (see
+# CACHE_IS_SHARED), authentications aren't cached at all.
+CACHE_BACKEND = 'locmem://?max_entries=1000'
+
+# Whether the cache is shared by all processes that use it rather than being
+# separate in each process. Data that another process may change (such as
+# cached authentications) is only cached when it is, as a process with its own
+# cache would not notice the change.
+CACHE_IS_SHARED = CACHE_BACKEND.split(':')[0] in ('memcached', 'db', 'file')
+
 # Make this unique, and don't share it with anybody.
 # Fill this in!
 SECRET_KEY = ''
@@ -146,7 +208,28 @@ TEMPLATE_LOADERS = (
 # 'django.template.loaders.eggs.load_template_source',
 )
 
+# Whether to limit how often each user can acquire, release, and renew vessels
+# and to refuse these requests when too many are already being processed. See
+# website/control/ratelimit.py for the limits. The limits are kept in the
+# django cache (see CACHE_BACKEND), so they are only shared by all website
+# processes if the cache is (see CACHE_IS_SHARED). With the default local
+# memory cache, each process enforces the limits on its own, so a user's
+# requests (and the backend operations admitted) can be up to the number of
+# website processes times the limits. Use memcached for limits that hold
+# across processes.
+RATE_LIMIT_VESSEL_OPERATIONS = True
+
+# Whether to profile each request (wall time, database queries, and time spent
+# talking to the lockserver, backend, and nodemanagers). The statistics of each
+# website process are shown to staff at /reports/profiling. This has some
+# overhead, so it's meant to be turned on while looking for slow requests.
+# This requires django 1.2 or later; with older versions it has no effect.
+PROFILE_REQUESTS = False
+
 MIDDLEWARE_CLASSES = (
+  # Our own middleware that profiles requests if PROFILE_REQUESTS is True.
+  # It's first so that the time taken by the other middleware is included.
+  'seattlegeni.website.middleware.profilerequest.ProfileRequestMiddleware',
   'django.middleware.common.CommonMiddleware',
   'django.contrib.csrf.middleware.CsrfViewMiddleware',
   'django.contrib.csrf.middleware.CsrfResponseMiddleware',
@@ -0,0 +1,131 @@
+#pragma out
+#pragma error OK
+"""
+Tests the running of acquisition jobs by website/control/acquisitionjobs.py.
+The jobs are run directly rather than by the worker threads.
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import maindb
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.website.control import acquisitionjobs
+
+import unittest
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    # Setup a fresh database for each test.
+    testlib.setup_test_db()
+    self.user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    self.original_retry_seconds = (acquisitionjobs.ADMISSION_RETRY_INITIAL_SECONDS,
+                                   acquisitionjobs.ADMISSION_RETRY_MAX_TOTAL_SECONDS)
+    acquisitionjobs.ADMISSION_RETRY_INITIAL_SECONDS = 0.01
+
+
+
+  def tearDown(self):
+    (acquisitionjobs.ADMISSION_RETRY_INITIAL_SECONDS,
+     acquisitionjobs.ADMISSION_RETRY_MAX_TOTAL_SECONDS) = self.original_retry_seconds
+    # Cleanup the test database.
+    testlib.teardown_test_db()
+
+
+
+  def _run_job_with(self, acquirefunc):
+    job = maindb.create_acquisition_job(self.user, 2, "lan")
+    acquisitionjobs._run_job(job, acquirefunc)
+    return maindb.get_acquisition_job(self.user, job.id)
+
+
+
+  def test_successful_job(self):
+    job = maindb.create_acquisition_job(self.user, 2, "lan")
+
+    acquirecalls = []
+    def mock_acquire(geniuser, vesselcount, vesseltype):
+      acquirecalls.append((geniuser.username, vesselcount, vesseltype))
+      # The job is marked as running while the acquisition is done.
+      self.assertEqual("running", maindb.get_acquisition_job(self.user, job.id).status)
+      return []
+
+    acquisitionjobs._run_job(job, mock_acquire)
+
+    self.assertEqual([("testuser", 2, "lan")], acquirecalls)
+    self.assertEqual("done", maindb.get_acquisition_job(self.user, job.id).status)
+
+
+
+  def test_failed_jobs(self):
+    def mock_acquire_unable(geniuser, vesselcount, vesseltype):
+      raise UnableToAcquireResourcesError("no lan vessels")
+
+    job = self._run_job_with(mock_acquire_unable)
+    self.assertEqual("failed", job.status)
+    self.assertEqual("UnableToAcquireResourcesError", job.error_type)
+    self.assertEqual("no lan vessels", job.error_message)
+
+    # The details of unexpected errors aren't shown to the user.
+    def mock_acquire_broken(geniuser, vesselcount, vesseltype):
+      raise ValueError("secret details")
+
+    job = self._run_job_with(mock_acquire_broken)
+    self.assertEqual("failed", job.status)
+    self.assertEqual("InternalError", job.error_type)
+    self.assertFalse("secret details" in job.error_message)
+
+
+
+  def test_busy_backend_is_waited_for(self):
+    refusals = [TooManyRequestsError("busy"), TooManyRequestsError("busy")]
+    def mock_acquire_when_not_busy(geniuser, vesselcount, vesseltype):
+      if refusals:
+        raise refusals.pop()
+      return []
+
+    job = self._run_job_with(mock_acquire_when_not_busy)
+    self.assertEqual("done", job.status)
+    self.assertEqual([], refusals)
+
+    # The job fails if the backend stays busy for too long.
+    acquisitionjobs.ADMISSION_RETRY_MAX_TOTAL_SECONDS = 0.05
+    def mock_acquire_always_busy(geniuser, vesselcount, vesseltype):
+      raise TooManyRequestsError("busy")
+
+    job = self._run_job_with(mock_acquire_always_busy)
+    self.assertEqual("failed", job.status)
+    self.assertEqual("TooManyRequestsError", job.error_type)
+
+
+
+  def test_job_is_only_run_once(self):
+    acquirecalls = []
+    def mock_acquire(geniuser, vesselcount, vesseltype):
+      acquirecalls.append(vesselcount)
+      return []
+
+    job = maindb.create_acquisition_job(self.user, 2, "lan")
+    acquisitionjobs._run_job(job, mock_acquire)
+    acquisitionjobs._run_job(job, mock_acquire)
+    self.assertEqual([2], acquirecalls)
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
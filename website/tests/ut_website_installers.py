@@ -0,0 +1,200 @@
+#pragma out
+#pragma error OK
+"""
+Tests the caching of installer builds by website/control/installers.py.
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.website import settings
+
+from seattlegeni.website.control import installers
+
+import django.core.cache
+
+import time
+import unittest
+
+
+
+
+
+DONOR_PUBKEY = "3 5"
+
+# The build_installers() calls made to the mock installer builder.
+build_calls = []
+
+# Whether the mock installer builder fails.
+builder_fails = False
+
+
+
+
+
+class MockInstallerBuilderProxy(object):
+
+  def __init__(self, url, transport=None):
+    pass
+
+
+
+  def build_installers(self, vessel_list, user_data):
+    build_calls.append((vessel_list, user_data))
+    if builder_fails:
+      raise Exception("Mock builder failure.")
+    build_id = str(len(build_calls))
+    urldict = {}
+    for platform in installers.PLATFORMS:
+      urldict[platform] = "https://example.com/" + build_id + "/" + platform
+    return {'build_id' : build_id, 'installers' : urldict}
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    global builder_fails
+    builder_fails = False
+    del build_calls[:]
+    self.original_server_proxy = installers.xmlrpclib.ServerProxy
+    installers.xmlrpclib.ServerProxy = MockInstallerBuilderProxy
+    self.original_builder_version = settings.SEATTLECLEARINGHOUSE_INSTALLER_BUILDER_VERSION
+    django.core.cache.cache.clear()
+
+
+
+  def tearDown(self):
+    installers.xmlrpclib.ServerProxy = self.original_server_proxy
+    installers.MAX_WAIT_FOR_BUILD_IN_PROGRESS_SECONDS = 60
+    settings.SEATTLECLEARINGHOUSE_INSTALLER_BUILDER_VERSION = self.original_builder_version
+    settings.PREBUILD_INSTALLERS = False
+
+
+
+  def test_build_is_cached(self):
+    self.assertEqual(None, installers.get_cached_installer_urls(DONOR_PUBKEY))
+
+    urldict = installers.get_installer_urls(DONOR_PUBKEY)
+    self.assertEqual("https://example.com/1/linux", urldict["linux"])
+    self.assertEqual(1, len(build_calls))
+
+    # The donor key and the state key are what the installers are built with.
+    (vessel_list, user_data) = build_calls[0]
+    self.assertEqual(DONOR_PUBKEY, user_data['owner']['public_key'])
+    self.assertEqual(installers._get_acceptdonations_state_pubkey(), user_data['user']['public_key'])
+
+    # Asking again, e.g. for another platform, doesn't build them again.
+    self.assertEqual(urldict, installers.get_installer_urls(DONOR_PUBKEY))
+    self.assertEqual(urldict, installers.get_cached_installer_urls(DONOR_PUBKEY))
+    self.assertEqual(1, len(build_calls))
+
+    # Other users have their own installers.
+    self.assertEqual("https://example.com/2/mac", installers.get_installer_urls("7 11")["mac"])
+    self.assertEqual(2, len(build_calls))
+
+    # A new version of the builder means new installers.
+    settings.SEATTLECLEARINGHOUSE_INSTALLER_BUILDER_VERSION += "-new"
+    self.assertEqual(None, installers.get_cached_installer_urls(DONOR_PUBKEY))
+    self.assertEqual("https://example.com/3/linux", installers.get_installer_urls(DONOR_PUBKEY)["linux"])
+
+
+
+  def test_failed_build_is_not_cached(self):
+    global builder_fails
+    builder_fails = True
+
+    self.assertRaises(InternalError, installers.get_installer_urls, DONOR_PUBKEY)
+    self.assertEqual(None, installers.get_cached_installer_urls(DONOR_PUBKEY))
+    self.assertEqual({}, installers.builds_in_progress)
+
+    builder_fails = False
+    installers.get_installer_urls(DONOR_PUBKEY)
+    self.assertEqual(2, len(build_calls))
+
+
+
+  def test_build_in_progress_is_waited_for(self):
+    # Pretend another thread is building the installers and fails.
+    cachekey = installers._get_installer_urls_cache_key(DONOR_PUBKEY)
+    installers.builds_in_progress[cachekey] = installers.threading.Event()
+    installers.MAX_WAIT_FOR_BUILD_IN_PROGRESS_SECONDS = 0.1
+    try:
+      self.assertRaises(InternalError, installers.get_installer_urls, DONOR_PUBKEY)
+    finally:
+      del installers.builds_in_progress[cachekey]
+
+    # The builder wasn't asked again.
+    self.assertEqual([], build_calls)
+
+
+
+  def test_builder_requests_time_out(self):
+    for transport in [installers._TimeoutTransport(), installers._TimeoutSafeTransport()]:
+      connection = transport.make_connection("example.com")
+      # Before python 2.7, the connection is wrapped.
+      connection = getattr(connection, "_conn", connection)
+      self.assertEqual(installers.INSTALLER_BUILDER_TIMEOUT_SECONDS, connection.timeout)
+
+
+
+  def test_prebuild_is_queued_once(self):
+    settings.PREBUILD_INSTALLERS = True
+
+    # Use a queue that the background thread (if it was started by another
+    # test) isn't waiting on, and don't let the thread be started.
+    original_queue = installers.prebuild_queue
+    original_thread = installers.prebuild_thread
+    installers.prebuild_queue = installers.Queue.Queue()
+    installers.prebuild_thread = "not started"
+
+    try:
+      installers.prebuild_installers_in_background(DONOR_PUBKEY)
+      installers.prebuild_installers_in_background(DONOR_PUBKEY)
+      installers.prebuild_installers_in_background("7 11")
+      self.assertEqual(2, installers.prebuild_queue.qsize())
+    finally:
+      installers.prebuild_queue = original_queue
+      installers.prebuild_thread = original_thread
+      installers.prebuild_queued_cache_keys.clear()
+
+
+
+  def test_prebuild_in_background(self):
+    # Nothing is built when prebuilding is turned off (as it is for the tests).
+    settings.PREBUILD_INSTALLERS = False
+    installers.prebuild_installers_in_background(DONOR_PUBKEY)
+    time.sleep(0.5)
+    self.assertEqual([], build_calls)
+
+    settings.PREBUILD_INSTALLERS = True
+    installers.prebuild_installers_in_background(DONOR_PUBKEY)
+
+    for i in range(50):
+      if installers.get_cached_installer_urls(DONOR_PUBKEY) is not None:
+        break
+      time.sleep(0.1)
+    else:
+      self.fail("The installers weren't built in the background.")
+
+    # Once built, they aren't built again.
+    installers.prebuild_installers_in_background(DONOR_PUBKEY)
+    installers.get_installer_urls(DONOR_PUBKEY)
+    self.assertEqual(1, len(build_calls))
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
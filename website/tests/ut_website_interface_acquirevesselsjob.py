@@ -0,0 +1,165 @@
+#pragma out
+#pragma error OK
+"""
+Tests for interface.submit_acquire_vessels_job() and
+interface.get_acquire_vessels_job_result(). The jobs aren't run by this test,
+the results are recorded directly through maindb.
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import maindb
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.website.control import acquisitionjobs
+from seattlegeni.website.control import interface
+
+from seattlegeni.website.tests import testutil
+
+import unittest
+
+
+
+
+
+# The jobs that were passed to acquisitionjobs.run_job_in_background().
+background_jobs = []
+
+def mock_run_job_in_background(job, acquirefunc):
+  background_jobs.append(job)
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    # Setup a fresh database for each test.
+    testlib.setup_test_db()
+    del background_jobs[:]
+    self.original_run_job_in_background = acquisitionjobs.run_job_in_background
+    acquisitionjobs.run_job_in_background = mock_run_job_in_background
+    self.original_get_acquisition_job = maindb.get_acquisition_job
+    self.user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+
+
+
+  def tearDown(self):
+    acquisitionjobs.run_job_in_background = self.original_run_job_in_background
+    maindb.get_acquisition_job = self.original_get_acquisition_job
+    # Cleanup the test database.
+    testlib.teardown_test_db()
+
+
+
+  def test_submit(self):
+    job_id = interface.submit_acquire_vessels_job(self.user, 2, 'wan')
+
+    self.assertEqual([job_id], [job.id for job in background_jobs])
+    job = maindb.get_acquisition_job(self.user, job_id)
+    self.assertEqual("pending", job.status)
+    self.assertEqual((2, "wan"), (job.vesselcount, job.vesseltype))
+
+    self.assertRaises(ProgrammerError, interface.submit_acquire_vessels_job, self.user, 2, 'x')
+
+    credit_limit = maindb.get_user_free_vessel_credits(self.user)
+    self.assertRaises(InsufficientUserResourcesError, interface.submit_acquire_vessels_job,
+                      self.user, credit_limit + 1, 'wan')
+
+
+
+  def test_submit_too_many_unfinished_jobs(self):
+    for i in range(interface.MAX_UNFINISHED_ACQUISITION_JOBS_PER_USER):
+      interface.submit_acquire_vessels_job(self.user, 1, 'wan')
+
+    self.assertRaises(InvalidRequestError, interface.submit_acquire_vessels_job, self.user, 1, 'wan')
+
+    # The refused job was neither kept nor run.
+    self.assertEqual(interface.MAX_UNFINISHED_ACQUISITION_JOBS_PER_USER,
+                     maindb.get_unfinished_acquisition_job_count(self.user))
+    self.assertEqual(interface.MAX_UNFINISHED_ACQUISITION_JOBS_PER_USER, len(background_jobs))
+
+    # Once a job finishes, another can be submitted.
+    maindb.finish_acquisition_job(background_jobs[0], vessel_list=[])
+    interface.submit_acquire_vessels_job(self.user, 1, 'wan')
+
+
+
+  def test_result_of_unfinished_job(self):
+    job_id = interface.submit_acquire_vessels_job(self.user, 1, 'wan')
+
+    self.assertEqual(None, interface.get_acquire_vessels_job_result(self.user, job_id))
+
+    self.assertRaises(DoesNotExistError, interface.get_acquire_vessels_job_result,
+                      self.user, job_id + 1)
+
+
+
+  def test_result_after_waiting(self):
+    job_id = interface.submit_acquire_vessels_job(self.user, 1, 'wan')
+
+    # Have the job finish while the result is being waited for.
+    lookups = []
+    def mock_get_acquisition_job(geniuser, job_id):
+      lookups.append(job_id)
+      if len(lookups) == 2:
+        maindb.finish_acquisition_job(background_jobs[0], vessel_list=[])
+      return self.original_get_acquisition_job(geniuser, job_id)
+    maindb.get_acquisition_job = mock_get_acquisition_job
+
+    self.assertEqual([], interface.get_acquire_vessels_job_result(self.user, job_id, 10))
+    self.assertEqual(2, len(lookups))
+
+
+
+  def test_result_of_failed_job(self):
+    errors = [UnableToAcquireResourcesError("no vessels"),
+              InsufficientUserResourcesError("no credits"),
+              TooManyRequestsError("too many"),
+              InternalError("internal details")]
+
+    for error in errors:
+      job = maindb.create_acquisition_job(self.user, 1, 'wan')
+      maindb.finish_acquisition_job(job, error=error)
+      self.assertRaises(error.__class__, interface.get_acquire_vessels_job_result,
+                        self.user, job.id)
+
+    # Any other error is reported as an internal error.
+    job = maindb.create_acquisition_job(self.user, 1, 'wan')
+    maindb.finish_acquisition_job(job, error=ValueError("unexpected"))
+    self.assertRaises(InternalError, interface.get_acquire_vessels_job_result, self.user, job.id)
+
+
+
+  def test_result_only_includes_vessels_still_acquired(self):
+    userport = self.user.usable_vessel_port
+    testutil.create_nodes_on_different_subnets(3, [userport])
+
+    vessel_list = list(maindb.get_available_rand_vessels(self.user, 3))[:3]
+    for vessel in vessel_list:
+      maindb.record_acquired_vessel(self.user, vessel)
+
+    # Only the first two vessels were acquired by the job.
+    job = maindb.create_acquisition_job(self.user, 2, 'wan')
+    maindb.finish_acquisition_job(job, vessel_list=vessel_list[:2])
+
+    maindb.record_released_vessel(vessel_list[0])
+
+    result = interface.get_acquire_vessels_job_result(self.user, job.id)
+    self.assertEqual([vessel_list[1].id], [vessel.id for vessel in result])
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
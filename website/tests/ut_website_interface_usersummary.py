@@ -0,0 +1,195 @@
+"""
+Tests the interface.get_user_summary call and the maindb functions that cache
+and forget user summaries.
+"""
+#pragma out
+#pragma error OK
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import maindb
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.website import settings
+
+from seattlegeni.website.control import interface
+
+from seattlegeni.website.control.models import Vessel
+
+from seattlegeni.website.tests import testutil
+
+import django.core.cache
+
+import datetime
+import unittest
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    # Setup a fresh database for each test.
+    testlib.setup_test_db()
+
+
+
+  def tearDown(self):
+    # Cleanup the test database.
+    testlib.teardown_test_db()
+
+
+
+  def _create_user_with_vessels(self, vesselcount):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    testutil.create_nodes_on_different_subnets(vesselcount, [user.usable_vessel_port])
+    vessel_list = list(Vessel.objects.all())
+    for vessel in vessel_list:
+      maindb.record_acquired_vessel(user, vessel)
+    return (user, vessel_list)
+
+
+
+  def test_summary_is_cached_until_vessels_change(self):
+    (user, vessel_list) = self._create_user_with_vessels(3)
+
+    summary = interface.get_user_summary(user)
+    self.assertEqual(3, len(summary["vessels"]))
+    self.assertEqual(0, summary["donation_count"])
+    self.assertEqual(user.free_vessel_credits, summary["total_vessel_credits"])
+    self.assertEqual(user.free_vessel_credits - 3, summary["available_vessel_credits"])
+    self.assertEqual(interface.get_available_vessel_credits(user),
+                     summary["available_vessel_credits"])
+
+    # A change made behind maindb's back isn't seen, as the summary is cached.
+    Vessel.objects.filter(id=vessel_list[0].id).update(acquired_by_user=None)
+    self.assertEqual(3, len(interface.get_user_summary(user)["vessels"]))
+
+    # Releasing a vessel through maindb makes the summary be computed again.
+    maindb.record_released_vessel(vessel_list[1])
+    summary = interface.get_user_summary(user)
+    self.assertEqual(1, len(summary["vessels"]))
+    self.assertEqual(user.free_vessel_credits - 1, summary["available_vessel_credits"])
+
+    # As does renewing.
+    vessel = maindb.get_acquired_vessels(user)[0]
+    oldexpires = summary["vessels"][0]["expires_in_seconds"]
+    maindb.renew_vessels_of_user(user, [vessel])
+    self.assertTrue(interface.get_user_summary(user)["vessels"][0]["expires_in_seconds"] > oldexpires)
+
+
+
+  def test_summary_is_forgotten_when_donations_change(self):
+    (user, vessel_list) = self._create_user_with_vessels(1)
+    node = vessel_list[0].node
+
+    self.assertEqual(0, interface.get_user_summary(user)["donation_count"])
+
+    maindb.create_donation(node, user, "")
+    summary = interface.get_user_summary(user)
+    self.assertEqual(1, summary["donation_count"])
+    self.assertEqual(user.free_vessel_credits + maindb.VESSEL_CREDITS_FOR_DONATIONS_MULTIPLIER,
+                     summary["total_vessel_credits"])
+
+    # Donations from inactive nodes don't count.
+    maindb.record_node_communication_failure(node)
+    self.assertEqual(0, interface.get_user_summary(user)["donation_count"])
+
+    maindb.record_node_communication_success(node, node.last_known_version,
+                                             node.last_known_ip, node.last_known_port)
+    self.assertEqual(1, interface.get_user_summary(user)["donation_count"])
+
+    # Saving the user (e.g. with new free vessel credits) forgets it, too.
+    user.free_vessel_credits += 5
+    user.save()
+    self.assertEqual(user.free_vessel_credits + maindb.VESSEL_CREDITS_FOR_DONATIONS_MULTIPLIER,
+                     interface.get_user_summary(user)["total_vessel_credits"])
+
+
+
+  def test_vessels_expire_while_cached(self):
+    (user, vessel_list) = self._create_user_with_vessels(2)
+
+    summary = interface.get_user_summary(user)
+    self.assertEqual(2, len(summary["vessels"]))
+
+    # Pretend the summary was created long enough ago that all of the vessels
+    # have expired since.
+    (snapshot, generation) = maindb.get_cached_user_summary(user)
+    snapshot["time_created"] -= maindb.DEFAULT_VESSEL_EXPIRATION_TIMEDELTA.days * 24 * 3600
+    snapshot["time_created"] -= maindb.DEFAULT_VESSEL_EXPIRATION_TIMEDELTA.seconds
+    maindb.cache_user_summary(user, snapshot, generation)
+
+    summary = interface.get_user_summary(user)
+    self.assertEqual([], summary["vessels"])
+    self.assertEqual(user.free_vessel_credits, summary["available_vessel_credits"])
+
+
+
+  def test_summary_computed_before_forgetting_is_not_used(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+
+    (summary, generation) = maindb.get_cached_user_summary(user)
+    self.assertEqual(None, summary)
+
+    # The user's summary is forgotten while it is being computed by someone
+    # else, who then stores it.
+    maindb.forget_cached_user_summary(user)
+    maindb.cache_user_summary(user, {"stale" : True}, generation)
+
+    (summary, newgeneration) = maindb.get_cached_user_summary(user)
+    self.assertEqual(None, summary)
+
+    maindb.cache_user_summary(user, {"stale" : False}, newgeneration)
+    self.assertEqual({"stale" : False}, maindb.get_cached_user_summary(user)[0])
+
+
+
+  def test_summary_without_generation_is_not_used(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+
+    # A summary is never stored without a generation.
+    maindb.cache_user_summary(user, {"stale" : True}, None)
+    (summary, generation) = maindb.get_cached_user_summary(user)
+    self.assertEqual(None, summary)
+    self.assertNotEqual(None, generation)
+
+    # If the generation is evicted from the cache, the summary isn't used.
+    maindb.cache_user_summary(user, {"stale" : True}, generation)
+    django.core.cache.cache.delete(maindb._get_user_summary_generation_cache_key(user.id))
+
+    (summary, newgeneration) = maindb.get_cached_user_summary(user)
+    self.assertEqual(None, summary)
+    self.assertNotEqual(None, newgeneration)
+
+
+
+  def test_summary_not_cached_without_shared_cache(self):
+    (user, vessel_list) = self._create_user_with_vessels(1)
+
+    settings.CACHE_IS_SHARED = False
+    try:
+      self.assertEqual(1, len(interface.get_user_summary(user)["vessels"]))
+      self.assertEqual((None, None), maindb.get_cached_user_summary(user))
+
+      # Changes made behind maindb's back are seen right away.
+      Vessel.objects.filter(id=vessel_list[0].id).update(acquired_by_user=None)
+      self.assertEqual([], interface.get_user_summary(user)["vessels"])
+    finally:
+      settings.CACHE_IS_SHARED = True
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
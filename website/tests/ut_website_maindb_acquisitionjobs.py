@@ -0,0 +1,175 @@
+#pragma out
+#pragma error OK
+"""
+Tests for the maindb functions that keep track of acquisition jobs.
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import maindb
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.website.control.models import AcquisitionJob
+
+from datetime import datetime
+from datetime import timedelta
+
+import unittest
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    # Setup a fresh database for each test.
+    testlib.setup_test_db()
+
+
+
+  def tearDown(self):
+    # Cleanup the test database.
+    testlib.teardown_test_db()
+
+
+
+  def _create_user(self, username):
+    return maindb.create_user(username, "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+
+
+
+  def test_job_lifecycle(self):
+    user = self._create_user("testuser")
+
+    job = maindb.create_acquisition_job(user, 10, "wan")
+    self.assertEqual("pending", maindb.get_acquisition_job(user, job.id).status)
+    self.assertEqual(1, maindb.get_unfinished_acquisition_job_count(user))
+
+    # A job is only started once.
+    self.assertTrue(maindb.start_acquisition_job(job))
+    self.assertFalse(maindb.start_acquisition_job(job))
+    self.assertEqual("running", maindb.get_acquisition_job(user, job.id).status)
+    self.assertEqual(1, maindb.get_unfinished_acquisition_job_count(user))
+
+    maindb.finish_acquisition_job(job, vessel_list=[])
+    job = maindb.get_acquisition_job(user, job.id)
+    self.assertEqual("done", job.status)
+    self.assertEqual("", job.vessel_handles)
+    self.assertEqual(0, maindb.get_unfinished_acquisition_job_count(user))
+
+
+
+  def test_failed_job(self):
+    user = self._create_user("testuser")
+
+    job = maindb.create_acquisition_job(user, 10, "lan")
+    maindb.start_acquisition_job(job)
+    maindb.finish_acquisition_job(job, error=UnableToAcquireResourcesError("no lan vessels"))
+
+    job = maindb.get_acquisition_job(user, job.id)
+    self.assertEqual("failed", job.status)
+    self.assertEqual("UnableToAcquireResourcesError", job.error_type)
+    self.assertEqual("no lan vessels", job.error_message)
+
+
+
+  def test_job_of_other_user(self):
+    user = self._create_user("testuser")
+    otheruser = self._create_user("otheruser")
+
+    job = maindb.create_acquisition_job(user, 10, "wan")
+    self.assertRaises(DoesNotExistError, maindb.get_acquisition_job, otheruser, job.id)
+    self.assertRaises(DoesNotExistError, maindb.get_acquisition_job, user, job.id + 1)
+    self.assertEqual(0, maindb.get_unfinished_acquisition_job_count(otheruser))
+
+
+
+  def test_timed_out_job_is_failed(self):
+    user = self._create_user("testuser")
+
+    job = maindb.create_acquisition_job(user, 10, "wan")
+    maindb.start_acquisition_job(job)
+
+    longago = datetime.now() - timedelta(seconds=maindb.ACQUISITION_JOB_TIMEOUT_SECONDS + 1)
+    AcquisitionJob.objects.filter(id=job.id).update(date_started=longago)
+
+    job = maindb.get_acquisition_job(user, job.id)
+    self.assertEqual("failed", job.status)
+    self.assertEqual("InternalError", job.error_type)
+    self.assertEqual(0, maindb.get_unfinished_acquisition_job_count(user))
+
+
+
+  def test_job_without_heartbeat_is_failed(self):
+    user = self._create_user("testuser")
+
+    pendingjob = maindb.create_acquisition_job(user, 10, "wan")
+    runningjob = maindb.create_acquisition_job(user, 10, "wan")
+    maindb.start_acquisition_job(runningjob)
+
+    longago = datetime.now() - timedelta(seconds=maindb.ACQUISITION_JOB_HEARTBEAT_TIMEOUT_SECONDS + 1)
+    AcquisitionJob.objects.all().update(date_heartbeat=longago)
+
+    # A heartbeat keeps a job from being considered lost.
+    maindb.record_acquisition_job_heartbeats([pendingjob.id])
+    self.assertEqual("pending", maindb.get_acquisition_job(user, pendingjob.id).status)
+
+    runningjob = maindb.get_acquisition_job(user, runningjob.id)
+    self.assertEqual("failed", runningjob.status)
+    self.assertEqual("InternalError", runningjob.error_type)
+    self.assertTrue("remain acquired" in runningjob.error_message)
+
+    # Heartbeats don't change finished jobs.
+    maindb.record_acquisition_job_heartbeats([runningjob.id])
+    heartbeat = AcquisitionJob.objects.get(id=runningjob.id).date_heartbeat
+    self.assertTrue(heartbeat < datetime.now() - timedelta(seconds=maindb.ACQUISITION_JOB_HEARTBEAT_TIMEOUT_SECONDS))
+
+
+
+  def test_unfinished_job_count_up_to_job(self):
+    user = self._create_user("testuser")
+
+    firstjob = maindb.create_acquisition_job(user, 10, "wan")
+    secondjob = maindb.create_acquisition_job(user, 10, "wan")
+
+    self.assertEqual(2, maindb.get_unfinished_acquisition_job_count(user))
+    self.assertEqual(1, maindb.get_unfinished_acquisition_job_count(user, max_job_id=firstjob.id))
+    self.assertEqual(2, maindb.get_unfinished_acquisition_job_count(user, max_job_id=secondjob.id))
+
+    maindb.delete_acquisition_job(firstjob)
+    self.assertRaises(DoesNotExistError, maindb.get_acquisition_job, user, firstjob.id)
+    self.assertEqual(1, maindb.get_unfinished_acquisition_job_count(user))
+
+
+
+  def test_old_finished_jobs_are_deleted(self):
+    user = self._create_user("testuser")
+
+    oldjob = maindb.create_acquisition_job(user, 10, "wan")
+    maindb.finish_acquisition_job(oldjob, vessel_list=[])
+    unfinishedjob = maindb.create_acquisition_job(user, 10, "wan")
+
+    longago = datetime.now() - maindb.ACQUISITION_JOB_RETENTION_TIMEDELTA - timedelta(seconds=1)
+    AcquisitionJob.objects.all().update(date_created=longago)
+
+    maindb.create_acquisition_job(user, 10, "wan")
+    self.assertRaises(DoesNotExistError, maindb.get_acquisition_job, user, oldjob.id)
+
+    # Old jobs that haven't finished are kept until they are timed out.
+    self.assertEqual(unfinishedjob.id, maindb.get_acquisition_job(user, unfinishedjob.id).id)
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
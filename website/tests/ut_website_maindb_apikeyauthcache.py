@@ -0,0 +1,131 @@
+#pragma out
+#pragma error OK
+"""
+Tests for the caching of successful api key authentications done by
+maindb.get_user_with_api_key().
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import maindb
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.website import settings
+
+from seattlegeni.website.control.models import GeniUser
+
+import unittest
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    # Setup a fresh database for each test.
+    testlib.setup_test_db()
+
+
+
+  def tearDown(self):
+    settings.CACHE_IS_SHARED = True
+    # Cleanup the test database.
+    testlib.teardown_test_db()
+
+
+
+  def test_authentication_is_cached(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    api_key = user.api_key
+
+    self.assertEqual(user.id, maindb.get_user_with_api_key("testuser", api_key).id)
+
+    # Change the api key without saving the model (and so without forgetting
+    # the cached authentication) to see that the cached authentication is
+    # used. The user itself is always loaded from the database.
+    GeniUser.objects.filter(id=user.id).update(api_key="changedkey", affiliation="changed")
+    self.assertEqual("changed", maindb.get_user_with_api_key("testuser", api_key).affiliation)
+
+    # Failed authentications aren't cached or affected by the cache.
+    self.assertRaises(DoesNotExistError, maindb.get_user_with_api_key, "testuser", "wrongkey")
+    self.assertRaises(DoesNotExistError, maindb.get_user_with_api_key, "otheruser", api_key)
+
+    maindb.forget_cached_auth(user)
+    self.assertRaises(DoesNotExistError, maindb.get_user_with_api_key, "testuser", api_key)
+    self.assertEqual(user.id, maindb.get_user_with_api_key("testuser", "changedkey").id)
+
+
+
+  def test_cached_value_has_no_secrets(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    api_key = user.api_key
+
+    maindb.get_user_with_api_key("testuser", api_key)
+
+    cachekey = maindb._get_api_key_auth_cache_key("testuser", api_key)
+    cachedvalue = maindb.django.core.cache.cache.get(cachekey)
+    self.assertEqual(user.id, cachedvalue[1])
+    for value in cachedvalue:
+      self.assertFalse(isinstance(value, GeniUser))
+      self.assertFalse(api_key in str(value))
+      self.assertFalse(user.user_privkey in str(value))
+      self.assertFalse(user.password in str(value))
+
+
+
+  def test_regenerate_api_key_forgets_authentication(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    old_api_key = user.api_key
+
+    maindb.get_user_with_api_key("testuser", old_api_key)
+
+    new_api_key = maindb.regenerate_api_key(user)
+    self.assertRaises(DoesNotExistError, maindb.get_user_with_api_key, "testuser", old_api_key)
+    self.assertEqual(user.id, maindb.get_user_with_api_key("testuser", new_api_key).id)
+
+
+
+  def test_changed_user_forgets_authentication(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    api_key = user.api_key
+
+    maindb.get_user_with_api_key("testuser", api_key)
+    maindb.set_user_keys(user, "5 6", "7 8 9")
+    self.assertEqual("5 6", maindb.get_user_with_api_key("testuser", api_key).user_pubkey)
+
+    # Deactivating the user (e.g. by an admin) saves the user directly.
+    user.is_active = False
+    user.save()
+    self.assertRaises(DoesNotExistError, maindb.get_user_with_api_key, "testuser", api_key)
+
+
+
+  def test_not_cached_without_shared_cache(self):
+    # Other processes wouldn't notice a forgotten authentication.
+    settings.CACHE_IS_SHARED = False
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    api_key = user.api_key
+
+    maindb.get_user_with_api_key("testuser", api_key)
+    self.assertEqual(None, maindb.django.core.cache.cache.get(
+        maindb._get_api_key_auth_cache_key("testuser", api_key)))
+
+    maindb.get_user_with_password("testuser", "password")
+    self.assertEqual(None, maindb.django.core.cache.cache.get(
+        maindb._get_password_auth_cache_key("testuser")))
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
@@ -0,0 +1,151 @@
+#pragma out
+#pragma error OK
+"""
+Tests for the node subnet field and the AvailableVesselCount records used to
+find subnets for lan vessel requests.
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import maindb
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.website.control.models import AvailableVesselCount
+
+from seattlegeni.website.tests import testutil
+
+import unittest
+
+
+
+
+
+def _get_count(subnet, port):
+  """Returns the stored available vessel count for a subnet and port."""
+  try:
+    return AvailableVesselCount.objects.get(subnet=subnet, port=port).count
+  except AvailableVesselCount.DoesNotExist:
+    return 0
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    # Setup a fresh database for each test.
+    testlib.setup_test_db()
+
+
+
+  def tearDown(self):
+    # Cleanup the test database.
+    testlib.teardown_test_db()
+
+
+
+  def test_node_subnet(self):
+    node = testutil.create_node_and_vessels_with_one_port_each("127.0.0.1", [])
+    self.assertEqual("127.0.0", node.subnet)
+
+    natnode = testutil.create_node_and_vessels_with_one_port_each(maindb.NAT_STRING_PREFIX + "abc", [])
+    self.assertEqual("", natnode.subnet)
+
+    maindb.record_node_communication_success(node, "10.0test", "127.0.1.1", 1234)
+    self.assertEqual("127.0.1", maindb.get_node(node.node_identifier).subnet)
+
+    self.assertEqual(["127.0.1"], maindb._get_subnet_list())
+
+
+
+  def test_counts_are_maintained(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    userport = user.usable_vessel_port
+
+    testutil.create_nodes_on_same_subnet(3, [userport, userport + 1])
+    node = testutil.create_node_and_vessels_with_one_port_each("127.0.1.1", [userport])
+    testutil.create_nat_nodes(2, [userport])
+
+    self.assertEqual(3, _get_count("127.0.0", userport))
+    self.assertEqual(3, _get_count("127.0.0", userport + 1))
+    self.assertEqual(1, _get_count("127.0.1", userport))
+    self.assertEqual(2, AvailableVesselCount.objects.filter(port=userport).count())
+
+    # Acquiring, releasing, and cleaning up a vessel.
+    vessel = maindb.get_vessels_on_node(node)[0]
+    maindb.record_acquired_vessel(user, vessel)
+    self.assertEqual(0, _get_count("127.0.1", userport))
+    maindb.record_released_vessel(vessel)
+    self.assertEqual(0, _get_count("127.0.1", userport))
+    maindb.mark_vessel_as_clean(vessel)
+    self.assertEqual(1, _get_count("127.0.1", userport))
+
+    # Changing the vessel's ports.
+    maindb.set_vessel_ports(vessel, [userport + 1])
+    self.assertEqual(0, _get_count("127.0.1", userport))
+    self.assertEqual(1, _get_count("127.0.1", userport + 1))
+
+    # Changes to the state and ip of the node.
+    maindb.mark_node_as_inactive(node)
+    self.assertEqual(0, _get_count("127.0.1", userport + 1))
+    maindb.record_node_communication_success(node, "10.0test", "127.0.0.100", 1234)
+    self.assertEqual(4, _get_count("127.0.0", userport + 1))
+    maindb.mark_node_as_broken(node)
+    self.assertEqual(3, _get_count("127.0.0", userport + 1))
+
+    self.assertEqual(0, maindb.reconcile_available_vessel_counts())
+
+
+
+  def test_reconcile_corrects_counts(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    userport = user.usable_vessel_port
+
+    testutil.create_nodes_on_same_subnet(3, [userport])
+
+    AvailableVesselCount.objects.all().delete()
+    AvailableVesselCount(subnet="127.9.9", port=userport, count=5).save()
+
+    self.assertEqual(2, maindb.reconcile_available_vessel_counts())
+    self.assertEqual(3, _get_count("127.0.0", userport))
+    self.assertEqual(0, _get_count("127.9.9", userport))
+    self.assertEqual(0, maindb.reconcile_available_vessel_counts())
+
+
+
+  def test_lan_vessels_from_database_use_counts(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    userport = user.usable_vessel_port
+
+    testutil.create_nodes_on_same_subnet(3, [userport], ip_prefix="127.0.0.")
+    testutil.create_nodes_on_same_subnet(2, [userport], ip_prefix="127.0.1.")
+
+    subnets_vessels_list = maindb._get_available_lan_vessels_from_database(userport, 3)
+    self.assertEqual(1, len(subnets_vessels_list))
+    self.assertEqual(3, len(subnets_vessels_list[0]))
+
+    subnets_vessels_list = maindb._get_available_lan_vessels_from_database(userport, 2)
+    self.assertEqual(2, len(subnets_vessels_list))
+
+    # A count that is too high doesn't result in too few vessels being returned.
+    AvailableVesselCount.objects.filter(subnet="127.0.1").update(count=3)
+    subnets_vessels_list = maindb._get_available_lan_vessels_from_database(userport, 3)
+    self.assertEqual(1, len(subnets_vessels_list))
+
+    self.assertEqual([], maindb._get_available_lan_vessels_from_database(userport, 4))
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
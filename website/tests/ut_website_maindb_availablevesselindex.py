@@ -0,0 +1,182 @@
+#pragma out
+#pragma error OK
+"""
+Tests for the in-process available vessel index used by the
+maindb.get_available_*_vessels() functions.
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import maindb
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.website.tests import testutil
+
+import unittest
+
+
+
+
+
+def _get_indexed_vessel_ids(port):
+  """Returns the ids of the vessels in the index for a port without building it."""
+  return maindb.available_vessel_index[port][1].get_vessel_ids()
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    # Setup a fresh database for each test.
+    testlib.setup_test_db()
+
+
+
+  def tearDown(self):
+    # Cleanup the test database.
+    testlib.teardown_test_db()
+
+
+
+  def test_index_is_updated_incrementally(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    userport = user.usable_vessel_port
+    
+    testutil.create_nodes_on_different_subnets(5, [userport])
+    
+    # Building the index happens on the first request.
+    vessel_list = maindb.get_available_rand_vessels(user, 5)
+    self.assertEqual(5, len(vessel_list))
+    self.assertEqual(5, len(_get_indexed_vessel_ids(userport)))
+    
+    # An acquired vessel is removed.
+    acquiredvessel = vessel_list[0]
+    maindb.record_acquired_vessel(user, acquiredvessel)
+    self.assertFalse(acquiredvessel.id in _get_indexed_vessel_ids(userport))
+    
+    # A vessel on a new node is added once its ports are set.
+    node = testutil.create_node_and_vessels_with_one_port_each("127.2.0.1", [userport])
+    self.assertEqual(5, len(_get_indexed_vessel_ids(userport)))
+    
+    # Vessels on a node marked inactive are removed.
+    maindb.mark_node_as_inactive(node)
+    self.assertEqual(4, len(_get_indexed_vessel_ids(userport)))
+    
+    # A released vessel isn't available again until it has been cleaned up.
+    maindb.record_released_vessel(acquiredvessel)
+    self.assertEqual(4, len(_get_indexed_vessel_ids(userport)))
+    maindb.mark_vessel_as_clean(acquiredvessel)
+    self.assertEqual(5, len(_get_indexed_vessel_ids(userport)))
+
+
+
+  def test_stale_index_is_rebuilt(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    userport = user.usable_vessel_port
+    
+    testutil.create_nodes_on_different_subnets(3, [userport])
+    
+    vessel_list = maindb.get_available_wan_vessels(user, 3)
+    self.assertEqual(3, len(vessel_list))
+    
+    # Clearing the index as if the vessels had been created by another
+    # process. The vessels have to be found anyways when more are needed than
+    # the index knows about.
+    maindb.reset_available_vessel_index()
+    maindb._get_available_vessel_index(userport)
+    for vesselid in _get_indexed_vessel_ids(userport):
+      maindb.available_vessel_index[userport][1].remove_vessel(vesselid)
+    
+    vessel_list = maindb.get_available_wan_vessels(user, 3)
+    self.assertEqual(3, len(vessel_list))
+    
+    # Changes made outside of maindb are caught when candidates are checked.
+    for vessel in vessel_list:
+      vessel.is_dirty = True
+      vessel.save()
+    
+    self.assertRaises(UnableToAcquireResourcesError, maindb.get_available_wan_vessels, user, 1)
+
+
+
+
+
+  def test_nat_vessels_not_crowded_out_by_invalid_ips(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    userport = user.usable_vessel_port
+    
+    # Nodes with invalid ips are on the same "" subnet as nat nodes.
+    for i in range(40):
+      testutil.create_node_and_vessels_with_one_port_each("invalidip" + str(i), [userport])
+    testutil.create_nat_nodes(3, [userport])
+    
+    vessel_list = maindb.get_available_nat_vessels(user, 3)
+    self.assertEqual(3, len(vessel_list))
+    for vessel in vessel_list:
+      self.assertTrue(vessel.node.last_known_ip.startswith(maindb.NAT_STRING_PREFIX))
+    
+    # A nat vessel whose node's ip becomes invalid is no longer chosen.
+    node = vessel_list[0].node
+    maindb.record_node_communication_success(node, node.last_known_version, "invalidip",
+                                             node.last_known_port)
+    self.assertRaises(UnableToAcquireResourcesError, maindb.get_available_nat_vessels, user, 3)
+
+
+
+  def test_port_index_structure(self):
+    portindex = maindb._AvailableVesselPortIndex()
+    for vesselid in range(1, 11):
+      # Two vessels per node, two nodes per subnet, and a nat node.
+      nodeid = (vesselid + 1) // 2
+      if nodeid == 5:
+        portindex.add_vessel(vesselid, nodeid, "", is_nat=True)
+      else:
+        portindex.add_vessel(vesselid, nodeid, "127.0." + str((nodeid + 1) // 2))
+    # A node with an invalid ip is on the "" subnet, too, but isn't a nat node.
+    portindex.add_vessel(11, 6, "")
+
+    self.assertEqual(11, len(portindex))
+    self.assertEqual(set(range(1, 12)), set(portindex.sample_vessels(100)))
+    self.assertEqual([9, 10, 11], sorted(portindex.sample_vessels(100, subnet="")))
+    self.assertEqual([9, 10], sorted(portindex.sample_nat_vessels(100)))
+    self.assertEqual([], portindex.sample_vessels(100, subnet="127.0.9"))
+    portindex.remove_vessel(11)
+
+    # One vessel from each subnet, never from nat nodes.
+    vesselidlist = portindex.sample_one_vessel_per_subnet(100)
+    self.assertEqual(2, len(vesselidlist))
+    self.assertEqual(set(["127.0.1", "127.0.2"]),
+                     set([portindex.get_index_values(vesselidlist)[vesselid][1] for vesselid in vesselidlist]))
+
+    # Removing the vessels of a node and of a subnet.
+    portindex.remove_node(1)
+    portindex.remove_vessel(3)
+    portindex.remove_vessel(3)
+    self.assertEqual([4], portindex.get_vessel_ids("127.0.1"))
+    portindex.remove_vessel(4)
+    self.assertEqual(["127.0.2"], portindex.get_subnets_with_vessel_count(1))
+    self.assertEqual([], portindex.get_subnets_with_vessel_count(5))
+    self.assertEqual(set([5, 6, 7, 8, 9, 10]), set(portindex.sample_vessels(100)))
+
+    # A vessel that is added again replaces what the index had for it.
+    portindex.add_vessel(5, 3, "127.0.5")
+    self.assertEqual({5 : (3, "127.0.5", False)}, portindex.get_index_values([5, 1]))
+    self.assertEqual([5], portindex.get_vessel_ids("127.0.5"))
+    self.assertEqual(6, len(portindex))
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
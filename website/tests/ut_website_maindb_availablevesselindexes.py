@@ -0,0 +1,103 @@
+#pragma out
+#pragma error OK
+"""
+Checks that the database uses the composite indexes provided through the
+custom sql in website/control/sql when looking up available vessels. The
+tests are run against sqlite3, but the EXPLAIN output of mysql is understood
+as well in case these are run against a mysql database.
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import maindb
+
+from seattlegeni.website import settings
+
+from seattlegeni.website.tests import testutil
+
+import django.db
+
+import unittest
+
+
+
+
+
+def _get_sql_and_params(queryset):
+  """
+  Returns the sql and params django would execute for the queryset. How to get
+  this differs between django versions.
+  """
+  query = queryset.query
+  if hasattr(query, "get_compiler"):
+    return query.get_compiler(using=queryset.db).as_sql()
+  else:
+    return query.as_sql()
+
+
+
+
+
+def _get_indexes_used(queryset):
+  """
+  Returns a string that contains the names of the indexes the database says it
+  will use for the queryset.
+  """
+  sql, params = _get_sql_and_params(queryset)
+
+  cursor = django.db.connection.cursor()
+  
+  if settings.DATABASE_ENGINE == "mysql":
+    cursor.execute("EXPLAIN " + sql, params)
+    columnnames = [column[0] for column in cursor.description]
+    keyindex = columnnames.index("key")
+    return " ".join([str(row[keyindex]) for row in cursor.fetchall()])
+  
+  else:
+    cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+    # The last column is the description of how each table is accessed.
+    return " ".join([str(row[-1]) for row in cursor.fetchall()])
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    # Setup a fresh database for each test.
+    testlib.setup_test_db()
+
+
+
+  def tearDown(self):
+    # Cleanup the test database.
+    testlib.teardown_test_db()
+
+
+
+  def test_available_vessels_uses_port_index(self):
+    userport = 100
+    
+    testutil.create_nodes_on_different_subnets(10, [userport - 1, userport, userport + 1])
+    
+    queryset = maindb._get_queryset_of_all_available_vessels_for_a_port_include_nat_nodes(userport)
+    self.assertEqual(10, queryset.count())
+    
+    indexes_used = _get_indexes_used(queryset)
+    self.assertTrue("control_vesselport_port_vessel" in indexes_used or
+                    "control_vessel_availability" in indexes_used, indexes_used)
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
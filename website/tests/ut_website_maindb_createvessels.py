@@ -0,0 +1,86 @@
+#pragma out
+#pragma error OK
+"""
+Tests for creating many vessels and their ports at once with
+maindb.create_vessels_with_ports().
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import maindb
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.website.tests import testutil
+
+import unittest
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    # Setup a fresh database for each test.
+    testlib.setup_test_db()
+
+
+
+  def tearDown(self):
+    # Cleanup the test database.
+    testlib.teardown_test_db()
+
+
+
+  def test_create_vessels_with_ports(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    userport = user.usable_vessel_port
+
+    node = testutil.create_node_and_vessels_with_one_port_each("127.0.0.1", [])
+
+    self.assertEqual([], maindb.create_vessels_with_ports(node, []))
+
+    requested = [("v10", [userport, 2000]), ("v11", [2001]), ("v12", [userport])]
+    vessel_list = maindb.create_vessels_with_ports(node, requested)
+
+    self.assertEqual(["v10", "v11", "v12"], [vessel.name for vessel in vessel_list])
+
+    for (vessel, (vesselname, port_list)) in zip(vessel_list, requested):
+      vessel = maindb.get_vessel(node.node_identifier, vesselname)
+      self.assertFalse(vessel.is_dirty)
+      self.assertEqual(None, vessel.acquired_by_user)
+      self.assertEqual(sorted(port_list), sorted([vp.port for vp in vessel.vesselport_set.all()]))
+
+    # The vessels are available the same as if they had been created one at a
+    # time, and the available vessel counts were kept up to date.
+    available = maindb.get_available_rand_vessels(user, 2)
+    self.assertEqual(["v10", "v12"], sorted([vessel.name for vessel in available]))
+    self.assertEqual(0, maindb.reconcile_available_vessel_counts())
+
+
+
+  def test_create_vessels_with_ports_is_atomic(self):
+    node = testutil.create_node_and_vessels_with_one_port_each("127.0.0.1", [])
+
+    maindb.create_vessels_with_ports(node, [("v10", [2000])])
+
+    # The second vessel already exists, so none of them are created.
+    self.assertRaises(Exception, maindb.create_vessels_with_ports, node,
+                      [("v11", [2001]), ("v10", [2002])])
+
+    self.assertEqual(["v10"], [vessel.name for vessel in maindb.get_vessels_on_node(node)])
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
@@ -0,0 +1,104 @@
+#pragma out
+#pragma error OK
+"""
+Tests for marking expired vessels as dirty and logging them, both of which
+change many records at once.
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import maindb
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.website.control.models import ActionLogVesselDetails
+from seattlegeni.website.control.models import Vessel
+
+from seattlegeni.website.tests import testutil
+
+from datetime import datetime
+from datetime import timedelta
+
+import unittest
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    # Setup a fresh database for each test.
+    testlib.setup_test_db()
+
+
+
+  def tearDown(self):
+    # Cleanup the test database.
+    testlib.teardown_test_db()
+
+
+
+  def test_mark_expired_vessels_as_dirty(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    userport = user.usable_vessel_port
+
+    testutil.create_nodes_on_different_subnets(3, [userport])
+
+    vessel_list = maindb.get_available_rand_vessels(user, 3)
+    for vessel in vessel_list:
+      maindb.record_acquired_vessel(user, vessel)
+
+    self.assertEqual([], maindb.mark_expired_vessels_as_dirty())
+
+    expiredidlist = []
+    for vessel in vessel_list[:2]:
+      vessel.date_expires = datetime.now() - timedelta(seconds=1)
+      vessel.save()
+      expiredidlist.append(vessel.id)
+
+    expired_list = maindb.mark_expired_vessels_as_dirty()
+    self.assertEqual(sorted(expiredidlist), sorted([vessel.id for vessel in expired_list]))
+
+    for vessel in expired_list:
+      self.assertTrue(vessel.is_dirty)
+      vessel = Vessel.objects.get(id=vessel.id)
+      self.assertEqual(None, vessel.acquired_by_user)
+      self.assertTrue(vessel.is_dirty)
+      self.assertEqual(None, vessel.date_expires)
+      self.assertEqual([], maindb.get_users_with_access_to_vessel(vessel))
+
+    stillacquired = Vessel.objects.get(id=vessel_list[2].id)
+    self.assertEqual(user.id, stillacquired.acquired_by_user_id)
+    self.assertEqual([user.id], [u.id for u in maindb.get_users_with_access_to_vessel(stillacquired)])
+
+    self.assertEqual([], maindb.mark_expired_vessels_as_dirty())
+
+
+
+  def test_create_action_log_event_vessel_details(self):
+    testutil.create_nodes_on_different_subnets(2, [100])
+    vessel_list = list(Vessel.objects.select_related('node'))
+
+    maindb.create_action_log_event("mark_expired_vessels_as_dirty", user=None, second_arg=None,
+                                   third_arg=None, was_successful=True, message=None,
+                                   date_started=datetime.now(), vessel_list=vessel_list)
+
+    details_list = list(ActionLogVesselDetails.objects.all())
+    self.assertEqual(2, len(details_list))
+    self.assertEqual(sorted([(v.node_id, v.node.last_known_ip, v.node.last_known_port, v.name) for v in vessel_list]),
+                     sorted([(d.node_id, d.node_address, d.node_port, d.vessel_name) for d in details_list]))
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
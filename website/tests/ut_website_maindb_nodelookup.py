@@ -0,0 +1,102 @@
+#pragma out
+#pragma error OK
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import maindb
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.website.control.models import Vessel
+
+from seattlegeni.website.tests import testutil
+
+import unittest
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    # Setup a fresh database for each test.
+    testlib.setup_test_db()
+
+
+
+  def tearDown(self):
+    # Cleanup the test database.
+    testlib.teardown_test_db()
+
+
+
+  def test_node_identifier_hash_is_set(self):
+    node = testutil.create_node_and_vessels_with_one_port_each("127.0.0.1", [])
+    
+    expected_hash = maindb._get_node_identifier_hash(node.node_identifier)
+    self.assertEqual(40, len(expected_hash))
+    
+    node = maindb.get_node(node.node_identifier)
+    self.assertEqual(expected_hash, node.node_identifier_hash)
+
+
+
+  def test_get_node_and_vessel_by_identifier(self):
+    node1 = testutil.create_node_and_vessels_with_one_port_each("127.0.0.1", [100])
+    node2 = testutil.create_node_and_vessels_with_one_port_each("127.0.0.2", [100])
+    
+    self.assertEqual(node1.id, maindb.get_node(node1.node_identifier).id)
+    self.assertEqual(node2.id, maindb.get_node(node2.node_identifier).id)
+    
+    # The test utility names the first vessel on each node "v2".
+    vessel = maindb.get_vessel(node2.node_identifier, "v2")
+    self.assertEqual(node2.id, vessel.node.id)
+    
+    self.assertRaises(DoesNotExistError, maindb.get_node, "nosuchnode")
+    self.assertRaises(DoesNotExistError, maindb.get_vessel, node1.node_identifier, "v3")
+    self.assertRaises(DoesNotExistError, maindb.get_vessel, "nosuchnode", "v2")
+
+
+
+
+  def test_get_vessels_and_their_nodes(self):
+    node1 = testutil.create_node_and_vessels_with_one_port_each("127.0.0.1", [100, 101])
+    node2 = testutil.create_node_and_vessels_with_one_port_each("127.0.0.2", [100])
+    
+    # Node 2 has no v3, but node 1 does, so it shows up in the query results.
+    requested = [(node2.node_identifier, "v2"), (node1.node_identifier, "v3"),
+                 (node1.node_identifier, "v2")]
+    vessel_list = maindb.get_vessels(requested)
+    
+    self.assertEqual(requested, [(vessel.node.node_identifier, vessel.name) for vessel in vessel_list])
+    self.assertEqual([], maindb.get_vessels([]))
+    
+    self.assertRaises(DoesNotExistError, maindb.get_vessels, [(node2.node_identifier, "v3")])
+    self.assertRaises(DoesNotExistError, maindb.get_vessels, [(node1.node_identifier, "v2"), ("nosuchnode", "v2")])
+    
+    nodedict = maindb.get_nodes_of_vessels(vessel_list)
+    self.assertEqual(2, len(nodedict))
+    self.assertEqual(node1.node_identifier, nodedict[node1.id].node_identifier)
+    
+    # The nodes retrieved along with the vessels are used.
+    self.assertTrue(nodedict[node2.id] is vessel_list[0].node)
+    
+    # The nodes of vessels retrieved without their node are looked up.
+    vessel = Vessel.objects.get(id=vessel_list[0].id)
+    nodedict = maindb.get_nodes_of_vessels([vessel, vessel_list[1]])
+    self.assertEqual(node2.node_identifier, nodedict[node2.id].node_identifier)
+    self.assertTrue(nodedict[node1.id] is vessel_list[1].node)
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
@@ -0,0 +1,104 @@
+#pragma out
+#pragma error OK
+"""
+Tests for the caching of successful password authentications done by
+maindb.get_user_with_password().
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import maindb
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.website import settings
+
+from seattlegeni.website.control.models import GeniUser
+
+import unittest
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    # Setup a fresh database for each test.
+    testlib.setup_test_db()
+    maindb.reset_password_check_stats()
+    self.original_secret_key = settings.SECRET_KEY
+
+
+
+  def tearDown(self):
+    settings.SECRET_KEY = self.original_secret_key
+    # Cleanup the test database.
+    testlib.teardown_test_db()
+
+
+
+  def test_authentication_is_cached(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+
+    self.assertEqual(user.id, maindb.get_user_with_password("testuser", "password").id)
+
+    # The user is loaded from the database, but the password isn't checked.
+    GeniUser.objects.filter(id=user.id).update(affiliation="changed")
+    self.assertEqual("changed", maindb.get_user_with_password("testuser", "password").affiliation)
+
+    # A wrong password is still checked against the database.
+    self.assertRaises(DoesNotExistError, maindb.get_user_with_password, "testuser", "wrongpassword")
+
+    stats = maindb.get_password_check_stats()
+    self.assertEqual(2, stats["hashed_count"])
+    self.assertEqual(1, stats["cached_count"])
+    self.assertTrue(stats["hashed_seconds"] >= 0)
+
+    # Neither the password nor the user's password hash, api key or private
+    # key are stored in the cache.
+    cachedvalue = maindb.django.core.cache.cache.get(maindb._get_password_auth_cache_key("testuser"))
+    self.assertEqual(user.id, cachedvalue[1])
+    for value in cachedvalue:
+      self.assertFalse(isinstance(value, GeniUser))
+      for secret in ["password", user.password, user.api_key, user.user_privkey]:
+        self.assertFalse(secret in str(value))
+
+
+
+  def test_password_change_forgets_authentication(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+
+    maindb.get_user_with_password("testuser", "password")
+
+    maindb.set_user_password(user, "newpassword")
+    self.assertRaises(DoesNotExistError, maindb.get_user_with_password, "testuser", "password")
+    self.assertEqual(user.id, maindb.get_user_with_password("testuser", "newpassword").id)
+
+
+
+  def test_not_cached_without_secret_key(self):
+    settings.SECRET_KEY = ''
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+
+    maindb.get_user_with_password("testuser", "password")
+    maindb.get_user_with_password("testuser", "password")
+
+    stats = maindb.get_password_check_stats()
+    self.assertEqual(2, stats["hashed_count"])
+    self.assertEqual(0, stats["cached_count"])
+    self.assertEqual(None, maindb.django.core.cache.cache.get(maindb._get_password_auth_cache_key("testuser")))
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
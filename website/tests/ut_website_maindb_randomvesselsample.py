@@ -0,0 +1,118 @@
+#pragma out
+#pragma error OK
+"""
+Tests for maindb._get_random_vessel_sample(), which chooses available vessels
+at random from the database when the available vessel index isn't used.
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import maindb
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.website.tests import testutil
+
+import unittest
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    # Setup a fresh database for each test.
+    testlib.setup_test_db()
+    self.user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    self.userport = self.user.usable_vessel_port
+    # Vessels on other ports make the id space larger than the queryset.
+    testutil.create_nodes_on_different_subnets(60, [self.userport - 1, self.userport, self.userport + 1])
+    self.queryset = maindb._get_queryset_of_all_available_vessels_for_a_port_include_nat_nodes(self.userport)
+
+
+
+  def tearDown(self):
+    maindb.USE_AVAILABLE_VESSEL_INDEX = True
+    # Cleanup the test database.
+    testlib.teardown_test_db()
+
+
+
+  def test_sample_is_random_subset_of_queryset(self):
+    availableidset = set(self.queryset.values_list('id', flat=True))
+    self.assertEqual(60, len(availableidset))
+
+    chosenidset = set()
+    for i in range(200):
+      vessel_list = maindb._get_random_vessel_sample(self.queryset, 5)
+      vesselidset = set([vessel.id for vessel in vessel_list])
+      self.assertEqual(5, len(vesselidset))
+      self.assertTrue(vesselidset.issubset(availableidset))
+      chosenidset.update(vesselidset)
+
+    # Every vessel, including those with the smallest and largest ids, gets
+    # chosen sometimes.
+    self.assertEqual(availableidset, chosenidset)
+
+
+
+  def test_sample_larger_than_queryset(self):
+    vessel_list = maindb._get_random_vessel_sample(self.queryset, 100)
+    self.assertEqual(60, len(set([vessel.id for vessel in vessel_list])))
+
+    # A queryset with only a few vessels, scattered through the id space.
+    vesselidlist = list(self.queryset.values_list('id', flat=True))[::20]
+    queryset = self.queryset.filter(id__in=vesselidlist)
+    vessel_list = maindb._get_random_vessel_sample(queryset, 2)
+    self.assertEqual(2, len(vessel_list))
+
+    vessel_list = maindb._get_random_vessel_sample(queryset.filter(id=-1), 2)
+    self.assertEqual([], vessel_list)
+
+
+
+  def test_get_available_vessels_without_index(self):
+    maindb.USE_AVAILABLE_VESSEL_INDEX = False
+
+    vessel_list = maindb.get_available_rand_vessels(self.user, 5)
+    self.assertEqual(maindb.GET_AVAILABLE_VESSELS_MULTIPLIER * 5 + maindb.GET_AVAILABLE_VESSELS_ADDER,
+                     len(vessel_list))
+
+    self.assertEqual(60, len(maindb.get_available_rand_vessels(self.user, 60)))
+    self.assertRaises(UnableToAcquireResourcesError, maindb.get_available_rand_vessels, self.user, 61)
+
+
+
+  def test_get_available_wan_vessels_without_index(self):
+    maindb.USE_AVAILABLE_VESSEL_INDEX = False
+
+    # More nodes on a subnet that already has one, nat nodes, and a node with
+    # an invalid ip, none of which add a subnet.
+    for ip in ["127.1.0.1", "127.1.0.2", "invalidip"]:
+      testutil.create_node_and_vessels_with_one_port_each(ip, [self.userport])
+    testutil.create_nat_nodes(5, [self.userport])
+
+    expectedcount = maindb.GET_AVAILABLE_VESSELS_MULTIPLIER * 5 + maindb.GET_AVAILABLE_VESSELS_ADDER
+    for (vesselcount, returnedcount) in [(5, expectedcount), (60, 60)]:
+      vessel_list = maindb.get_available_wan_vessels(self.user, vesselcount)
+      subnetlist = [vessel.node.subnet for vessel in vessel_list]
+      self.assertEqual(returnedcount, len(set(subnetlist)))
+      self.assertEqual(returnedcount, len(subnetlist))
+      self.assertFalse("" in subnetlist)
+
+    self.assertRaises(UnableToAcquireResourcesError, maindb.get_available_wan_vessels, self.user, 61)
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
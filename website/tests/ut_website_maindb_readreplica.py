@@ -0,0 +1,156 @@
+#pragma out
+#pragma error OK
+"""
+Tests for deciding whether maindb reads that allow stale data go to the read
+replica. The tests only use a single database, so the replica's lag is faked.
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import maindb
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.website import settings
+
+from seattlegeni.website.control.models import Node
+
+from seattlegeni.website.tests import testutil
+
+import unittest
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    # Setup a fresh database for each test.
+    testlib.setup_test_db()
+
+    self.original_get_read_replica_lag_seconds = maindb._get_read_replica_lag_seconds
+    self.original_connect_to_read_replica = maindb._connect_to_read_replica
+    self.lag_check_count = 0
+    maindb.read_replica_status = None
+
+
+
+  def tearDown(self):
+    # Cleanup the test database.
+    testlib.teardown_test_db()
+
+    maindb._get_read_replica_lag_seconds = self.original_get_read_replica_lag_seconds
+    maindb._connect_to_read_replica = self.original_connect_to_read_replica
+    maindb.read_replica_status = None
+    settings.MAINDB_READ_REPLICA = None
+    settings.MAINDB_READ_REPLICA_MAX_LAG_SECONDS = 30
+
+
+
+  def _fake_replica_lag(self, lag):
+    settings.MAINDB_READ_REPLICA = {'ENGINE': 'django.db.backends.mysql'}
+
+    def mock_get_read_replica_lag_seconds():
+      self.lag_check_count += 1
+      return lag
+    maindb._get_read_replica_lag_seconds = mock_get_read_replica_lag_seconds
+
+
+
+  def test_no_replica_configured(self):
+    testutil.create_nodes_on_different_subnets(3, [100])
+
+    self.assertFalse(maindb._is_read_replica_usable())
+
+    queryset = Node.objects.all()
+    self.assertTrue(maindb.get_queryset_for_reading(queryset) is queryset)
+
+    self.assertEqual(3, len(maindb.get_active_nodes(allow_stale=True)))
+    self.assertEqual(3, len(maindb._get_subnet_list(allow_stale=True)))
+
+
+
+  def test_replica_within_max_lag(self):
+    self._fake_replica_lag(5)
+    self.assertTrue(maindb._is_read_replica_usable())
+
+    # The result is reused rather than checking the replica every time.
+    self.assertTrue(maindb._is_read_replica_usable())
+    self.assertEqual(1, self.lag_check_count)
+
+
+
+  def test_replica_too_far_behind(self):
+    self._fake_replica_lag(31)
+    self.assertFalse(maindb._is_read_replica_usable())
+
+
+
+  def test_replica_not_replicating(self):
+    self._fake_replica_lag(None)
+    self.assertFalse(maindb._is_read_replica_usable())
+
+
+
+  def test_replica_lag_not_checked(self):
+    self._fake_replica_lag(1000)
+    settings.MAINDB_READ_REPLICA_MAX_LAG_SECONDS = None
+    maindb._connect_to_read_replica = lambda: None
+    self.assertTrue(maindb._is_read_replica_usable())
+    self.assertEqual(0, self.lag_check_count)
+
+
+
+  def test_replica_unreachable(self):
+    testutil.create_nodes_on_different_subnets(3, [100])
+
+    # The test database has no replica connection, so using it fails.
+    settings.MAINDB_READ_REPLICA = {'ENGINE': 'django.db.backends.mysql'}
+
+    # Initializing the primary database doesn't touch the replica.
+    maindb.init_maindb()
+
+    self.assertFalse(maindb._is_read_replica_usable())
+    self.assertEqual(3, len(maindb.get_active_nodes(allow_stale=True)))
+
+    maindb.read_replica_status = None
+    settings.MAINDB_READ_REPLICA_MAX_LAG_SECONDS = None
+    self.assertFalse(maindb._is_read_replica_usable())
+    self.assertEqual(3, len(maindb._get_subnet_list(allow_stale=True)))
+
+
+
+  def test_replica_connection_setup_fails(self):
+    testutil.create_nodes_on_different_subnets(3, [100])
+    self._fake_replica_lag(5)
+
+    class MockReplicaConnection(object):
+      closed = False
+      def cursor(self):
+        raise Exception("replica is down")
+      def close(self):
+        self.closed = True
+
+    connection = MockReplicaConnection()
+    self.assertRaises(Exception, maindb.init_read_replica_connection, connection)
+    self.assertTrue(connection.closed)
+
+    # The replica isn't used until it is checked again.
+    self.assertFalse(maindb._is_read_replica_usable())
+    self.assertEqual(0, self.lag_check_count)
+    self.assertEqual(3, len(maindb.get_active_nodes(allow_stale=True)))
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
@@ -0,0 +1,137 @@
+#pragma out
+#pragma error OK
+"""
+Tests for the maindb functions that count a user's acquired vessels and
+donations rather than retrieving them, or that retrieve a page of them at a
+time.
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import maindb
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.website.tests import testutil
+
+from datetime import datetime
+from datetime import timedelta
+
+import unittest
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    # Setup a fresh database for each test.
+    testlib.setup_test_db()
+
+
+
+  def tearDown(self):
+    # Cleanup the test database.
+    testlib.teardown_test_db()
+
+
+
+  def test_acquired_vessel_count(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    userport = user.usable_vessel_port
+
+    testutil.create_nodes_on_different_subnets(3, [userport])
+
+    self.assertEqual(0, maindb.get_acquired_vessel_count(user))
+
+    vessel_list = maindb.get_available_rand_vessels(user, 3)
+    for vessel in vessel_list:
+      maindb.record_acquired_vessel(user, vessel)
+
+    self.assertEqual(3, maindb.get_acquired_vessel_count(user))
+
+    # Expired vessels aren't counted even before they are marked as dirty.
+    vessel_list[0].date_expires = datetime.now() - timedelta(seconds=1)
+    vessel_list[0].save()
+    self.assertEqual(2, maindb.get_acquired_vessel_count(user))
+
+    maindb.record_released_vessel(vessel_list[1])
+    self.assertEqual(1, maindb.get_acquired_vessel_count(user))
+    self.assertEqual(len(maindb.get_acquired_vessels(user)), maindb.get_acquired_vessel_count(user))
+
+
+
+  def test_acquired_vessels_page(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    userport = user.usable_vessel_port
+
+    testutil.create_nodes_on_different_subnets(5, [userport])
+
+    vessel_list = maindb.get_available_rand_vessels(user, 5)
+    for vessel in vessel_list:
+      maindb.record_acquired_vessel(user, vessel)
+
+    # Expired vessels aren't included.
+    vessel_list[0].date_expires = datetime.now() - timedelta(seconds=1)
+    vessel_list[0].save()
+
+    paged_vessel_list = []
+    after_vessel_id = 0
+    while True:
+      page = maindb.get_acquired_vessels_page(user, after_vessel_id, 2)
+      self.assertTrue(len(page) <= 2)
+      if not page:
+        break
+      paged_vessel_list += page
+      after_vessel_id = page[-1].id
+
+    expected_ids = sorted([vessel.id for vessel in maindb.get_acquired_vessels(user)])
+    self.assertEqual(4, len(expected_ids))
+    self.assertEqual(expected_ids, [vessel.id for vessel in paged_vessel_list])
+
+
+
+  def test_donation_count(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+
+    for i in range(3):
+      node = testutil.create_node_and_vessels_with_one_port_each("127.0.0." + str(i), [])
+      maindb.create_donation(node, user, "")
+
+    self.assertEqual(3, maindb.get_donation_count_by_user(user))
+    self.assertEqual(30 + user.free_vessel_credits, maindb.get_user_total_vessel_credits(user))
+
+    maindb.mark_node_as_inactive(node)
+    self.assertEqual(2, maindb.get_donation_count_by_user(user))
+    self.assertEqual(3, maindb.get_donation_count_by_user(user, include_inactive_and_broken=True))
+
+
+
+  def test_require_user_can_acquire_resources(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    userport = user.usable_vessel_port
+
+    testutil.create_nodes_on_different_subnets(2, [userport])
+
+    for vessel in maindb.get_available_rand_vessels(user, 2):
+      maindb.record_acquired_vessel(user, vessel)
+
+    credits = maindb.get_user_total_vessel_credits(user)
+    maindb.require_user_can_acquire_resources(user, credits - 2)
+    self.assertRaises(InsufficientUserResourcesError,
+                      maindb.require_user_can_acquire_resources, user, credits - 1)
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
@@ -0,0 +1,120 @@
+#pragma out
+#pragma error OK
+"""
+Tests for the version of vessel records and for renewing vessels without
+holding node locks.
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import maindb
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.website.control.models import Vessel
+
+from seattlegeni.website.tests import testutil
+
+from datetime import datetime
+from datetime import timedelta
+
+import unittest
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    # Setup a fresh database for each test.
+    testlib.setup_test_db()
+
+
+
+  def tearDown(self):
+    # Cleanup the test database.
+    testlib.teardown_test_db()
+
+
+
+  def test_version_is_incremented(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    userport = user.usable_vessel_port
+
+    testutil.create_nodes_on_different_subnets(1, [userport])
+    vessel = maindb.get_available_rand_vessels(user, 1)[0]
+    self.assertEqual(0, vessel.version)
+
+    maindb.record_acquired_vessel(user, vessel)
+    self.assertEqual(1, vessel.version)
+    maindb.record_released_vessel(vessel)
+    maindb.mark_vessel_as_clean(vessel)
+    self.assertEqual(3, vessel.version)
+
+    vessel = Vessel.objects.get(id=vessel.id)
+    self.assertEqual(3, vessel.version)
+    self.assertFalse(vessel.is_dirty)
+    self.assertEqual(None, vessel.acquired_by_user)
+
+
+
+  def test_update_does_not_overwrite_renewal(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    userport = user.usable_vessel_port
+
+    testutil.create_nodes_on_different_subnets(1, [userport])
+    vessel = maindb.get_available_rand_vessels(user, 1)[0]
+    maindb.record_acquired_vessel(user, vessel)
+
+    # Another object for the same vessel is renewed while this one is used to
+    # change a different field.
+    othervessel = Vessel.objects.get(id=vessel.id)
+    self.assertEqual(1, maindb.renew_vessels_of_user(user, [othervessel]))
+    maindb.mark_vessel_as_needing_user_key_sync(vessel)
+
+    vessel = Vessel.objects.get(id=vessel.id)
+    self.assertEqual(othervessel.date_expires, vessel.date_expires)
+    self.assertFalse(vessel.user_keys_in_sync)
+
+
+
+  def test_renew_vessels_of_user(self):
+    user = maindb.create_user("testuser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    otheruser = maindb.create_user("otheruser", "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    userport = user.usable_vessel_port
+
+    testutil.create_nodes_on_different_subnets(4, [userport])
+    vessel_list = maindb.get_available_rand_vessels(user, 4)
+    maindb.record_acquired_vessel(user, vessel_list[0])
+    maindb.record_acquired_vessel(user, vessel_list[1])
+    maindb.record_released_vessel(vessel_list[1])
+    maindb.record_acquired_vessel(otheruser, vessel_list[2])
+
+    # Only the first vessel is acquired by the user.
+    self.assertEqual(1, maindb.renew_vessels_of_user(user, vessel_list))
+
+    onedayfromnow = datetime.now() + timedelta(days=1)
+    self.assertTrue(vessel_list[0].date_expires > onedayfromnow)
+    self.assertTrue(Vessel.objects.get(id=vessel_list[0].id).date_expires > onedayfromnow)
+
+    for vessel in vessel_list[1:]:
+      vessel = Vessel.objects.get(id=vessel.id)
+      self.assertTrue(vessel.date_expires is None or vessel.date_expires < onedayfromnow)
+    self.assertEqual(otheruser.id, Vessel.objects.get(id=vessel_list[2].id).acquired_by_user_id)
+
+    self.assertEqual(0, maindb.renew_vessels_of_user(user, []))
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
@@ -0,0 +1,195 @@
+#pragma out
+#pragma error OK
+"""
+Tests the cache of get_node_info() results in the nodemanager api, with the
+nmclient functions it uses mocked out.
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import nodemanager
+
+import unittest
+
+
+
+
+
+NODE_IP = "127.0.0.1"
+NODE_PORT = 1224
+
+# The number of times each mock nmclient function has been called.
+nmclient_call_counts = {}
+
+# What the mock node returns for GetVessels.
+mock_vesseldict = {}
+
+
+
+
+
+def _count_call(name):
+  nmclient_call_counts[name] = nmclient_call_counts.get(name, 0) + 1
+
+
+
+def mock_nmclient_createhandle(ip, port):
+  _count_call("createhandle")
+  return "handle"
+
+
+
+def mock_nmclient_destroyhandle(nmhandle):
+  _count_call("destroyhandle")
+
+
+
+def mock_nmclient_getvesseldict(nmhandle):
+  _count_call("getvesseldict")
+  vesseldict = {"nodekey" : "nodekey", "version" : "0.1",
+                "vessels" : {"v1" : {"status" : "Fresh"}}}
+  vesseldict["vessels"].update(mock_vesseldict)
+  return vesseldict
+
+
+
+def mock_nmclient_get_handle_info(nmhandle):
+  return {}
+
+
+
+def mock_nmclient_set_handle_info(nmhandle, handleinfo):
+  pass
+
+
+
+def mock_nmclient_signedsay(nmhandle, *callargs):
+  _count_call("signedsay")
+  return "Success"
+
+
+
+def mock_rsa_string_to_key(keystring):
+  return keystring
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    nmclient_call_counts.clear()
+    mock_vesseldict.clear()
+    nodemanager.reset_node_info_cache()
+
+    self.originals = {}
+    mocks = {"nmclient_createhandle" : mock_nmclient_createhandle,
+             "nmclient_destroyhandle" : mock_nmclient_destroyhandle,
+             "nmclient_getvesseldict" : mock_nmclient_getvesseldict,
+             "nmclient_get_handle_info" : mock_nmclient_get_handle_info,
+             "nmclient_set_handle_info" : mock_nmclient_set_handle_info,
+             "nmclient_signedsay" : mock_nmclient_signedsay,
+             "rsa_string_to_publickey" : mock_rsa_string_to_key,
+             "rsa_string_to_privatekey" : mock_rsa_string_to_key}
+    for name in mocks:
+      self.originals[name] = getattr(nodemanager, name)
+      setattr(nodemanager, name, mocks[name])
+
+
+
+  def tearDown(self):
+    for name in self.originals:
+      setattr(nodemanager, name, self.originals[name])
+    nodemanager.reset_node_info_cache()
+
+
+
+  def test_cached_result_is_used_within_ttl(self):
+    nodeinfo = nodemanager.get_node_info(NODE_IP, NODE_PORT)
+    self.assertEqual(1, nmclient_call_counts["getvesseldict"])
+    # Missing keys are filled in.
+    self.assertEqual([], nodeinfo["vessels"]["v1"]["userkeys"])
+
+    # Without allow_cached the node is always asked.
+    nodemanager.get_node_info(NODE_IP, NODE_PORT)
+    self.assertEqual(2, nmclient_call_counts["getvesseldict"])
+
+    cachednodeinfo = nodemanager.get_node_info(NODE_IP, NODE_PORT, allow_cached=True)
+    self.assertEqual(2, nmclient_call_counts["getvesseldict"])
+    self.assertEqual(nodeinfo, cachednodeinfo)
+
+    # Other nodes aren't served from this node's entry.
+    nodemanager.get_node_info(NODE_IP, NODE_PORT + 1, allow_cached=True)
+    self.assertEqual(3, nmclient_call_counts["getvesseldict"])
+
+    # Make the entry older than the TTL.
+    cachekey = nodemanager._get_node_info_cache_key(NODE_IP, NODE_PORT)
+    (time_stored, entry) = nodemanager.node_info_cache[cachekey]
+    nodemanager.node_info_cache[cachekey] = (time_stored - nodemanager.NODE_INFO_CACHE_SECONDS, entry)
+
+    mock_vesseldict["v2"] = {"status" : "Fresh"}
+    nodeinfo = nodemanager.get_node_info(NODE_IP, NODE_PORT, allow_cached=True)
+    self.assertEqual(4, nmclient_call_counts["getvesseldict"])
+    self.assertTrue("v2" in nodeinfo["vessels"])
+
+
+
+  def test_cached_result_is_a_copy(self):
+    nodeinfo = nodemanager.get_node_info(NODE_IP, NODE_PORT)
+
+    # Changing what was returned doesn't change the cache.
+    nodeinfo["vessels"]["v1"]["userkeys"].append("userkey")
+    del nodeinfo["vessels"]["v1"]["status"]
+
+    cachednodeinfo = nodemanager.get_node_info(NODE_IP, NODE_PORT, allow_cached=True)
+    self.assertEqual(1, nmclient_call_counts["getvesseldict"])
+    self.assertEqual([], cachednodeinfo["vessels"]["v1"]["userkeys"])
+    self.assertEqual("Fresh", cachednodeinfo["vessels"]["v1"]["status"])
+
+    # Nor does changing what was returned from the cache.
+    cachednodeinfo["vessels"].clear()
+    cachednodeinfo = nodemanager.get_node_info(NODE_IP, NODE_PORT, allow_cached=True)
+    self.assertTrue("v1" in cachednodeinfo["vessels"])
+
+
+
+  def test_signed_call_invalidates_cache(self):
+    nodemanager.get_node_info(NODE_IP, NODE_PORT)
+    nodemanager.get_node_info(NODE_IP, NODE_PORT + 1)
+
+    nodehandle = nodemanager.get_node_handle("nodekey", NODE_IP, NODE_PORT, "pubkey", "privkey")
+    nodemanager.reset_vessel(nodehandle, "v1")
+    self.assertEqual(1, nmclient_call_counts["signedsay"])
+
+    nodemanager.get_node_info(NODE_IP, NODE_PORT, allow_cached=True)
+    self.assertEqual(3, nmclient_call_counts["getvesseldict"])
+
+    # The other node's entry is still used.
+    nodemanager.get_node_info(NODE_IP, NODE_PORT + 1, allow_cached=True)
+    self.assertEqual(3, nmclient_call_counts["getvesseldict"])
+
+    # Every handle that was created was destroyed.
+    self.assertEqual(nmclient_call_counts["createhandle"], nmclient_call_counts["destroyhandle"])
+
+
+
+  def test_invalidate(self):
+    nodemanager.get_node_info(NODE_IP, NODE_PORT)
+    nodemanager.invalidate_node_info_cache(NODE_IP, NODE_PORT)
+    nodemanager.get_node_info(NODE_IP, NODE_PORT, allow_cached=True)
+    self.assertEqual(2, nmclient_call_counts["getvesseldict"])
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
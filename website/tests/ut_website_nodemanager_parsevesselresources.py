@@ -0,0 +1,81 @@
+#pragma out
+#pragma error OK
+"""
+Tests the parsing of vessel resource files in the nodemanager api.
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import nodemanager
+
+import unittest
+
+
+
+
+
+RESOURCEDATA = """resource cpu .10
+resource memory 100000000   # 100 MiB
+resource events 10
+resource connport 1224
+resource connport 12345.0
+resource connport 1223
+resource messport 1223
+resource messport 1224
+resource messport 12345
+resource messport 5000
+
+call gethostbyname_ex allow
+"""
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def test_parse(self):
+    parsed = nodemanager.parse_vessel_resources(RESOURCEDATA)
+
+    self.assertEqual({"cpu" : 0.1, "memory" : 100000000.0, "events" : 10.0},
+                     parsed["resources"])
+    self.assertEqual([1224, 12345, 1223], parsed["connports"])
+    self.assertEqual([1223, 1224, 12345, 5000], parsed["messports"])
+
+    # The usable ports are in the order of the connports.
+    self.assertEqual([1224, 12345, 1223], parsed["usableports"])
+
+
+
+  def test_parse_empty(self):
+    parsed = nodemanager.parse_vessel_resources("")
+    self.assertEqual({}, parsed["resources"])
+    self.assertEqual([], parsed["usableports"])
+
+
+
+  def test_parse_malformed(self):
+    self.assertRaises(ValueError, nodemanager.parse_vessel_resources,
+                      "resource connport\n")
+    self.assertRaises(ValueError, nodemanager.parse_vessel_resources,
+                      "resource messport abc\n")
+
+
+
+  def test_non_numeric_quantity_is_left_out(self):
+    parsed = nodemanager.parse_vessel_resources("resource cpu abc\nresource events 10\n")
+    self.assertEqual({"events" : 10.0}, parsed["resources"])
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
@@ -0,0 +1,115 @@
+#pragma out
+#pragma error OK
+"""
+Tests for the aggregation of request profiles by common/util/profiling.py,
+which the website's profiling middleware uses.
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.util import profiling
+
+import unittest
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    profiling.reset()
+    profiling.set_current_profile(None)
+
+
+
+  def tearDown(self):
+    profiling.reset()
+    profiling.set_current_profile(None)
+
+
+
+  def _profile_request(self, name, querycount, backendseconds=0.0):
+    profiling.start_request("/some/path")
+    profiling.set_request_name(name)
+    profiling.add_time("backend", backendseconds)
+    querylist = [{"sql":"SELECT " + str(i), "time":"0.002"} for i in range(querycount)]
+    return profiling.finish_request(querylist)
+
+
+
+  def test_request_is_aggregated(self):
+    profile = self._profile_request("view_a", 3, backendseconds=0.5)
+    self.assertEqual("view_a", profile["name"])
+    self.assertEqual(3, profile["db_query_count"])
+    self.assertAlmostEqual(0.006, profile["db_seconds"])
+    self.assertEqual(0.5, profile["backend_seconds"])
+
+    self._profile_request("view_a", 7)
+    self._profile_request("view_b", 0)
+
+    stats = profiling.get_aggregate_stats()
+    self.assertEqual(["view_a", "view_b"], sorted(stats.keys()))
+    self.assertEqual(2, stats["view_a"]["count"])
+    self.assertEqual(10, stats["view_a"]["db_query_count"])
+    self.assertEqual(0.5, stats["view_a"]["backend_seconds"])
+    self.assertEqual(0.0, stats["view_a"]["lockserver_seconds"])
+
+    # 3 and 7 queries are in the buckets with upper bounds of 5 and 10.
+    histogram = stats["view_a"]["query_count_histogram"]
+    self.assertEqual(2, sum(histogram))
+    self.assertEqual(1, histogram[profiling.QUERY_COUNT_HISTOGRAM_BOUNDS.index(5)])
+    self.assertEqual(1, histogram[profiling.QUERY_COUNT_HISTOGRAM_BOUNDS.index(10)])
+    self.assertEqual(2, sum(stats["view_a"]["wall_time_histogram"]))
+
+    self.assertTrue(len(profiling.get_report()) > 0)
+
+
+
+  def test_no_request_being_profiled(self):
+    # Code not run as part of a profiled request can still add time.
+    profiling.add_time("lockserver", 1.0)
+    self.assertEqual(None, profiling.finish_request([]))
+    self.assertEqual({}, profiling.get_aggregate_stats())
+
+
+
+  def test_slow_request_sample_is_bounded(self):
+    for i in range(profiling.SLOW_REQUEST_SAMPLE_SIZE + 5):
+      self._profile_request("view_" + str(i), 1)
+
+    sample = profiling.get_slow_request_sample()
+    self.assertEqual(profiling.SLOW_REQUEST_SAMPLE_SIZE, len(sample))
+    self.assertEqual([(0.002, "SELECT ?")], sample[0]["queries"])
+
+    # Slowest first.
+    walltimes = [item["wall_seconds"] for item in sample]
+    self.assertEqual(sorted(walltimes, reverse=True), walltimes)
+
+    profiling.reset()
+    self.assertEqual([], profiling.get_slow_request_sample())
+
+
+
+  def test_slow_request_sample_sql_is_redacted(self):
+    profiling.start_request("view_a")
+    sql = "SELECT `id` FROM `control_geniuser` T2 WHERE (`api_key` = 'it''s \\'secret' AND `id` = 12)"
+    profiling.finish_request([{"sql":sql, "time":"0.002"}])
+
+    queries = profiling.get_slow_request_sample()[0]["queries"]
+    self.assertEqual([(0.002, "SELECT `id` FROM `control_geniuser` T2 WHERE (`api_key` = ? AND `id` = ?)")],
+                     queries)
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
@@ -0,0 +1,145 @@
+#pragma out
+#pragma error OK
+"""
+Tests for the per-user rate limits and the admission control of backend
+operations in website/control/ratelimit.py.
+"""
+
+# The seattlegeni testlib must be imported first.
+from seattlegeni.tests import testlib
+
+from seattlegeni.common.api import maindb
+
+from seattlegeni.common.exceptions import *
+
+from seattlegeni.website import settings
+
+from seattlegeni.website.control import interface
+from seattlegeni.website.control import ratelimit
+
+import django.core.cache
+
+import time
+import unittest
+
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    # Setup a fresh database for each test.
+    testlib.setup_test_db()
+    # The testlib turns rate limiting off for all other tests.
+    settings.RATE_LIMIT_VESSEL_OPERATIONS = True
+    django.core.cache.cache.delete(ratelimit.BACKEND_OPERATION_COUNT_CACHE_KEY)
+
+
+
+  def tearDown(self):
+    settings.RATE_LIMIT_VESSEL_OPERATIONS = False
+    django.core.cache.cache.delete(ratelimit.BACKEND_OPERATION_COUNT_CACHE_KEY)
+    # Cleanup the test database.
+    testlib.teardown_test_db()
+
+
+
+  def _create_user(self, username):
+    user = maindb.create_user(username, "password", "example@example.com", "affiliation", "1 2", "2 2 2", "3 4")
+    for operation in ratelimit.RATE_LIMITS:
+      django.core.cache.cache.delete(ratelimit._get_bucket_cache_key(username, operation))
+    return user
+
+
+
+  def test_bucket_is_exhausted_and_refilled(self):
+    user = self._create_user("testuser")
+    (bucketsize, seconds_per_token) = ratelimit.RATE_LIMITS["release"]
+
+    # A burst up to the size of the bucket is allowed.
+    for i in range(bucketsize):
+      ratelimit.require_user_within_rate_limit(user, "release")
+
+    self.assertRaises(TooManyRequestsError, ratelimit.require_user_within_rate_limit,
+                      user, "release")
+
+    # Other operations and other users have their own buckets.
+    ratelimit.require_user_within_rate_limit(user, "renew")
+    otheruser = self._create_user("otheruser")
+    ratelimit.require_user_within_rate_limit(otheruser, "release")
+
+    # Pretend that enough time has passed for one token to be added back.
+    cachekey = ratelimit._get_bucket_cache_key(user.username, "release")
+    (tokens, lastupdate) = django.core.cache.cache.get(cachekey)
+    django.core.cache.cache.set(cachekey, (tokens, lastupdate - seconds_per_token))
+
+    ratelimit.require_user_within_rate_limit(user, "release")
+    self.assertRaises(TooManyRequestsError, ratelimit.require_user_within_rate_limit,
+                      user, "release")
+
+
+
+  def test_rate_limit_of_interface_function(self):
+    user = self._create_user("testuser")
+    (bucketsize, seconds_per_token) = ratelimit.RATE_LIMITS["acquire"]
+
+    # Empty the bucket. The rate limit is checked before anything else (such
+    # as the lockserver) is used.
+    cachekey = ratelimit._get_bucket_cache_key(user.username, "acquire")
+    django.core.cache.cache.set(cachekey, (0.0, time.time()))
+
+    self.assertRaises(TooManyRequestsError, interface.acquire_vessels, user, 1, "wan")
+
+    # Acquisitions in the background are refused when they are submitted.
+    self.assertRaises(TooManyRequestsError, interface.submit_acquire_vessels_job, user, 1, "wan")
+    self.assertEqual(0, maindb.get_unfinished_acquisition_job_count(user))
+
+
+
+  def test_admission_control(self):
+    for i in range(ratelimit.MAX_CONCURRENT_BACKEND_OPERATIONS):
+      ratelimit.start_backend_operation()
+
+    self.assertRaises(TooManyRequestsError, ratelimit.start_backend_operation)
+
+    # The refused operation isn't counted, so finishing one makes room for
+    # exactly one more.
+    ratelimit.finish_backend_operation()
+    ratelimit.start_backend_operation()
+    self.assertRaises(TooManyRequestsError, ratelimit.start_backend_operation)
+
+    for i in range(ratelimit.MAX_CONCURRENT_BACKEND_OPERATIONS):
+      ratelimit.finish_backend_operation()
+    self.assertEqual(0, django.core.cache.cache.get(ratelimit.BACKEND_OPERATION_COUNT_CACHE_KEY))
+
+    # Finishing more operations than were started doesn't make the count
+    # negative.
+    ratelimit.finish_backend_operation()
+    self.assertEqual(0, django.core.cache.cache.get(ratelimit.BACKEND_OPERATION_COUNT_CACHE_KEY))
+
+
+
+  def test_disabled(self):
+    settings.RATE_LIMIT_VESSEL_OPERATIONS = False
+    user = self._create_user("testuser")
+    (bucketsize, seconds_per_token) = ratelimit.RATE_LIMITS["acquire"]
+
+    for i in range(bucketsize + 1):
+      ratelimit.require_user_within_rate_limit(user, "acquire")
+
+    for i in range(ratelimit.MAX_CONCURRENT_BACKEND_OPERATIONS + 1):
+      ratelimit.start_backend_operation()
+
+
+
+
+
+def run_test():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  run_test()
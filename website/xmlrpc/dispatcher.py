@@ -18,9 +18,15 @@
   http://code.djangoproject.com/wiki/XML-RPC
 """
 
+import sys
+import xmlrpclib
+
 from SimpleXMLRPCServer import SimpleXMLRPCDispatcher
 from django.http import HttpResponse
 
+from seattlegeni.common.util import profiling
+
+from seattlegeni.website.xmlrpc import marshalling
 from seattlegeni.website.xmlrpc.views import PublicXMLRPCFunctions
 from django.views.decorators.csrf import csrf_exempt
 
@@ -29,10 +35,59 @@ from django.views.decorators.csrf import csrf_exempt
 # directory through a web browser (that is, through a GET request).
 SEATTLECLEARINGHOUSE_XMLRPC_API_DOC_URL = "https://seattle.cs.washington.edu/wiki/SeattleGeniApi"
 
+
+
+
+class SeattleGeniXMLRPCDispatcher(SimpleXMLRPCDispatcher):
+  """
+  A SimpleXMLRPCDispatcher that marshals successful responses with
+  marshalling.dumps_response() rather than xmlrpclib.dumps(). Faults are
+  still marshaled by xmlrpclib, as they are small.
+  """
+
+  def _marshaled_dispatch(self, data, dispatch_method=None, path=None):
+    # This is SimpleXMLRPCDispatcher._marshaled_dispatch() other than how the
+    # response is marshaled. Using dumps_response() requires allow_none to be
+    # False and the default encoding.
+    try:
+      params, method = xmlrpclib.loads(data)
+
+      # Aggregate the profile of the request by xmlrpc method rather than by
+      # view, as all xmlrpc requests have the same view. Calls of methods that
+      # don't exist are aggregated together so that clients can't add any
+      # number of names to the statistics.
+      knownmethod = not method.startswith("_") and hasattr(self.instance, method)
+      if knownmethod or method == "system.multicall":
+        profiling.set_request_name("xmlrpc." + method)
+      else:
+        profiling.set_request_name("xmlrpc." + profiling.UNKNOWN_REQUEST_NAME)
+
+      if dispatch_method is not None:
+        response = dispatch_method(method, params)
+      else:
+        response = self._dispatch(method, params)
+
+      response = marshalling.dumps_response(response)
+
+    except xmlrpclib.Fault, fault:
+      response = xmlrpclib.dumps(fault, allow_none=self.allow_none,
+                                 encoding=self.encoding)
+
+    except:
+      # Report the exception back to the client.
+      exc_type, exc_value = sys.exc_info()[:2]
+      response = xmlrpclib.dumps(xmlrpclib.Fault(1, "%s:%s" % (exc_type, exc_value)),
+                                 encoding=self.encoding, allow_none=self.allow_none)
+
+    return response
+
+
+
+
 # Create a Dispatcher. This handles the calls and translates info to function maps.
 # TODO: allow_none = True or False? Does using None in the api make the xmlrpc
 #       api python-specific?
-dispatcher = SimpleXMLRPCDispatcher(allow_none=False, encoding=None)
+dispatcher = SeattleGeniXMLRPCDispatcher(allow_none=False, encoding=None)
 
 
 @csrf_exempt
@@ -0,0 +1,211 @@
+"""
+<Program>
+  marshalling.py
+
+<Purpose>
+  Helpers for turning the results of the public xmlrpc functions into
+  xmlrpc responses more cheaply than xmlrpclib does.
+
+  dumps_response() produces the same document as xmlrpclib.dumps() does for a
+  method response, but only handles the types our functions return (anything
+  else is left to xmlrpclib). The marshaled form of strings is cached, as the
+  same long strings (e.g. node identifiers and vessel handles) are in many
+  responses.
+
+  get_compact_dict_list() turns a list of dictionaries that all have the same
+  keys into a list of rows so that the keys aren't repeated in the response.
+  Clients ask for this format explicitly (see views.py).
+"""
+
+import xmlrpclib
+
+from xmlrpclib import escape
+
+
+
+
+
+# The most marshaled strings to keep in the cache. When it is full, the cache
+# is emptied rather than keeping track of which entries were used recently.
+STRING_FRAGMENT_CACHE_MAX_ENTRIES = 5000
+
+# Longer strings than this aren't cached.
+STRING_FRAGMENT_CACHE_MAX_LENGTH = 4096
+
+# A dict mapping strings to their marshaled form. Access is not locked:
+# individual dict operations are atomic and a lost update only means a string
+# is marshaled again.
+string_fragment_cache = {}
+
+# A dict mapping struct member names to the marshaled start of the member.
+member_fragment_cache = {}
+
+RESPONSE_HEADER = "<?xml version='1.0'?>\n<methodResponse>\n<params>\n<param>\n"
+RESPONSE_FOOTER = "</param>\n</params>\n</methodResponse>\n"
+
+
+
+
+
+class _UnsupportedValueError(Exception):
+  """Raised when a value can't be marshaled by _dump()."""
+
+
+
+
+
+def dumps_response(value):
+  """
+  <Purpose>
+    Marshal the return value of an xmlrpc function into a method response.
+  <Arguments>
+    value
+      The value to marshal.
+  <Exceptions>
+    TypeError or OverflowError if the value can't be marshaled, the same as
+    xmlrpclib.dumps(). None is not allowed.
+  <Side Effects>
+    Strings in the value may have been added to the cache.
+  <Returns>
+    The xmlrpc response document as a string. This is the same as what
+    xmlrpclib.dumps((value,), methodresponse=True) would return.
+  """
+  out = []
+  try:
+    _dump(value, out.append, {})
+  except _UnsupportedValueError:
+    return xmlrpclib.dumps((value,), methodresponse=True)
+
+  return RESPONSE_HEADER + "".join(out) + RESPONSE_FOOTER
+
+
+
+
+
+def _dump_string(value, write):
+  """Writes the marshaled form of a str, using the cache if possible."""
+  fragment = string_fragment_cache.get(value)
+  if fragment is not None:
+    write(fragment)
+    return
+
+  fragment = "<value><string>" + escape(value) + "</string></value>\n"
+
+  if len(value) <= STRING_FRAGMENT_CACHE_MAX_LENGTH:
+    if len(string_fragment_cache) >= STRING_FRAGMENT_CACHE_MAX_ENTRIES:
+      string_fragment_cache.clear()
+    string_fragment_cache[value] = fragment
+
+  write(fragment)
+
+
+
+
+
+def _dump_member_name(name, write):
+  """Writes the start of a struct member, using the cache if possible."""
+  fragment = member_fragment_cache.get(name)
+  if fragment is not None:
+    write(fragment)
+    return
+
+  if type(name) is unicode:
+    encodedname = name.encode("utf-8")
+  elif type(name) is str:
+    encodedname = name
+  else:
+    raise TypeError("dictionary key must be string")
+
+  fragment = "<member>\n<name>" + escape(encodedname) + "</name>\n"
+
+  if len(member_fragment_cache) >= STRING_FRAGMENT_CACHE_MAX_ENTRIES:
+    member_fragment_cache.clear()
+  member_fragment_cache[name] = fragment
+
+  write(fragment)
+
+
+
+
+
+def _dump(value, write, memo):
+  """
+  Writes the marshaled form of a value. memo is a dict whose keys are the ids
+  of the lists and dicts currently being marshaled, to catch recursion.
+  """
+  valuetype = type(value)
+
+  if valuetype is str:
+    _dump_string(value, write)
+
+  elif valuetype is bool:
+    if value:
+      write("<value><boolean>1</boolean></value>\n")
+    else:
+      write("<value><boolean>0</boolean></value>\n")
+
+  elif valuetype is int or valuetype is long:
+    if value > xmlrpclib.MAXINT or value < xmlrpclib.MININT:
+      raise OverflowError("int exceeds XML-RPC limits")
+    write("<value><int>" + str(int(value)) + "</int></value>\n")
+
+  elif valuetype is float:
+    write("<value><double>" + repr(value) + "</double></value>\n")
+
+  elif valuetype is unicode:
+    write("<value><string>" + escape(value.encode("utf-8")) + "</string></value>\n")
+
+  elif valuetype is list or valuetype is tuple:
+    if id(value) in memo:
+      raise TypeError("cannot marshal recursive sequences")
+    memo[id(value)] = None
+    write("<value><array><data>\n")
+    for item in value:
+      _dump(item, write, memo)
+    write("</data></array></value>\n")
+    del memo[id(value)]
+
+  elif valuetype is dict:
+    if id(value) in memo:
+      raise TypeError("cannot marshal recursive dictionaries")
+    memo[id(value)] = None
+    write("<value><struct>\n")
+    for (name, item) in value.items():
+      _dump_member_name(name, write)
+      _dump(item, write, memo)
+      write("</member>\n")
+    write("</struct></value>\n")
+    del memo[id(value)]
+
+  else:
+    # Leave None, DateTime, Binary, instances, etc. to xmlrpclib.
+    raise _UnsupportedValueError
+
+
+
+
+
+def get_compact_dict_list(dict_list, keylist):
+  """
+  <Purpose>
+    Convert a list of dictionaries that have the same keys into a compact form
+    that doesn't repeat the keys.
+  <Arguments>
+    dict_list
+      A list of dictionaries, each of which has all of the keys in keylist.
+    keylist
+      The list of keys to include, in the order their values are to be in
+      each row.
+  <Exceptions>
+    None
+  <Side Effects>
+    None
+  <Returns>
+    A dictionary {'fields':keylist, 'rows':rowlist} where rowlist has a list
+    of the values of each dictionary, in the same order as keylist.
+  """
+  rowlist = []
+  for item in dict_list:
+    rowlist.append([item[key] for key in keylist])
+
+  return {'fields':list(keylist), 'rows':rowlist}
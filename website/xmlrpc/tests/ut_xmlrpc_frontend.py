@@ -32,6 +32,9 @@ from seattlegeni.common.exceptions import *
 
 from seattlegeni.common.api import maindb
 
+from seattlegeni.common.util import profiling
+
+from seattlegeni.website.xmlrpc import dispatcher
 from seattlegeni.website.xmlrpc import views
 
 from seattlegeni.website.xmlrpc.tests import xmlrpctestutil
@@ -67,6 +70,11 @@ def mock_raises_UnableToAcquireResourcesError(*args, **kwargs):
 
 
 
+def mock_raises_TooManyRequestsError(*args, **kwargs):
+  raise TooManyRequestsError
+
+
+
 def mock_noop(*args, **kwargs):
   pass
 
@@ -216,6 +224,13 @@ class SeattleGeniTestCase(unittest.TestCase):
     else:
       self.fail("Expected an exception.")
 
+    try:
+      proxy.get_resource_info_page(auth, "", 10, [])
+    except xmlrpclib.Fault, e:
+      self.assertEqual(e.faultCode, views.FAULTCODE_AUTHERROR)
+    else:
+      self.fail("Expected an exception.")
+
     try:
       proxy.get_account_info(auth)
     except xmlrpclib.Fault, e:
@@ -303,6 +318,18 @@ class SeattleGeniTestCase(unittest.TestCase):
       self.assertEqual(e.faultCode, views.FAULTCODE_NOTENOUGHCREDITS)
     else:
       self.fail("Expected an exception.")
+    
+    # This is the case where the user has renewed vessels too often recently.
+    
+    interface.get_vessel_list = mock_interface_get_vessel_list
+    interface.renew_vessels = mock_raises_TooManyRequestsError
+    
+    try:
+      proxy.renew_resources(auth, vesselhandle_list)
+    except xmlrpclib.Fault, e:
+      self.assertEqual(e.faultCode, views.FAULTCODE_TRYAGAINLATER)
+    else:
+      self.fail("Expected an exception.")
 
 
   
@@ -391,6 +418,107 @@ class SeattleGeniTestCase(unittest.TestCase):
 
 
 
+  def test_acquire_resources_async(self):
+    
+    auth = {'username':'tester', 'api_key':'api_key'}
+    rspec_valid = {'rspec_type':'random', 'number_of_nodes':2}
+    
+    submitcalls = []
+    def mock_submit_acquire_vessels_job(geniuser, vesselcount, vesseltype):
+      submitcalls.append((vesselcount, vesseltype))
+      return 42
+    interface.submit_acquire_vessels_job = mock_submit_acquire_vessels_job
+    
+    self.assertEqual(42, proxy.acquire_resources_async(auth, rspec_valid))
+    self.assertEqual([(2, 'rand')], submitcalls)
+    
+    try:
+      proxy.acquire_resources_async(auth, {'rspec_type':'wtf', 'number_of_nodes':10})
+    except xmlrpclib.Fault, e:
+      self.assertEqual(e.faultCode, views.FAULTCODE_INVALIDREQUEST)
+    else:
+      self.fail("Expected an exception.")
+    
+    # The user already has too many acquisitions in progress.
+    interface.submit_acquire_vessels_job = mock_raises_InvalidRequestError
+    
+    try:
+      proxy.acquire_resources_async(auth, rspec_valid)
+    except xmlrpclib.Fault, e:
+      self.assertEqual(e.faultCode, views.FAULTCODE_INVALIDREQUEST)
+    else:
+      self.fail("Expected an exception.")
+    
+    interface.submit_acquire_vessels_job = mock_raises_InsufficientUserResourcesError
+    
+    try:
+      proxy.acquire_resources_async(auth, rspec_valid)
+    except xmlrpclib.Fault, e:
+      self.assertEqual(e.faultCode, views.FAULTCODE_NOTENOUGHCREDITS)
+    else:
+      self.fail("Expected an exception.")
+
+
+
+  def test_get_acquire_resources_result(self):
+    
+    auth = {'username':'tester', 'api_key':'api_key'}
+    
+    interface.get_vessel_infodict_list = mock_interface_get_vessel_infodict_list
+    
+    resultcalls = []
+    jobresults = {1:None, 2:[]}
+    def mock_get_acquire_vessels_job_result(geniuser, job_id, max_wait_seconds):
+      resultcalls.append((job_id, max_wait_seconds))
+      return jobresults[job_id]
+    interface.get_acquire_vessels_job_result = mock_get_acquire_vessels_job_result
+    
+    self.assertEqual({'status':'pending'}, proxy.get_acquire_resources_result(auth, 1, 0))
+    self.assertEqual({'status':'done', 'vessels':[]}, proxy.get_acquire_resources_result(auth, 2, 5))
+    self.assertEqual([(1, 0), (2, 5)], resultcalls)
+    
+    for (job_id, max_wait_seconds) in [("1", 0), (1, "0")]:
+      try:
+        proxy.get_acquire_resources_result(auth, job_id, max_wait_seconds)
+      except xmlrpclib.Fault, e:
+        self.assertEqual(e.faultCode, views.FAULTCODE_INVALIDREQUEST)
+      else:
+        self.fail("Expected an exception.")
+    
+    # The errors the job can fail with.
+    errorfaults = [(mock_raises_DoesNotExistError, views.FAULTCODE_INVALIDREQUEST),
+                   (mock_raises_UnableToAcquireResourcesError, views.FAULTCODE_UNABLETOACQUIRE),
+                   (mock_raises_InsufficientUserResourcesError, views.FAULTCODE_NOTENOUGHCREDITS)]
+    
+    for (mockfunc, faultcode) in errorfaults:
+      interface.get_acquire_vessels_job_result = mockfunc
+      try:
+        proxy.get_acquire_resources_result(auth, 1, 0)
+      except xmlrpclib.Fault, e:
+        self.assertEqual(e.faultCode, faultcode)
+      else:
+        self.fail("Expected an exception.")
+    
+    # Waiting isn't allowed within a multicall, but checking is.
+    interface.get_acquire_vessels_job_result = mock_get_acquire_vessels_job_result
+    del resultcalls[:]
+    
+    multicall = xmlrpclib.MultiCall(proxy)
+    multicall.get_acquire_resources_result(auth, 1, 0)
+    multicall.get_acquire_resources_result(auth, 1, 5)
+    results = multicall()
+    
+    self.assertEqual({'status':'pending'}, results[0])
+    try:
+      results[1]
+    except xmlrpclib.Fault, e:
+      self.assertEqual(e.faultCode, views.FAULTCODE_INVALIDREQUEST)
+    else:
+      self.fail("Expected an exception.")
+    self.assertEqual([(1, 0)], resultcalls)
+
+
+
   def test_acquire_specific_vessels(self):
     
     auth = {'username':'tester', 'api_key':'api_key'}
@@ -490,6 +618,198 @@ class SeattleGeniTestCase(unittest.TestCase):
 
 
 
+  def test_get_resource_info_page(self):
+    
+    auth = {'username':'tester', 'api_key':'api_key'}
+    
+    # Fake vessels that only have the ids the cursor is made from.
+    class MockVessel(object):
+      def __init__(self, id):
+        self.id = id
+    
+    all_vessels = [MockVessel(id) for id in [3, 5, 8, 9, 12]]
+    
+    def mock_get_acquired_vessels_page(geniuser, after_vessel_id, page_size):
+      vessels = [vessel for vessel in all_vessels if vessel.id > after_vessel_id]
+      return vessels[:page_size]
+    
+    def mock_get_vessel_infodict_list(vessel_list, fields=None):
+      return [{'handle':str(vessel.id), 'fields':fields or []} for vessel in vessel_list]
+    
+    interface.get_acquired_vessels_page = mock_get_acquired_vessels_page
+    interface.get_vessel_infodict_list = mock_get_vessel_infodict_list
+    
+    handles = []
+    cursor = ""
+    while True:
+      page = proxy.get_resource_info_page(auth, cursor, 2, ['handle'])
+      self.assertTrue(len(page['vessels']) <= 2)
+      for vesselinfo in page['vessels']:
+        handles.append(vesselinfo['handle'])
+        self.assertEqual(['handle'], vesselinfo['fields'])
+      cursor = page['next_cursor']
+      if not cursor:
+        break
+    
+    self.assertEqual(['3', '5', '8', '9', '12'], handles)
+    
+    # A page that ends exactly at the last vessel has no next page.
+    page = proxy.get_resource_info_page(auth, "", 5, [])
+    self.assertEqual(5, len(page['vessels']))
+    self.assertEqual("", page['next_cursor'])
+    
+    for (cursor, page_size, fields) in [("notanumber", 2, []), (1, 2, []),
+                                        ("", 0, []), ("", views.MAX_RESOURCE_INFO_PAGE_SIZE + 1, []),
+                                        ("", 2, ['nosuchfield']), ("", 2, "handle")]:
+      try:
+        proxy.get_resource_info_page(auth, cursor, page_size, fields)
+      except xmlrpclib.Fault, e:
+        self.assertEqual(e.faultCode, views.FAULTCODE_INVALIDREQUEST)
+      else:
+        self.fail("Expected an exception.")
+
+
+
+  def test_get_resource_info_compact_format(self):
+    
+    auth = {'username':'tester', 'api_key':'api_key'}
+    
+    infodict_list = []
+    for i in range(3):
+      infodict = {}
+      for field in interface.VESSEL_INFODICT_FIELDS:
+        infodict[field] = field + str(i)
+      infodict_list.append(infodict)
+    
+    def mock_get_vessel_infodict_list(vessel_list, fields=None):
+      return infodict_list
+    
+    interface.get_acquired_vessels = mock_interface_get_vessel_list
+    interface.get_vessel_infodict_list = mock_get_vessel_infodict_list
+    
+    self.assertEqual(infodict_list, proxy.get_resource_info(auth))
+    self.assertEqual(infodict_list, proxy.get_resource_info(auth, 'full'))
+    
+    response = proxy.get_resource_info(auth, 'compact')
+    self.assertEqual(interface.VESSEL_INFODICT_FIELDS, response['fields'])
+    expanded = [dict(zip(response['fields'], row)) for row in response['rows']]
+    self.assertEqual(infodict_list, expanded)
+    
+    try:
+      proxy.get_resource_info(auth, 'unknownformat')
+    except xmlrpclib.Fault, e:
+      self.assertEqual(e.faultCode, views.FAULTCODE_INVALIDREQUEST)
+    else:
+      self.fail("Expected an exception.")
+
+
+
+  def test_multicall(self):
+    
+    auth = {'username':'tester', 'api_key':'api_key'}
+    
+    # Count how many times the auth info is checked.
+    authcalls = []
+    def mock_counting_get_user_with_api_key(username, api_key):
+      authcalls.append(username)
+      return mock_interface_get_user_with_api_key(username, api_key)
+    interface.get_user_with_api_key = mock_counting_get_user_with_api_key
+    
+    interface.get_vessel_list = mock_interface_get_vessel_list
+    interface.renew_vessels = mock_noop
+    interface.get_acquired_vessels = mock_interface_get_vessel_list
+    interface.get_vessel_infodict_list = mock_interface_get_vessel_infodict_list
+    
+    multicall = xmlrpclib.MultiCall(proxy)
+    multicall.renew_resources(auth, ['vessel1'])
+    multicall.get_resource_info(auth)
+    multicall.renew_resources(auth, "not a list")
+    multicall.no_such_method(auth)
+    results = multicall()
+    
+    self.assertEqual(0, results[0])
+    self.assertEqual([], results[1])
+    
+    for index in [2, 3]:
+      try:
+        results[index]
+      except xmlrpclib.Fault, e:
+        self.assertEqual(e.faultCode, views.FAULTCODE_INVALIDREQUEST)
+      else:
+        self.fail("Expected an exception.")
+    
+    # The user was only authenticated once for the whole batch.
+    self.assertEqual(['tester'], authcalls)
+    
+    # A call authenticated with a password can change the user, so calls after
+    # it authenticate again.
+    interface.get_user_with_password = mock_interface_get_user_with_password
+    interface.regenerate_api_key = mock_interface_regenerate_api_key
+    del authcalls[:]
+    
+    multicall = xmlrpclib.MultiCall(proxy)
+    multicall.get_resource_info(auth)
+    multicall.regenerate_api_key({'username':'tester', 'password':'password'})
+    multicall.get_resource_info(auth)
+    multicall.get_resource_info(auth)
+    results = multicall()
+    
+    self.assertEqual([], results[2])
+    self.assertEqual(['tester', 'tester'], authcalls)
+    
+    # Batches can't be nested, not even by calling _dispatch directly.
+    del authcalls[:]
+    nestedcalllist = [{'methodName':'get_resource_info', 'params':[auth]}]
+    
+    multicall = xmlrpclib.MultiCall(proxy)
+    multicall.system.multicall(nestedcalllist)
+    multicall._dispatch('system.multicall', [nestedcalllist])
+    multicall.get_resource_info(auth)
+    results = multicall()
+    
+    for index in [0, 1]:
+      try:
+        results[index]
+      except xmlrpclib.Fault, e:
+        self.assertEqual(e.faultCode, views.FAULTCODE_INVALIDREQUEST)
+      else:
+        self.fail("Expected an exception.")
+    
+    self.assertEqual([], results[2])
+    self.assertEqual(['tester'], authcalls)
+    
+    # Too many calls in one batch.
+    multicall = xmlrpclib.MultiCall(proxy)
+    for i in range(views.MAX_MULTICALL_CALLS + 1):
+      multicall.get_resource_info(auth)
+    
+    try:
+      multicall()
+    except xmlrpclib.Fault, e:
+      self.assertEqual(e.faultCode, views.FAULTCODE_INVALIDREQUEST)
+    else:
+      self.fail("Expected an exception.")
+
+
+
+  def test_profiled_request_names(self):
+    
+    # The names of methods that don't exist aren't used.
+    unknownname = "xmlrpc." + profiling.UNKNOWN_REQUEST_NAME
+    
+    for (method, expectedname) in [("system.multicall", "xmlrpc.system.multicall"),
+                                   ("get_resource_info", "xmlrpc.get_resource_info"),
+                                   ("no_such_method", unknownname),
+                                   ("_dispatch", unknownname)]:
+      profiling.start_request("view")
+      try:
+        dispatcher.dispatcher._marshaled_dispatch(xmlrpclib.dumps(([],), method))
+        self.assertEqual(expectedname, profiling.get_current_profile()["name"])
+      finally:
+        profiling.set_current_profile(None)
+
+
+
 def main():
   # The tests don't use the database, so we just make a single database
   # so that it exists to prevent unrelated errors when we use the models.
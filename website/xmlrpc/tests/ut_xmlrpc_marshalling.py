@@ -0,0 +1,110 @@
+"""
+<Program>
+  ut_xmlrpc_marshalling.py
+
+<Purpose>
+  Tests that the responses produced by marshalling.dumps_response() are the
+  same as the ones xmlrpclib produces.
+"""
+
+#pragma out
+#pragma error OK
+
+
+# We import the testlib FIRST, as the test db settings 
+# need to be set before we import anything else.
+from seattlegeni.tests import testlib
+
+import xmlrpclib
+import unittest
+
+from seattlegeni.website.xmlrpc import marshalling
+
+
+
+
+class SeattleGeniTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    marshalling.string_fragment_cache.clear()
+    marshalling.member_fragment_cache.clear()
+
+
+  def tearDown(self):
+    pass
+
+
+
+  def assertSameAsXmlrpclib(self, value):
+    expected = xmlrpclib.dumps((value,), methodresponse=True)
+    self.assertEqual(expected, marshalling.dumps_response(value))
+
+
+
+  def test_simple_values(self):
+    for value in [0, -5, 12345, 3L, True, False, 1.5, "", "plain",
+                  "<escaped> & \"quoted\"", u"unicode \xe9", [], {}]:
+      self.assertSameAsXmlrpclib(value)
+
+
+
+  def test_vessel_infodict_list(self):
+    infodict_list = []
+    for i in range(20):
+      node_id = "nodeid" * 50 + str(i % 5)
+      infodict_list.append({"node_id":node_id, "node_ip":"127.0.0." + str(i),
+                            "node_port":1224, "vessel_id":"v" + str(i),
+                            "handle":node_id + ":v" + str(i), "is_active":True,
+                            "expires_in_seconds":3600 * i})
+    
+    # Marshal twice so that the cached fragments are used the second time.
+    self.assertSameAsXmlrpclib(infodict_list)
+    self.assertTrue(len(marshalling.string_fragment_cache) > 0)
+    self.assertSameAsXmlrpclib(infodict_list)
+    
+    self.assertSameAsXmlrpclib({"vessels":infodict_list, "next_cursor":"12"})
+
+
+
+  def test_string_cache_is_bounded(self):
+    for i in range(marshalling.STRING_FRAGMENT_CACHE_MAX_ENTRIES + 10):
+      marshalling.dumps_response(str(i))
+    self.assertTrue(len(marshalling.string_fragment_cache) <= marshalling.STRING_FRAGMENT_CACHE_MAX_ENTRIES)
+    
+    # Long strings aren't cached.
+    marshalling.string_fragment_cache.clear()
+    marshalling.dumps_response("x" * (marshalling.STRING_FRAGMENT_CACHE_MAX_LENGTH + 1))
+    self.assertEqual(0, len(marshalling.string_fragment_cache))
+
+
+
+  def test_unsupported_values(self):
+    # Values the fast path doesn't handle are left to xmlrpclib.
+    self.assertSameAsXmlrpclib([xmlrpclib.DateTime(0)])
+    self.assertSameAsXmlrpclib({"data":xmlrpclib.Binary("abc")})
+    
+    self.assertRaises(TypeError, marshalling.dumps_response, [None])
+    self.assertRaises(TypeError, marshalling.dumps_response, {1:"nonstring key"})
+    self.assertRaises(OverflowError, marshalling.dumps_response, 2 ** 40)
+    
+    recursivelist = []
+    recursivelist.append(recursivelist)
+    self.assertRaises(TypeError, marshalling.dumps_response, recursivelist)
+
+
+
+  def test_compact_dict_list(self):
+    dict_list = [{"a":1, "b":"x"}, {"a":2, "b":"y"}]
+    compact = marshalling.get_compact_dict_list(dict_list, ["b", "a"])
+    self.assertEqual({"fields":["b", "a"], "rows":[["x", 1], ["y", 2]]}, compact)
+
+
+
+def main():
+  unittest.main()
+
+
+
+if __name__ == "__main__":
+  main()
@@ -33,6 +33,7 @@ import django.core.mail
 
 import random
 import string
+import threading
 import traceback
 
 # Used for raising xmlrpc faults
@@ -53,6 +54,8 @@ from seattlegeni.common.util.decorators import log_function_call_without_first_a
 # All of the work that needs to be done is passed through the controller interface.
 from seattlegeni.website.control import interface
 
+from seattlegeni.website.xmlrpc import marshalling
+
 from seattle.repyportability import *
 add_dy_support(locals())
 
@@ -76,6 +79,31 @@ FAULTCODE_INVALIDREQUEST = 102
 FAULTCODE_NOTENOUGHCREDITS = 103
 # 104 used to be used for "private key doesn't exist".
 FAULTCODE_UNABLETOACQUIRE = 105
+# The request was refused because of rate limiting or because the server is too
+# busy. The client should wait a while before trying again.
+FAULTCODE_TRYAGAINLATER = 106
+
+# The maximum number of calls that can be made in a single system.multicall
+# request. This keeps one request from tying up a web server process for too
+# long.
+MAX_MULTICALL_CALLS = 50
+
+# The most vessels that get_resource_info_page() returns in one page.
+MAX_RESOURCE_INFO_PAGE_SIZE = 500
+
+# The formats that functions returning vessel 'info' dictionaries can return
+# them in. In the 'compact' format, the list of dictionaries is instead a
+# dictionary {'fields':keylist, 'rows':rowlist} where each row is the list of
+# the values of one vessel's dictionary, in the same order as keylist.
+VESSEL_INFO_FORMATS = ['full', 'compact']
+
+# While a system.multicall request is being handled, the attribute 'users' of
+# this is a dict mapping (username, api_key) tuples to the GeniUser objects
+# they authenticated as, so that each call in the batch doesn't have to
+# authenticate again. It is emptied by any call that authenticates with a
+# password, as such calls can change the user. It is thread-local because
+# requests can be handled by multiple threads of the same process.
+multicall_auth_data = threading.local()
 
 
 
@@ -99,6 +127,19 @@ class PublicXMLRPCFunctions(object):
     """
       
     try:
+      # Batches of calls are made through the standard system.multicall
+      # method, each call of which is dispatched through here.
+      if method == "system.multicall":
+        if len(args) != 1:
+          raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST,
+                                "system.multicall takes a single list of calls.")
+        return _multicall(self._dispatch, args[0])
+      
+      # Methods starting with an underscore aren't public. In particular,
+      # calling _dispatch from within a batch would allow nested batches.
+      if method.startswith("_"):
+        raise InvalidRequestError("The requested method '" + method + "' doesn't exist.")
+      
       # Get the requested function (making sure it exists).
       try:
         func = getattr(self, method)
@@ -112,6 +153,11 @@ class PublicXMLRPCFunctions(object):
       log.error("The xmlrpc server was used incorrectly: " + traceback.format_exc())
       raise
     
+    except TooManyRequestsError, err:
+      # Any of the functions that acquire, release, or renew vessels can be
+      # refused this way.
+      raise xmlrpclib.Fault(FAULTCODE_TRYAGAINLATER, str(err))
+    
     except xmlrpclib.Fault:
       # A xmlrpc Fault was intentionally raised by the code in this module.
       raise
@@ -180,42 +226,110 @@ class PublicXMLRPCFunctions(object):
     """
     geni_user = _auth(auth)
     
-    if not isinstance(rspec, dict):
-      raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "rspec is an invalid data type.")
+    (resource_type, num_vessels) = _get_resource_type_and_count_from_rspec(rspec)
+    
+    acquired_vessels = []
     
     try:
-      resource_type = rspec['rspec_type']
-    except KeyError:
-      raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "rspec is missing rspec_type")
+      acquired_vessels = interface.acquire_vessels(geni_user, num_vessels, resource_type)
+    except UnableToAcquireResourcesError, err:
+      raise xmlrpclib.Fault(FAULTCODE_UNABLETOACQUIRE, "Unable to fulfill vessel acquire request at this given time. Details: " + str(err))
+    except InsufficientUserResourcesError, err:
+      raise xmlrpclib.Fault(FAULTCODE_NOTENOUGHCREDITS, "You do not have enough vessel credits to acquire the number of vessels requested.")
+    
+    # since acquire_vessels returns a list of Vessel objects, we
+    # need to convert them into a list of 'info' dictionaries.
+    return interface.get_vessel_infodict_list(acquired_vessels)
+
+
+
+  @staticmethod
+  @log_function_call
+  def acquire_resources_async(auth, rspec):
+    """
+    <Purpose>
+      Starts acquiring resources for users over XMLRPC without waiting for
+      the acquisition to finish. The result is retrieved by calling
+      get_acquire_resources_result() with the returned job id.
+    <Arguments>
+      auth
+        An authorization dict.
+      rspec
+        A resource specification dict of the form {'rspec_type':type, 'number_of_nodes':num}
+    <Exceptions>
+      Raises xmlrpclib Fault objects:
+        FAULTCODE_INTERNALERROR for internal errors.
+        FAULTCODE_INVALIDREQUEST for bad user input or if the user has too
+          many acquisitions in progress.
+        FAULTCODE_NOTENOUGHCREDITS if user has insufficient vessel credits to complete request.
+    <Returns>
+      The job id (an integer) of the acquisition.
+    """
+    geni_user = _auth(auth)
+    
+    (resource_type, num_vessels) = _get_resource_type_and_count_from_rspec(rspec)
     
     try:
-      num_vessels = rspec['number_of_nodes']
-    except KeyError:
-      raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "rspec is missing number_of_nodes")
+      return interface.submit_acquire_vessels_job(geni_user, num_vessels, resource_type)
+    except InvalidRequestError, err:
+      raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, str(err))
+    except InsufficientUserResourcesError, err:
+      raise xmlrpclib.Fault(FAULTCODE_NOTENOUGHCREDITS, "You do not have enough vessel credits to acquire the number of vessels requested.")
+
+
+
+  @staticmethod
+  @log_function_call
+  def get_acquire_resources_result(auth, job_id, max_wait_seconds):
+    """
+    <Purpose>
+      Gets the result of an acquisition started with acquire_resources_async(),
+      optionally waiting for it to finish (at most 30 seconds).
+    <Arguments>
+      auth
+        An authorization dict.
+      job_id
+        The job id returned by acquire_resources_async().
+      max_wait_seconds
+        The longest to wait for the acquisition to finish if it hasn't yet.
+        Use 0 to not wait at all. This must be 0 within a system.multicall
+        so that a batch can't keep the server busy for long.
+    <Exceptions>
+      Raises xmlrpclib Fault objects:
+        FAULTCODE_INTERNALERROR for internal errors.
+        FAULTCODE_INVALIDREQUEST for bad user input, an unknown job id, or
+          waiting within a system.multicall.
+        FAULTCODE_NOTENOUGHCREDITS if user had insufficient vessel credits to complete request.
+        FAULTCODE_UNABLETOACQUIRE if the vessels could not be acquired.
+    <Returns>
+      A dictionary with a 'status' key. If the acquisition hasn't finished, the
+      status is 'pending'. Otherwise, the status is 'done' and the 'vessels' key
+      is a list of 'info' dictionaries, the same as acquire_resources() returns.
+    """
+    geni_user = _auth(auth)
     
-    acquired_vessels = []
+    if not isinstance(job_id, int):
+      raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "job_id must be an integer.")
     
-    # validate rspec data
-    if not isinstance(resource_type, str) or not isinstance(num_vessels, int):
-      raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "rspec has invalid data types.")
+    if type(max_wait_seconds) not in [int, float]:
+      raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "max_wait_seconds must be a number.")
     
-    if resource_type not in ['wan', 'lan', 'nat', 'random'] or num_vessels < 1:
-      raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "rspec has invalid values.")
-      
-    # The interface.acquire_vessels() call expects 'rand' instead of 'random'.
-    if resource_type == 'random':
-      resource_type = 'rand'
+    if max_wait_seconds > 0 and getattr(multicall_auth_data, "users", None) is not None:
+      raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "max_wait_seconds must be 0 within a multicall.")
     
     try:
-      acquired_vessels = interface.acquire_vessels(geni_user, num_vessels, resource_type)
+      acquired_vessels = interface.get_acquire_vessels_job_result(geni_user, job_id, max_wait_seconds)
+    except DoesNotExistError, err:
+      raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, str(err))
     except UnableToAcquireResourcesError, err:
       raise xmlrpclib.Fault(FAULTCODE_UNABLETOACQUIRE, "Unable to fulfill vessel acquire request at this given time. Details: " + str(err))
     except InsufficientUserResourcesError, err:
       raise xmlrpclib.Fault(FAULTCODE_NOTENOUGHCREDITS, "You do not have enough vessel credits to acquire the number of vessels requested.")
     
-    # since acquire_vessels returns a list of Vessel objects, we
-    # need to convert them into a list of 'info' dictionaries.
-    return interface.get_vessel_infodict_list(acquired_vessels)
+    if acquired_vessels is None:
+      return {'status':'pending'}
+    
+    return {'status':'done', 'vessels':interface.get_vessel_infodict_list(acquired_vessels)}
 
 
 
@@ -374,21 +488,106 @@ class PublicXMLRPCFunctions(object):
   
   @staticmethod
   @log_function_call
-  def get_resource_info(auth):
+  def get_resource_info(auth, format='full'):
     """
     <Purpose>
       Gets a user's acquired vessels over XMLRPC.
     <Arguments>
       auth
         An authorization dict.
+      format
+        (optional) 'full' (the default) or 'compact'. See VESSEL_INFO_FORMATS.
     <Exceptions>
-      None.
+      Raises xmlrpclib Fault objects:
+        FAULTCODE_INVALIDREQUEST for an unknown format.
     <Returns>
       A list of 'info' dictionaries, each 'infodict' contains vessel info.
     """
     geni_user = _auth(auth)
+    _require_valid_vessel_info_format(format)
+    
     user_vessels = interface.get_acquired_vessels(geni_user)
-    return interface.get_vessel_infodict_list(user_vessels)
+    infodict_list = interface.get_vessel_infodict_list(user_vessels)
+    return _get_vessel_info_in_format(infodict_list, None, format)
+  
+  
+  
+  @staticmethod
+  @log_function_call
+  def get_resource_info_page(auth, cursor, page_size, fields, format='full'):
+    """
+    <Purpose>
+      Gets a page of a user's acquired vessels over XMLRPC. Users with many
+      vessels can use this rather than get_resource_info() to get them a page
+      at a time.
+    <Arguments>
+      auth
+        An authorization dict.
+      cursor
+        The empty string to get the first page, otherwise the 'next_cursor' of
+        the previous page.
+      page_size
+        The most vessels to include in the page, at most 500.
+      fields
+        A list of the keys to include in each 'info' dictionary, or an empty
+        list to include all of them.
+      format
+        (optional) 'full' (the default) or 'compact'. See VESSEL_INFO_FORMATS.
+    <Exceptions>
+      Raises xmlrpclib Fault objects:
+        FAULTCODE_INVALIDREQUEST for bad user input.
+    <Returns>
+      A dictionary whose key 'vessels' is a list of 'info' dictionaries and
+      whose key 'next_cursor' is the cursor of the next page, or the empty
+      string if this is the last page. The cursor is the database id of the
+      last vessel of the page as a string. Vessels are ordered by id, so a
+      vessel acquired while the pages are being retrieved is only included if
+      its id is after the cursor.
+    """
+    geni_user = _auth(auth)
+    
+    if not isinstance(cursor, str):
+      raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "cursor must be a string.")
+    
+    if cursor == "":
+      after_vessel_id = 0
+    else:
+      try:
+        after_vessel_id = int(cursor)
+      except ValueError:
+        raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "Invalid cursor.")
+      if after_vessel_id < 1:
+        raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "Invalid cursor.")
+    
+    if not isinstance(page_size, int) or page_size < 1 or page_size > MAX_RESOURCE_INFO_PAGE_SIZE:
+      raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "page_size must be an integer " +
+                            "between 1 and " + str(MAX_RESOURCE_INFO_PAGE_SIZE) + ".")
+    
+    if not isinstance(fields, list):
+      raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "fields must be a list.")
+    
+    for field in fields:
+      if field not in interface.VESSEL_INFODICT_FIELDS:
+        raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "Unknown field: " + str(field))
+    
+    if len(fields) == 0:
+      fields = None
+    
+    _require_valid_vessel_info_format(format)
+    
+    # Get one more vessel than was asked for to find out whether there is a
+    # next page without another query.
+    user_vessels = interface.get_acquired_vessels_page(geni_user, after_vessel_id, page_size + 1)
+    
+    if len(user_vessels) > page_size:
+      user_vessels = user_vessels[:page_size]
+      next_cursor = str(user_vessels[-1].id)
+    else:
+      next_cursor = ""
+    
+    infodict_list = interface.get_vessel_infodict_list(user_vessels, fields)
+    vessels = _get_vessel_info_in_format(infodict_list, fields, format)
+    return {'vessels':vessels, 'next_cursor':next_cursor}
   
   
   
@@ -543,6 +742,138 @@ class PublicXMLRPCFunctions(object):
 
 
 
+def _require_valid_vessel_info_format(format):
+  """
+  Raises a FAULTCODE_INVALIDREQUEST Fault if format isn't one of
+  VESSEL_INFO_FORMATS.
+  """
+  if format not in VESSEL_INFO_FORMATS:
+    raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "format must be one of " +
+                          str(VESSEL_INFO_FORMATS) + ".")
+
+
+
+
+
+def _get_vessel_info_in_format(infodict_list, fields, format):
+  """
+  Returns the list of vessel 'info' dictionaries, which have the given fields
+  (None means all of them), in the given format.
+  """
+  if format == 'compact':
+    if fields is None:
+      fields = interface.VESSEL_INFODICT_FIELDS
+    return marshalling.get_compact_dict_list(infodict_list, fields)
+  
+  return infodict_list
+
+
+
+
+
+def _get_resource_type_and_count_from_rspec(rspec):
+  """
+  <Purpose>
+    Internally used function that validates the rspec given to
+    acquire_resources() or acquire_resources_async().
+  <Arguments>
+    rspec
+      A resource specification dict of the form {'rspec_type':type, 'number_of_nodes':num}
+  <Exceptions>
+    Raises xmlrpclib Fault Objects:
+      FAULTCODE_INVALIDREQUEST if the rspec is invalid.
+  <Returns>
+    A tuple of (resource_type, num_vessels) where resource_type is the vessel
+    type as the interface expects it.
+  """
+  if not isinstance(rspec, dict):
+    raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "rspec is an invalid data type.")
+  
+  try:
+    resource_type = rspec['rspec_type']
+  except KeyError:
+    raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "rspec is missing rspec_type")
+  
+  try:
+    num_vessels = rspec['number_of_nodes']
+  except KeyError:
+    raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "rspec is missing number_of_nodes")
+  
+  # validate rspec data
+  if not isinstance(resource_type, str) or not isinstance(num_vessels, int):
+    raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "rspec has invalid data types.")
+  
+  if resource_type not in ['wan', 'lan', 'nat', 'random'] or num_vessels < 1:
+    raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST, "rspec has invalid values.")
+    
+  # The interface calls expect 'rand' instead of 'random'.
+  if resource_type == 'random':
+    resource_type = 'rand'
+  
+  return (resource_type, num_vessels)
+
+
+
+
+def _multicall(dispatchfunc, calllist):
+  """
+  <Purpose>
+    Internally used function that implements system.multicall. The calls are
+    made in order, each one through dispatchfunc. Authentication with the
+    same username and api key is only done once for the whole batch.
+  <Arguments>
+    dispatchfunc
+      The function to dispatch each call with (PublicXMLRPCFunctions._dispatch).
+    calllist
+      A list of dicts of the form {'methodName':name, 'params':paramlist}.
+  <Exceptions>
+    Raises xmlrpclib Fault objects:
+      FAULTCODE_INVALIDREQUEST if calllist is not a list or is too long.
+  <Returns>
+    A list with one item for each call: a single-item list containing the
+    call's return value if the call succeeded, or a dict of the form
+    {'faultCode':code, 'faultString':string} if it failed.
+  """
+  if not isinstance(calllist, list):
+    raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST,
+                          "The system.multicall argument must be a list, not a " + str(type(calllist)))
+  
+  if len(calllist) > MAX_MULTICALL_CALLS:
+    raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST,
+                          "A system.multicall request can contain at most " +
+                          str(MAX_MULTICALL_CALLS) + " calls.")
+  
+  resultlist = []
+  
+  multicall_auth_data.users = {}
+  try:
+    for call in calllist:
+      try:
+        if not isinstance(call, dict) or not isinstance(call.get('methodName'), str) or \
+            not isinstance(call.get('params'), list):
+          raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST,
+                                "Each call must be a dict with 'methodName' and 'params'.")
+        
+        if call['methodName'] == "system.multicall":
+          raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST,
+                                "system.multicall can't be called from within system.multicall.")
+        
+        resultlist.append([dispatchfunc(call['methodName'], call['params'])])
+      
+      except xmlrpclib.Fault, fault:
+        resultlist.append({'faultCode':fault.faultCode, 'faultString':fault.faultString})
+      
+      except InvalidRequestError, err:
+        resultlist.append({'faultCode':FAULTCODE_INVALIDREQUEST, 'faultString':str(err)})
+  
+  finally:
+    multicall_auth_data.users = None
+  
+  return resultlist
+
+
+
+
 @log_function_call
 def _auth(auth):
   """
@@ -568,12 +899,25 @@ def _auth(auth):
   except KeyError:
     raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST,
                           "Auth dict must contain both a 'username' and an 'api_key'.")
-    
+  
+  # Within a system.multicall request, only authenticate once.
+  batchusers = getattr(multicall_auth_data, "users", None)
+  if batchusers is not None:
+    try:
+      if (username, api_key) in batchusers:
+        return batchusers[(username, api_key)]
+    except TypeError:
+      # An unhashable username or api_key will fail authentication below.
+      pass
+  
   try:
     geni_user = interface.get_user_with_api_key(username, api_key)
   except DoesNotExistError:
     raise xmlrpclib.Fault(FAULTCODE_AUTHERROR, "User auth failed.")
   
+  if batchusers is not None:
+    batchusers[(username, api_key)] = geni_user
+  
   return geni_user
 
 
@@ -604,6 +948,12 @@ def _pwauth(auth):
   except KeyError:
     raise xmlrpclib.Fault(FAULTCODE_INVALIDREQUEST,
                           "PasswordAuth dict must contain both a 'username' and an 'password'.")
+  
+  # The call may change the user (e.g. regenerate_api_key), so any calls after
+  # it in the same system.multicall request have to authenticate again.
+  batchusers = getattr(multicall_auth_data, "users", None)
+  if batchusers is not None:
+    batchusers.clear()
     
   try:
     geni_user = interface.get_user_with_password(username, password)
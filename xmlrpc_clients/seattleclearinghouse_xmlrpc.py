@@ -40,6 +40,8 @@
     AuthenticationError
     InvalidRequestError
     InternalError
+  Methods that acquire, release, or renew vessels may also raise
+    TryAgainLaterError
   The safest way to be certain to catch any of these errors  is to the catch
   their base class:
     SeattleClearinghouseError
@@ -47,6 +49,7 @@
 
 import os
 import socket
+import time
 import xmlrpclib
 
 # If a user does not provide us with an API key, we'll need to load
@@ -69,6 +72,15 @@ FAULTCODE_AUTHERROR = 101
 FAULTCODE_INVALIDREQUEST = 102
 FAULTCODE_NOTENOUGHCREDITS = 103
 FAULTCODE_UNABLETOACQUIRE = 105
+FAULTCODE_TRYAGAINLATER = 106
+
+# The longest SeattleClearinghouse waits for an acquisition to finish in a
+# single get_acquire_resources_result call.
+MAX_ACQUIRE_RESULT_WAIT_SECONDS = 30
+
+# The most vessels SeattleClearinghouse returns in a single page of
+# get_resource_info_page results.
+MAX_RESOURCE_INFO_PAGE_SIZE = 500
 
 
 
@@ -122,6 +134,11 @@ class SeattleClearinghouseClient(object):
       api_key = self._get_api_key(username, private_key_string)
     
     self.auth = {'username':username, 'api_key':api_key}
+    
+    # While a batch is open (see batch()), this is the xmlrpclib.MultiCall
+    # the calls are added to.
+    self._batch_multicall = None
+    self._batch_results = None
 
 
 
@@ -161,43 +178,126 @@ class SeattleClearinghouseClient(object):
 
 
   
-  def _do_call(self, function, *args):
+  def _do_call(self, methodname, *args):
+    if self._batch_multicall is not None:
+      # Add the call to the open batch rather than making it now.
+      getattr(self._batch_multicall, methodname)(self.auth, *args)
+      result = BatchCallResult()
+      self._batch_results.append(result)
+      return result
+    
     try:
-      return function(self.auth, *args)
+      return getattr(self.proxy, methodname)(self.auth, *args)
     except socket.error, err:
       raise CommunicationError("XMLRPC failed: " + str(err))
     except xmlrpclib.Fault, fault:
-      if fault.faultCode == FAULTCODE_AUTHERROR:
-        raise AuthenticationError
-      elif fault.faultCode == FAULTCODE_INVALIDREQUEST:
-        raise InvalidRequestError(fault.faultString)
-      elif fault.faultCode == FAULTCODE_NOTENOUGHCREDITS:
-        raise NotEnoughCreditsError(fault.faultString)
-      elif fault.faultCode == FAULTCODE_UNABLETOACQUIRE:
-        raise UnableToAcquireResourcesError(fault.faultString)
-      else:
-        raise InternalError(fault.faultString)
+      raise _get_error_for_fault(fault)
+
 
 
+  def _do_call_and_convert(self, conversionfunc, methodname, *args):
+    """
+    Like _do_call(), but the result is passed through conversionfunc before
+    it is returned (or, in a batch, before it is given to the BatchCallResult).
+    """
+    result = self._do_call(methodname, *args)
+    if isinstance(result, BatchCallResult):
+      result._conversionfunc = conversionfunc
+      return result
+    return conversionfunc(result)
+
 
-  def _do_pwauth_call(self, function, password, *args):
+
+  def _do_pwauth_call(self, methodname, password, *args):
     """For use by calls that require a password rather than an api key."""
+    if self._batch_multicall is not None:
+      raise SeattleClearinghouseError("Calls that require the account password " +
+                                      "can't be made as part of a batch.")
+    
     pwauth = {'username':self.auth['username'], 'password':password}
     try:
-      return function(pwauth, *args)
+      return getattr(self.proxy, methodname)(pwauth, *args)
     except socket.error, err:
       raise CommunicationError("XMLRPC failed: " + str(err))
     except xmlrpclib.Fault, fault:
-      if fault.faultCode == FAULTCODE_AUTHERROR:
-        raise AuthenticationError
-      elif fault.faultCode == FAULTCODE_INVALIDREQUEST:
-        raise InvalidRequestError(fault.faultString)
-      elif fault.faultCode == FAULTCODE_NOTENOUGHCREDITS:
-        raise NotEnoughCreditsError(fault.faultString)
-      elif fault.faultCode == FAULTCODE_UNABLETOACQUIRE:
-        raise UnableToAcquireResourcesError(fault.faultString)
-      else:
-        raise InternalError(fault.faultString)
+      raise _get_error_for_fault(fault)
+
+
+
+  def batch(self):
+    """
+    <Purpose>
+      Make several calls in a single request to SeattleClearinghouse, which
+      also only has to authenticate the account once for all of them. This is
+      meant to be used with a 'with' statement:
+      
+        with client.batch() as batch:
+          renewal = client.renew_resources(handlelist)
+          resourceinfo = client.get_resource_info()
+          accountinfo = client.get_account_info()
+        vessellist = resourceinfo.get_result()
+      
+      While the batch is open, methods of the client (other than those that
+      require the account password) don't make the call right away but return
+      a BatchCallResult. The calls are made in order when the 'with' block
+      ends. At most 50 calls can be made in one batch.
+    <Arguments>
+      None
+    <Exceptions>
+      SeattleClearinghouseError
+        If a batch is already open.
+    <Side Effects>
+      None until the batch is used in a 'with' statement.
+    <Returns>
+      A ClientBatch object to use in a 'with' statement.
+    """
+    if self._batch_multicall is not None:
+      raise SeattleClearinghouseError("A batch is already open.")
+    
+    return ClientBatch(self)
+
+
+
+  def _start_batch(self):
+    """Called by ClientBatch when the 'with' block of a batch begins."""
+    if self._batch_multicall is not None:
+      raise SeattleClearinghouseError("A batch is already open.")
+    
+    self._batch_multicall = xmlrpclib.MultiCall(self.proxy)
+    self._batch_results = []
+
+
+
+  def _finish_batch(self, send):
+    """
+    Called by ClientBatch when the 'with' block of a batch ends. If send is
+    True, the batched calls are made and their BatchCallResults are filled in.
+    Otherwise (the block raised an exception), the calls are discarded.
+    Returns the list of BatchCallResults.
+    """
+    multicall = self._batch_multicall
+    resultlist = self._batch_results
+    self._batch_multicall = None
+    self._batch_results = None
+    
+    if not send or not resultlist:
+      return resultlist
+    
+    try:
+      multicall_results = multicall()
+    except socket.error, err:
+      raise CommunicationError("XMLRPC failed: " + str(err))
+    except xmlrpclib.Fault, fault:
+      # The whole batch failed (e.g. it contained too many calls).
+      raise _get_error_for_fault(fault)
+    
+    for index in range(len(resultlist)):
+      try:
+        resultlist[index]._set_result(multicall_results[index])
+      except xmlrpclib.Fault, fault:
+        resultlist[index]._set_error(_get_error_for_fault(fault))
+    
+    return resultlist
 
 
 
@@ -310,7 +410,115 @@ class SeattleClearinghouseClient(object):
       raise TypeError("count must be an integer")
     
     rspec = {'rspec_type':res_type, 'number_of_nodes':count}
-    return self._do_call(self.proxy.acquire_resources, rspec)
+    return self._do_call("acquire_resources", rspec)
+
+
+
+  def acquire_resources_async(self, res_type, count):
+    """
+    <Purpose>
+      Start acquiring vessels without waiting for the acquisition to finish.
+      This is better than acquire_resources() for large numbers of vessels.
+      The result is retrieved with get_acquire_resources_result() or
+      wait_for_acquire_resources_result().
+    <Arguments>
+      res_type
+        A string describing the type of vessels to acquire.
+      count
+        The number of vessels to acquire.
+    <Exceptions>
+      The common exceptions described in the module comments, as well as:
+      SeattleClearinghouseNotEnoughCredits
+        If the account does not have enough available vessel credits to fulfill
+        the request.
+      InvalidRequestError
+        Also raised if the account has too many acquisitions in progress.
+    <Side Effects>
+      The acquisition has been started.
+    <Returns>
+      The job id of the acquisition.
+    """
+    if not isinstance(res_type, basestring):
+      raise TypeError("res_type must be a string")
+    if type(count) not in [int, long]:
+      raise TypeError("count must be an integer")
+    
+    rspec = {'rspec_type':res_type, 'number_of_nodes':count}
+    return self._do_call("acquire_resources_async", rspec)
+
+
+
+  def get_acquire_resources_result(self, job_id, max_wait_seconds=0):
+    """
+    <Purpose>
+      Get the result of an acquisition started with acquire_resources_async().
+    <Arguments>
+      job_id
+        The job id returned by acquire_resources_async().
+      max_wait_seconds
+        (optional) How long SeattleClearinghouse should wait for the
+        acquisition to finish if it hasn't yet. It waits at most
+        MAX_ACQUIRE_RESULT_WAIT_SECONDS. The default is to not wait.
+    <Exceptions>
+      The common exceptions described in the module comments, as well as:
+      SeattleClearinghouseNotEnoughCredits
+        If the account did not have enough available vessel credits to fulfill
+        the request.
+      UnableToAcquireResourcesError
+        If the vessels could not be acquired.
+    <Side Effects>
+      None
+    <Returns>
+      A dictionary with a 'status' key, which is 'pending' if the acquisition
+      hasn't finished. Otherwise the status is 'done' and the 'vessels' key
+      is the list of dictionaries of the acquired vessels, as
+      acquire_resources() returns.
+    """
+    if type(job_id) not in [int, long]:
+      raise TypeError("job_id must be an integer")
+    if type(max_wait_seconds) not in [int, long, float]:
+      raise TypeError("max_wait_seconds must be a number")
+    
+    return self._do_call("get_acquire_resources_result", job_id, max_wait_seconds)
+
+
+
+  def wait_for_acquire_resources_result(self, job_id, timeout=None):
+    """
+    <Purpose>
+      Wait for an acquisition started with acquire_resources_async() to finish.
+    <Arguments>
+      job_id
+        The job id returned by acquire_resources_async().
+      timeout
+        (optional) The number of seconds to wait, or None to wait until the
+        acquisition finishes.
+    <Exceptions>
+      The same as get_acquire_resources_result().
+    <Side Effects>
+      None
+    <Returns>
+      The list of dictionaries of the acquired vessels, as acquire_resources()
+      returns, or None if the acquisition didn't finish within the timeout.
+    """
+    if self._batch_multicall is not None:
+      raise SeattleClearinghouseError("Can't wait for a result as part of a batch.")
+    
+    if timeout is not None:
+      deadline = time.time() + timeout
+    
+    while True:
+      if timeout is None:
+        wait_seconds = MAX_ACQUIRE_RESULT_WAIT_SECONDS
+      else:
+        wait_seconds = max(0, min(MAX_ACQUIRE_RESULT_WAIT_SECONDS, deadline - time.time()))
+      
+      result = self.get_acquire_resources_result(job_id, wait_seconds)
+      if result['status'] == 'done':
+        return result['vessels']
+      
+      if timeout is not None and time.time() >= deadline:
+        return None
 
 
 
@@ -332,7 +540,7 @@ class SeattleClearinghouseClient(object):
       A list of vessel handles of the acquired vessels.
     """
     _validate_handle_list(handlelist)
-    return self._do_call(self.proxy.acquire_specific_vessels, handlelist)
+    return self._do_call("acquire_specific_vessels", handlelist)
 
 
 
@@ -354,7 +562,7 @@ class SeattleClearinghouseClient(object):
       None
     """
     _validate_handle_list(handlelist)
-    return self._do_call(self.proxy.release_resources, handlelist)
+    return self._do_call("release_resources", handlelist)
 
       
       
@@ -379,16 +587,19 @@ class SeattleClearinghouseClient(object):
       None
     """
     _validate_handle_list(handlelist)
-    return self._do_call(self.proxy.renew_resources, handlelist)
+    return self._do_call("renew_resources", handlelist)
     
 
 
-  def get_resource_info(self):
+  def get_resource_info(self, use_compact_format=False):
     """
     <Purpose>
       Obtain information about acquired vessels.
     <Arguments>
-      None
+      use_compact_format
+        (optional) If True, SeattleClearinghouse sends the information in a
+        more compact format, which is faster for accounts with many vessels.
+        What is returned is the same either way. Default is False.
     <Exceptions>
       The common exceptions described in the module comments, as well as:
     <Side Effects>
@@ -397,7 +608,92 @@ class SeattleClearinghouseClient(object):
       A list of dictionaries, where each dictionary describes a vessel that
       is currently acquired by the account.
     """
-    return self._do_call(self.proxy.get_resource_info)
+    if use_compact_format:
+      return self._do_call_and_convert(_expand_compact_vessel_info,
+                                       "get_resource_info", 'compact')
+    
+    return self._do_call("get_resource_info")
+      
+      
+      
+  def get_resource_info_page(self, cursor="", page_size=100, fields=None,
+                             use_compact_format=False):
+    """
+    <Purpose>
+      Obtain information about a page of acquired vessels. This is better than
+      get_resource_info() for accounts with many vessels.
+    <Arguments>
+      cursor
+        (optional) The 'next_cursor' of the previous page. The default is to
+        get the first page.
+      page_size
+        (optional) The most vessels to include in the page, at most
+        MAX_RESOURCE_INFO_PAGE_SIZE. Default is 100.
+      fields
+        (optional) A list of the keys to include in each vessel's dictionary,
+        e.g. ['handle', 'expires_in_seconds']. By default, all are included.
+      use_compact_format
+        (optional) The same as for get_resource_info().
+    <Exceptions>
+      The common exceptions described in the module comments.
+    <Side Effects>
+      None
+    <Returns>
+      A dictionary whose key 'vessels' is a list of dictionaries, each
+      describing a vessel, and whose key 'next_cursor' is the cursor of the
+      next page, or the empty string if this is the last page. The cursor is
+      the id of the last vessel of the page (as a string), so vessels
+      acquired while paging may not be included.
+    """
+    if not isinstance(cursor, basestring):
+      raise TypeError("cursor must be a string")
+    if type(page_size) not in [int, long]:
+      raise TypeError("page_size must be an integer")
+    if fields is None:
+      fields = []
+    if not isinstance(fields, list):
+      raise TypeError("fields must be a list")
+    
+    if use_compact_format:
+      return self._do_call_and_convert(_expand_compact_vessel_info_page,
+                                       "get_resource_info_page",
+                                       cursor, page_size, fields, 'compact')
+    
+    return self._do_call("get_resource_info_page", cursor, page_size, fields)
+      
+      
+      
+  def iter_resource_info(self, page_size=100, fields=None, use_compact_format=False):
+    """
+    <Purpose>
+      Iterate over information about acquired vessels, which is obtained a
+      page at a time as needed.
+    <Arguments>
+      page_size
+        (optional) The number of vessels to obtain at a time. Default is 100.
+      fields
+        (optional) The same as for get_resource_info_page().
+      use_compact_format
+        (optional) The same as for get_resource_info().
+    <Exceptions>
+      The common exceptions described in the module comments.
+    <Side Effects>
+      None
+    <Returns>
+      An iterator of dictionaries, each describing a vessel.
+    """
+    if self._batch_multicall is not None:
+      raise SeattleClearinghouseError("Can't iterate over pages as part of a batch.")
+    
+    cursor = ""
+    while True:
+      page = self.get_resource_info_page(cursor, page_size, fields, use_compact_format)
+      for vesselinfo in page['vessels']:
+        yield vesselinfo
+      
+      cursor = page['next_cursor']
+      if not cursor:
+        return
       
       
       
@@ -414,7 +710,7 @@ class SeattleClearinghouseClient(object):
     <Returns>
       A dictionary with information about the account.
     """
-    return self._do_call(self.proxy.get_account_info)
+    return self._do_call("get_account_info")
     
     
     
@@ -432,7 +728,7 @@ class SeattleClearinghouseClient(object):
     <Returns>
       A string containing the public key of the account.
     """
-    return self._do_call(self.proxy.get_public_key)
+    return self._do_call("get_public_key")
 
 
 
@@ -456,7 +752,7 @@ class SeattleClearinghouseClient(object):
     <Returns>
       None
     """
-    self._do_pwauth_call(self.proxy.set_public_key, password, pubkeystring)
+    self._do_pwauth_call("set_public_key", password, pubkeystring)
 
 
 
@@ -476,13 +772,127 @@ class SeattleClearinghouseClient(object):
     <Returns>
       The new api key for the account.
     """
-    api_key = self._do_pwauth_call(self.proxy.regenerate_api_key, password)
+    api_key = self._do_pwauth_call("regenerate_api_key", password)
     self.auth['api_key'] = api_key
     return api_key
    
       
 
 
+class ClientBatch(object):
+  """
+  A batch of calls to make in a single request. These are created by
+  SeattleClearinghouseClient.batch() and are meant to be used in a 'with'
+  statement. After the 'with' block, the 'results' attribute is the list of
+  BatchCallResults of the calls in the batch, in the order they were made.
+  """
+  
+  def __init__(self, client):
+    self._client = client
+    self.results = None
+
+
+
+  def __enter__(self):
+    self._client._start_batch()
+    return self
+
+
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    # If the block raised an exception, don't send the calls and let the
+    # exception propagate.
+    self.results = self._client._finish_batch(send=exc_type is None)
+    return False
+
+
+
+
+
+class BatchCallResult(object):
+  """
+  The result of a call made as part of a batch. Once the batch has been sent,
+  get_result() returns what the client method would have returned or raises
+  what it would have raised.
+  """
+  
+  def __init__(self):
+    self._is_done = False
+    self._result = None
+    self._error = None
+    # Set by the client if the result needs to be converted.
+    self._conversionfunc = None
+
+
+
+  def _set_result(self, result):
+    if self._conversionfunc is not None:
+      result = self._conversionfunc(result)
+    self._result = result
+    self._is_done = True
+
+
+
+  def _set_error(self, error):
+    self._error = error
+    self._is_done = True
+
+
+
+  def get_result(self):
+    if not self._is_done:
+      raise SeattleClearinghouseError("The batch this call is part of hasn't been sent.")
+    if self._error is not None:
+      raise self._error
+    return self._result
+
+
+
+
+
+def _get_error_for_fault(fault):
+  """
+  Returns the SeattleClearinghouseError to raise for a xmlrpclib.Fault from
+  the server.
+  """
+  if fault.faultCode == FAULTCODE_AUTHERROR:
+    return AuthenticationError()
+  elif fault.faultCode == FAULTCODE_INVALIDREQUEST:
+    return InvalidRequestError(fault.faultString)
+  elif fault.faultCode == FAULTCODE_NOTENOUGHCREDITS:
+    return NotEnoughCreditsError(fault.faultString)
+  elif fault.faultCode == FAULTCODE_UNABLETOACQUIRE:
+    return UnableToAcquireResourcesError(fault.faultString)
+  elif fault.faultCode == FAULTCODE_TRYAGAINLATER:
+    return TryAgainLaterError(fault.faultString)
+  else:
+    return InternalError(fault.faultString)
+
+
+
+
+
+def _expand_compact_vessel_info(compactinfo):
+  """
+  Returns the list of vessel dictionaries that a 'compact' format response,
+  which is of the form {'fields':keylist, 'rows':rowlist}, describes.
+  """
+  keylist = compactinfo['fields']
+  return [dict(zip(keylist, row)) for row in compactinfo['rows']]
+
+
+
+
+
+def _expand_compact_vessel_info_page(page):
+  """The same as _expand_compact_vessel_info() for get_resource_info_page()."""
+  page['vessels'] = _expand_compact_vessel_info(page['vessels'])
+  return page
+
+
+
+
+
 def _validate_handle_list(handlelist):
   """
   Raise a TypeError or ValueError if handlelist is not a non-empty list of
@@ -580,3 +990,12 @@ class UnableToAcquireResourcesError(SeattleClearinghouseError):
   Indicates that the requested operation failed because SeattleClearinghouse was unable
   to acquire the requested resources.
   """
+
+
+class TryAgainLaterError(SeattleClearinghouseError):
+  """
+  Indicates that SeattleClearinghouse refused the request because the account
+  has made too many similar requests recently or because it is too busy. The
+  request can be made again after waiting a while (the message may say how
+  long).
+  """